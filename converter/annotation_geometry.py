@@ -0,0 +1,53 @@
+"""
+Annotation Geometry
+Helpers for the viewer's annotation geometries (level-0 image pixel coordinates).
+
+Geometries are GeoJSON-like ``{"type", "coordinates"}`` where coordinates
+nest ``[x, y]`` pairs to any depth (Point, LineString, Rectangle, Ellipse and
+the viewer's flat Polygon point lists alike). The ``annotations.bbox`` column
+is derived in Postgres by ``annotation_bbox()`` with the same rule as
+geometry_bbox() here.
+"""
+
+from typing import Iterator, Optional
+
+BBox = tuple[float, float, float, float]
+
+
+def iter_points(coordinates) -> Iterator[tuple[float, float]]:
+    """Every ``[x, y]`` pair in a nested coordinate array"""
+    if not isinstance(coordinates, (list, tuple)) or not coordinates:
+        return
+    if len(coordinates) >= 2 and all(isinstance(c, (int, float)) and not isinstance(c, bool) for c in coordinates[:2]):
+        yield float(coordinates[0]), float(coordinates[1])
+        return
+    for item in coordinates:
+        yield from iter_points(item)
+
+
+def geometry_bbox(geometry: dict) -> Optional[BBox]:
+    """``(min_x, min_y, max_x, max_y)`` of a geometry, or None without points"""
+    points = list(iter_points((geometry or {}).get("coordinates")))
+    if not points:
+        return None
+    xs = [p[0] for p in points]
+    ys = [p[1] for p in points]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def parse_bbox(value: str) -> BBox:
+    """Parse ``x0,y0,x1,y1`` (corners in any order); raises ValueError"""
+    parts = value.split(",")
+    if len(parts) != 4:
+        raise ValueError("bbox must be x0,y0,x1,y1")
+    try:
+        x0, y0, x1, y1 = (float(p) for p in parts)
+    except ValueError:
+        raise ValueError("bbox coordinates must be numbers")
+    if any(v != v or v in (float("inf"), float("-inf")) for v in (x0, y0, x1, y1)):
+        raise ValueError("bbox coordinates must be finite")
+    return min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)
+
+
+def scale_bbox(bbox: BBox, factor: float) -> BBox:
+    return tuple(v * factor for v in bbox)
@@ -0,0 +1,388 @@
+"""
+Bulk Annotation Import
+Streaming parser, validator and vectorized measurement for large annotation
+uploads (AI / StarDist output with 100k+ polygons).
+
+Bodies are either a GeoJSON FeatureCollection or NDJSON (one Feature or
+PathView annotation object per line). Both are parsed incrementally from the
+request stream: the FeatureCollection wrapper is walked by hand and each
+feature decoded with ``json.JSONDecoder.raw_decode``, so memory stays at one
+batch whatever the upload size. Bounding boxes and areas of a whole batch are
+computed with NumPy reductions over the concatenated vertices.
+"""
+
+import json
+import math
+import codecs
+from dataclasses import dataclass
+from typing import AsyncIterator, Optional
+
+import numpy as np
+
+NDJSON_MEDIA_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl", "application/x-jsonlines")
+
+# A single feature (or top-level GeoJSON member) larger than this is rejected
+MAX_FEATURE_CHARS = 16 * 1024 * 1024
+
+POINT_TYPES = {"Point", "MultiPoint", "LineString", "MultiLineString"}
+AREA_TYPES = {"Polygon", "MultiPolygon", "Rectangle", "Ellipse"}
+GEOMETRY_TYPES = POINT_TYPES | AREA_TYPES
+
+# Keys export_annotations folds into GeoJSON properties; restored to columns on import
+EXPORT_PROPERTY_KEYS = ("tool", "annotation_type", "created_at")
+
+_WHITESPACE = " \t\r\n"
+_decoder = json.JSONDecoder()
+
+
+class BulkImportError(ValueError):
+    """Malformed body (as opposed to a single invalid feature)"""
+
+
+# =============================================================================
+# Streaming parsers
+# =============================================================================
+
+class FeatureCollectionParser:
+    """
+    Incremental GeoJSON FeatureCollection parser.
+
+    ``feed(text)`` returns the features completed so far; ``close()`` checks
+    the document ended properly. Members other than ``features`` are decoded
+    and ignored.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+        self.state = "start"
+        self.key = None
+
+    def _skip_ws(self):
+        while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+            self.pos += 1
+
+    def _peek(self) -> Optional[str]:
+        self._skip_ws()
+        return self.buffer[self.pos] if self.pos < len(self.buffer) else None
+
+    def _decode(self, final: bool):
+        """Decode the JSON value at pos; None when more input is needed"""
+        try:
+            value, end = _decoder.raw_decode(self.buffer, self.pos)
+        except json.JSONDecodeError as e:
+            if final or len(self.buffer) - self.pos > MAX_FEATURE_CHARS:
+                raise BulkImportError(f"Invalid JSON at character {e.pos}: {e.msg}")
+            return None
+        if end == len(self.buffer) and not final:
+            return None  # A number may continue in the next chunk
+        self.pos = end
+        return (value,)
+
+    def _step(self, final: bool) -> tuple[bool, Optional[dict]]:
+        """Advance one token; (progressed, feature)"""
+        state = self.state
+        if state == "done":
+            if self._peek() is not None:
+                raise BulkImportError("Unexpected data after the FeatureCollection")
+            return False, None
+
+        char = self._peek()
+        if char is None:
+            if final:
+                raise BulkImportError("Unexpected end of document")
+            return False, None
+
+        if state == "start":
+            if char != "{":
+                raise BulkImportError("Expected a GeoJSON FeatureCollection object")
+            self.pos += 1
+            self.state = "key"
+        elif state in ("key", "next_key"):
+            if char == "}":
+                self.pos += 1
+                self.state = "done"
+            elif state == "next_key" and char == ",":
+                self.pos += 1
+                self.state = "key"
+            elif state == "key" and char == '"':
+                decoded = self._decode(final)
+                if decoded is None:
+                    return False, None
+                self.key = decoded[0]
+                self.state = "colon"
+            else:
+                raise BulkImportError(f"Unexpected '{char}' in FeatureCollection")
+        elif state == "colon":
+            if char != ":":
+                raise BulkImportError("Expected ':' after member name")
+            self.pos += 1
+            self.state = "features" if self.key == "features" else "value"
+        elif state == "value":
+            decoded = self._decode(final)
+            if decoded is None:
+                return False, None
+            if self.key == "type" and decoded[0] != "FeatureCollection":
+                raise BulkImportError(f"Expected a FeatureCollection, got {decoded[0]!r}")
+            self.state = "next_key"
+        elif state == "features":
+            if char != "[":
+                raise BulkImportError("'features' must be an array")
+            self.pos += 1
+            self.state = "feature_or_end"
+        elif state in ("feature_or_end", "feature"):
+            if char == "]":
+                if state == "feature":
+                    raise BulkImportError("Trailing ',' in features")
+                self.pos += 1
+                self.state = "next_key"
+                return True, None
+            decoded = self._decode(final)
+            if decoded is None:
+                return False, None
+            self.state = "after_feature"
+            return True, decoded[0]
+        elif state == "after_feature":
+            if char == ",":
+                self.pos += 1
+                self.state = "feature"
+            elif char == "]":
+                self.pos += 1
+                self.state = "next_key"
+            else:
+                raise BulkImportError(f"Unexpected '{char}' between features")
+        return True, None
+
+    def _run(self, final: bool) -> list:
+        features = []
+        while True:
+            progressed, feature = self._step(final)
+            if feature is not None:
+                features.append(feature)
+            if not progressed:
+                break
+        # Drop consumed input
+        if self.pos > 1 << 16:
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+        return features
+
+    def feed(self, text: str) -> list:
+        self.buffer += text
+        return self._run(final=False)
+
+    def close(self) -> list:
+        features = self._run(final=True)
+        if self.state != "done":
+            raise BulkImportError("Unexpected end of document")
+        return features
+
+
+class NdjsonParser:
+    """Incremental NDJSON parser: one JSON object per non-empty line"""
+
+    def __init__(self):
+        self.pending = ""
+        self.line = 0
+
+    def _parse(self, lines: list[str]) -> list:
+        items = []
+        for line in lines:
+            self.line += 1
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                items.append(json.loads(line))
+            except json.JSONDecodeError as e:
+                raise BulkImportError(f"Invalid JSON on line {self.line}: {e.msg}")
+        return items
+
+    def feed(self, text: str) -> list:
+        lines = (self.pending + text).split("\n")
+        self.pending = lines.pop()
+        if len(self.pending) > MAX_FEATURE_CHARS:
+            raise BulkImportError(f"Line {self.line + 1} is too long")
+        return self._parse(lines)
+
+    def close(self) -> list:
+        lines, self.pending = [self.pending], ""
+        return self._parse(lines)
+
+
+async def iter_features(chunks: AsyncIterator[bytes], ndjson: bool) -> AsyncIterator[dict]:
+    """Decode a streamed body into feature / annotation objects"""
+    parser = NdjsonParser() if ndjson else FeatureCollectionParser()
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    async for chunk in chunks:
+        try:
+            text = decoder.decode(chunk)
+        except UnicodeDecodeError:
+            raise BulkImportError("Body is not valid UTF-8")
+        for item in parser.feed(text):
+            yield item
+    for item in parser.close():
+        yield item
+
+
+# =============================================================================
+# Validation
+# =============================================================================
+
+@dataclass
+class ImportedAnnotation:
+    type: str
+    tool: str
+    geometry: dict
+    properties: dict
+    rings: list  # (k, 2) float arrays: the geometry's point lists
+    signs: list  # Per ring: +1 outer / -1 hole / 0 no area
+
+
+def _ring(points) -> np.ndarray:
+    try:
+        array = np.asarray(points, dtype=np.float64)
+    except (TypeError, ValueError):
+        raise ValueError("coordinates must be arrays of numbers")
+    if array.ndim == 1:
+        array = array.reshape(1, -1)
+    if array.ndim != 2 or array.shape[0] == 0 or array.shape[1] < 2:
+        raise ValueError("coordinates must be [x, y] pairs")
+    array = array[:, :2]
+    if not np.isfinite(array).all():
+        raise ValueError("coordinates must be finite")
+    return array
+
+
+def _polygon_rings(rings) -> tuple[list, list]:
+    if not isinstance(rings, list) or not rings:
+        raise ValueError("polygon has no rings")
+    arrays = [_ring(ring) for ring in rings]
+    return arrays, [1] + [-1] * (len(arrays) - 1)
+
+
+def geometry_rings(geometry: dict) -> tuple[list, list]:
+    """Point lists of a geometry and their area sign; raises ValueError"""
+    if not isinstance(geometry, dict):
+        raise ValueError("geometry must be an object")
+    kind = geometry.get("type")
+    coordinates = geometry.get("coordinates")
+    if kind not in GEOMETRY_TYPES:
+        raise ValueError(f"unsupported geometry type {kind!r}")
+    if not isinstance(coordinates, list) or not coordinates:
+        raise ValueError("geometry has no coordinates")
+
+    if kind == "Point":
+        return [_ring(coordinates)], [0]
+    if kind == "MultiLineString":
+        return [_ring(line) for line in coordinates], [0] * len(coordinates)
+    if kind == "MultiPolygon":
+        rings, signs = [], []
+        for polygon in coordinates:
+            polygon_rings, polygon_signs = _polygon_rings(polygon)
+            rings += polygon_rings
+            signs += polygon_signs
+        return rings, signs
+    if kind == "Polygon" and isinstance(coordinates[0], list) and coordinates[0] and isinstance(coordinates[0][0], list):
+        # GeoJSON rings; the viewer's own polygons are a flat point list
+        return _polygon_rings(coordinates)
+    # Rectangle / Ellipse areas come from their bounding box
+    return [_ring(coordinates)], [1 if kind == "Polygon" else 0]
+
+
+def normalize_feature(item) -> ImportedAnnotation:
+    """
+    Validate a GeoJSON Feature or PathView annotation object.
+
+    Features take type/tool from the properties export_annotations writes
+    (annotation_type, tool), defaulting to "region" and the geometry type.
+    Raises ValueError with the reason.
+    """
+    if not isinstance(item, dict):
+        raise ValueError("expected an object")
+    geometry = item.get("geometry")
+    properties = item.get("properties") or {}
+    if not isinstance(properties, dict):
+        raise ValueError("properties must be an object")
+    properties = dict(properties)
+
+    if item.get("type") == "Feature":
+        annotation_type = properties.get("annotation_type") or "region"
+        tool = properties.get("tool")
+        for key in EXPORT_PROPERTY_KEYS:
+            properties.pop(key, None)
+    else:
+        annotation_type = item.get("type") or "region"
+        tool = item.get("tool")
+
+    rings, signs = geometry_rings(geometry)
+    tool = tool or geometry["type"].lower()
+    if not isinstance(annotation_type, str) or not isinstance(tool, str):
+        raise ValueError("type and tool must be strings")
+    if len(annotation_type) > 50 or len(tool) > 50:
+        raise ValueError("type and tool are at most 50 characters")
+    return ImportedAnnotation(
+        type=annotation_type,
+        tool=tool,
+        geometry={"type": geometry["type"], "coordinates": geometry["coordinates"]},
+        properties=properties,
+        rings=rings,
+        signs=signs,
+    )
+
+
+# =============================================================================
+# Vectorized measurement
+# =============================================================================
+
+def measure_batch(annotations: list[ImportedAnnotation]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Bounding boxes ``(n, 4)`` as min_x, min_y, max_x, max_y and areas ``(n,)``
+    in square level-0 pixels for a batch, from one pass over all vertices.
+
+    Polygon areas use the shoelace formula per ring (holes subtracted);
+    Rectangle and Ellipse areas follow from the bounding box; points and
+    lines have no area.
+    """
+    count = len(annotations)
+    if count == 0:
+        return np.zeros((0, 4)), np.zeros(0)
+    rings = [ring for a in annotations for ring in a.rings]
+    signs = np.array([sign for a in annotations for sign in a.signs], dtype=np.float64)
+    ring_owner = np.repeat(np.arange(count), [len(a.rings) for a in annotations])
+    lengths = np.array([len(ring) for ring in rings])
+    points = np.concatenate(rings)
+
+    ring_starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    point_counts = np.bincount(ring_owner, weights=lengths, minlength=count).astype(np.int64)
+    feature_starts = np.concatenate(([0], np.cumsum(point_counts)[:-1]))
+
+    x, y = points[:, 0], points[:, 1]
+    bboxes = np.column_stack((
+        np.minimum.reduceat(x, feature_starts),
+        np.minimum.reduceat(y, feature_starts),
+        np.maximum.reduceat(x, feature_starts),
+        np.maximum.reduceat(y, feature_starts),
+    ))
+
+    # Shoelace: each vertex with the next one of its ring (wrapping around)
+    following = np.arange(1, len(points) + 1)
+    following[ring_starts + lengths - 1] = ring_starts
+    cross = x * y[following] - x[following] * y
+    ring_areas = np.abs(np.add.reduceat(cross, ring_starts)) / 2
+    areas = np.bincount(ring_owner, weights=ring_areas * signs, minlength=count)
+
+    width = bboxes[:, 2] - bboxes[:, 0]
+    height = bboxes[:, 3] - bboxes[:, 1]
+    kinds = np.array([a.geometry["type"] for a in annotations])
+    areas = np.where(kinds == "Rectangle", width * height, areas)
+    areas = np.where(kinds == "Ellipse", math.pi * width * height / 4, areas)
+    return bboxes, np.maximum(areas, 0)
+
+
+def area_measurement(area_px: float, pixel_spacing: list) -> dict:
+    """The viewer's ``properties.measurement`` for an area (see calculatePolygonArea)"""
+    area_um2 = area_px * pixel_spacing[0] * pixel_spacing[1]
+    if area_um2 >= 1_000_000:
+        return {"value": area_um2 / 1_000_000, "unit": "mm²", "display": f"{area_um2 / 1_000_000:.3f} mm²"}
+    return {"value": area_um2, "unit": "µm²", "display": f"{area_um2:.0f} µm²"}
@@ -0,0 +1,203 @@
+"""
+Annotation Level of Detail
+Simplified variants of dense annotation geometries for low magnification.
+
+When an annotation is written, its polygons and polylines are simplified
+with Douglas-Peucker for every downsample in LOD_DOWNSAMPLES (the 2x steps
+of a WSI pyramid) and the variants that actually drop vertices are stored in
+``annotations.geometry_lod`` next to the geometry, keyed by downsample::
+
+    {"4": {"type": "Polygon", "coordinates": [...]}, "16": {...}}
+
+The column is rewritten in the same statement as the geometry, so a variant
+always belongs to the annotation version it was built from. ``'{}'`` means
+nothing was worth simplifying; NULL means not computed yet (rows written
+before the column existed).
+
+Douglas-Peucker runs on all rings of a batch at once: each pass computes
+the distance of every pending vertex to the chord of its segment and keeps
+the farthest vertex of each segment beyond the tolerance, so a pass is a
+handful of NumPy operations whatever the number of annotations.
+"""
+
+from typing import Optional
+
+import numpy as np
+
+# Downsamples (level-0 pixels per displayed pixel) variants are built for
+LOD_DOWNSAMPLES = (2, 4, 8, 16, 32, 64, 128, 256)
+
+# Geometries with fewer vertices are never simplified
+LOD_MIN_VERTICES = 8
+
+# A variant is stored only if it keeps at most this share of the vertices of
+# the previous one (otherwise the previous variant serves that downsample too)
+LOD_MAX_RATIO = 0.8
+
+SIMPLIFIABLE_TYPES = {"Polygon", "MultiPolygon", "LineString", "MultiLineString"}
+
+
+def simplify_rings(rings: list[np.ndarray], closed: list[bool], tolerance: float) -> list[np.ndarray]:
+    """
+    Douglas-Peucker over many point lists at once.
+
+    ``closed`` rings keep at least four vertices (their start, the vertex
+    farthest from it and the farthest vertex of each half), so polygons
+    never collapse into lines.
+    """
+    if not rings:
+        return []
+    lengths = np.array([len(ring) for ring in rings])
+    points = np.concatenate(rings).astype(np.float64)
+    count = len(points)
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    ends = starts + lengths - 1
+    index = np.arange(count)
+    ring_of = np.repeat(np.arange(len(rings)), lengths)
+    closed = np.asarray(closed, dtype=bool)
+
+    keep = np.zeros(count, dtype=bool)
+    keep[starts] = True
+    keep[ends] = True
+
+    # Closed rings: also keep the vertex farthest from the start
+    from_start = np.hypot(*(points - points[starts][ring_of]).T)
+    farthest = np.maximum.reduceat(from_start, starts)
+    candidates = closed[ring_of] & (from_start == farthest[ring_of]) & (from_start > 0)
+    first = np.unique(ring_of[candidates], return_index=True)[1]
+    keep[index[candidates][first]] = True
+
+    forced = closed[ring_of]
+    while True:
+        pending = ~keep
+        if not pending.any():
+            break
+        previous = np.maximum.accumulate(np.where(keep, index, 0))
+        following = np.minimum.accumulate(np.where(keep, index, count)[::-1])[::-1]
+
+        # Distance of each vertex to the chord of the segment it lies in
+        a = points[previous]
+        ab = points[following] - a
+        ap = points - a
+        length2 = (ab * ab).sum(axis=1)
+        t = np.clip((ap * ab).sum(axis=1) / np.where(length2 > 0, length2, 1), 0, 1)
+        distance = np.hypot(*(ap - t[:, None] * ab).T)
+
+        # First pass on closed rings splits both halves regardless of tolerance
+        split = pending & ((distance > tolerance) | (forced & (distance > 0)))
+        forced = np.zeros(count, dtype=bool)
+        if not split.any():
+            break
+        segment, far, where = previous[split], distance[split], index[split]
+        order = np.lexsort((-far, segment))
+        boundary = np.concatenate(([True], segment[order][1:] != segment[order][:-1]))
+        keep[where[order][boundary]] = True
+
+    kept_per_ring = np.add.reduceat(keep.astype(np.int64), starts)
+    return np.split(points[keep], np.cumsum(kept_per_ring)[:-1])
+
+
+def _parts(geometry: dict) -> Optional[tuple[list, list, bool]]:
+    """(point lists, closed flags, flat viewer polygon) of a geometry, or None"""
+    if not isinstance(geometry, dict) or geometry.get("type") not in SIMPLIFIABLE_TYPES:
+        return None
+    kind, coordinates = geometry["type"], geometry.get("coordinates")
+    if not isinstance(coordinates, list) or not coordinates:
+        return None
+    try:
+        if kind == "LineString":
+            lists, closed = [coordinates], [False]
+        elif kind == "MultiLineString":
+            lists, closed = coordinates, [False] * len(coordinates)
+        elif kind == "MultiPolygon":
+            lists = [ring for polygon in coordinates for ring in polygon]
+            closed = [True] * len(lists)
+        elif isinstance(coordinates[0], list) and coordinates[0] and isinstance(coordinates[0][0], list):
+            lists, closed = coordinates, [True] * len(coordinates)
+        else:
+            return [np.asarray(coordinates, dtype=np.float64)[:, :2]], [True], True
+        arrays = [np.asarray(points, dtype=np.float64)[:, :2] for points in lists]
+    except (TypeError, ValueError, IndexError):
+        return None
+    if any(array.ndim != 2 or len(array) == 0 or not np.isfinite(array).all() for array in arrays):
+        return None
+    return arrays, closed, False
+
+
+def _rebuild(geometry: dict, rings: list[np.ndarray], flat: bool) -> dict:
+    """The geometry with its point lists replaced (rounded to whole pixels)"""
+    lists = [np.rint(ring).astype(np.int64).tolist() for ring in rings]
+    kind = geometry["type"]
+    if flat or kind == "LineString":
+        coordinates = lists[0]
+    elif kind == "MultiPolygon":
+        coordinates, position = [], 0
+        for polygon in geometry["coordinates"]:
+            coordinates.append(lists[position:position + len(polygon)])
+            position += len(polygon)
+    else:
+        coordinates = lists
+    return {"type": kind, "coordinates": coordinates}
+
+
+def build_lod_batch(geometries: list[dict], tolerance: float) -> list[dict]:
+    """
+    The ``geometry_lod`` value of each geometry: variants keyed by
+    downsample, simplified to ``tolerance`` displayed pixels
+    (``tolerance * downsample`` level-0 pixels). Empty when nothing is
+    worth simplifying.
+    """
+    result = [{} for _ in geometries]
+    parsed = [_parts(geometry) for geometry in geometries]
+    active = [
+        i for i, parts in enumerate(parsed)
+        if parts is not None and sum(len(ring) for ring in parts[0]) >= LOD_MIN_VERTICES
+    ]
+    if not active:
+        return result
+
+    rings = [ring for i in active for ring in parsed[i][0]]
+    closed = [flag for i in active for flag in parsed[i][1]]
+    ring_counts = np.array([len(parsed[i][0]) for i in active])
+    first_ring = np.concatenate(([0], np.cumsum(ring_counts)[:-1]))
+    owners = np.repeat(np.arange(len(active)), ring_counts)
+    stored_vertices = np.bincount(owners, weights=[len(ring) for ring in rings], minlength=len(active))
+
+    # Each downsample refines the previous one's output
+    for downsample in LOD_DOWNSAMPLES:
+        rings = simplify_rings(rings, closed, tolerance * downsample)
+        vertices = np.bincount(owners, weights=[len(ring) for ring in rings], minlength=len(active))
+        store = np.flatnonzero(vertices <= LOD_MAX_RATIO * stored_vertices)
+        for k in store:
+            i = active[k]
+            parts = rings[first_ring[k]:first_ring[k] + ring_counts[k]]
+            result[i][str(downsample)] = _rebuild(geometries[i], parts, parsed[i][2])
+        stored_vertices[store] = vertices[store]
+    return result
+
+
+def lod_join_sql(param: int) -> str:
+    """
+    LATERAL join exposing ``lod.lod_geometry`` / ``lod.lod``: the first
+    stored variant among the text[] of keys in query parameter ``param``
+    """
+    return f"""
+            LEFT JOIN LATERAL (
+                SELECT geometry_lod -> k AS lod_geometry, k AS lod
+                FROM unnest(${param}::text[]) WITH ORDINALITY AS keys(k, n)
+                WHERE geometry_lod ? k
+                ORDER BY n LIMIT 1
+            ) lod ON TRUE"""
+
+
+def lod_keys(downsample: float) -> list[str]:
+    """Variant keys usable at ``downsample``, best first"""
+    return [str(d) for d in reversed(LOD_DOWNSAMPLES) if d <= downsample]
+
+
+def pick_lod(lod: Optional[dict], downsample: float) -> Optional[tuple[str, dict]]:
+    """(key, geometry) of the coarsest stored variant no coarser than ``downsample``"""
+    for key in lod_keys(downsample):
+        if lod and key in lod:
+            return key, lod[key]
+    return None
@@ -0,0 +1,380 @@
+"""
+Annotation Vector Tiles
+Mapbox Vector Tiles (MVT 2.1) of a slide's annotations on the image pyramid's
+tile grid, and their cache.
+
+Tile ``(level, x, y)`` covers the same level-0 pixels as image tile
+``(level, x, y)``. Geometries are clipped to the tile (plus a buffer so
+strokes do not end at tile edges), quantised to MVT_EXTENT units with
+consecutive duplicate points dropped, and written with a small protobuf
+encoder (no dependency, like the PNG/TIFF writers in region.py): the packed
+geometry integers of a whole layer are varint-encoded in one NumPy pass.
+"""
+
+import math
+import struct
+from typing import Optional
+
+import numpy as np
+
+from annotation_export import standard_geometry
+from annotation_geometry import BBox
+from tile_cache import ByteLRUCache
+
+MVT_MEDIA_TYPE = "application/vnd.mapbox-vector-tile"
+MVT_LAYER = "annotations"
+# Tile coordinate range and clipping buffer, in tile units
+MVT_EXTENT = 4096
+MVT_BUFFER = 64
+
+# Geometry types and commands (MVT spec 4.3)
+POINT, LINESTRING, POLYGON = 1, 2, 3
+MOVE_TO, LINE_TO, CLOSE_PATH = 1, 2, 7
+
+
+# =============================================================================
+# Protobuf encoding
+# =============================================================================
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _varints(values: np.ndarray) -> tuple[bytes, np.ndarray]:
+    """Varint encoding of uint32 values, and the byte offset after each one"""
+    values = values.astype(np.uint64)
+    lengths = np.ones(len(values), dtype=np.int64)
+    for shift in (7, 14, 21, 28):
+        lengths += values >= (1 << shift)
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    out = np.empty(int(ends[-1]) if len(ends) else 0, dtype=np.uint8)
+    for byte in range(5):
+        has = lengths > byte
+        chunk = (values[has] >> np.uint64(7 * byte)) & np.uint64(0x7F)
+        more = (lengths[has] > byte + 1).astype(np.uint64) << np.uint64(7)
+        out[starts[has] + byte] = (chunk | more).astype(np.uint8)
+    return out.tobytes(), ends
+
+
+def _field(number: int, payload: bytes) -> bytes:
+    """Length-delimited field"""
+    return _varint(number << 3 | 2) + _varint(len(payload)) + payload
+
+
+def _value(value) -> bytes:
+    """An MVT Value message"""
+    if isinstance(value, bool):
+        return _varint(7 << 3) + _varint(int(value))
+    if isinstance(value, int):
+        if value >= 0:
+            return _varint(5 << 3) + _varint(value)
+        return _varint(6 << 3) + _varint((-value << 1) - 1)
+    if isinstance(value, float):
+        return _varint(3 << 3 | 1) + struct.pack("<d", value)
+    return _field(1, str(value).encode("utf-8"))
+
+
+def _zigzag(values: np.ndarray) -> np.ndarray:
+    return (values << 1) ^ (values >> 63)
+
+
+class LayerBuilder:
+    """Features of one MVT layer with shared key/value tables"""
+
+    def __init__(self, name: str, extent: int = MVT_EXTENT):
+        self.name = name
+        self.extent = extent
+        self.keys: dict[str, int] = {}
+        self.values: dict[tuple, int] = {}
+        self.features: list[tuple[int, list[int], np.ndarray]] = []
+
+    def __len__(self) -> int:
+        return len(self.features)
+
+    def _tag(self, table: dict, key) -> int:
+        index = table.get(key)
+        if index is None:
+            index = table[key] = len(table)
+        return index
+
+    def add(self, geometry_type: int, commands: np.ndarray, properties: dict):
+        tags = []
+        for key, value in properties.items():
+            tags.append(self._tag(self.keys, key))
+            tags.append(self._tag(self.values, (type(value).__name__, value)))
+        self.features.append((geometry_type, tags, commands))
+
+    def encode(self) -> bytes:
+        geometry, ends = _varints(np.concatenate([f[2] for f in self.features]) if self.features else np.zeros(0))
+        bounds = np.concatenate(([0], ends[np.cumsum([len(f[2]) for f in self.features]) - 1])) if self.features else [0]
+        parts = [_varint(15 << 3) + _varint(2), _field(1, self.name.encode("utf-8"))]
+        for i, (geometry_type, tags, _) in enumerate(self.features):
+            packed_tags = b"".join(_varint(tag) for tag in tags)
+            feature = (
+                (_field(2, packed_tags) if tags else b"")
+                + _varint(3 << 3) + _varint(geometry_type)
+                + _field(4, geometry[bounds[i]:bounds[i + 1]])
+            )
+            parts.append(_field(2, feature))
+        parts.extend(_field(3, key.encode("utf-8")) for key in self.keys)
+        parts.extend(_field(4, _value(value)) for _, value in self.values)
+        parts.append(_varint(5 << 3) + _varint(self.extent))
+        return _field(3, b"".join(parts))
+
+
+# =============================================================================
+# Clipping and quantisation
+# =============================================================================
+
+def clip_ring(ring: np.ndarray, box: BBox) -> np.ndarray:
+    """Sutherland-Hodgman clip of an (open) ring against a rectangle"""
+    x0, y0, x1, y1 = box
+    for axis, bound, lower in ((0, x0, True), (0, x1, False), (1, y0, True), (1, y1, False)):
+        if len(ring) == 0:
+            break
+        inside = ring[:, axis] >= bound if lower else ring[:, axis] <= bound
+        if inside.all():
+            continue
+        if not inside.any():
+            return ring[:0]
+        previous = np.roll(ring, 1, axis=0)
+        crossing = inside != np.roll(inside, 1)
+        delta = ring[:, axis] - previous[:, axis]
+        t = (bound - previous[:, axis]) / np.where(crossing, delta, 1)
+        intersection = previous + t[:, None] * (ring - previous)
+        # Each vertex emits the edge's crossing point (if any), then itself (if inside)
+        counts = crossing.astype(np.int64) + inside
+        positions = np.cumsum(counts) - counts
+        out = np.empty((int(counts.sum()), 2))
+        out[positions[crossing]] = intersection[crossing]
+        out[(positions + crossing)[inside]] = ring[inside]
+        ring = out
+    return ring
+
+
+def clip_line(line: np.ndarray, box: BBox) -> list[np.ndarray]:
+    """Liang-Barsky clip of a polyline against a rectangle: the pieces inside"""
+    x0, y0, x1, y1 = box
+    start, delta = line[:-1], np.diff(line, axis=0)
+    t0 = np.zeros(len(delta))
+    t1 = np.ones(len(delta))
+    valid = np.ones(len(delta), dtype=bool)
+    for p, q in (
+        (-delta[:, 0], start[:, 0] - x0), (delta[:, 0], x1 - start[:, 0]),
+        (-delta[:, 1], start[:, 1] - y0), (delta[:, 1], y1 - start[:, 1]),
+    ):
+        parallel = p == 0
+        valid &= ~(parallel & (q < 0))
+        ratio = q / np.where(parallel, 1, p)
+        t0 = np.where(~parallel & (p < 0), np.maximum(t0, ratio), t0)
+        t1 = np.where(~parallel & (p > 0), np.minimum(t1, ratio), t1)
+    valid &= t0 <= t1
+    if not valid.any():
+        return []
+    a = start + t0[:, None] * delta
+    b = start + t1[:, None] * delta
+    # A piece continues while the previous segment was valid and left unclipped
+    continues = np.concatenate(([False], valid[:-1] & (t1[:-1] >= 1))) & (t0 <= 0)
+    pieces = []
+    for i in np.flatnonzero(valid):
+        if continues[i]:
+            pieces[-1].append(b[i])
+        else:
+            pieces.append([a[i], b[i]])
+    return [np.array(piece) for piece in pieces]
+
+
+def _quantise(points: np.ndarray, origin: np.ndarray, scale: np.ndarray) -> np.ndarray:
+    q = np.rint((points - origin) * scale).astype(np.int64)
+    if len(q) > 1:
+        q = q[np.concatenate(([True], np.any(q[1:] != q[:-1], axis=1)))]
+    return q
+
+
+def _ring_area(ring: np.ndarray) -> float:
+    x, y = ring[:, 0], ring[:, 1]
+    return float(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))) / 2
+
+
+def _commands(parts: list[tuple[np.ndarray, bool]]) -> np.ndarray:
+    """Packed MoveTo/LineTo/ClosePath integers of paths (points, closed)"""
+    out = []
+    cursor = np.zeros(2, dtype=np.int64)
+    for points, closed in parts:
+        deltas = np.diff(points, axis=0, prepend=cursor[None, :])
+        cursor = points[-1]
+        zigzag = _zigzag(deltas).ravel()
+        out.append([MOVE_TO | 1 << 3, zigzag[0], zigzag[1]])
+        if len(points) > 1:
+            out.append([LINE_TO | (len(points) - 1) << 3])
+            out.append(zigzag[2:])
+        if closed:
+            out.append([CLOSE_PATH | 1 << 3])
+    return np.concatenate([np.asarray(o, dtype=np.int64) for o in out])
+
+
+def _point_commands(points: np.ndarray) -> np.ndarray:
+    deltas = np.diff(points, axis=0, prepend=np.zeros((1, 2), dtype=np.int64))
+    return np.concatenate(([MOVE_TO | len(points) << 3], _zigzag(deltas).ravel()))
+
+
+def buffered_box(tile_box: BBox, extent: int = MVT_EXTENT, buffer: int = MVT_BUFFER) -> BBox:
+    """Level-0 box a tile's features are clipped to"""
+    pad_x = buffer * (tile_box[2] - tile_box[0]) / extent
+    pad_y = buffer * (tile_box[3] - tile_box[1]) / extent
+    return tile_box[0] - pad_x, tile_box[1] - pad_y, tile_box[2] + pad_x, tile_box[3] + pad_y
+
+
+def tile_feature(geometry: dict, tile_box: BBox, extent: int = MVT_EXTENT,
+                 buffer: int = MVT_BUFFER) -> Optional[tuple[int, np.ndarray]]:
+    """
+    (MVT type, packed geometry) of a level-0 geometry within a tile box, or
+    None when nothing of it is left after clipping and quantisation.
+    Exterior rings are wound with positive area in tile coordinates and
+    holes with negative area, as MVT requires.
+    """
+    geometry = standard_geometry(geometry)
+    if geometry is None:
+        return None
+    kind, coordinates = geometry["type"], geometry["coordinates"]
+    clip_box = buffered_box(tile_box, extent, buffer)
+    scale = np.array([extent / (tile_box[2] - tile_box[0]), extent / (tile_box[3] - tile_box[1])])
+    origin = np.array(tile_box[:2])
+    try:
+        if kind in ("Point", "MultiPoint"):
+            points = np.asarray([coordinates] if kind == "Point" else coordinates, dtype=np.float64)[:, :2]
+            inside = ((points[:, 0] >= clip_box[0]) & (points[:, 0] <= clip_box[2])
+                      & (points[:, 1] >= clip_box[1]) & (points[:, 1] <= clip_box[3]))
+            if not inside.any():
+                return None
+            return POINT, _point_commands(np.rint((points[inside] - origin) * scale).astype(np.int64))
+
+        if kind in ("LineString", "MultiLineString"):
+            parts = []
+            for line in ([coordinates] if kind == "LineString" else coordinates):
+                for piece in clip_line(np.asarray(line, dtype=np.float64)[:, :2], clip_box):
+                    piece = _quantise(piece, origin, scale)
+                    if len(piece) >= 2:
+                        parts.append((piece, False))
+            return (LINESTRING, _commands(parts)) if parts else None
+
+        parts = []
+        for polygon in ([coordinates] if kind == "Polygon" else coordinates):
+            for index, ring in enumerate(polygon):
+                ring = np.asarray(ring, dtype=np.float64)[:, :2]
+                if len(ring) > 1 and np.array_equal(ring[0], ring[-1]):
+                    ring = ring[:-1]
+                ring = _quantise(clip_ring(ring, clip_box), origin, scale)
+                if len(ring) > 1 and np.array_equal(ring[0], ring[-1]):
+                    ring = ring[:-1]
+                area = _ring_area(ring) if len(ring) >= 3 else 0.0
+                if area == 0:
+                    if index == 0:
+                        break  # No exterior left: drop the polygon with its holes
+                    continue
+                if (area > 0) != (index == 0):
+                    ring = ring[::-1]
+                parts.append((ring, True))
+        return (POLYGON, _commands(parts)) if parts else None
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def tile_properties(row) -> dict:
+    """Scalar attributes of an annotation for its tile feature"""
+    properties = {"id": row["id"], "type": row["type"], "tool": row["tool"]}
+    for key, value in (row["properties"] or {}).items():
+        if key.startswith("_") or key in properties or value is None:
+            continue
+        if isinstance(value, dict):
+            value = value.get("display") or value.get("name")
+        if isinstance(value, float) and not math.isfinite(value):
+            continue
+        if isinstance(value, (str, int, float, bool)):
+            properties[key] = value
+    return properties
+
+
+def encode_tile(rows: list, tile_box: BBox, layer: str = MVT_LAYER, extent: int = MVT_EXTENT) -> bytes:
+    """The MVT of annotation rows (id, type, tool, geometry, properties) in a tile box"""
+    builder = LayerBuilder(layer, extent)
+    for row in rows:
+        feature = tile_feature(row["geometry"], tile_box, extent)
+        if feature is not None:
+            builder.add(feature[0], feature[1], tile_properties(row))
+    return builder.encode() if len(builder) else b""
+
+
+# =============================================================================
+# Cache
+# =============================================================================
+
+class AnnotationTileCache:
+    """
+    In-process LRU of encoded annotation tiles with per-tile invalidation.
+
+    Each cached tile remembers the level-0 box it covers (buffer included),
+    so a changed annotation evicts exactly the tiles its bounding box
+    touches, at every level. A per-study generation makes a tile built
+    from rows read before a change unable to land in the cache after it.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, ttl: float = 3600.0):
+        self.memory = ByteLRUCache(max_bytes, ttl)
+        self._boxes: dict[str, dict[str, BBox]] = {}
+        self._generations: dict[str, int] = {}
+        self.stats = {"hits": 0, "misses": 0, "invalidated_tiles": 0}
+
+    @staticmethod
+    def key(study_id: str, level: int, x: int, y: int) -> str:
+        return f"mvt:{study_id}:{level}:{x}:{y}"
+
+    def generation(self, study_id: str) -> int:
+        return self._generations.get(study_id, 0)
+
+    def get(self, study_id: str, level: int, x: int, y: int) -> Optional[bytes]:
+        entry = self.memory.get(self.key(study_id, level, x, y))
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        return entry[0]
+
+    def set(self, study_id: str, level: int, x: int, y: int, box: BBox, content: bytes, generation: int):
+        if generation != self.generation(study_id):
+            return
+        key = self.key(study_id, level, x, y)
+        self.memory.set(key, content, MVT_MEDIA_TYPE)
+        boxes = self._boxes.setdefault(study_id, {})
+        boxes[key] = box
+        if len(boxes) > 2 * len(self.memory) + 64:
+            for stale in [k for k in boxes if self.memory.get(k) is None]:
+                del boxes[stale]
+
+    def invalidate(self, study_id: str, bbox: Optional[BBox] = None) -> int:
+        """Evict the study's tiles intersecting ``bbox`` (all of them when None)"""
+        self._generations[study_id] = self.generation(study_id) + 1
+        boxes = self._boxes.get(study_id)
+        if not boxes:
+            return 0
+        removed = 0
+        for key, box in list(boxes.items()):
+            if bbox is None or (box[0] <= bbox[2] and bbox[0] <= box[2] and box[1] <= bbox[3] and bbox[1] <= box[3]):
+                self.memory.delete(key)
+                del boxes[key]
+                removed += 1
+        self.stats["invalidated_tiles"] += removed
+        return removed
+
+    def get_stats(self) -> dict:
+        return {
+            **self.stats,
+            "tiles": len(self.memory),
+            "memory_mb": round(self.memory.current_bytes / (1024 * 1024), 2),
+        }
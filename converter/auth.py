@@ -4,7 +4,10 @@ Handles token validation and user management
 """
 
 import os
+import time
+import hashlib
 import logging
+from collections import OrderedDict
 from typing import Optional
 from functools import lru_cache
 
@@ -72,8 +75,61 @@ class TokenPayload(BaseModel):
     picture: Optional[str] = None
 
 
-# Cache for Auth0 JWKS (JSON Web Key Set)
+# Cache for Auth0 JWKS (JSON Web Key Set); refreshed when a token names an unknown kid
 _jwks_cache = None
+_jwks_fetched_at = 0.0
+JWKS_MIN_REFRESH_SECONDS = 60
+
+# Verified tokens keyed by SHA-256 of the raw token, honouring the token's exp claim
+TOKEN_CACHE_MAX_ENTRIES = int(os.getenv("TOKEN_CACHE_MAX_ENTRIES", "10000"))
+_token_cache: "OrderedDict[str, tuple[float, TokenPayload]]" = OrderedDict()
+
+# Resolved users keyed by Auth0 sub, and debounced last_login writes per user id
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+LAST_LOGIN_DEBOUNCE_MINUTES = float(os.getenv("LAST_LOGIN_DEBOUNCE_MINUTES", "5"))
+_user_cache: dict[str, tuple[float, "User"]] = {}
+_last_login_written: dict[int, float] = {}
+
+
+def _token_hash(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def _get_cached_token(token: str) -> Optional[TokenPayload]:
+    key = _token_hash(token)
+    entry = _token_cache.get(key)
+    if entry is None:
+        return None
+    if entry[0] <= time.time():
+        _token_cache.pop(key, None)
+        return None
+    _token_cache.move_to_end(key)
+    return entry[1]
+
+
+def _cache_token(token: str, payload: TokenPayload, exp: Optional[float]):
+    if not exp:
+        return
+    _token_cache[_token_hash(token)] = (float(exp), payload)
+    while len(_token_cache) > TOKEN_CACHE_MAX_ENTRIES:
+        _token_cache.popitem(last=False)
+
+
+def invalidate_user_cache(auth0_id: Optional[str] = None, user_id: Optional[int] = None):
+    """Drop cached User objects (by Auth0 sub or DB id); no arguments clears everything"""
+    if auth0_id is None and user_id is None:
+        _user_cache.clear()
+        _token_cache.clear()
+        _last_login_written.clear()
+        return
+    for sub, (_, user) in list(_user_cache.items()):
+        if sub == auth0_id or (user_id is not None and user.id == user_id):
+            _user_cache.pop(sub, None)
+
+
+def _last_login_due(user_id: int) -> bool:
+    last = _last_login_written.get(user_id)
+    return last is None or time.monotonic() - last >= LAST_LOGIN_DEBOUNCE_MINUTES * 60
 
 
 def _parse_allowlist(value: str) -> set[str]:
@@ -149,21 +205,49 @@ async def _try_bypass_user(request: Request) -> Optional["User"]:
         return User(id=0, auth0_id=payload.sub, email=bypass_email, name=bypass_name, picture=None, role=bypass_role)
 
 
-async def get_jwks():
-    """Fetch Auth0 JWKS for token verification"""
-    global _jwks_cache
-    if _jwks_cache is None:
+async def get_jwks(force_refresh: bool = False):
+    """Fetch Auth0 JWKS for token verification.
+    
+    The key set is cached; force_refresh re-fetches it (at most once per
+    JWKS_MIN_REFRESH_SECONDS) so rotated signing keys are picked up.
+    """
+    global _jwks_cache, _jwks_fetched_at
+    if force_refresh and _jwks_cache is not None:
+        if time.monotonic() - _jwks_fetched_at < JWKS_MIN_REFRESH_SECONDS:
+            return _jwks_cache
+    if _jwks_cache is None or force_refresh:
         async with httpx.AsyncClient() as client:
             response = await client.get(
                 f"https://{AUTH0_DOMAIN}/.well-known/jwks.json"
             )
             response.raise_for_status()
             _jwks_cache = response.json()
+            _jwks_fetched_at = time.monotonic()
     return _jwks_cache
 
 
+def _find_rsa_key(jwks: dict, kid: Optional[str]) -> dict:
+    for key in jwks.get("keys", []):
+        if key["kid"] == kid:
+            return {
+                "kty": key["kty"],
+                "kid": key["kid"],
+                "use": key["use"],
+                "n": key["n"],
+                "e": key["e"]
+            }
+    return {}
+
+
 async def verify_token(token: str) -> TokenPayload:
-    """Verify Auth0 JWT token and extract payload"""
+    """Verify Auth0 JWT token and extract payload.
+    
+    Verified tokens are cached by hash until their exp claim.
+    """
+    cached = _get_cached_token(token)
+    if cached is not None:
+        return cached
+    
     try:
         # Check if Auth0 is configured
         if not AUTH0_DOMAIN or not AUTH0_AUDIENCE:
@@ -184,18 +268,14 @@ async def verify_token(token: str) -> TokenPayload:
             raise HTTPException(status_code=401, detail="Invalid token format")
 
         logger.debug(f"🔐 Token header: {unverified_header}")
-        rsa_key = {}
-
-        for key in jwks["keys"]:
-            if key["kid"] == unverified_header["kid"]:
-                rsa_key = {
-                    "kty": key["kty"],
-                    "kid": key["kid"],
-                    "use": key["use"],
-                    "n": key["n"],
-                    "e": key["e"]
-                }
-                break
+        kid = unverified_header.get("kid")
+        rsa_key = _find_rsa_key(jwks, kid)
+
+        if not rsa_key:
+            # Signing key may have been rotated - refresh the key set once
+            logger.info(f"🔐 Unknown kid {kid}, refreshing JWKS")
+            jwks = await get_jwks(force_refresh=True)
+            rsa_key = _find_rsa_key(jwks, kid)
 
         if not rsa_key:
             logger.error(f"🔐 ❌ No matching key found for kid: {unverified_header.get('kid')}")
@@ -219,12 +299,14 @@ async def verify_token(token: str) -> TokenPayload:
 
         logger.info(f"🔐 ✅ Token verified successfully for user: {payload.get('sub')} ({payload.get('email', 'no email')})")
 
-        return TokenPayload(
+        token_payload = TokenPayload(
             sub=payload.get("sub"),
             email=payload.get("email") or payload.get(f"https://{AUTH0_DOMAIN}/email"),
             name=payload.get("name") or payload.get(f"https://{AUTH0_DOMAIN}/name"),
             picture=payload.get("picture")
         )
+        _cache_token(token, token_payload, payload.get("exp"))
+        return token_payload
 
     except HTTPException:
         raise
@@ -258,8 +340,36 @@ async def get_db_pool():
     return _db_pool
 
 
+async def _touch_last_login(conn, user_id: int):
+    """Record a login, at most once per LAST_LOGIN_DEBOUNCE_MINUTES per user"""
+    if not _last_login_due(user_id):
+        return
+    _last_login_written[user_id] = time.monotonic()
+    await conn.execute(
+        "UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = $1",
+        user_id
+    )
+
+
 async def get_or_create_user(token_payload: TokenPayload) -> User:
-    """Get existing user or create new one from Auth0 token"""
+    """Get existing user or create new one from Auth0 token.
+    
+    Users are cached per Auth0 sub for USER_CACHE_TTL_SECONDS; callers get a
+    copy they may modify.
+    """
+    cached = _user_cache.get(token_payload.sub)
+    if cached and cached[0] > time.monotonic():
+        user = cached[1]
+        if user.id and _last_login_due(user.id):
+            pool = await get_db_pool()
+            if pool is not None:
+                try:
+                    async with pool.acquire() as conn:
+                        await _touch_last_login(conn, user.id)
+                except Exception as e:
+                    logger.warning(f"Failed to update last_login for user {user.id}: {e}")
+        return user.model_copy()
+    
     pool = await get_db_pool()
     
     if pool is None:
@@ -281,12 +391,9 @@ async def get_or_create_user(token_payload: TokenPayload) -> User:
         )
         
         if row:
-            # Update last login
-            await conn.execute(
-                "UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = $1",
-                row["id"]
-            )
-            return User(
+            # Update last login (debounced)
+            await _touch_last_login(conn, row["id"])
+            user = User(
                 id=row["id"],
                 auth0_id=row["auth0_id"],
                 email=row["email"],
@@ -294,6 +401,8 @@ async def get_or_create_user(token_payload: TokenPayload) -> User:
                 picture=row["picture"],
                 role=row["role"]
             )
+            _user_cache[user.auth0_id] = (time.monotonic() + USER_CACHE_TTL_SECONDS, user)
+            return user.model_copy()
         
         # Create new user
         email = token_payload.email or f"{token_payload.sub}@auth0.user"
@@ -324,10 +433,13 @@ async def get_or_create_user(token_payload: TokenPayload) -> User:
             role=row["role"]
         )
         
+        _last_login_written[user.id] = time.monotonic()
+        
         # Process any pending shares for this user
         await process_pending_shares(user.id, email)
         
-        return user
+        _user_cache[user.auth0_id] = (time.monotonic() + USER_CACHE_TTL_SECONDS, user)
+        return user.model_copy()
 
 
 async def process_pending_shares(user_id: int, user_email: str):
@@ -395,6 +507,8 @@ async def process_pending_shares(user_id: int, user_email: str):
                     )
                 except Exception as e:
                     logger.error(f"Failed to convert pending share {share['id']}: {e}")
+            
+            invalidate_access_cache(user_id=user_id)
                     
     except Exception as e:
         logger.error(f"Error processing pending shares for {user_email}: {e}")
@@ -515,6 +629,7 @@ async def set_study_owner(study_id: str, user_id: int, force: bool = False) -> b
                     study_id,
                     user_id
                 )
+                invalidate_access_cache(study_id=study_id)
                 logger.info(f"Set study {study_id} owner to user {user_id} (forced)")
                 return True
             else:
@@ -534,6 +649,7 @@ async def set_study_owner(study_id: str, user_id: int, force: bool = False) -> b
                 logger.info(f"🔐 SQL result: {result}")
                 rows_affected = int(result.split()[-1])
                 if rows_affected > 0:
+                    invalidate_access_cache(study_id=study_id)
                     logger.info(f"🔐 ✅ Successfully set study {study_id} owner to user {user_id}")
                     return True
                 else:
@@ -595,6 +711,41 @@ async def get_user_slide_ids(user_id: int) -> list[str]:
         return [row["study_id"] for row in rows]
 
 
+# =============================================================================
+# Access Decision Cache
+# =============================================================================
+
+# Tile and pyramid requests check access for every single request; cache the
+# (user, study) decision briefly and invalidate explicitly when shares change.
+ACCESS_CACHE_TTL_SECONDS = float(os.getenv("ACCESS_CACHE_TTL_SECONDS", "30"))
+ACCESS_CACHE_MAX_ENTRIES = 50000
+
+_access_cache: dict[tuple[Optional[int], str], tuple[float, bool]] = {}
+
+
+def _cache_access_decision(user_id: Optional[int], study_id: str, allowed: bool):
+    now = time.monotonic()
+    if len(_access_cache) >= ACCESS_CACHE_MAX_ENTRIES:
+        for key in [k for k, (expires, _) in _access_cache.items() if expires <= now]:
+            del _access_cache[key]
+        if len(_access_cache) >= ACCESS_CACHE_MAX_ENTRIES:
+            _access_cache.clear()
+    _access_cache[(user_id, study_id)] = (now + ACCESS_CACHE_TTL_SECONDS, allowed)
+
+
+def invalidate_access_cache(study_id: Optional[str] = None, user_id: Optional[int] = None):
+    """Drop cached access decisions for a study and/or a user.
+    
+    With no arguments the whole cache is cleared.
+    """
+    if study_id is None and user_id is None:
+        _access_cache.clear()
+        return
+    for key in list(_access_cache):
+        if (study_id is not None and key[1] == study_id) or (user_id is not None and key[0] == user_id):
+            _access_cache.pop(key, None)
+
+
 async def can_access_study(user_id: Optional[int], study_id: str) -> bool:
     """Check if user can access a specific study/slide.
     
@@ -606,62 +757,59 @@ async def can_access_study(user_id: Optional[int], study_id: str) -> bool:
     5. Slide has no owner record (unowned/sample - accessible to all authenticated users)
     
     For unauthenticated requests (user_id=None), only samples are accessible.
+    Decisions are cached for ACCESS_CACHE_TTL_SECONDS.
     """
+    cached = _access_cache.get((user_id, study_id))
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+    
     pool = await get_db_pool()
     if pool is None:
         return True  # Allow access if DB unavailable (fail open for development)
     
     async with pool.acquire() as conn:
-        # First check if this slide exists in our database at all
-        slide_exists = await conn.fetchrow(
-            "SELECT id, owner_id, is_sample FROM slides WHERE orthanc_study_id = $1",
-            study_id
-        )
-        
-        # If no record exists, it's an unowned/sample study
-        if not slide_exists:
-            # Allow access to any authenticated user, or unauthenticated if it's a sample
-            return user_id is not None or True  # Unowned slides are effectively samples
-        
-        # If it's explicitly a sample, allow access to anyone
-        if slide_exists["is_sample"]:
-            return True
-        
-        # For non-sample slides, user must be authenticated
-        if user_id is None:
-            logger.debug(f"Access denied: unauthenticated request for non-sample slide {study_id}")
-            return False
-        
-        # Check ownership and sharing
+        # Single round-trip: slide record plus ownership/share check
         row = await conn.fetchrow(
             """
-            SELECT 1 FROM slides s
+            SELECT
+                s.is_sample,
+                COALESCE($1::int IS NOT NULL AND (
+                    -- User owns the slide
+                    s.owner_id = $1
+                    -- Slide is directly shared with user
+                    OR EXISTS (
+                        SELECT 1 FROM slide_shares ss
+                        WHERE ss.slide_id = s.id AND ss.shared_with_id = $1
+                    )
+                    -- Slide's case is shared with user
+                    OR EXISTS (
+                        SELECT 1 FROM case_shares cs
+                        WHERE cs.case_id = s.case_id AND cs.shared_with_id = $1
+                    )
+                ), false) AS has_access
+            FROM slides s
             WHERE s.orthanc_study_id = $2
-            AND (
-                -- User owns the slide
-                s.owner_id = $1
-                -- Slide is directly shared with user
-                OR EXISTS (
-                    SELECT 1 FROM slide_shares ss
-                    WHERE ss.slide_id = s.id AND ss.shared_with_id = $1
-                )
-                -- Slide's case is shared with user
-                OR EXISTS (
-                    SELECT 1 FROM case_shares cs
-                    WHERE cs.case_id = s.case_id AND cs.shared_with_id = $1
-                )
-            )
             """,
             user_id,
             study_id
         )
-        
-        if row:
-            return True
-        
-        # Log access denial for debugging
-        logger.debug(f"Access denied: user {user_id} cannot access slide {study_id}")
-        return False
+    
+    if not row:
+        # No record: unowned/sample study, accessible to everyone
+        allowed = True
+    elif row["is_sample"]:
+        # Explicit samples are accessible to anyone
+        allowed = True
+    elif user_id is None:
+        logger.debug(f"Access denied: unauthenticated request for non-sample slide {study_id}")
+        allowed = False
+    else:
+        allowed = bool(row["has_access"])
+        if not allowed:
+            logger.debug(f"Access denied: user {user_id} cannot access slide {study_id}")
+    
+    _cache_access_decision(user_id, study_id, allowed)
+    return allowed
 
 
 async def share_slide(study_id: str, owner_id: int, share_with_email: str, permission: str = "view") -> dict:
@@ -717,6 +865,7 @@ async def share_slide(study_id: str, owner_id: int, share_with_email: str, permi
                 target_user["id"],
                 permission
             )
+            invalidate_access_cache(study_id=study_id)
             logger.info(f"Shared slide {study_id} with user {target_user['id']}")
             return {"success": True, "pending": False, "message": "Shared successfully"}
         else:
@@ -785,6 +934,7 @@ async def unshare_slide(study_id: str, owner_id: int, unshare_user_id: int) -> d
             unshare_user_id
         )
         logger.info(f"unshare_slide: DELETE result={result}")
+        invalidate_access_cache(study_id=study_id)
         
         # Check if user still has inherited access via case share
         has_inherited_access = False
@@ -1085,6 +1235,7 @@ async def share_case(case_id: int, owner_id: int, share_with_email: str, permiss
                 target_user["id"],
                 permission
             )
+            invalidate_access_cache(user_id=target_user["id"])
             logger.info(f"Shared case {case_id} with user {target_user['id']}")
             return {"success": True, "pending": False, "message": "Case shared successfully"}
         else:
@@ -1143,6 +1294,7 @@ async def unshare_case(case_id: int, owner_id: int, unshare_user_id: int) -> dic
             unshare_user_id
         )
         logger.info(f"unshare_case: DELETE result={result}")
+        invalidate_access_cache(user_id=unshare_user_id)
         
         return {"success": True, "message": "Case share removed"}
 
@@ -1470,6 +1622,7 @@ async def update_user_profile(user_id: int, email: str = None, name: str = None,
         query = f"UPDATE users SET {', '.join(updates)} WHERE id = ${param_idx}"
         
         result = await conn.execute(query, *params)
+        invalidate_user_cache(user_id=user_id)
         logger.info(f"Updated user {user_id} profile: {result}")
         return "UPDATE" in result
 
@@ -1534,6 +1687,7 @@ async def batch_share_studies(study_ids: list[str], owner_id: int, share_with_em
                         target_user_id,
                         permission
                     )
+                    invalidate_access_cache(study_id=study_id)
                     success += 1
                 else:
                     # User doesn't exist - create pending share
@@ -1595,6 +1749,7 @@ async def batch_unshare_studies(study_ids: list[str], owner_id: int, unshare_use
                     slide["id"],
                     unshare_user_id
                 )
+                invalidate_access_cache(study_id=study_id)
                 # Check if any row was deleted
                 if "DELETE 1" in result or "DELETE" in result:
                     success += 1
@@ -1751,6 +1906,7 @@ async def create_slide(
                 original_filename, source_format, scanner_manufacturer,
                 width, height, magnification, block_id, case_id, patient_id
             )
+            invalidate_access_cache(study_id=orthanc_study_id)
             return row["id"] if row else None
         except Exception as e:
             logger.error(f"Failed to create slide: {e}")
@@ -1820,6 +1976,9 @@ async def update_slide(
         try:
             result = await conn.execute(query, *params)
             logger.info(f"✏️ update_slide result: {result}")
+            if case_id is not None:
+                # Moving a slide between cases changes who inherits access via case shares
+                invalidate_access_cache()
             return "UPDATE 1" in result
         except Exception as e:
             logger.error(f"✏️ Failed to update slide: {e}")
@@ -2169,6 +2328,7 @@ async def delete_slide(study_id: str, owner_id: int) -> dict:
                 )
                 logger.info(f"delete_slide: Deleted slide record: {result}")
             
+            invalidate_access_cache(study_id=study_id)
             logger.info(f"delete_slide: Successfully deleted slide {study_id} from database")
             return {"success": True, "message": "Slide deleted from database", "orthanc_id": study_id}
             
@@ -0,0 +1,873 @@
+"""
+Conversion Worker
+Runs the CPU-bound part of WSI conversion (ZIP extraction, pre-processing,
+wsidicomizer pyramid generation) in a process pool so it never blocks the
+API event loop. Progress is sent back to the ConversionJob through a queue.
+"""
+
+import os
+import sys
+import queue
+import asyncio
+import logging
+import multiprocessing
+from pathlib import Path
+from typing import Callable, Optional
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+logger = logging.getLogger(__name__)
+
+# Job fields a worker is allowed to report back
+PROGRESS_FIELDS = ("status", "progress", "message")
+
+# How often the event loop drains the progress queue
+PROGRESS_POLL_SECONDS = 0.25
+
+
+class ConversionCancelled(Exception):
+    """Raised inside a worker when its job has been cancelled"""
+
+
+class JobProgress:
+    """
+    Stand-in for ConversionJob inside a worker: assigning ``progress``,
+    ``message`` or ``status`` sends the update to the parent process.
+    Each update is also a cancellation checkpoint.
+    """
+
+    def __init__(self, job_id: str, progress_queue, cancel_flags=None):
+        object.__setattr__(self, "job_id", job_id)
+        object.__setattr__(self, "_queue", progress_queue)
+        object.__setattr__(self, "_cancel_flags", cancel_flags)
+        object.__setattr__(self, "progress", 0)
+        object.__setattr__(self, "message", "")
+        object.__setattr__(self, "status", "processing")
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name in PROGRESS_FIELDS:
+            try:
+                self._queue.put_nowait((self.job_id, name, value))
+            except Exception:
+                pass  # Progress is best-effort, never fail a conversion over it
+            self.check_cancelled()
+
+    def check_cancelled(self):
+        flags = self._cancel_flags
+        if flags is not None and flags.get(self.job_id):
+            raise ConversionCancelled(f"Job {self.job_id} cancelled")
+
+
+def _apply_memory_limit(memory_limit_mb: int):
+    """Cap the worker's address space so a runaway conversion fails with MemoryError"""
+    if not memory_limit_mb:
+        return
+    try:
+        import resource
+    except ImportError:
+        logger.warning("Per-job memory limits are not supported on this platform")
+        return
+    limit = memory_limit_mb * 1024 * 1024
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+
+def _init_worker(converter_dir: str):
+    # Spawned workers only import this module; make sibling modules importable
+    if converter_dir not in sys.path:
+        sys.path.insert(0, converter_dir)
+    logging.basicConfig(level=logging.INFO)
+
+
+# =============================================================================
+# LZW/Unsupported Compression Handling
+# =============================================================================
+
+def check_tiff_compression(file_path: Path) -> tuple[bool, int]:
+    """
+    Check if a TIFF/SVS file uses LZW or other unsupported compression.
+    Returns (needs_conversion, compression_type)
+    
+    TIFF Compression codes:
+    - 1: Uncompressed
+    - 5: LZW (not supported by OpenSlide)
+    - 6: JPEG (old-style)
+    - 7: JPEG (new-style, supported)
+    - 8: Adobe Deflate
+    - 32773: PackBits
+    - 33003: JPEG2000 (supported by OpenSlide with plugins)
+    - 33005: JPEG2000 (supported by OpenSlide with plugins)
+    """
+    try:
+        import tifffile
+        with tifffile.TiffFile(str(file_path)) as tif:
+            # Check all pages for compression
+            unsupported_compressions = {5, 6, 8, 32773}  # LZW, old JPEG, Deflate, PackBits
+            for page in tif.pages:
+                compression = page.compression
+                if isinstance(compression, int) and compression in unsupported_compressions:
+                    logger.info(f"Found unsupported compression {compression} in {file_path.name}")
+                    return True, compression
+                # tifffile uses enum, check value
+                if hasattr(compression, 'value') and compression.value in unsupported_compressions:
+                    logger.info(f"Found unsupported compression {compression.value} in {file_path.name}")
+                    return True, compression.value
+        return False, 0
+    except Exception as e:
+        logger.warning(f"Could not check TIFF compression: {e}")
+        return False, 0
+
+
+def convert_to_jpeg_tiff(source_path: Path, output_dir: Path) -> Path:
+    """
+    Convert a TIFF with unsupported compression (LZW, Deflate, etc.) 
+    to a JPEG-compressed pyramid TIFF using pyvips.
+    
+    This creates a proper pyramid TIFF that OpenSlide/wsidicomizer can read.
+    Handles YCbCr JPEG TIFFs (PhotometricInterpretation=6) correctly.
+    """
+    import pyvips
+    
+    logger.info(f"Pre-processing {source_path.name} - converting to JPEG compression...")
+    
+    output_path = output_dir / f"{source_path.stem}_jpeg.tiff"
+    
+    # Check source TIFF photometric interpretation using tifffile
+    # YCbCr (6) JPEGs need special handling
+    source_is_ycbcr = False
+    try:
+        import tifffile
+        with tifffile.TiffFile(str(source_path)) as tif:
+            if tif.pages:
+                photometric = tif.pages[0].photometric
+                logger.info(f"Source photometric: {photometric} (6=YCbCr, 2=RGB)")
+                source_is_ycbcr = (photometric == 6)  # PHOTOMETRIC.YCBCR
+    except Exception as e:
+        logger.warning(f"Could not check photometric: {e}")
+    
+    # Load image with pyvips
+    # For YCbCr JPEG TIFFs, we need to ensure proper color conversion
+    image = pyvips.Image.new_from_file(str(source_path), access='random')
+    
+    logger.info(f"Loaded image: {image.width}x{image.height}, {image.bands} bands, interpretation={image.interpretation}")
+    
+    # Handle YCbCr source images - pyvips should auto-convert, but let's be explicit
+    if source_is_ycbcr or image.interpretation in ['ycc', 'ycbcr']:
+        logger.info("Source is YCbCr - converting to sRGB")
+        try:
+            # For YCbCr JPEG, pyvips usually reads as RGB already, but if it's still YCC:
+            if image.interpretation in ['ycc', 'ycbcr']:
+                image = image.colourspace('srgb')
+                logger.info(f"Converted YCbCr to sRGB")
+        except Exception as e:
+            logger.warning(f"YCbCr conversion warning: {e}")
+    
+    # Ensure image is in sRGB color space (fixes color issues from various source formats)
+    # This handles CMYK, LAB, or other color spaces that might come from source TIFFs
+    if image.interpretation not in ['srgb', 'rgb', 'b-w']:
+        try:
+            logger.info(f"Converting from {image.interpretation} to sRGB")
+            image = image.colourspace('srgb')
+            logger.info(f"Converted to sRGB, now {image.bands} bands")
+        except Exception as e:
+            logger.warning(f"Could not convert to sRGB: {e}")
+    
+    # Ensure image is in a format compatible with JPEG (RGB, no alpha)
+    if image.bands == 4:
+        # Remove alpha channel
+        image = image.flatten(background=[255, 255, 255])
+        logger.info("Flattened 4-band to 3-band RGB")
+    elif image.bands == 1:
+        # Convert grayscale to RGB
+        image = image.colourspace('srgb')
+        logger.info("Converted grayscale to sRGB")
+    
+    # Save as pyramid TIFF with JPEG compression
+    # Use RGB photometric interpretation for compatibility (rgbjpeg=True means store as RGB not YCbCr)
+    image.tiffsave(
+        str(output_path),
+        tile=True,
+        tile_width=256,
+        tile_height=256,
+        pyramid=False,  # Don't create pyramid - let wsidicomizer do it with add_missing_levels
+        compression='jpeg',
+        Q=90,
+        bigtiff=True,  # Support files > 4GB
+        rgbjpeg=True   # Store JPEG as RGB (PhotometricInterpretation=2), not YCbCr (6)
+    )
+    
+    logger.info(f"Created JPEG-compressed TIFF (RGB): {output_path}")
+    return output_path
+
+
+def preprocess_for_conversion(file_path: Path, output_dir: Path, job=None) -> Path:
+    """
+    Pre-process a WSI file if it uses unsupported compression or obfuscation.
+    Returns the path to use for conversion (may be original or converted file).
+    """
+    ext = file_path.suffix.lower()
+    
+    # Handle 3DHISTECH DCX files (obfuscated tiles)
+    if ext == '.dcx':
+        if job:
+            job.message = "Deobfuscating DCX file..."
+            job.progress = 20
+        
+        logger.info(f"Processing DCX file: {file_path.name}")
+        
+        try:
+            # Import from same directory (works in Docker)
+            import sys
+            import os
+            sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+            from dcx_lossless import convert_dcx_lossless
+            
+            output_path = output_dir / f"{file_path.stem}_decoded.tiff"
+            
+            def progress_cb(progress, message):
+                if job:
+                    # Map DCX progress (0-100) to job progress (20-50)
+                    job.progress = 20 + int(progress * 0.3)
+                    job.message = message
+            
+            convert_dcx_lossless(file_path, output_path, progress_cb)
+            logger.info(f"DCX deobfuscation complete: {output_path}")
+            return output_path
+            
+        except Exception as e:
+            logger.error(f"DCX deobfuscation failed: {e}")
+            raise Exception(f"DCX file deobfuscation failed: {e}")
+    
+    # Only check TIFF-based formats for compression issues
+    if ext not in ['.tiff', '.tif', '.svs', '.scn', '.bif']:
+        return file_path
+    
+    needs_conversion, compression = check_tiff_compression(file_path)
+    
+    if not needs_conversion:
+        return file_path
+    
+    compression_names = {
+        5: 'LZW',
+        6: 'Old JPEG',
+        8: 'Deflate/ZIP',
+        32773: 'PackBits'
+    }
+    comp_name = compression_names.get(compression, f'Type {compression}')
+    
+    if job:
+        job.message = f"Converting {comp_name} compression to JPEG..."
+        job.progress = 25
+    
+    logger.info(f"File uses {comp_name} compression - pre-processing with pyvips")
+    
+    try:
+        converted_path = convert_to_jpeg_tiff(file_path, output_dir)
+        logger.info(f"Pre-processing complete: {converted_path}")
+        return converted_path
+    except Exception as e:
+        logger.error(f"Pre-processing failed: {e}")
+        # Try to continue with original file anyway
+        logger.info("Attempting to continue with original file...")
+        return file_path
+
+
+# =============================================================================
+# Format Detection
+# =============================================================================
+
+def detect_format(filename: str) -> str:
+    """Detect WSI format from filename"""
+    ext = Path(filename).suffix.lower()
+    format_map = {
+        ".ndpi": "hamamatsu",
+        ".svs": "aperio",
+        ".tif": "generic_tiff",
+        ".tiff": "generic_tiff",
+        ".dcx": "generic_tiff",  # DCX multiresolution TIFF
+        ".isyntax": "philips",
+        ".mrxs": "mirax",
+        ".scn": "leica",
+        ".bif": "ventana",
+        ".vsi": "olympus",
+        ".dcm": "dicom",
+        ".zip": "zip_archive",  # Multi-file format in ZIP
+    }
+    return format_map.get(ext, "unknown")
+
+
+def find_wsi_index_file(folder: Path) -> Optional[Path]:
+    """
+    Find the main WSI index file in a folder (for multi-file formats).
+    Returns the path to the main file, or None if not found.
+    """
+    # Priority order for index files
+    index_patterns = [
+        "**/*.mrxs",   # 3DHISTECH MIRAX
+        "**/*.vms",    # Hamamatsu VMS
+        "**/*.vmu",    # Hamamatsu VMU
+        "**/*.ets",    # Hamamatsu ETS (multi-file)
+        "**/*.svslide",  # Aperio multi-file
+    ]
+    
+    for pattern in index_patterns:
+        matches = list(folder.glob(pattern))
+        if matches:
+            # Return the first match (should only be one)
+            logger.info(f"Found WSI index file: {matches[0]}")
+            return matches[0]
+    
+    return None
+
+
+def get_multifile_format(index_file: Path) -> str:
+    """Get the format name for a multi-file WSI index file"""
+    ext = index_file.suffix.lower()
+    format_map = {
+        ".mrxs": "mirax",
+        ".vms": "hamamatsu_vms",
+        ".vmu": "hamamatsu_vmu",
+        ".ets": "hamamatsu_ets",
+        ".svslide": "aperio_multifile",
+    }
+    return format_map.get(ext, "unknown")
+
+
+# Mapping of formats to manufacturer info
+FORMAT_METADATA = {
+    "hamamatsu": {
+        "manufacturer": "Hamamatsu Photonics",
+        "model": "NanoZoomer",
+        "format_name": "NDPI",
+    },
+    "hamamatsu_vms": {
+        "manufacturer": "Hamamatsu Photonics",
+        "model": "NanoZoomer VMS",
+        "format_name": "VMS",
+    },
+    "hamamatsu_vmu": {
+        "manufacturer": "Hamamatsu Photonics",
+        "model": "NanoZoomer VMU",
+        "format_name": "VMU",
+    },
+    "hamamatsu_ets": {
+        "manufacturer": "Hamamatsu Photonics",
+        "model": "NanoZoomer ETS",
+        "format_name": "ETS",
+    },
+    "aperio": {
+        "manufacturer": "Leica Biosystems (Aperio)",
+        "model": "Aperio Scanner",
+        "format_name": "SVS",
+    },
+    "aperio_multifile": {
+        "manufacturer": "Leica Biosystems (Aperio)",
+        "model": "Aperio Scanner",
+        "format_name": "SVSlide",
+    },
+    "philips": {
+        "manufacturer": "Philips",
+        "model": "IntelliSite Ultra Fast Scanner",
+        "format_name": "iSyntax",
+    },
+    "leica": {
+        "manufacturer": "Leica Biosystems",
+        "model": "Leica Scanner",
+        "format_name": "SCN",
+    },
+    "ventana": {
+        "manufacturer": "Roche (Ventana)",
+        "model": "Ventana Scanner",
+        "format_name": "BIF",
+    },
+    "mirax": {
+        "manufacturer": "3DHISTECH",
+        "model": "Pannoramic Scanner",
+        "format_name": "MRXS",
+    },
+    "olympus": {
+        "manufacturer": "Olympus",
+        "model": "VS Series",
+        "format_name": "VSI",
+    },
+    "generic_tiff": {
+        "manufacturer": "Unknown",
+        "model": "Unknown",
+        "format_name": "TIFF",
+    },
+    "zip_archive": {
+        "manufacturer": "Unknown",
+        "model": "Unknown",
+        "format_name": "ZIP (multi-file)",
+    },
+}
+
+
+def get_format_metadata(source_format: str) -> dict:
+    """Get manufacturer metadata for a format"""
+    return FORMAT_METADATA.get(source_format, {
+        "manufacturer": "Unknown",
+        "model": "Unknown", 
+        "format_name": source_format.upper(),
+    })
+
+
+def convert_isyntax_to_dicom(job, file_path: Path, output_dir: Path):
+    """
+    Convert Philips iSyntax file to DICOM using pyisyntax.
+    Note: wsidicomizer does not support iSyntax directly, so we use pyisyntax
+    to create a simple DICOM representation at a reduced resolution level.
+    """
+    try:
+        from isyntax import ISyntax
+        import numpy as np
+        import pydicom
+        from pydicom.uid import generate_uid
+        import datetime
+        
+        job.message = "Opening iSyntax file..."
+        job.progress = 15
+        
+        with ISyntax.open(str(file_path)) as isyntax:
+            # Get image dimensions
+            width, height = isyntax.dimensions
+            num_levels = isyntax.level_count
+            
+            job.message = f"iSyntax: {width}x{height}, {num_levels} levels"
+            job.progress = 25
+            
+            # Use a mid-resolution level for reasonable file size and quality
+            level = min(3, num_levels - 1)  # Use level 3 or lowest available
+            
+            level_obj = isyntax.wsi.get_level(level)
+            level_width = level_obj.width
+            level_height = level_obj.height
+            
+            job.message = f"Reading level {level} ({level_width}x{level_height})..."
+            job.progress = 35
+            
+            # Read the whole image at this resolution
+            pixels = isyntax.read_region(0, 0, level_width, level_height, level=level)
+            
+            job.message = "Creating DICOM..."
+            job.progress = 50
+            
+            # Create DICOM dataset
+            ds = pydicom.Dataset()
+            ds.SOPClassUID = '1.2.840.10008.5.1.4.1.1.77.1.6'  # VL Whole Slide Microscopy
+            ds.SOPInstanceUID = generate_uid()
+            ds.StudyInstanceUID = generate_uid()
+            ds.SeriesInstanceUID = generate_uid()
+            ds.PatientName = file_path.stem
+            ds.PatientID = 'ISYNTAX-CONVERT'
+            ds.StudyDate = datetime.datetime.now().strftime('%Y%m%d')
+            ds.StudyTime = datetime.datetime.now().strftime('%H%M%S')
+            ds.StudyDescription = f"Philips iSyntax (level {level} of {num_levels})"
+            ds.SeriesDescription = f"Converted from iSyntax"
+            ds.Modality = 'SM'
+            ds.Manufacturer = 'Philips (converted via pyisyntax)'
+            ds.ImageType = ['ORIGINAL', 'PRIMARY', 'VOLUME']
+            ds.SamplesPerPixel = 3
+            ds.PhotometricInterpretation = 'RGB'
+            ds.Rows = pixels.shape[0]
+            ds.Columns = pixels.shape[1]
+            ds.BitsAllocated = 8
+            ds.BitsStored = 8
+            ds.HighBit = 7
+            ds.PixelRepresentation = 0
+            ds.PlanarConfiguration = 0
+            
+            # Handle RGBA -> RGB if needed
+            if pixels.shape[2] == 4:
+                pixel_data = pixels[:, :, :3].tobytes()
+            else:
+                pixel_data = pixels.tobytes()
+            ds.PixelData = pixel_data
+            
+            ds.file_meta = pydicom.Dataset()
+            ds.file_meta.MediaStorageSOPClassUID = ds.SOPClassUID
+            ds.file_meta.MediaStorageSOPInstanceUID = ds.SOPInstanceUID
+            ds.file_meta.TransferSyntaxUID = pydicom.uid.ExplicitVRLittleEndian
+            
+            output_file = output_dir / f"{file_path.stem}_level{level}.dcm"
+            ds.save_as(str(output_file))
+            
+            job.message = f"iSyntax conversion complete ({level_width}x{level_height})"
+            job.progress = 70
+            
+            return [output_file]
+            
+    except ImportError as e:
+        raise Exception(f"pyisyntax not available: {e}")
+
+
+# =============================================================================
+# Conversion Pipeline (runs inside a worker)
+# =============================================================================
+
+def convert_to_dicom_files(job, file_path: Path, output_dir: Path, extracted_dir: Path) -> list[Path]:
+    """
+    Convert a WSI file (or ZIP of a multi-file format) into DICOM files in
+    ``output_dir``. Blocking; ``job`` only needs ``progress``/``message``.
+    """
+    import zipfile
+
+    actual_file_path = file_path
+    original_filename = file_path.name
+
+    # Detect format first
+    source_format = detect_format(file_path.name)
+    job.message = f"Detected format: {source_format}"
+    job.progress = 10
+
+    # Handle ZIP archives (multi-file formats like MIRAX)
+    if source_format == "zip_archive":
+        job.message = "Extracting ZIP archive..."
+        job.progress = 15
+
+        extracted_dir.mkdir(parents=True, exist_ok=True)
+
+        try:
+            with zipfile.ZipFile(file_path, 'r') as zip_ref:
+                zip_ref.extractall(extracted_dir)
+            logger.info(f"Extracted ZIP to {extracted_dir}")
+
+            # List extracted contents for debugging
+            extracted_files = list(extracted_dir.rglob("*"))
+            logger.info(f"Extracted {len(extracted_files)} files/folders")
+
+        except zipfile.BadZipFile:
+            raise Exception("Invalid ZIP file")
+
+        # Find the main WSI index file
+        index_file = find_wsi_index_file(extracted_dir)
+
+        if not index_file:
+            raise Exception("No supported WSI index file found in ZIP archive. "
+                          "Supported formats: MRXS, VMS, VMU, ETS, SVSlide")
+
+        # Update paths and format
+        actual_file_path = index_file
+        source_format = get_multifile_format(index_file)
+        original_filename = index_file.name
+
+        job.message = f"Found {source_format.upper()} file: {index_file.name}"
+        logger.info(f"Processing multi-file WSI: {source_format} from {index_file}")
+
+    # Pre-process files with unsupported compression (LZW, Deflate, etc.)
+    # This converts them to JPEG-compressed pyramid TIFF using pyvips
+    job.progress = 18
+    job.message = "Checking file compression..."
+    actual_file_path = preprocess_for_conversion(actual_file_path, output_dir, job)
+
+    # Use wsidicomizer for all supported formats (including iSyntax)
+    from wsidicomizer import WsiDicomizer
+
+    job.progress = 20
+    job.message = f"Opening {source_format} file..."
+
+    # Special check for iSyntax to ensure isyntax module is available
+    if source_format == "philips":
+        try:
+            import isyntax
+            logger.info("isyntax module available for iSyntax support")
+        except ImportError:
+            logger.warning("isyntax module not available, trying anyway...")
+
+    # Get format metadata for proper manufacturer/model tagging
+    format_meta = get_format_metadata(source_format)
+    # Use original_filename from ZIP extraction if applicable, otherwise file_path.name
+    if not original_filename or original_filename == file_path.name:
+        original_filename = actual_file_path.name
+
+    # Helper to truncate strings to DICOM VR limits
+    def truncate_lo(value: str, max_len: int = 64) -> str:
+        """Truncate string to fit DICOM LO (Long String) VR limit of 64 chars"""
+        if value and len(value) > max_len:
+            return value[:max_len-3] + "..."
+        return value
+
+    # Create metadata post-processor to add source tracking
+    def metadata_post_processor(ds, wsi_metadata):
+        """Add source format tracking to DICOM metadata"""
+        # Set manufacturer info
+        ds.Manufacturer = truncate_lo(format_meta["manufacturer"])
+        ds.ManufacturerModelName = truncate_lo(format_meta["model"])
+        ds.SoftwareVersions = ["DICOM Server Converter v1.0", f"Converted from {format_meta['format_name']}"]
+
+        # Store original filename in InstitutionName (visible in metadata) - truncated
+        ds.InstitutionName = truncate_lo(f"Converted: {original_filename}")
+
+        # Update series description to include source format (LO max 64)
+        if hasattr(ds, 'SeriesDescription'):
+            ds.SeriesDescription = truncate_lo(f"{ds.SeriesDescription} [Source: {format_meta['format_name']}]")
+        else:
+            ds.SeriesDescription = truncate_lo(f"Converted from {format_meta['format_name']}")
+
+        # Set ContentLabel from original filename (CS VR - max 16 chars, uppercase only)
+        # ContentLabel uses CS VR: uppercase letters, digits, space, underscore only
+        import re
+        clean_label = re.sub(r'[^A-Z0-9_ ]', '', original_filename.upper().replace('.', '_'))[:16]
+        if clean_label:
+            ds.ContentLabel = clean_label
+
+        # Truncate any other LO fields that might be too long from source metadata
+        lo_fields = ['InstitutionName', 'StationName', 'PatientID', 'AccessionNumber', 
+                    'SpecimenIdentifier', 'ContainerIdentifier']
+        for field in lo_fields:
+            if hasattr(ds, field):
+                val = getattr(ds, field)
+                if isinstance(val, str) and len(val) > 64:
+                    setattr(ds, field, truncate_lo(val))
+                    logger.info(f"Truncated {field} from {len(val)} to 64 chars")
+
+        return ds
+
+    # Convert to DICOM using wsidicomizer
+    # wsidicomizer supports: SVS, NDPI, iSyntax, MRXS, SCN, CZI, TIFF, and more
+    job.message = "Converting to DICOM WSI pyramid (this may take a while)..."
+    job.progress = 30
+
+    logger.info(f"Converting {format_meta['format_name']} from {format_meta['manufacturer']}")
+
+    # Special handling for iSyntax files - try wsidicomizer first (more stable)
+    if source_format == "philips":
+        logger.info("Converting iSyntax using wsidicomizer...")
+        try:
+            with WsiDicomizer.open(str(actual_file_path), metadata_post_processor=metadata_post_processor) as wsi:
+                logger.info(f"Opened iSyntax: {wsi.size.width}x{wsi.size.height}")
+                num_levels = len(wsi.levels) if hasattr(wsi, 'levels') else 1
+                logger.info(f"Source has {num_levels} pyramid levels")
+                job.message = f"Generating DICOM pyramid ({wsi.size.width}x{wsi.size.height})..."
+                job.progress = 40
+                # add_missing_levels=True generates downsampled pyramid levels
+                wsi.save(str(output_dir), add_missing_levels=True)
+                generated_files = list(output_dir.glob("*.dcm"))
+                logger.info(f"wsidicomizer generated {len(generated_files)} DICOM files (with pyramid)")
+        except Exception as e:
+            logger.warning(f"wsidicomizer failed for iSyntax: {e}")
+            # Fall back to simple single-level conversion
+            logger.info("Falling back to simple iSyntax conversion...")
+            try:
+                dicom_files = convert_isyntax_to_dicom(job, actual_file_path, output_dir)
+                logger.info(f"Simple converter generated {len(dicom_files)} DICOM files")
+            except Exception as e2:
+                logger.error(f"All iSyntax converters failed: {e2}")
+                raise Exception(f"iSyntax conversion failed: {e2}")
+    else:
+        # Use wsidicomizer for other formats (including multi-file from ZIP)
+        try:
+            with WsiDicomizer.open(str(actual_file_path), metadata_post_processor=metadata_post_processor) as wsi:
+                # Log pyramid information
+                logger.info(f"Opened WSI: {wsi.size.width}x{wsi.size.height}")
+                num_levels = len(wsi.levels) if hasattr(wsi, 'levels') else 1
+                logger.info(f"Source has {num_levels} pyramid levels")
+
+                job.message = f"Generating DICOM pyramid ({wsi.size.width}x{wsi.size.height})..."
+                job.progress = 40
+
+                # add_missing_levels=True ensures full pyramid is generated
+                wsi.save(str(output_dir), add_missing_levels=True)
+
+                # Log generated files
+                generated_files = list(output_dir.glob("*.dcm"))
+                logger.info(f"Generated {len(generated_files)} DICOM files (with pyramid)")
+
+        except Exception as e:
+            error_msg = str(e).lower()
+            # Check if this is an error we can recover from with pyvips
+            recoverable_errors = [
+                'compression', 'unsupported', 'decode',  # Compression issues
+                'levels needs to be integer', 'tolerance',  # Pyramid level issues
+                'cannot read', 'failed to read', 'openslide',  # Read issues
+                "'h' format", 'struct.error', '65535'  # opentile JPEG encoding limits (tiles > 65535 px)
+            ]
+            is_recoverable = any(err in error_msg for err in recoverable_errors)
+
+            if is_recoverable:
+                logger.warning(f"wsidicomizer failed with recoverable error: {e}")
+                logger.info("Attempting pyvips fallback conversion...")
+
+                job.message = "Trying alternative conversion method..."
+                job.progress = 25
+
+                try:
+                    # Force conversion through pyvips
+                    converted_path = convert_to_jpeg_tiff(file_path, output_dir)
+
+                    job.message = "Re-attempting DICOM conversion..."
+                    job.progress = 35
+
+                    with WsiDicomizer.open(str(converted_path), metadata_post_processor=metadata_post_processor) as wsi:
+                        logger.info(f"Opened converted WSI: {wsi.size.width}x{wsi.size.height}")
+                        num_levels = len(wsi.levels) if hasattr(wsi, 'levels') else 1
+                        logger.info(f"Source has {num_levels} pyramid levels")
+
+                        job.message = f"Generating DICOM pyramid ({wsi.size.width}x{wsi.size.height})..."
+                        job.progress = 45
+
+                        wsi.save(str(output_dir), add_missing_levels=True)
+
+                        generated_files = list(output_dir.glob("*.dcm"))
+                        logger.info(f"Fallback generated {len(generated_files)} DICOM files")
+                except Exception as fallback_error:
+                    logger.error(f"Fallback conversion also failed: {fallback_error}")
+                    raise Exception(f"Conversion failed: {e}. Fallback also failed: {fallback_error}")
+            else:
+                logger.error(f"wsidicomizer failed: {str(e)}")
+                raise
+
+
+    return sorted(output_dir.glob("*.dcm"))
+
+
+def run_conversion_job(job_id: str, file_path: str, output_dir: str, extracted_dir: str,
+                       progress_queue, cancel_flags=None, memory_limit_mb: int = 0) -> list[str]:
+    """Worker entry point; paths are passed as strings to keep arguments picklable"""
+    _apply_memory_limit(memory_limit_mb)
+    job = JobProgress(job_id, progress_queue, cancel_flags)
+    job.status = "processing"
+    job.message = "Starting conversion..."
+    dicom_files = convert_to_dicom_files(job, Path(file_path), Path(output_dir), Path(extracted_dir))
+    job.check_cancelled()
+    return [str(f) for f in dicom_files]
+
+
+# =============================================================================
+# Executor
+# =============================================================================
+
+class ConversionExecutor:
+    """
+    Process pool for conversions with bounded concurrency.
+
+    ``max_workers=0`` runs conversions in a thread instead (development and
+    platforms without process support); the event loop stays free either way.
+    Each process handles a single job (``max_tasks_per_child=1``), so memory
+    held by native decoders is returned to the OS between conversions.
+    """
+
+    def __init__(self, max_workers: int = 2, memory_limit_mb: int = 0):
+        self.max_workers = max_workers
+        self.memory_limit_mb = memory_limit_mb
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._manager = None
+        self._queue = None
+        self._cancel_flags = None
+        self._jobs: dict[str, object] = {}
+        self._drain_task: Optional[asyncio.Task] = None
+        self.stats = {"submitted": 0, "completed": 0, "failed": 0, "pool_restarts": 0}
+
+    @property
+    def uses_processes(self) -> bool:
+        return self.max_workers > 0
+
+    def _ensure_pool(self):
+        if self._queue is None:
+            if self.uses_processes:
+                context = multiprocessing.get_context("spawn")
+                self._manager = context.Manager()
+                self._queue = self._manager.Queue()
+                self._cancel_flags = self._manager.dict()
+            else:
+                self._queue = queue.Queue()
+                self._cancel_flags = {}
+        if self.uses_processes and self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(os.path.dirname(os.path.abspath(__file__)),),
+                max_tasks_per_child=1,
+            )
+        if self._drain_task is None or self._drain_task.done():
+            self._drain_task = asyncio.get_running_loop().create_task(self._drain_progress())
+
+    def _apply_updates(self):
+        while True:
+            try:
+                job_id, field, value = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            except (EOFError, OSError):
+                return  # Manager went away during shutdown
+            job = self._jobs.get(job_id)
+            if job is not None and field in PROGRESS_FIELDS:
+                setattr(job, field, value)
+
+    async def _drain_progress(self):
+        while True:
+            self._apply_updates()
+            await asyncio.sleep(PROGRESS_POLL_SECONDS)
+
+    async def submit(self, job, *args, fn: Callable = run_conversion_job):
+        """
+        Run ``fn(job.job_id, *args, progress_queue, cancel_flags, memory_limit_mb)``
+        off the event loop, mirroring its progress onto ``job``. Returns fn's result.
+        """
+        self._ensure_pool()
+        self._jobs[job.job_id] = job
+        self.stats["submitted"] += 1
+        loop = asyncio.get_running_loop()
+        try:
+            if self.uses_processes:
+                result = await loop.run_in_executor(
+                    self._pool, fn, job.job_id, *args, self._queue, self._cancel_flags, self.memory_limit_mb
+                )
+            else:
+                # Never cap the address space of the API process itself
+                result = await asyncio.to_thread(fn, job.job_id, *args, self._queue, self._cancel_flags, 0)
+            self.stats["completed"] += 1
+            return result
+        except BrokenProcessPool:
+            # A worker died (e.g. killed by the OOM killer); start a fresh pool
+            self.stats["failed"] += 1
+            self.stats["pool_restarts"] += 1
+            logger.error(f"💥 Conversion worker died while processing job {job.job_id}")
+            self._pool.shutdown(wait=False, cancel_futures=False)
+            self._pool = None
+            raise RuntimeError("Conversion worker crashed (out of memory?)")
+        except Exception:
+            self.stats["failed"] += 1
+            raise
+        finally:
+            self._apply_updates()
+            self._jobs.pop(job.job_id, None)
+            self._clear_cancel(job.job_id)
+
+    def cancel(self, job_id: str):
+        """Ask a running conversion to stop at its next progress checkpoint"""
+        if self._cancel_flags is not None and job_id in self._jobs:
+            self._cancel_flags[job_id] = True
+
+    def _clear_cancel(self, job_id: str):
+        try:
+            if self._cancel_flags is not None:
+                self._cancel_flags.pop(job_id, None)
+        except (EOFError, OSError):
+            pass
+
+    def get_stats(self) -> dict:
+        return {
+            **self.stats,
+            "mode": "process" if self.uses_processes else "thread",
+            "max_workers": self.max_workers,
+            "memory_limit_mb": self.memory_limit_mb,
+            "active_jobs": len(self._jobs),
+        }
+
+    async def close(self):
+        if self._drain_task:
+            self._drain_task.cancel()
+            self._drain_task = None
+        if self._pool:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        if self._manager:
+            self._manager.shutdown()
+            self._manager = None
+        self._queue = None
+        self._cancel_flags = None
@@ -25,6 +25,8 @@ from pathlib import Path
 from typing import Optional, Tuple
 import struct
 
+from dcx_lossless import deobfuscate_tile as _deobfuscate
+
 logger = logging.getLogger(__name__)
 
 # Default key size used by 3DHISTECH DCX files
@@ -66,19 +68,7 @@ def deobfuscate_tile(tile_data: bytes, key_size: int = DEFAULT_KEY_SIZE) -> byte
         logger.warning(f"Tile too small ({len(tile_data)} bytes) for key size {key_size}")
         return tile_data
     
-    data = bytearray(tile_data)
-    key_offset = len(data) - key_size
-    
-    # Extract key from end
-    key = data[key_offset:]
-    
-    # XOR first key_size bytes with the key
-    xor_length = min(key_size, key_offset)
-    for i in range(xor_length):
-        data[i] ^= key[i]
-    
-    # Return data without the key
-    return bytes(data[:key_offset])
+    return _deobfuscate(tile_data, key_size)
 
 
 def verify_jpeg(data: bytes) -> bool:
@@ -11,17 +11,24 @@ The approach:
 3. Write new BigTIFF with raw JPEG bytes at tile offsets
 """
 
+import mmap
 import struct
 import io
 import logging
 from pathlib import Path
-from typing import List, Tuple, Optional, BinaryIO
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, List, Tuple, Optional, BinaryIO
+
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
 # DCX obfuscation key size
 KEY_SIZE = 1024
 
+# Tiles handed to the thread pool at a time (bounds memory when workers > 1)
+TILE_BATCH_SIZE = 256
+
 # TIFF constants
 TIFF_MAGIC_LE = b'II'  # Little-endian
 BIGTIFF_VERSION = 43
@@ -53,21 +60,23 @@ TIFF_RATIONAL = 5   # Two LONGs: numerator and denominator
 TIFF_LONG8 = 16     # 64-bit unsigned (BigTIFF)
 
 
-def deobfuscate_tile(tile_data: bytes) -> bytes:
-    """Deobfuscate a DCX tile by XORing with key from end"""
-    if len(tile_data) <= KEY_SIZE:
-        return tile_data
-    
-    data = bytearray(tile_data)
-    key_offset = len(data) - KEY_SIZE
-    key = data[key_offset:]
+def deobfuscate_tile(tile_data, key_size: int = KEY_SIZE) -> bytes:
+    """
+    Deobfuscate a DCX tile by XORing with key from end.
+
+    Accepts bytes or a memoryview (e.g. a slice of a memory-mapped file);
+    the XOR is a single vectorized NumPy operation.
+    """
+    if len(tile_data) <= key_size:
+        return bytes(tile_data)
     
-    # XOR first KEY_SIZE bytes
-    for i in range(min(KEY_SIZE, key_offset)):
-        data[i] ^= key[i]
+    data = np.frombuffer(tile_data, dtype=np.uint8)
+    key_offset = len(data) - key_size
+    xor_length = min(key_size, key_offset)
     
-    # Return without key
-    return bytes(data[:key_offset])
+    # XOR first KEY_SIZE bytes with the key, return without key
+    head = data[:xor_length] ^ data[key_offset:key_offset + xor_length]
+    return head.tobytes() + data[xor_length:key_offset].tobytes()
 
 
 class BigTiffWriter:
@@ -109,7 +118,7 @@ class BigTiffWriter:
     def write_page(self, 
                    width: int, height: int,
                    tile_width: int, tile_height: int,
-                   jpeg_tiles: List[bytes],
+                   jpeg_tiles: Iterable[bytes],
                    samples_per_pixel: int = 3,
                    bits_per_sample: Tuple[int, ...] = (8, 8, 8),
                    jpeg_tables: Optional[bytes] = None,
@@ -120,6 +129,9 @@ class BigTiffWriter:
         """
         Write a single page/IFD with pre-compressed JPEG tiles.
         
+        Tiles are written as they are produced, so jpeg_tiles can be a
+        generator and a level never has to be held in memory.
+        
         Args:
             x_resolution: Tuple of (numerator, denominator) for X resolution
             y_resolution: Tuple of (numerator, denominator) for Y resolution
@@ -131,10 +143,10 @@ class BigTiffWriter:
         tile_offsets = []
         tile_byte_counts = []
         
+        self.file.seek(self.current_offset)
         for jpeg_data in jpeg_tiles:
             tile_offsets.append(self.current_offset)
             tile_byte_counts.append(len(jpeg_data))
-            self.file.seek(self.current_offset)
             self.file.write(jpeg_data)
             self.current_offset += len(jpeg_data)
         
@@ -240,8 +252,7 @@ class BigTiffWriter:
         """Write an array of values and return the offset"""
         offset = self.current_offset
         self.file.seek(offset)
-        for v in values:
-            self.file.write(struct.pack(fmt, v))
+        self.file.write(struct.pack(f'{fmt[0]}{len(values)}{fmt[1:]}', *values))
         self.current_offset = self.file.tell()
         # Align
         padding = (8 - (self.current_offset % 8)) % 8
@@ -293,13 +304,41 @@ class BigTiffWriter:
         logger.info(f"Linked {len(self.ifd_offsets)} IFDs")
 
 
+def iter_deobfuscated_tiles(data, tile_offsets: List[int], tile_sizes: List[int],
+                            executor: Optional[ThreadPoolExecutor] = None) -> Iterator[bytes]:
+    """
+    Yield deobfuscated tiles in order from a buffer (usually a memory map).
+    
+    With an executor, tiles are deobfuscated in batches of TILE_BATCH_SIZE
+    on the pool; otherwise serially.
+    """
+    view = memoryview(data)
+    slices = (view[offset:offset + size] for offset, size in zip(tile_offsets, tile_sizes))
+    if executor is None:
+        for raw_tile in slices:
+            yield deobfuscate_tile(raw_tile)
+        return
+    
+    batch = []
+    for raw_tile in slices:
+        batch.append(raw_tile)
+        if len(batch) == TILE_BATCH_SIZE:
+            yield from executor.map(deobfuscate_tile, batch)
+            batch = []
+    if batch:
+        yield from executor.map(deobfuscate_tile, batch)
+
+
 def convert_dcx_lossless(input_path: Path, output_path: Path,
-                         progress_callback=None) -> bool:
+                         progress_callback=None, workers: int = 1) -> bool:
     """
     Convert DCX to standard BigTIFF with lossless JPEG tile transcoding.
     
-    STREAMING version - processes one page at a time to minimize memory usage.
+    STREAMING version - the input is memory-mapped once and tiles go
+    straight from the map into the writer, one at a time.
     No decode/re-encode - just copy the raw JPEG bytes!
+    
+    workers > 1 deobfuscates tiles on a thread pool.
     """
     import tifffile
     
@@ -423,47 +462,40 @@ def convert_dcx_lossless(input_path: Path, output_path: Path,
     # Second pass: stream tiles one page at a time
     logger.info(f"Writing lossless TIFF: {output_path}")
     
-    with BigTiffWriter(output_path) as writer:
-        for page_idx, meta in enumerate(page_metadata):
-            if progress_callback:
-                progress_callback(
-                    int((page_idx / len(page_metadata)) * 95),
-                    f"Processing level {page_idx + 1}/{len(page_metadata)}"
+    executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        with open(input_path, 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data, \
+                BigTiffWriter(output_path) as writer:
+            for page_idx, meta in enumerate(page_metadata):
+                if progress_callback:
+                    progress_callback(
+                        int((page_idx / len(page_metadata)) * 95),
+                        f"Processing level {page_idx + 1}/{len(page_metadata)}"
+                    )
+                
+                # Tiles are streamed from the map into the writer - never a whole level in memory
+                writer.write_page(
+                    width=meta['width'],
+                    height=meta['height'],
+                    tile_width=meta['tile_width'],
+                    tile_height=meta['tile_height'],
+                    jpeg_tiles=iter_deobfuscated_tiles(
+                        data, meta['tile_offsets'], meta['tile_sizes'], executor
+                    ),
+                    samples_per_pixel=meta['samples'],
+                    is_reduced=meta['is_reduced'],
+                    x_resolution=meta.get('x_resolution'),
+                    y_resolution=meta.get('y_resolution'),
+                    resolution_unit=meta.get('resolution_unit', 3),
                 )
+                
+                logger.info(f"  Page {page_idx} written ({len(meta['tile_offsets'])} tiles)")
             
-            # Stream tiles for this page only - don't hold all pages in memory
-            jpeg_tiles = []
-            with open(input_path, 'rb') as f:
-                for tile_idx, (offset, size) in enumerate(zip(meta['tile_offsets'], meta['tile_sizes'])):
-                    f.seek(offset)
-                    raw_tile = f.read(size)
-                    jpeg_data = deobfuscate_tile(raw_tile)
-                    jpeg_tiles.append(jpeg_data)
-                    
-                    # Log progress for large pages
-                    if tile_idx > 0 and tile_idx % 1000 == 0:
-                        logger.info(f"  Page {page_idx}: processed {tile_idx}/{len(meta['tile_offsets'])} tiles")
-            
-            # Write this page immediately
-            writer.write_page(
-                width=meta['width'],
-                height=meta['height'],
-                tile_width=meta['tile_width'],
-                tile_height=meta['tile_height'],
-                jpeg_tiles=jpeg_tiles,
-                samples_per_pixel=meta['samples'],
-                is_reduced=meta['is_reduced'],
-                x_resolution=meta.get('x_resolution'),
-                y_resolution=meta.get('y_resolution'),
-                resolution_unit=meta.get('resolution_unit', 3),
-            )
-            
-            # Free memory for this page's tiles before processing next
-            del jpeg_tiles
-            
-            logger.info(f"  Page {page_idx} written")
-        
-        writer.finalize()
+            writer.finalize()
+    finally:
+        if executor is not None:
+            executor.shutdown()
     
     logger.info(f"Lossless transcode complete: {output_path}")
     if progress_callback:
@@ -0,0 +1,402 @@
+"""
+Native DICOM Frame Server
+Serves stored compressed frames as-is instead of Orthanc's decode/re-encode /preview
+
+Each instance gets a frame index parsed once from its encapsulated Pixel Data
+(Extended Offset Table, Basic Offset Table or the fragment list). Frames are
+then read with one byte-range read from Orthanc's storage directory when it is
+mounted into the converter, or fetched from Orthanc's /frames/{n}/raw endpoint.
+"""
+
+import os
+import mmap
+import time
+import struct
+import asyncio
+import logging
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_INDEX_CACHE_SIZE = 512
+SERIES_LEVELS_TTL_SECONDS = 300
+
+# Encapsulated transfer syntaxes -> media type of one frame
+TRANSFER_SYNTAX_MEDIA_TYPES = {
+    "1.2.840.10008.1.2.4.50": "image/jpeg",      # JPEG Baseline
+    "1.2.840.10008.1.2.4.51": "image/jpeg",      # JPEG Extended
+    "1.2.840.10008.1.2.4.57": "image/jpeg",      # JPEG Lossless
+    "1.2.840.10008.1.2.4.70": "image/jpeg",      # JPEG Lossless SV1
+    "1.2.840.10008.1.2.4.80": "image/jls",       # JPEG-LS Lossless
+    "1.2.840.10008.1.2.4.81": "image/jls",       # JPEG-LS Near-lossless
+    "1.2.840.10008.1.2.4.90": "image/jp2",       # JPEG 2000 Lossless
+    "1.2.840.10008.1.2.4.91": "image/jp2",       # JPEG 2000
+    "1.2.840.10008.1.2.4.201": "image/jphc",     # HTJ2K Lossless
+    "1.2.840.10008.1.2.4.202": "image/jphc",     # HTJ2K Lossless RPCL
+    "1.2.840.10008.1.2.4.203": "image/jphc",     # HTJ2K
+    "1.2.840.10008.1.2.4.110": "image/jxl",      # JPEG XL Lossless
+    "1.2.840.10008.1.2.4.111": "image/jxl",      # JPEG XL JPEG Recompression
+    "1.2.840.10008.1.2.4.112": "image/jxl",      # JPEG XL
+}
+
+# Frames that every browser can put straight into an <img>
+BROWSER_TRANSFER_SYNTAXES = {"1.2.840.10008.1.2.4.50"}
+
+def accepted_media_types(accept: str) -> list[str]:
+    """Frame media types named in an Accept header (sorted, for cache keys)"""
+    return sorted({t for t in TRANSFER_SYNTAX_MEDIA_TYPES.values() if t in (accept or "")})
+
+
+# Explicit VR with a 4-byte length field
+LONG_VRS = {b"OB", b"OD", b"OF", b"OL", b"OV", b"OW", b"SQ", b"SV", b"UC", b"UN", b"UR", b"UT", b"UV"}
+
+UNDEFINED_LENGTH = 0xFFFFFFFF
+ITEM = (0xFFFE, 0xE000)
+ITEM_DELIMITER = (0xFFFE, 0xE00D)
+SEQUENCE_DELIMITER = (0xFFFE, 0xE0DD)
+PIXEL_DATA = (0x7FE0, 0x0010)
+EXTENDED_OFFSET_TABLE = (0x7FE0, 0x0001)
+EXTENDED_OFFSET_TABLE_LENGTHS = (0x7FE0, 0x0002)
+NUMBER_OF_FRAMES = (0x0028, 0x0008)
+TRANSFER_SYNTAX_UID = (0x0002, 0x0010)
+
+
+class FrameIndex:
+    """Byte spans of every frame of one instance"""
+
+    __slots__ = ("transfer_syntax", "frames", "path")
+
+    def __init__(self, transfer_syntax: str, frames: list[tuple[tuple[int, int], ...]],
+                 path: Optional[Path] = None):
+        self.transfer_syntax = transfer_syntax
+        self.frames = frames  # frame -> ((offset, length), ...) fragments, usually one
+        self.path = path
+
+    @property
+    def media_type(self) -> str:
+        return TRANSFER_SYNTAX_MEDIA_TYPES.get(self.transfer_syntax, "application/octet-stream")
+
+    @property
+    def number_of_frames(self) -> int:
+        return len(self.frames)
+
+
+# =============================================================================
+# Encapsulated Pixel Data parsing (explicit VR little endian)
+# =============================================================================
+
+def _read_header(buf, pos: int) -> tuple[tuple[int, int], bytes, int, int]:
+    """Return (tag, vr, value length, value offset) of the element at pos"""
+    group, element = struct.unpack_from("<HH", buf, pos)
+    if group == 0xFFFE:
+        (length,) = struct.unpack_from("<I", buf, pos + 4)
+        return (group, element), b"", length, pos + 8
+    vr = bytes(buf[pos + 4:pos + 6])
+    if vr in LONG_VRS:
+        (length,) = struct.unpack_from("<I", buf, pos + 8)
+        return (group, element), vr, length, pos + 12
+    (length,) = struct.unpack_from("<H", buf, pos + 6)
+    return (group, element), vr, length, pos + 8
+
+
+def _skip_undefined(buf, pos: int, end_tag: tuple[int, int]) -> int:
+    """Skip elements/items until end_tag; returns the position after it"""
+    while True:
+        tag, vr, length, value_pos = _read_header(buf, pos)
+        if tag == end_tag:
+            return value_pos
+        if vr == b"UN" and length == UNDEFINED_LENGTH:
+            raise ValueError("Undefined-length UN elements are not supported")
+        if length == UNDEFINED_LENGTH:
+            # Sequence or item of undefined length
+            pos = _skip_undefined(buf, value_pos, ITEM_DELIMITER if tag == ITEM else SEQUENCE_DELIMITER)
+        else:
+            pos = value_pos + length
+
+
+def _unpack_offsets(buf, pos: int, length: int, fmt: str) -> list[int]:
+    size = struct.calcsize(fmt)
+    return list(struct.unpack_from(f"<{length // size}{fmt}", buf, pos))
+
+
+def parse_frame_index(buf) -> FrameIndex:
+    """
+    Build the frame index of a DICOM Part 10 file held in buf (bytes or mmap).
+
+    Raises ValueError if the file is not encapsulated explicit VR little endian
+    or its fragments cannot be mapped onto frames.
+    """
+    if bytes(buf[128:132]) != b"DICM":
+        raise ValueError("Not a DICOM Part 10 file")
+
+    pos = 132
+    transfer_syntax = None
+    number_of_frames = 1
+    extended_offsets = extended_lengths = None
+
+    while pos < len(buf):
+        tag, vr, length, value_pos = _read_header(buf, pos)
+        if tag == TRANSFER_SYNTAX_UID:
+            transfer_syntax = bytes(buf[value_pos:value_pos + length]).rstrip(b"\0 ").decode("ascii")
+        elif tag[0] != 0x0002 and transfer_syntax not in TRANSFER_SYNTAX_MEDIA_TYPES:
+            raise ValueError(f"Transfer syntax {transfer_syntax} has no encapsulated frames")
+        elif tag == NUMBER_OF_FRAMES:
+            number_of_frames = int(bytes(buf[value_pos:value_pos + length]).strip(b"\0 ") or 1)
+        elif tag == EXTENDED_OFFSET_TABLE:
+            extended_offsets = _unpack_offsets(buf, value_pos, length, "Q")
+        elif tag == EXTENDED_OFFSET_TABLE_LENGTHS:
+            extended_lengths = _unpack_offsets(buf, value_pos, length, "Q")
+        elif tag == PIXEL_DATA:
+            if length != UNDEFINED_LENGTH:
+                raise ValueError("Pixel Data is not encapsulated")
+            break
+        if length == UNDEFINED_LENGTH:
+            pos = _skip_undefined(buf, value_pos, SEQUENCE_DELIMITER)
+        else:
+            pos = value_pos + length
+    else:
+        raise ValueError("No Pixel Data element")
+
+    # Basic Offset Table item
+    tag, _, bot_length, bot_pos = _read_header(buf, value_pos)
+    if tag != ITEM:
+        raise ValueError("Missing Basic Offset Table item")
+    first_fragment = bot_pos + bot_length
+
+    if extended_offsets and extended_lengths and len(extended_offsets) == len(extended_lengths):
+        # One fragment per frame; offsets point at each fragment's item tag
+        frames = [
+            ((first_fragment + offset + 8, length),)
+            for offset, length in zip(extended_offsets, extended_lengths)
+        ]
+        return FrameIndex(transfer_syntax, frames)
+
+    fragments = []  # (offset relative to first fragment, data offset, length)
+    pos = first_fragment
+    while True:
+        tag, _, length, data_pos = _read_header(buf, pos)
+        if tag == SEQUENCE_DELIMITER:
+            break
+        if tag != ITEM:
+            raise ValueError(f"Unexpected element {tag} in Pixel Data")
+        fragments.append((pos - first_fragment, data_pos, length))
+        pos = data_pos + length
+
+    basic_offsets = _unpack_offsets(buf, bot_pos, bot_length, "I")
+    if basic_offsets:
+        bounds = basic_offsets[1:] + [float("inf")]
+        frames, i = [], 0
+        for start, end in zip(basic_offsets, bounds):
+            spans = []
+            while i < len(fragments) and fragments[i][0] < end:
+                if fragments[i][0] >= start:
+                    spans.append(fragments[i][1:])
+                i += 1
+            frames.append(tuple(spans))
+    elif len(fragments) == number_of_frames:
+        frames = [(frag[1:],) for frag in fragments]
+    elif number_of_frames == 1:
+        frames = [tuple(frag[1:] for frag in fragments)]
+    else:
+        raise ValueError(f"{len(fragments)} fragments cannot be mapped onto {number_of_frames} frames")
+    return FrameIndex(transfer_syntax, frames)
+
+
+def index_file(path: Path) -> FrameIndex:
+    """Parse the frame index of a stored file through a memory map"""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        index = parse_frame_index(buf)
+    index.path = path
+    return index
+
+
+def read_spans(path: Path, spans: tuple[tuple[int, int], ...]) -> bytes:
+    """Read a frame's fragment(s) - one positioned read per fragment"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        return b"".join(os.pread(fd, length, offset) for offset, length in spans)
+    finally:
+        os.close(fd)
+
+
+# =============================================================================
+# Frame server
+# =============================================================================
+
+class FrameServer:
+    """
+    Serves compressed frames of Orthanc instances without any codec work.
+
+    With ``storage_dir`` (Orthanc's storage directory, mounted read-only) a
+    frame is one byte-range read of the stored file; otherwise it comes from
+    Orthanc's ``/instances/{id}/frames/{n}/raw``. Either way the media type
+    follows the instance's transfer syntax.
+    """
+
+    def __init__(self, client, storage_dir: Optional[str] = None,
+                 cache_size: int = DEFAULT_INDEX_CACHE_SIZE):
+        self.client = client
+        self.storage_dir = Path(storage_dir) if storage_dir else None
+        self.cache_size = cache_size
+        self._indexes: OrderedDict[str, Optional[FrameIndex]] = OrderedDict()
+        self._transfer_syntaxes: OrderedDict[str, Optional[str]] = OrderedDict()
+        self._series_levels: dict[str, tuple[float, Optional[list[dict]]]] = {}
+        self.stats = {"local_reads": 0, "local_read_failures": 0, "raw_fetches": 0, "indexes_built": 0, "index_failures": 0}
+
+    def _remember(self, cache: OrderedDict, key: str, value):
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > self.cache_size:
+            cache.popitem(last=False)
+
+    def invalidate(self, instance_id: Optional[str] = None):
+        """Forget the index of an instance (or of all instances and series)"""
+        if instance_id is None:
+            self._indexes.clear()
+            self._transfer_syntaxes.clear()
+            self._series_levels.clear()
+        else:
+            self._indexes.pop(instance_id, None)
+            self._transfer_syntaxes.pop(instance_id, None)
+
+    async def _storage_path(self, instance_id: str) -> Optional[Path]:
+        """Locate the uncompressed stored file of an instance under storage_dir"""
+        response = await self.client.get(f"/instances/{instance_id}/attachments/dicom/info")
+        if response.status_code != 200:
+            return None
+        info = response.json()
+        uuid = info.get("Uuid", "")
+        if not uuid or info.get("CompressedSize") != info.get("UncompressedSize"):
+            return None  # Orthanc storage compression is enabled
+        path = self.storage_dir / uuid[0:2] / uuid[2:4] / uuid
+        return path if path.is_file() else None
+
+    async def get_index(self, instance_id: str) -> Optional[FrameIndex]:
+        """Frame index of a locally readable instance, built once and cached"""
+        if self.storage_dir is None:
+            return None
+        if instance_id in self._indexes:
+            self._indexes.move_to_end(instance_id)
+            return self._indexes[instance_id]
+
+        index = None
+        path = await self._storage_path(instance_id)
+        if path is not None:
+            try:
+                index = await asyncio.to_thread(index_file, path)
+                self.stats["indexes_built"] += 1
+            except (ValueError, struct.error, OSError) as e:
+                self.stats["index_failures"] += 1
+                logger.debug(f"No frame index for {instance_id}: {e}")
+        self._remember(self._indexes, instance_id, index)
+        return index
+
+    async def transfer_syntax(self, instance_id: str) -> Optional[str]:
+        index = await self.get_index(instance_id)
+        if index is not None:
+            return index.transfer_syntax
+        if instance_id not in self._transfer_syntaxes:
+            response = await self.client.get(f"/instances/{instance_id}/metadata/TransferSyntax")
+            syntax = response.text.strip() if response.status_code == 200 else None
+            self._remember(self._transfer_syntaxes, instance_id, syntax)
+        return self._transfer_syntaxes[instance_id]
+
+    async def get_frame(self, instance_id: str, frame: int) -> Optional[tuple[bytes, str, str]]:
+        """
+        Return (bytes, media_type, transfer_syntax) of a frame as stored.
+
+        Frames are 0-based, like Orthanc's /instances/{id}/frames/{n}.
+
+        Returns None if the instance or frame does not exist or the instance
+        is not encapsulated (callers fall back to a rendered frame).
+        """
+        index = await self.get_index(instance_id)
+        if index is not None:
+            if not 0 <= frame < index.number_of_frames:
+                return None
+            try:
+                data = await asyncio.to_thread(read_spans, index.path, index.frames[frame])
+            except OSError as e:
+                # Attachment deleted or moved behind our back: re-locate it next time
+                logger.warning(f"⚠️ Stored file of {instance_id} unreadable, using Orthanc: {e}")
+                self.stats["local_read_failures"] += 1
+                self.invalidate(instance_id)
+            else:
+                self.stats["local_reads"] += 1
+                return data, index.media_type, index.transfer_syntax
+
+        syntax = await self.transfer_syntax(instance_id)
+        if syntax not in TRANSFER_SYNTAX_MEDIA_TYPES:
+            return None
+        response = await self.client.get(f"/instances/{instance_id}/frames/{frame}/raw")
+        if response.status_code != 200:
+            return None
+        self.stats["raw_fetches"] += 1
+        return response.content, TRANSFER_SYNTAX_MEDIA_TYPES[syntax], syntax
+
+    async def _levels(self, series_id: str) -> Optional[list[dict]]:
+        """TILED_FULL single-plane pyramid levels of a series, largest first"""
+        now = time.monotonic()
+        cached = self._series_levels.get(series_id)
+        if cached and cached[0] > now:
+            return cached[1]
+
+        levels = None
+        response = await self.client.get(f"/series/{series_id}/instances-tags?simplify")
+        if response.status_code == 200:
+            levels = []
+            for instance_id, tags in response.json().items():
+                if "VOLUME" not in str(tags.get("ImageType", "")):
+                    continue
+                width = int(tags.get("TotalPixelMatrixColumns", 0) or 0)
+                height = int(tags.get("TotalPixelMatrixRows", 0) or 0)
+                tile_w = int(tags.get("Columns", 0) or 0)
+                tile_h = int(tags.get("Rows", 0) or 0)
+                if not (width and height and tile_w and tile_h):
+                    continue
+                tiles_x = (width + tile_w - 1) // tile_w
+                tiles_y = (height + tile_h - 1) // tile_h
+                levels.append({
+                    "instanceId": instance_id,
+                    "width": width,
+                    "tilesX": tiles_x,
+                    "tilesY": tiles_y,
+                    # Frame n is tile n only for TILED_FULL with a single focal plane / optical path
+                    "direct": (tags.get("DimensionOrganizationType", "TILED_FULL") == "TILED_FULL"
+                               and int(tags.get("NumberOfFrames", 1) or 1) == tiles_x * tiles_y),
+                })
+            levels.sort(key=lambda lvl: lvl["width"], reverse=True)
+            # Two instances of the same size (focal planes in one series) make levels ambiguous
+            if len({lvl["width"] for lvl in levels}) != len(levels):
+                levels = None
+        self._series_levels[series_id] = (now + SERIES_LEVELS_TTL_SECONDS, levels)
+        return levels
+
+    async def get_tile(self, series_id: str, level: int, x: int, y: int) -> Optional[tuple[bytes, str]]:
+        """
+        Serve a WSI plugin tile path natively as (bytes, media_type).
+
+        Returns None when the tile can't be served as stored (sparse tiling,
+        several focal planes, non-browser codec) so the caller can fall back
+        to the WSI plugin.
+        """
+        levels = await self._levels(series_id)
+        if not levels or not 0 <= level < len(levels):
+            return None
+        lvl = levels[level]
+        if not lvl["direct"] or not (0 <= x < lvl["tilesX"] and 0 <= y < lvl["tilesY"]):
+            return None
+        frame = await self.get_frame(lvl["instanceId"], y * lvl["tilesX"] + x)
+        if frame is None or frame[2] not in BROWSER_TRANSFER_SYNTAXES:
+            return None
+        return frame[0], frame[1]
+
+    def get_stats(self) -> dict:
+        return {
+            **self.stats,
+            "storage_dir": str(self.storage_dir) if self.storage_dir else None,
+            "cached_indexes": len(self._indexes),
+        }
@@ -0,0 +1,71 @@
+"""
+HTTP Conditional Requests
+Deterministic ETags and If-None-Match handling for tiles, frames and metadata
+"""
+
+import json
+import hashlib
+from typing import Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+
+
+# DICOM frames/tiles never change for a given SOP Instance (Orthanc IDs are
+# hashes of the DICOM UIDs), so browsers and CDNs may keep them forever
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+TILE_CACHE_CONTROL = "public, max-age=604800, immutable"
+# Metadata can change when instances are added: always revalidate
+REVALIDATE_CACHE_CONTROL = "private, no-cache"
+
+
+def strong_etag(*parts) -> str:
+    """Quoted strong ETag derived only from identifiers (no body needed)"""
+    key = "|".join(str(p) for p in parts)
+    return '"' + hashlib.sha256(key.encode()).hexdigest()[:32] + '"'
+
+
+def json_etag(document) -> str:
+    """Quoted strong ETag of a JSON-serializable document"""
+    body = json.dumps(document, sort_keys=True, separators=(",", ":"), default=str)
+    return '"' + hashlib.sha256(body.encode()).hexdigest()[:32] + '"'
+
+
+def content_etag(content: bytes) -> str:
+    """Quoted strong ETag of a response body"""
+    return '"' + hashlib.sha256(content).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str, wildcard: bool = False) -> bool:
+    """
+    If-None-Match comparison (weak, per RFC 9110): any listed tag, or '*'
+    when ``wildcard`` is set. '*' means "any current representation", so it
+    may only match once the resource is known to exist.
+    """
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            if wildcard:
+                return True
+            continue
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def not_modified(request: Request, etag: str, headers: dict, exists: bool = False) -> Optional[Response]:
+    """
+    Return a 304 if the client already has this ETag, else None.
+
+    ``headers`` (Cache-Control, Vary, ...) are repeated on the 304 as required.
+    Pass ``exists=True`` once the resource has been resolved to also honour
+    ``If-None-Match: *``; tile and frame ETags are derived from identifiers
+    before anything is fetched, so for them '*' is ignored.
+    """
+    if etag_matches(request.headers.get("if-none-match"), etag, wildcard=exists):
+        return Response(status_code=304, headers={**headers, "ETag": etag})
+    return None
@@ -0,0 +1,341 @@
+"""
+IIIF Image API 3 and Deep Zoom
+Map IIIF image requests and DZI tiles onto the slide's pyramid levels:
+requests that line up with a native tile are served as that tile, anything
+else is rendered from the closest finer level
+"""
+
+import io
+import math
+import logging
+from typing import NamedTuple, Optional
+from xml.sax.saxutils import quoteattr
+
+import numpy as np
+
+from prefetch import PyramidLevel
+
+logger = logging.getLogger(__name__)
+
+IIIF_CONTEXT = "http://iiif.io/api/image/3/context.json"
+IIIF_PROTOCOL = "http://iiif.io/api/image"
+IIIF_LD_MEDIA_TYPE = f'application/ld+json;profile="{IIIF_CONTEXT}"'
+
+IIIF_FORMATS = {
+    "jpg": "image/jpeg",
+    "png": "image/png",
+    "webp": "image/webp",
+}
+IIIF_QUALITIES = ("default", "color", "gray", "bitonal")
+IIIF_EXTRA_FEATURES = [
+    "mirroring", "regionByPct", "regionByPx", "regionSquare", "rotationBy90s",
+    "sizeByConfinedWh", "sizeByH", "sizeByPct", "sizeByW", "sizeByWh", "sizeUpscaling",
+]
+
+DZI_NAMESPACE = "http://schemas.microsoft.com/deepzoom/2008"
+DZI_FORMAT = "jpg"
+
+RENDER_JPEG_QUALITY = 90
+# Pyramid levels whose downsample is within this of a scale factor count as that factor
+SCALE_TOLERANCE = 0.02
+
+
+class IiifError(ValueError):
+    """Malformed (400), unsupported (501) or out-of-range (404) image request"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class Rect(NamedTuple):
+    """Rectangle in level-0 pixels"""
+    x: int
+    y: int
+    width: int
+    height: int
+
+
+class ImageRequest(NamedTuple):
+    region: Rect
+    width: int
+    height: int
+    rotation: int = 0
+    mirror: bool = False
+    quality: str = "default"
+    format: str = "jpg"
+
+    @property
+    def media_type(self) -> str:
+        return IIIF_FORMATS[self.format]
+
+    @property
+    def variant(self) -> str:
+        """Tile cache format suffix of the rendered image"""
+        r = self.region
+        return (f"iiif-{r.width}x{r.height}-{self.width}x{self.height}"
+                f"-{'m' if self.mirror else ''}{self.rotation}-{self.quality}.{self.format}")
+
+
+def scale_factors(levels: list[PyramidLevel]) -> list[int]:
+    """Integer downsample of every pyramid level, finest first"""
+    factors = []
+    for level in levels:
+        factor = max(1, round(level.downsample))
+        if factor not in factors:
+            factors.append(factor)
+    return factors
+
+
+def _level_for_factor(levels: list[PyramidLevel], factor: float) -> Optional[int]:
+    for i, level in enumerate(levels):
+        if abs(level.downsample - factor) <= SCALE_TOLERANCE * factor:
+            return i
+    return None
+
+
+def native_tile(levels: list[PyramidLevel], request: ImageRequest) -> Optional[tuple[int, int, int]]:
+    """
+    (level, x, y) of the native tile that is exactly this request, or None.
+
+    The region must be one whole tile of a pyramid level (not clipped at the
+    image edge), at that level's resolution, unrotated and in colour.
+    """
+    if request.rotation or request.mirror or request.quality not in ("default", "color"):
+        return None
+    region = request.region
+    level = _level_for_factor(levels, region.width / request.width)
+    if level is None:
+        return None
+    lvl = levels[level]
+    factor = round(lvl.downsample)
+    span_x, span_y = lvl.tile_width * factor, lvl.tile_height * factor
+    if (region.x % span_x or region.y % span_y or region.width != span_x or region.height != span_y
+            or request.width != lvl.tile_width or request.height != lvl.tile_height):
+        return None
+    tile_x, tile_y = region.x // span_x, region.y // span_y
+    if tile_x >= lvl.tiles_x or tile_y >= lvl.tiles_y:
+        return None
+    return level, tile_x, tile_y
+
+
+# =============================================================================
+# IIIF Image API 3
+# =============================================================================
+
+def info_json(image_id: str, levels: list[PyramidLevel], max_area: int) -> dict:
+    """IIIF image information document for a pyramid"""
+    base = levels[0]
+    # Whole-image sizes cheap enough to request, smallest first
+    sizes = [
+        {"width": level.width, "height": level.height}
+        for level in reversed(levels)
+        if level.width * level.height <= max_area
+    ]
+    return {
+        "@context": IIIF_CONTEXT,
+        "id": image_id,
+        "type": "ImageService3",
+        "protocol": IIIF_PROTOCOL,
+        "profile": "level2",
+        "width": base.width,
+        "height": base.height,
+        "maxArea": max_area,
+        "sizes": sizes,
+        "tiles": [{
+            "width": base.tile_width,
+            "height": base.tile_height,
+            "scaleFactors": scale_factors(levels),
+        }],
+        "extraQualities": ["gray", "bitonal"],
+        "extraFormats": ["png", "webp"],
+        "extraFeatures": IIIF_EXTRA_FEATURES,
+    }
+
+
+def _numbers(spec: str, count: int, parse=int) -> list:
+    parts = spec.split(",")
+    if len(parts) != count:
+        raise IiifError(f"Expected {count} comma-separated values: {spec}")
+    try:
+        return [parse(p) for p in parts]
+    except ValueError:
+        raise IiifError(f"Invalid number in: {spec}")
+
+
+def parse_region(spec: str, width: int, height: int) -> Rect:
+    """IIIF region (full | square | x,y,w,h | pct:x,y,w,h), clipped to the image"""
+    if spec == "full":
+        return Rect(0, 0, width, height)
+    if spec == "square":
+        side = min(width, height)
+        return Rect((width - side) // 2, (height - side) // 2, side, side)
+    if spec.startswith("pct:"):
+        px, py, pw, ph = _numbers(spec[4:], 4, float)
+        x, y = round(px * width / 100), round(py * height / 100)
+        w, h = round(pw * width / 100), round(ph * height / 100)
+    else:
+        x, y, w, h = _numbers(spec, 4)
+    if w <= 0 or h <= 0 or x < 0 or y < 0:
+        raise IiifError(f"Invalid region: {spec}")
+    if x >= width or y >= height:
+        raise IiifError(f"Region is outside the image: {spec}")
+    return Rect(x, y, min(w, width - x), min(h, height - y))
+
+
+def parse_size(spec: str, region: Rect, max_area: int) -> tuple[int, int]:
+    """IIIF size ([^]max | w, | ,h | pct:n | w,h | !w,h) for a region"""
+    upscale = spec.startswith("^")
+    if upscale:
+        spec = spec[1:]
+    rw, rh = region.width, region.height
+
+    if spec == "max":
+        w, h = rw, rh
+        if upscale or w * h > max_area:
+            # Largest size within maxArea, keeping the aspect ratio
+            factor = math.sqrt(max_area / (w * h))
+            if not upscale:
+                factor = min(factor, 1.0)
+            w, h = max(1, int(w * factor)), max(1, int(h * factor))
+    elif spec.startswith("pct:"):
+        try:
+            pct = float(spec[4:])
+        except ValueError:
+            raise IiifError(f"Invalid size: {spec}")
+        if pct <= 0:
+            raise IiifError(f"Invalid size: {spec}")
+        w, h = max(1, round(rw * pct / 100)), max(1, round(rh * pct / 100))
+    elif spec.startswith("!"):
+        bw, bh = _numbers(spec[1:], 2)
+        if bw <= 0 or bh <= 0:
+            raise IiifError(f"Invalid size: {spec}")
+        factor = min(bw / rw, bh / rh)
+        if not upscale:
+            factor = min(factor, 1.0)
+        w, h = max(1, int(rw * factor)), max(1, int(rh * factor))
+    else:
+        parts = spec.split(",")
+        if len(parts) != 2 or not any(parts):
+            raise IiifError(f"Invalid size: {spec}")
+        try:
+            w = int(parts[0]) if parts[0] else None
+            h = int(parts[1]) if parts[1] else None
+        except ValueError:
+            raise IiifError(f"Invalid size: {spec}")
+        if w is None:
+            w = max(1, round(rw * h / rh))
+        elif h is None:
+            h = max(1, round(rh * w / rw))
+        if w <= 0 or h <= 0:
+            raise IiifError(f"Invalid size: {spec}")
+
+    if not upscale and (w > rw or h > rh):
+        raise IiifError(f"Size {w}x{h} is larger than the region; use ^ to upscale")
+    if w * h > max_area:
+        raise IiifError(f"Size {w}x{h} exceeds maxArea {max_area}")
+    return w, h
+
+
+def parse_rotation(spec: str) -> tuple[int, bool]:
+    """IIIF rotation ([!]degrees); only multiples of 90 are supported"""
+    mirror = spec.startswith("!")
+    try:
+        degrees = float(spec[1:] if mirror else spec)
+    except ValueError:
+        raise IiifError(f"Invalid rotation: {spec}")
+    if not 0 <= degrees <= 360:
+        raise IiifError(f"Invalid rotation: {spec}")
+    if degrees % 90:
+        raise IiifError("Only rotations by multiples of 90 degrees are supported", status_code=501)
+    return int(degrees) % 360, mirror
+
+
+def parse_image_request(region: str, size: str, rotation: str, quality_format: str,
+                        width: int, height: int, max_area: int) -> ImageRequest:
+    """Parse the path parameters of a IIIF image request"""
+    quality, _, fmt = quality_format.rpartition(".")
+    if quality not in IIIF_QUALITIES:
+        raise IiifError(f"Unsupported quality: {quality}")
+    if fmt not in IIIF_FORMATS:
+        raise IiifError(f"Unsupported format: {fmt}", status_code=501 if fmt else 400)
+    rect = parse_region(region, width, height)
+    out_w, out_h = parse_size(size, rect, max_area)
+    degrees, mirror = parse_rotation(rotation)
+    return ImageRequest(rect, out_w, out_h, degrees, mirror, quality, fmt)
+
+
+def render(pixels: np.ndarray, request: ImageRequest) -> bytes:
+    """Resize, mirror/rotate, apply the quality and encode a stitched region (blocking)"""
+    from PIL import Image
+
+    image = Image.fromarray(pixels, "RGB")
+    if image.size != (request.width, request.height):
+        image = image.resize((request.width, request.height), Image.Resampling.LANCZOS)
+    if request.mirror:
+        image = image.transpose(Image.Transpose.FLIP_LEFT_RIGHT)
+    if request.rotation:
+        # IIIF rotates clockwise, Pillow counter-clockwise
+        image = image.rotate(-request.rotation, expand=True)
+    if request.quality == "gray":
+        image = image.convert("L")
+    elif request.quality == "bitonal":
+        image = image.convert("1")
+
+    out = io.BytesIO()
+    if request.format == "jpg":
+        image.save(out, "JPEG", quality=RENDER_JPEG_QUALITY)
+    elif request.format == "webp":
+        image.save(out, "WEBP", quality=RENDER_JPEG_QUALITY)
+    else:
+        image.save(out, "PNG")
+    return out.getvalue()
+
+
+# =============================================================================
+# Deep Zoom (DZI)
+# =============================================================================
+
+def dzi_max_level(width: int, height: int) -> int:
+    """Deep Zoom level holding the full-resolution image (level 0 is 1x1)"""
+    return max(0, math.ceil(math.log2(max(width, height))))
+
+
+def dzi_descriptor(levels: list[PyramidLevel]) -> str:
+    """
+    DZI descriptor using the native tile size and no overlap, so the Deep
+    Zoom levels that match a pyramid level map one tile to one native tile.
+    """
+    base = levels[0]
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<Image xmlns={quoteattr(DZI_NAMESPACE)} TileSize="{base.tile_width}" Overlap="0" '
+        f'Format="{DZI_FORMAT}">'
+        f'<Size Width="{base.width}" Height="{base.height}"/></Image>'
+    )
+
+
+def dzi_tile_request(levels: list[PyramidLevel], dzi_level: int, column: int, row: int,
+                     fmt: str = DZI_FORMAT) -> ImageRequest:
+    """The region and output size of a Deep Zoom tile"""
+    base = levels[0]
+    max_level = dzi_max_level(base.width, base.height)
+    if not 0 <= dzi_level <= max_level:
+        raise IiifError(f"Deep Zoom level must be between 0 and {max_level}", status_code=404)
+    if fmt not in IIIF_FORMATS:
+        raise IiifError(f"Unsupported format: {fmt}")
+    factor = 2 ** (max_level - dzi_level)
+    tile_size = base.tile_width
+    # Size of this Deep Zoom level in its own pixels
+    level_w = math.ceil(base.width / factor)
+    level_h = math.ceil(base.height / factor)
+    x, y = column * tile_size, row * tile_size
+    if column < 0 or row < 0 or x >= level_w or y >= level_h:
+        raise IiifError("Tile is outside the image", status_code=404)
+    out_w, out_h = min(tile_size, level_w - x), min(tile_size, level_h - y)
+    region = Rect(
+        x * factor, y * factor,
+        min(out_w * factor, base.width - x * factor),
+        min(out_h * factor, base.height - y * factor),
+    )
+    return ImageRequest(region, out_w, out_h, format=fmt)
@@ -0,0 +1,547 @@
+"""
+Conversion Job Queue
+Durable queue of WSI conversion jobs shared by every converter process.
+
+Jobs live in the Postgres ``conversion_jobs`` table and are claimed with
+``FOR UPDATE SKIP LOCKED`` under a renewable lease, so any number of uvicorn
+workers (or hosts sharing the uploads volume) can pull from the same queue.
+Without a database the queue runs in-process with the same semantics.
+"""
+
+import os
+import re
+import time
+import socket
+import asyncio
+import logging
+from pathlib import Path
+from datetime import datetime
+from typing import Awaitable, Callable, Optional
+
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+# Lease on a claimed job; renewed by heartbeats while the conversion runs
+DEFAULT_LEASE_SECONDS = 120
+DEFAULT_MAX_ATTEMPTS = 3
+# Retry n waits RETRY_BACKOFF_SECONDS * 2**(n-1)
+DEFAULT_RETRY_BACKOFF_SECONDS = 30
+DEFAULT_POLL_SECONDS = 2.0
+
+ACTIVE_STATUSES = ("pending", "processing")
+FINAL_STATUSES = ("completed", "failed", "cancelled")
+
+# Files saved by the upload endpoints: incoming/{job_id}_{filename}
+INCOMING_FILE_RE = re.compile(r"^([0-9a-f]{8})_(.+)$")
+
+
+class ConversionJob(BaseModel):
+    job_id: str
+    filename: str
+    status: str  # pending, processing, completed, failed, cancelled
+    progress: int = 0
+    message: str = ""
+    study_uid: Optional[str] = None
+    study_id: Optional[str] = None  # Orthanc study ID
+    owner_id: Optional[int] = None  # User ID of uploader
+    created_at: datetime
+    completed_at: Optional[datetime] = None
+    # Queue bookkeeping
+    file_path: Optional[str] = None
+    source_format: Optional[str] = None
+    upload_id: Optional[str] = None  # Chunked upload session that produced the file
+    priority: int = 0  # Lower runs first (file size in bytes, so small slides go first)
+    attempts: int = 0
+    cancel_requested: bool = False
+    lease_lost: bool = False  # Another worker may have reclaimed it: stop and write nothing
+
+
+class JobCancelled(Exception):
+    """Raised by a runner when the job was cancelled mid-flight"""
+
+
+def _job_from_row(row) -> ConversionJob:
+    fields = ConversionJob.model_fields
+    return ConversionJob(**{k: v for k, v in dict(row).items() if k in fields})
+
+
+def worker_identity() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobQueue:
+    """
+    Leased, prioritized job queue with retries, cancellation and recovery.
+
+    ``runner(job)`` performs the conversion and returns the Orthanc study ID;
+    ``on_failed(job)`` is called once a job is given up on (retries exhausted
+    or cancelled) so the caller can move the input file out of the way.
+    """
+
+    def __init__(
+        self,
+        pool_getter: Callable[[], Awaitable],
+        lease_seconds: int = DEFAULT_LEASE_SECONDS,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        retry_backoff_seconds: float = DEFAULT_RETRY_BACKOFF_SECONDS,
+        poll_seconds: float = DEFAULT_POLL_SECONDS,
+    ):
+        self._pool_getter = pool_getter
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_backoff_seconds = retry_backoff_seconds
+        self.poll_seconds = poll_seconds
+        self.worker_id = worker_identity()
+
+        # Without a database this is the queue; with one it holds the jobs
+        # this process is running (live progress) and recently touched jobs
+        self.jobs: dict[str, ConversionJob] = {}
+        self._pool = None
+        self._started = False
+        self._available_at: dict[str, float] = {}  # memory mode retry backoff
+
+        self._runner = None
+        self._on_failed = None
+        self._on_cancel = None
+        self._concurrency = 1
+        self._running: dict[str, asyncio.Task] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    @property
+    def durable(self) -> bool:
+        return self._pool is not None
+
+    async def _get_pool(self):
+        if not self._started:
+            # Decide once; a database that is down at startup means in-process mode
+            self._pool = await self._pool_getter()
+            self._started = True
+        return self._pool
+
+    # -------------------------------------------------------------------------
+    # Producer side
+    # -------------------------------------------------------------------------
+
+    async def enqueue(self, job: ConversionJob) -> ConversionJob:
+        job.status = "pending"
+        pool = await self._get_pool()
+        if pool is not None:
+            async with pool.acquire() as conn:
+                await conn.execute(
+                    """
+                    INSERT INTO conversion_jobs (
+                        job_id, filename, file_path, source_format, upload_id, status,
+                        progress, message, owner_id, priority, max_attempts, created_at
+                    ) VALUES ($1, $2, $3, $4, $5, 'pending', 0, $6, $7, $8, $9, $10)
+                    ON CONFLICT (job_id) DO NOTHING
+                    """,
+                    job.job_id, job.filename, job.file_path, job.source_format, job.upload_id,
+                    job.message, job.owner_id, job.priority, self.max_attempts, job.created_at
+                )
+        self.jobs[job.job_id] = job
+        self._wake()
+        return job
+
+    async def get(self, job_id: str) -> Optional[ConversionJob]:
+        running = self.jobs.get(job_id)
+        if running is not None and (job_id in self._running or not self.durable):
+            return running
+        pool = await self._get_pool()
+        if pool is None:
+            return None
+        async with pool.acquire() as conn:
+            row = await conn.fetchrow("SELECT * FROM conversion_jobs WHERE job_id = $1", job_id)
+        if row is None:
+            # Jobs added directly to the local map (e.g. by tests) are still visible
+            return running
+        return _job_from_row(row)
+
+    async def list(self, limit: int = 200) -> list[ConversionJob]:
+        pool = await self._get_pool()
+        if pool is None:
+            return sorted(self.jobs.values(), key=lambda j: j.created_at, reverse=True)[:limit]
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(
+                "SELECT * FROM conversion_jobs ORDER BY created_at DESC LIMIT $1", limit
+            )
+        jobs = [_job_from_row(row) for row in rows]
+        # Overlay live progress of jobs running here
+        return [self.jobs[j.job_id] if j.job_id in self._running else j for j in jobs]
+
+    async def delete(self, job_id: str) -> bool:
+        """Remove a finished job from history; raises ValueError if still active"""
+        job = await self.get(job_id)
+        if job is None:
+            return False
+        if job.status in ACTIVE_STATUSES:
+            raise ValueError(f"Cannot delete job that is {job.status}")
+        self.jobs.pop(job_id, None)
+        pool = await self._get_pool()
+        if pool is not None:
+            async with pool.acquire() as conn:
+                await conn.execute("DELETE FROM conversion_jobs WHERE job_id = $1", job_id)
+        return True
+
+    async def cancel(self, job_id: str) -> Optional[ConversionJob]:
+        """
+        Cancel a job. Pending jobs are cancelled immediately; running jobs are
+        flagged and stop at the worker's next progress checkpoint.
+        """
+        job = await self.get(job_id)
+        if job is None or job.status not in ACTIVE_STATUSES:
+            return job
+
+        pool = await self._get_pool()
+        if pool is not None:
+            async with pool.acquire() as conn:
+                row = await conn.fetchrow(
+                    """
+                    UPDATE conversion_jobs SET
+                        cancel_requested = TRUE,
+                        status = CASE WHEN status = 'pending' THEN 'cancelled' ELSE status END,
+                        message = CASE WHEN status = 'pending' THEN 'Cancelled' ELSE 'Cancelling...' END,
+                        completed_at = CASE WHEN status = 'pending' THEN NOW() ELSE completed_at END,
+                        updated_at = NOW()
+                    WHERE job_id = $1 AND status IN ('pending', 'processing')
+                    RETURNING *
+                    """,
+                    job_id
+                )
+            if row is not None:
+                job = _job_from_row(row)
+        else:
+            job.cancel_requested = True
+            if job.status == "pending":
+                job.status = "cancelled"
+                job.message = "Cancelled"
+                job.completed_at = datetime.utcnow()
+
+        local = self.jobs.get(job_id)
+        if local is not None and local is not job:
+            local.cancel_requested = True
+        if job_id in self._running and self._on_cancel:
+            self._on_cancel(job_id)
+        if job.status == "cancelled" and self._on_failed:
+            await self._on_failed(job)
+        return job
+
+    # -------------------------------------------------------------------------
+    # Consumer side
+    # -------------------------------------------------------------------------
+
+    async def _claim(self) -> Optional[ConversionJob]:
+        pool = await self._get_pool()
+        if pool is None:
+            now = time.monotonic()
+            pending = [
+                j for j in self.jobs.values()
+                if j.status == "pending" and j.job_id not in self._running
+                and self._available_at.get(j.job_id, 0) <= now
+            ]
+            if not pending:
+                return None
+            job = min(pending, key=lambda j: (j.priority, j.created_at))
+            job.status = "processing"
+            job.attempts += 1
+            return job
+
+        async with pool.acquire() as conn:
+            row = await conn.fetchrow(
+                """
+                UPDATE conversion_jobs SET
+                    status = 'processing',
+                    attempts = attempts + 1,
+                    lease_owner = $1,
+                    lease_expires_at = NOW() + make_interval(secs => $2),
+                    started_at = COALESCE(started_at, NOW()),
+                    updated_at = NOW()
+                WHERE job_id = (
+                    SELECT job_id FROM conversion_jobs
+                    WHERE (status = 'pending' AND available_at <= NOW())
+                       OR (status = 'processing' AND lease_expires_at < NOW())
+                    ORDER BY priority, created_at
+                    FOR UPDATE SKIP LOCKED
+                    LIMIT 1
+                )
+                RETURNING *
+                """,
+                self.worker_id, float(self.lease_seconds)
+            )
+        if row is None:
+            return None
+        job = _job_from_row(row)
+        self.jobs[job.job_id] = job
+        return job
+
+    async def _heartbeat(self, job: ConversionJob):
+        """Renew the lease, persist progress and pick up cancellation requests"""
+        pool = await self._get_pool()
+        if pool is None:
+            if job.cancel_requested and self._on_cancel:
+                self._on_cancel(job.job_id)
+            return
+        async with pool.acquire() as conn:
+            row = await conn.fetchrow(
+                """
+                UPDATE conversion_jobs SET
+                    progress = $3, message = $4,
+                    lease_expires_at = NOW() + make_interval(secs => $5),
+                    updated_at = NOW()
+                WHERE job_id = $1 AND lease_owner = $2 AND status = 'processing'
+                RETURNING cancel_requested
+                """,
+                job.job_id, self.worker_id, job.progress, job.message, float(self.lease_seconds)
+            )
+        if row is None:
+            logger.warning(f"⚠️ Lost lease on conversion job {job.job_id}")
+            job.lease_lost = True
+        elif row["cancel_requested"]:
+            job.cancel_requested = True
+        if (job.cancel_requested or job.lease_lost) and self._on_cancel:
+            self._on_cancel(job.job_id)
+
+    async def _finish(self, job: ConversionJob, status: str, message: str, retry_in: Optional[float] = None) -> bool:
+        """
+        Record a job's outcome and release its lease. Returns False (and
+        writes nothing) when this worker no longer holds the lease: the row
+        then belongs to whichever worker reclaimed it.
+        """
+        job.status = status
+        job.message = message
+        if status in FINAL_STATUSES:
+            job.completed_at = datetime.utcnow()
+            if status == "completed":
+                job.progress = 100
+        pool = await self._get_pool()
+        if pool is None:
+            if retry_in is not None:
+                self._available_at[job.job_id] = time.monotonic() + retry_in
+            return True
+        async with pool.acquire() as conn:
+            result = await conn.execute(
+                """
+                UPDATE conversion_jobs SET
+                    status = $2, progress = $3, message = $4,
+                    study_uid = $5, study_id = $6, completed_at = $7,
+                    available_at = NOW() + make_interval(secs => $8),
+                    lease_owner = NULL, lease_expires_at = NULL,
+                    updated_at = NOW()
+                WHERE job_id = $1 AND lease_owner = $9
+                """,
+                job.job_id, status, job.progress, message, job.study_uid, job.study_id,
+                job.completed_at, float(retry_in or 0), self.worker_id
+            )
+        if result == "UPDATE 0":
+            job.lease_lost = True
+            self._abandon(job)
+            return False
+        return True
+
+    def _abandon(self, job: ConversionJob):
+        """Drop a job whose lease was lost; its row and input belong to the worker that reclaimed it"""
+        logger.warning(f"⚠️ Stopped conversion job {job.job_id} after losing its lease")
+        self.jobs.pop(job.job_id, None)
+
+    async def _run(self, job: ConversionJob):
+        stop = asyncio.Event()
+
+        async def heartbeat_loop():
+            interval = max(1.0, self.lease_seconds / 3)
+            while not stop.is_set():
+                try:
+                    await asyncio.wait_for(stop.wait(), timeout=interval)
+                except asyncio.TimeoutError:
+                    try:
+                        await self._heartbeat(job)
+                    except Exception as e:
+                        logger.warning(f"Heartbeat failed for job {job.job_id}: {e}")
+
+        heartbeat = asyncio.create_task(heartbeat_loop())
+        try:
+            if job.cancel_requested:
+                raise JobCancelled()
+            if job.attempts > self.max_attempts:
+                raise RuntimeError(f"Gave up after {self.max_attempts} attempts")
+            logger.info(f"🔄 Conversion job {job.job_id} started (attempt {job.attempts}, worker {self.worker_id})")
+            study_uid = await self._runner(job)
+            if job.lease_lost:
+                self._abandon(job)
+                return
+            job.study_uid = study_uid
+            job.study_id = study_uid
+            await self._finish(job, "completed", f"Conversion complete. Study: {study_uid}")
+        except (JobCancelled, asyncio.CancelledError) as e:
+            if isinstance(e, asyncio.CancelledError) and not job.cancel_requested:
+                # Shutdown: leave the lease to expire so another worker picks it up
+                raise
+            if job.lease_lost:
+                self._abandon(job)
+                return
+            if await self._finish(job, "cancelled", "Cancelled") and self._on_failed:
+                await self._on_failed(job)
+        except Exception as e:
+            if job.lease_lost:
+                self._abandon(job)
+                return
+            if job.cancel_requested:
+                if await self._finish(job, "cancelled", "Cancelled") and self._on_failed:
+                    await self._on_failed(job)
+            elif job.attempts < self.max_attempts:
+                delay = self.retry_backoff_seconds * 2 ** (job.attempts - 1)
+                logger.warning(f"⚠️ Conversion job {job.job_id} failed (attempt {job.attempts}), retrying in {delay:.0f}s: {e}")
+                await self._finish(job, "pending", f"Retrying after error: {e}", retry_in=delay)
+            else:
+                logger.error(f"❌ Conversion job {job.job_id} failed: {e}")
+                if await self._finish(job, "failed", f"Conversion failed: {str(e)}") and self._on_failed:
+                    await self._on_failed(job)
+        finally:
+            stop.set()
+            await heartbeat
+
+    async def _dispatch(self):
+        while True:
+            try:
+                while len(self._running) < self._concurrency:
+                    job = await self._claim()
+                    if job is None:
+                        break
+                    task = asyncio.create_task(self._run(job))
+                    self._running[job.job_id] = task
+                    task.add_done_callback(lambda t, job_id=job.job_id: self._job_done(job_id))
+            except Exception as e:
+                logger.error(f"Job dispatcher error: {e}")
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    def _job_done(self, job_id: str):
+        self._running.pop(job_id, None)
+        self._wake()
+
+    def _wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def start(
+        self,
+        runner: Callable[[ConversionJob], Awaitable[Optional[str]]],
+        on_failed: Optional[Callable[[ConversionJob], Awaitable]] = None,
+        on_cancel: Optional[Callable[[str], None]] = None,
+        concurrency: int = 1,
+    ):
+        """Start pulling jobs (call once per process, from the lifespan)"""
+        self._runner = runner
+        self._on_failed = on_failed
+        self._on_cancel = on_cancel
+        self._concurrency = max(1, concurrency)
+        await self._get_pool()
+        self._wakeup = asyncio.Event()
+        self._dispatcher = asyncio.create_task(self._dispatch())
+        mode = "postgres" if self.durable else "in-process (no database)"
+        logger.info(f"📋 Conversion queue started: {mode}, concurrency={self._concurrency}, worker={self.worker_id}")
+
+    async def stop(self):
+        if self._dispatcher:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+        for task in list(self._running.values()):
+            task.cancel()
+        if self._running:
+            await asyncio.gather(*self._running.values(), return_exceptions=True)
+
+    # -------------------------------------------------------------------------
+    # Crash recovery
+    # -------------------------------------------------------------------------
+
+    async def recover(self, watch_folder: Path, source_format_of: Callable[[str], str]) -> dict:
+        """
+        Recover after a crash or restart:
+        - expire leases held by dead processes on this host so jobs restart now
+        - delete partial outputs in processing/ that no live job owns
+        - re-queue input files in incoming/ that have no job (lost in-memory
+          jobs or a crash between saving and enqueueing)
+        """
+        pool = await self._get_pool()
+        report = {"leases_released": 0, "dirs_removed": 0, "files_requeued": 0}
+        active_ids: set[str] = set()
+        known_ids: set[str] = set(self.jobs)
+
+        if pool is not None:
+            host = socket.gethostname()
+            async with pool.acquire() as conn:
+                leases = await conn.fetch(
+                    "SELECT job_id, lease_owner FROM conversion_jobs WHERE status = 'processing' AND lease_owner LIKE $1",
+                    f"{host}:%"
+                )
+                for lease in leases:
+                    pid = lease["lease_owner"].rsplit(":", 1)[-1]
+                    if pid.isdigit() and not _pid_alive(int(pid)):
+                        await conn.execute(
+                            "UPDATE conversion_jobs SET lease_expires_at = NOW() WHERE job_id = $1",
+                            lease["job_id"]
+                        )
+                        report["leases_released"] += 1
+                rows = await conn.fetch("SELECT job_id, status FROM conversion_jobs")
+            known_ids |= {row["job_id"] for row in rows}
+            active_ids = {row["job_id"] for row in rows if row["status"] == "processing"}
+        active_ids |= set(self._running)
+
+        processing_dir = Path(watch_folder) / "processing"
+        if processing_dir.exists():
+            for entry in processing_dir.iterdir():
+                job_id = entry.name.split("_", 1)[0]
+                if entry.is_dir() and job_id not in active_ids:
+                    await asyncio.to_thread(_rmtree, entry)
+                    report["dirs_removed"] += 1
+
+        incoming_dir = Path(watch_folder) / "incoming"
+        if incoming_dir.exists():
+            for entry in incoming_dir.iterdir():
+                match = INCOMING_FILE_RE.match(entry.name)
+                if not entry.is_file() or not match or match.group(1) in known_ids:
+                    continue
+                job_id, filename = match.groups()
+                await self.enqueue(ConversionJob(
+                    job_id=job_id,
+                    filename=filename,
+                    status="pending",
+                    message="Re-queued after restart",
+                    created_at=datetime.utcnow(),
+                    file_path=str(entry),
+                    source_format=source_format_of(filename),
+                    priority=entry.stat().st_size,
+                ))
+                report["files_requeued"] += 1
+
+        if any(report.values()):
+            logger.info(f"♻️ Conversion queue recovery: {report}")
+        return report
+
+    def get_stats(self) -> dict:
+        return {
+            "mode": "postgres" if self.durable else "memory",
+            "worker_id": self.worker_id,
+            "running": len(self._running),
+            "concurrency": self._concurrency,
+            "local_jobs": len(self.jobs),
+        }
+
+
+def _rmtree(path: Path):
+    import shutil
+    shutil.rmtree(path, ignore_errors=True)
@@ -4,18 +4,21 @@ Converts proprietary WSI formats to DICOM and uploads to Orthanc
 """
 
 import os
+import re
 import uuid
 import shutil
 import asyncio
 import json
+import time
 from pathlib import Path
 from datetime import datetime, timedelta
 from typing import Optional
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks, Request, Depends
+from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks, Request, Depends, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, RedirectResponse, Response
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
 from pydantic_settings import BaseSettings
 
@@ -31,6 +34,43 @@ from auth import (
     get_share_counts_for_studies, share_case, unshare_case, get_case_shares,
     get_slide_access_info, delete_pending_slide_share, delete_pending_case_share, delete_slide
 )
+from orthanc_client import OrthancClient, OrthancStream
+from tile_cache import TileCache, tile_key
+from wsi_metadata import load_wsi_metadata, invalidate_wsi_metadata
+# Conversion helpers live in conversion_worker (importable by pool processes)
+from conversion_worker import (  # noqa: F401
+    ConversionExecutor, check_tiff_compression, preprocess_for_conversion, detect_format
+)
+from job_queue import JobQueue, ConversionJob, JobCancelled
+from stow_upload import StowUploader, UploadProgress
+from frame_server import FrameServer, BROWSER_TRANSFER_SYNTAXES, accepted_media_types
+from tile_batch import TILE_PACK_MEDIA_TYPE, fetch_tiles, pack_tiles
+from prefetch import TilePrefetcher, PyramidCache, choose_level, predict_tiles
+from tile_transcode import TileTranscoder, TileFormat, POLICIES as TRANSCODE_POLICIES
+from icc_lut import IccCorrector
+from orthanc_index import OrthancIndex
+from region import (
+    REGION_MEDIA_TYPES, TIFF_TILE_SIZE, PNG_BAND_HEIGHT, level_for_mpp, plan_region,
+    stitch_region, iter_bands, encode_region, png_stream, tiff_stream, tiff_size
+)
+from annotation_geometry import geometry_bbox, parse_bbox, scale_bbox
+from annotation_import import (
+    NDJSON_MEDIA_TYPES, BulkImportError, iter_features, normalize_feature, measure_batch, area_measurement
+)
+from annotation_lod import build_lod_batch, lod_keys, lod_join_sql, pick_lod
+from annotation_tiles import AnnotationTileCache, MVT_MEDIA_TYPE, MVT_EXTENT, buffered_box, encode_tile
+from annotation_export import EXPORT_WRITERS, annotation_from_row, export_stream
+from iiif import (
+    IiifError, ImageRequest, IIIF_LD_MEDIA_TYPE, info_json, native_tile, parse_image_request, render,
+    dzi_descriptor, dzi_tile_request
+)
+from http_cache import (
+    strong_etag, json_etag, content_etag, not_modified,
+    IMMUTABLE_CACHE_CONTROL, TILE_CACHE_CONTROL, REVALIDATE_CACHE_CONTROL
+)
+from manifest import (
+    fetch_icc_profile, load_manifest, refresh_manifest, delete_manifest, schedule_manifest_refresh
+)
 
 # Alias for optional authentication (returns None if not authenticated)
 optional_user = get_current_user
@@ -47,6 +87,69 @@ class Settings(BaseSettings):
     redis_url: str = "redis://redis:6379"
     watch_folder: str = "/uploads"
     max_upload_size_gb: int = 20
+    # Shared Orthanc connection pool
+    orthanc_max_connections: int = 100
+    orthanc_max_keepalive: int = 20
+    orthanc_keepalive_expiry: float = 30.0
+    orthanc_http2: bool = False
+    orthanc_tile_timeout: float = 30.0
+    orthanc_metadata_timeout: float = 30.0
+    # Orthanc storage directory mounted read-only (frames served by byte-range reads)
+    orthanc_storage_dir: str = ""
+    # Tile cache (in-process LRU + Redis)
+    tile_cache_memory_mb: int = 256
+    tile_cache_memory_ttl_seconds: int = 3600
+    tile_cache_redis_ttl_seconds: int = 86400
+    tile_cache_redis_enabled: bool = True
+    # Conversion pool (0 workers = run conversions in a thread)
+    conversion_workers: int = 2
+    conversion_memory_limit_mb: int = 0
+    # Conversion queue
+    conversion_max_attempts: int = 3
+    conversion_retry_backoff_seconds: float = 30.0
+    conversion_lease_seconds: int = 120
+    # Upload of converted DICOM files (0 batch MB = one /instances request per file)
+    stow_concurrency: int = 4
+    stow_batch_mb: int = 64
+    stow_max_attempts: int = 3
+    # Batched tile fetches (POST /studies/{id}/tiles:batch)
+    tile_batch_max_tiles: int = 64
+    tile_batch_concurrency: int = 16
+    # Viewport prefetch (POST /studies/{id}/prefetch); waits while this many client fetches are in flight
+    prefetch_enabled: bool = True
+    prefetch_concurrency: int = 2
+    prefetch_max_tiles: int = 48
+    prefetch_busy_inflight: int = 16
+    # Tile transcoding to AVIF/WebP/JPEG: off | balanced | bandwidth (switchable at /admin/tile-transcoding)
+    tile_transcode_policy: str = "balanced"
+    tile_transcode_quality: int = 75
+    tile_transcode_workers: int = 2
+    # Server-side ICC colour correction of tiles (?icc=1) via a per-series 3D LUT
+    icc_lut_size: int = 33
+    icc_lut_cache_size: int = 32
+    icc_correction_workers: int = 2
+    # Region extraction (GET /studies/{id}/region); larger regions than the buffer limit are streamed
+    region_max_pixels: int = 1 << 30
+    region_buffer_max_pixels: int = 1 << 24
+    region_concurrency: int = 16
+    # IIIF Image API / Deep Zoom; base URL defaults to the request's (behind a proxy: X-Forwarded-Prefix)
+    iiif_base_url: str = ""
+    iiif_max_area: int = 4_194_304
+    # Bulk annotation import (POST /studies/{id}/annotations:bulk), COPYed in batches in one transaction
+    annotation_import_batch_size: int = 5000
+    annotation_import_max_features: int = 1_000_000
+    # Simplified annotation geometries for low magnification: Douglas-Peucker
+    # tolerance in displayed pixels (level-0 pixels / downsample)
+    annotation_lod_tolerance: float = 0.5
+    # Annotation vector tiles (GET /studies/{id}/annotations/tiles/{level}/{x}/{y}.mvt)
+    annotation_tile_cache_mb: int = 64
+    annotation_tile_max_features: int = 50_000
+    # Rows fetched per round trip by the streamed export's server-side cursor
+    annotation_export_prefetch: int = 1000
+    # Local study/series/instance index fed by Orthanc's /changes (one consumer process holds the lease)
+    orthanc_index_enabled: bool = True
+    orthanc_index_poll_seconds: float = 2.0
+    orthanc_index_page_size: int = 500
 
     class Config:
         env_file = ".env"
@@ -54,21 +157,89 @@ class Settings(BaseSettings):
 
 settings = Settings()
 
-# Track conversion jobs
-conversion_jobs: dict = {}
+# Shared, pooled client used for every Orthanc request (started in lifespan)
+orthanc_client = OrthancClient(
+    settings.orthanc_url,
+    settings.orthanc_username,
+    settings.orthanc_password,
+    max_connections=settings.orthanc_max_connections,
+    max_keepalive_connections=settings.orthanc_max_keepalive,
+    keepalive_expiry=settings.orthanc_keepalive_expiry,
+    http2=settings.orthanc_http2,
+    timeouts={
+        "tile": httpx.Timeout(settings.orthanc_tile_timeout, connect=5.0),
+        "metadata": httpx.Timeout(settings.orthanc_metadata_timeout, connect=5.0),
+    },
+)
 
+# Shared tile cache in front of the Orthanc WSI plugin
+tile_cache = TileCache(
+    max_memory_bytes=settings.tile_cache_memory_mb * 1024 * 1024,
+    memory_ttl=settings.tile_cache_memory_ttl_seconds,
+    redis_url=settings.redis_url if settings.tile_cache_redis_enabled else None,
+    redis_ttl=settings.tile_cache_redis_ttl_seconds,
+)
 
-class ConversionJob(BaseModel):
-    job_id: str
-    filename: str
-    status: str  # pending, processing, completed, failed
-    progress: int = 0
-    message: str = ""
-    study_uid: Optional[str] = None
-    study_id: Optional[str] = None  # Orthanc study ID
-    owner_id: Optional[int] = None  # User ID of uploader
-    created_at: datetime
-    completed_at: Optional[datetime] = None
+# Encoded annotation vector tiles, evicted per tile when annotations change
+annotation_tile_cache = AnnotationTileCache(max_bytes=settings.annotation_tile_cache_mb * 1024 * 1024)
+
+# AVIF/WebP/low-quality JPEG tiles for clients that ask for them
+tile_transcoder = TileTranscoder(
+    policy=settings.tile_transcode_policy,
+    default_quality=settings.tile_transcode_quality,
+    workers=settings.tile_transcode_workers,
+)
+
+# Per-series ICC -> sRGB LUTs for colour-corrected tiles
+icc_corrector = IccCorrector(
+    lut_size=settings.icc_lut_size,
+    max_luts=settings.icc_lut_cache_size,
+    workers=settings.icc_correction_workers,
+)
+
+# Low-priority warming of the tile cache ahead of a moving viewport
+tile_prefetcher = TilePrefetcher(
+    warm=lambda tile: warm_wsi_tile(*tile),
+    busy=lambda: tile_cache.interactive_inflight() >= settings.prefetch_busy_inflight,
+    concurrency=settings.prefetch_concurrency,
+)
+pyramid_cache = PyramidCache(orthanc_client)
+
+# Stored compressed frames, served without Orthanc's decode/re-encode
+frame_server = FrameServer(orthanc_client, storage_dir=settings.orthanc_storage_dir or None)
+
+# CPU-bound conversions run here, off the event loop
+conversion_executor = ConversionExecutor(
+    max_workers=settings.conversion_workers,
+    memory_limit_mb=settings.conversion_memory_limit_mb,
+)
+
+# Durable conversion queue (Postgres; in-process when no database is available)
+job_queue = JobQueue(
+    get_db_pool,
+    lease_seconds=settings.conversion_lease_seconds,
+    max_attempts=settings.conversion_max_attempts,
+    retry_backoff_seconds=settings.conversion_retry_backoff_seconds,
+)
+
+# Parallel, streamed upload of converted files to Orthanc
+stow_uploader = StowUploader(
+    orthanc_client,
+    concurrency=settings.stow_concurrency,
+    batch_bytes=settings.stow_batch_mb * 1024 * 1024,
+    max_attempts=settings.stow_max_attempts,
+)
+
+# Index of Orthanc resources kept current from the /changes feed
+orthanc_index = OrthancIndex(
+    orthanc_client,
+    get_db_pool,
+    poll_seconds=settings.orthanc_index_poll_seconds,
+    page_size=settings.orthanc_index_page_size,
+)
+
+# Jobs known to this process (the whole queue when running without a database)
+conversion_jobs: dict[str, ConversionJob] = job_queue.jobs
 
 
 class UploadResponse(BaseModel):
@@ -115,199 +286,6 @@ class AnnotationUpdate(BaseModel):
 # The old in-memory store has been removed to prevent data loss
 
 
-# =============================================================================
-# LZW/Unsupported Compression Handling
-# =============================================================================
-
-def check_tiff_compression(file_path: Path) -> tuple[bool, int]:
-    """
-    Check if a TIFF/SVS file uses LZW or other unsupported compression.
-    Returns (needs_conversion, compression_type)
-    
-    TIFF Compression codes:
-    - 1: Uncompressed
-    - 5: LZW (not supported by OpenSlide)
-    - 6: JPEG (old-style)
-    - 7: JPEG (new-style, supported)
-    - 8: Adobe Deflate
-    - 32773: PackBits
-    - 33003: JPEG2000 (supported by OpenSlide with plugins)
-    - 33005: JPEG2000 (supported by OpenSlide with plugins)
-    """
-    try:
-        import tifffile
-        with tifffile.TiffFile(str(file_path)) as tif:
-            # Check all pages for compression
-            unsupported_compressions = {5, 6, 8, 32773}  # LZW, old JPEG, Deflate, PackBits
-            for page in tif.pages:
-                compression = page.compression
-                if isinstance(compression, int) and compression in unsupported_compressions:
-                    logger.info(f"Found unsupported compression {compression} in {file_path.name}")
-                    return True, compression
-                # tifffile uses enum, check value
-                if hasattr(compression, 'value') and compression.value in unsupported_compressions:
-                    logger.info(f"Found unsupported compression {compression.value} in {file_path.name}")
-                    return True, compression.value
-        return False, 0
-    except Exception as e:
-        logger.warning(f"Could not check TIFF compression: {e}")
-        return False, 0
-
-
-def convert_to_jpeg_tiff(source_path: Path, output_dir: Path) -> Path:
-    """
-    Convert a TIFF with unsupported compression (LZW, Deflate, etc.) 
-    to a JPEG-compressed pyramid TIFF using pyvips.
-    
-    This creates a proper pyramid TIFF that OpenSlide/wsidicomizer can read.
-    Handles YCbCr JPEG TIFFs (PhotometricInterpretation=6) correctly.
-    """
-    import pyvips
-    
-    logger.info(f"Pre-processing {source_path.name} - converting to JPEG compression...")
-    
-    output_path = output_dir / f"{source_path.stem}_jpeg.tiff"
-    
-    # Check source TIFF photometric interpretation using tifffile
-    # YCbCr (6) JPEGs need special handling
-    source_is_ycbcr = False
-    try:
-        import tifffile
-        with tifffile.TiffFile(str(source_path)) as tif:
-            if tif.pages:
-                photometric = tif.pages[0].photometric
-                logger.info(f"Source photometric: {photometric} (6=YCbCr, 2=RGB)")
-                source_is_ycbcr = (photometric == 6)  # PHOTOMETRIC.YCBCR
-    except Exception as e:
-        logger.warning(f"Could not check photometric: {e}")
-    
-    # Load image with pyvips
-    # For YCbCr JPEG TIFFs, we need to ensure proper color conversion
-    image = pyvips.Image.new_from_file(str(source_path), access='random')
-    
-    logger.info(f"Loaded image: {image.width}x{image.height}, {image.bands} bands, interpretation={image.interpretation}")
-    
-    # Handle YCbCr source images - pyvips should auto-convert, but let's be explicit
-    if source_is_ycbcr or image.interpretation in ['ycc', 'ycbcr']:
-        logger.info("Source is YCbCr - converting to sRGB")
-        try:
-            # For YCbCr JPEG, pyvips usually reads as RGB already, but if it's still YCC:
-            if image.interpretation in ['ycc', 'ycbcr']:
-                image = image.colourspace('srgb')
-                logger.info(f"Converted YCbCr to sRGB")
-        except Exception as e:
-            logger.warning(f"YCbCr conversion warning: {e}")
-    
-    # Ensure image is in sRGB color space (fixes color issues from various source formats)
-    # This handles CMYK, LAB, or other color spaces that might come from source TIFFs
-    if image.interpretation not in ['srgb', 'rgb', 'b-w']:
-        try:
-            logger.info(f"Converting from {image.interpretation} to sRGB")
-            image = image.colourspace('srgb')
-            logger.info(f"Converted to sRGB, now {image.bands} bands")
-        except Exception as e:
-            logger.warning(f"Could not convert to sRGB: {e}")
-    
-    # Ensure image is in a format compatible with JPEG (RGB, no alpha)
-    if image.bands == 4:
-        # Remove alpha channel
-        image = image.flatten(background=[255, 255, 255])
-        logger.info("Flattened 4-band to 3-band RGB")
-    elif image.bands == 1:
-        # Convert grayscale to RGB
-        image = image.colourspace('srgb')
-        logger.info("Converted grayscale to sRGB")
-    
-    # Save as pyramid TIFF with JPEG compression
-    # Use RGB photometric interpretation for compatibility (rgbjpeg=True means store as RGB not YCbCr)
-    image.tiffsave(
-        str(output_path),
-        tile=True,
-        tile_width=256,
-        tile_height=256,
-        pyramid=False,  # Don't create pyramid - let wsidicomizer do it with add_missing_levels
-        compression='jpeg',
-        Q=90,
-        bigtiff=True,  # Support files > 4GB
-        rgbjpeg=True   # Store JPEG as RGB (PhotometricInterpretation=2), not YCbCr (6)
-    )
-    
-    logger.info(f"Created JPEG-compressed TIFF (RGB): {output_path}")
-    return output_path
-
-
-def preprocess_for_conversion(file_path: Path, output_dir: Path, job=None) -> Path:
-    """
-    Pre-process a WSI file if it uses unsupported compression or obfuscation.
-    Returns the path to use for conversion (may be original or converted file).
-    """
-    ext = file_path.suffix.lower()
-    
-    # Handle 3DHISTECH DCX files (obfuscated tiles)
-    if ext == '.dcx':
-        if job:
-            job.message = "Deobfuscating DCX file..."
-            job.progress = 20
-        
-        logger.info(f"Processing DCX file: {file_path.name}")
-        
-        try:
-            # Import from same directory (works in Docker)
-            import sys
-            import os
-            sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
-            from dcx_lossless import convert_dcx_lossless
-            
-            output_path = output_dir / f"{file_path.stem}_decoded.tiff"
-            
-            def progress_cb(progress, message):
-                if job:
-                    # Map DCX progress (0-100) to job progress (20-50)
-                    job.progress = 20 + int(progress * 0.3)
-                    job.message = message
-            
-            convert_dcx_lossless(file_path, output_path, progress_cb)
-            logger.info(f"DCX deobfuscation complete: {output_path}")
-            return output_path
-            
-        except Exception as e:
-            logger.error(f"DCX deobfuscation failed: {e}")
-            raise Exception(f"DCX file deobfuscation failed: {e}")
-    
-    # Only check TIFF-based formats for compression issues
-    if ext not in ['.tiff', '.tif', '.svs', '.scn', '.bif']:
-        return file_path
-    
-    needs_conversion, compression = check_tiff_compression(file_path)
-    
-    if not needs_conversion:
-        return file_path
-    
-    compression_names = {
-        5: 'LZW',
-        6: 'Old JPEG',
-        8: 'Deflate/ZIP',
-        32773: 'PackBits'
-    }
-    comp_name = compression_names.get(compression, f'Type {compression}')
-    
-    if job:
-        job.message = f"Converting {comp_name} compression to JPEG..."
-        job.progress = 25
-    
-    logger.info(f"File uses {comp_name} compression - pre-processing with pyvips")
-    
-    try:
-        converted_path = convert_to_jpeg_tiff(file_path, output_dir)
-        logger.info(f"Pre-processing complete: {converted_path}")
-        return converted_path
-    except Exception as e:
-        logger.error(f"Pre-processing failed: {e}")
-        # Try to continue with original file anyway
-        logger.info("Attempting to continue with original file...")
-        return file_path
-
-
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Startup and shutdown events"""
@@ -315,6 +293,25 @@ async def lifespan(app: FastAPI):
     for subdir in ["incoming", "processing", "completed", "failed"]:
         Path(settings.watch_folder, subdir).mkdir(parents=True, exist_ok=True)
     
+    await orthanc_client.start()
+    
+    # Pick up conversions interrupted by a crash/restart, then start pulling jobs
+    try:
+        await job_queue.recover(Path(settings.watch_folder), detect_format)
+        await asyncio.to_thread(cleanup_expired_upload_sessions)
+    except Exception as e:
+        logger.error(f"Conversion queue recovery failed: {e}")
+    await job_queue.start(
+        convert_wsi_to_dicom,
+        on_failed=move_failed_input,
+        on_cancel=conversion_executor.cancel,
+        concurrency=max(1, settings.conversion_workers),
+    )
+    if settings.prefetch_enabled:
+        tile_prefetcher.start()
+    if settings.orthanc_index_enabled:
+        orthanc_index.start()
+    
     print(f"🚀 Converter service started")
     print(f"   Orthanc URL: {settings.orthanc_url}")
     print(f"   Watch folder: {settings.watch_folder}")
@@ -322,6 +319,14 @@ async def lifespan(app: FastAPI):
     yield
     
     # Shutdown
+    await job_queue.stop()
+    await tile_prefetcher.stop()
+    await orthanc_index.stop()
+    await orthanc_client.close()
+    await tile_cache.close()
+    tile_transcoder.close()
+    icc_corrector.close()
+    await conversion_executor.close()
     print("👋 Converter service shutting down")
 
 
@@ -346,6 +351,148 @@ app.add_middleware(
 # Helper Functions
 # =============================================================================
 
+async def fetch_tile_from_orthanc(series_id: str, level: int, x: int, y: int) -> Optional[tuple[bytes, str]]:
+    """Fetch a tile from Orthanc, bypassing the cache"""
+    # Stored JPEG frame as-is when the tile maps onto one; WSI plugin otherwise
+    native = await frame_server.get_tile(series_id, level, x, y)
+    if native is not None:
+        return native
+    response = await orthanc_client.get(f"/wsi/tiles/{series_id}/{level}/{x}/{y}")
+    if response.status_code in (403, 404):
+        return None
+    if response.status_code != 200:
+        raise HTTPException(status_code=502, detail=f"Orthanc error: {response.status_code}")
+    return response.content, response.headers.get("content-type", "image/jpeg")
+
+
+async def fetch_wsi_tile(series_id: str, level: int, x: int, y: int) -> Optional[tuple[bytes, str]]:
+    """
+    Fetch a tile through the tile cache.
+    Returns (content, media_type), or None if Orthanc has no such tile.
+    """
+    return await tile_cache.get_or_fetch(
+        tile_key(series_id, level, x, y),
+        lambda: fetch_tile_from_orthanc(series_id, level, x, y)
+    )
+
+
+def negotiate_tile_format(request: Request, quality: Optional[str] = None) -> Optional[TileFormat]:
+    """Transcode target for a tile request (None = serve the native tile)"""
+    return tile_transcoder.negotiate(
+        request.headers.get("accept", ""),
+        quality if quality is not None else request.query_params.get("quality"),
+        save_data=request.headers.get("save-data", "").lower() == "on",
+    )
+
+
+def wants_icc_correction(request: Request) -> bool:
+    """True if a tile request asks for server-side ICC correction (?icc=1)"""
+    return request.query_params.get("icc", "").lower() in ("1", "true", "srgb")
+
+
+def tile_response_headers() -> dict:
+    """Headers shared by every tile response"""
+    headers = {"Cache-Control": TILE_CACHE_CONTROL}
+    if tile_transcoder.policy != "off":
+        # The representation depends on these request headers
+        headers["Vary"] = "Accept, Save-Data"
+    return headers
+
+
+async def load_series_icc_profile(series_id: str) -> Optional[bytes]:
+    """ICC profile of a series' first instance, read through Orthanc's /content route"""
+    series_response = await orthanc_client.get(f"/series/{series_id}")
+    if series_response.status_code != 200:
+        return None
+    instances = series_response.json().get("Instances") or []
+    if not instances:
+        return None
+    icc = await fetch_icc_profile(orthanc_client, instances[0])
+    return icc[0] if icc else None
+
+
+async def fetch_icc_tile(series_id: str, level: int, x: int, y: int) -> Optional[tuple[bytes, str]]:
+    """
+    Fetch a tile colour-corrected to sRGB with the series' ICC LUT.
+    Corrected tiles are cached separately from native ones; a series without
+    an ICC profile gets its native tiles.
+    """
+    async def correct():
+        tile = await fetch_wsi_tile(series_id, level, x, y)
+        if tile is None:
+            return None
+        lut = await icc_corrector.get_lut(series_id, lambda: load_series_icc_profile(series_id))
+        if lut is None:
+            return tile
+        try:
+            return await icc_corrector.correct(tile[0], lut)
+        except Exception as e:
+            logger.warning(f"ICC correction of tile {series_id}/{level}/{x}/{y} failed, serving native tile: {e}")
+            return tile
+
+    return await tile_cache.get_or_fetch(tile_key(series_id, level, x, y, "icc"), correct)
+
+
+async def fetch_wsi_tile_as(
+    series_id: str, level: int, x: int, y: int, fmt: Optional[TileFormat], icc: bool = False
+) -> Optional[tuple[bytes, str]]:
+    """
+    Fetch a tile in the negotiated format, optionally ICC-corrected first.
+    Transcoded tiles are cached under their own format key, so a hit needs
+    neither the source tile nor any CPU. Falls back to the untranscoded tile
+    if transcoding fails.
+    """
+    fetch_source = fetch_icc_tile if icc else fetch_wsi_tile
+    if fmt is None:
+        return await fetch_source(series_id, level, x, y)
+
+    async def transcode_tile():
+        tile = await fetch_source(series_id, level, x, y)
+        if tile is None:
+            return None
+        return await tile_transcoder.transcode(tile[0], fmt), fmt.media_type
+
+    variant = tile_variant(fmt, icc)
+    try:
+        return await tile_cache.get_or_fetch(tile_key(series_id, level, x, y, variant), transcode_tile)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.warning(f"Tile transcode to {variant} failed, serving untranscoded tile: {e}")
+        return await fetch_source(series_id, level, x, y)
+
+
+def tile_variant(fmt: Optional[TileFormat], icc: bool) -> str:
+    """ETag component naming the representation of a tile"""
+    variant = fmt.key if fmt else "native"
+    return f"icc-{variant}" if icc else variant
+
+
+async def warm_wsi_tile(series_id: str, level: int, x: int, y: int) -> bool:
+    """Prefetch a tile into the cache; True if it had to be fetched"""
+    return await tile_cache.warm(
+        tile_key(series_id, level, x, y),
+        lambda: fetch_tile_from_orthanc(series_id, level, x, y)
+    )
+
+
+async def invalidate_study_tiles(study_id: str):
+    """Drop cached tiles and series mappings for a study (call before deleting it from Orthanc)"""
+    try:
+        response = await orthanc_client.get(f"/studies/{study_id}")
+        if response.status_code != 200:
+            return
+        # Frame indexes point into files that are about to disappear
+        frame_server.invalidate()
+        for series_id in response.json().get("Series", []):
+            _series_study_cache.pop(series_id, None)
+            icc_corrector.invalidate(series_id)
+            removed = await tile_cache.invalidate_series(series_id)
+            logger.info(f"🧹 Invalidated {removed} cached tiles for series {series_id}")
+    except Exception as e:
+        logger.warning(f"Failed to invalidate tile cache for study {study_id}: {e}")
+
+
 async def owns_study(user_id: int, study_id: str) -> bool:
     """Check if user owns a specific study"""
     owner_id = await get_study_owner(study_id)
@@ -370,30 +517,145 @@ async def get_slide_id_from_orthanc(study_id: str) -> Optional[int]:
 # Annotation Endpoints (PostgreSQL-backed)
 # =============================================================================
 
+async def pyramid_level(study_id: str, level: int):
+    """A pyramid level (PyramidLevel) of the study's main WSI series"""
+    series_id, _ = await resolve_region_source(study_id, None)
+    levels = await pyramid_cache.get(series_id)
+    if not levels:
+        raise HTTPException(status_code=404, detail="No WSI pyramid for this study")
+    if level >= len(levels):
+        raise HTTPException(status_code=400, detail=f"Level {level} out of range (0-{len(levels) - 1})")
+    return levels[level]
+
+
+async def level_downsample(study_id: str, level: int) -> float:
+    """Downsample of a pyramid level of the study's main WSI series"""
+    return (await pyramid_level(study_id, level)).downsample
+
+
+def invalidate_annotation_tiles(study_id: str, *geometries):
+    """Evict the vector tiles touched by these (old or new) geometries"""
+    for geometry in geometries:
+        if isinstance(geometry, str):
+            try:
+                geometry = json.loads(geometry)
+            except ValueError:
+                continue
+        bbox = geometry_bbox(geometry) if isinstance(geometry, dict) else None
+        if bbox:
+            annotation_tile_cache.invalidate(study_id, bbox)
+
+
+async def annotation_lod(geometries: list[dict]) -> list[dict]:
+    """geometry_lod values for a batch; large batches are simplified off the event loop"""
+    if len(geometries) < 64:
+        return build_lod_batch(geometries, settings.annotation_lod_tolerance)
+    return await asyncio.to_thread(build_lod_batch, geometries, settings.annotation_lod_tolerance)
+
+
+async def simplify_missing_lod(missing: list, downsample: float, background_tasks: BackgroundTasks):
+    """
+    Simplify annotations written before geometry_lod existed, in place, and
+    store their variants afterwards unless the annotation changed meanwhile.
+    """
+    lods = await annotation_lod([annotation["geometry"] for annotation, _ in missing])
+    for (annotation, _), lod in zip(missing, lods):
+        picked = pick_lod(lod, downsample)
+        if picked:
+            annotation["lod"] = int(picked[0])
+            annotation["geometry"] = picked[1]
+    
+    async def store():
+        pool = await get_db_pool()
+        if pool is None:
+            return
+        async with pool.acquire() as conn:
+            await conn.executemany(
+                "UPDATE annotations SET geometry_lod = $2 WHERE id = $1 AND updated_at = $3",
+                [(annotation["id"], json.dumps(lod), version) for (annotation, version), lod in zip(missing, lods)]
+            )
+        logger.info(f"🔻 Stored simplified geometries for {len(missing)} annotations")
+    
+    background_tasks.add_task(store)
+
+
 @app.get("/studies/{study_id}/annotations")
-async def get_annotations(study_id: str, user: User = Depends(require_user)):
-    """Get all annotations for a slide"""
+async def get_annotations(
+    study_id: str,
+    background_tasks: BackgroundTasks,
+    bbox: Optional[str] = None,
+    level: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, gt=0),
+    simplify: Optional[float] = Query(None, ge=1),
+    user: User = Depends(require_user)
+):
+    """
+    Get the annotations of a slide.
+    
+    ``?bbox=x0,y0,x1,y1`` returns only annotations whose bounding box
+    intersects that rectangle, given in pixels of pyramid ``level``
+    (default 0, full resolution); answered from the GiST index on
+    annotations(study_id, bbox). ``?limit=N`` caps the result and sets
+    ``truncated`` when more annotations match.
+    
+    ``?simplify=D`` (level-0 pixels per displayed pixel) returns the
+    precomputed simplified variant of dense geometries suited to that
+    downsample, marked with ``lod``; those are for display, not editing.
+    """
     # Check access
     if not user.id or not await can_access_study(user.id, study_id):
         raise HTTPException(status_code=403, detail="Access denied to this slide")
     
+    query_box = None
+    if bbox is not None:
+        try:
+            query_box = parse_bbox(bbox)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if level:
+            query_box = scale_bbox(query_box, await level_downsample(study_id, level))
+    
     pool = await get_db_pool()
     if pool is None:
         return {"annotations": [], "count": 0, "error": "Database unavailable"}
     
+    conditions = ["study_id = $1"]
+    args = [study_id]
+    if query_box is not None:
+        conditions.append("bbox && box(point($2, $3), point($4, $5))")
+        args.extend(query_box)
+    keys = lod_keys(simplify) if simplify else []
+    lod_join = ""
+    lod_columns = ""
+    if keys:
+        # Coarsest stored variant no coarser than the requested downsample
+        args.append(keys)
+        lod_join = lod_join_sql(len(args))
+        lod_columns = ", lod.lod_geometry, lod.lod, geometry_lod IS NULL AS lod_missing"
+    limit_clause = ""
+    if limit is not None:
+        args.append(limit + 1)
+        limit_clause = f"LIMIT ${len(args)}"
+    
     async with pool.acquire() as conn:
         rows = await conn.fetch(
-            """
+            f"""
             SELECT id, study_id, type, tool, geometry, properties, 
-                   created_at, updated_at
-            FROM annotations
-            WHERE study_id = $1
+                   created_at, updated_at{lod_columns}
+            FROM annotations{lod_join}
+            WHERE {" AND ".join(conditions)}
             ORDER BY created_at ASC
+            {limit_clause}
             """,
-            study_id
+            *args
         )
         
+        truncated = limit is not None and len(rows) > limit
+        if truncated:
+            rows = rows[:limit]
+        
         annotations = []
+        missing = []
         for row in rows:
             # Parse geometry if it's a string (shouldn't happen with JSONB, but safety check)
             geometry = row["geometry"]
@@ -416,7 +678,7 @@ async def get_annotations(study_id: str, user: User = Depends(require_user)):
                 logger.warning(f"Skipping annotation {row['id']} with invalid geometry")
                 continue
             
-            annotations.append({
+            annotation = {
                 "id": row["id"],
                 "study_id": row["study_id"],
                 "type": row["type"],
@@ -425,9 +687,22 @@ async def get_annotations(study_id: str, user: User = Depends(require_user)):
                 "properties": properties,
                 "created_at": row["created_at"].isoformat() if row["created_at"] else None,
                 "updated_at": row["updated_at"].isoformat() if row["updated_at"] else None
-            })
+            }
+            if keys and row["lod"] is not None:
+                lod_geometry = row["lod_geometry"]
+                annotation["geometry"] = json.loads(lod_geometry) if isinstance(lod_geometry, str) else lod_geometry
+                annotation["lod"] = int(row["lod"])
+            elif keys and row["lod_missing"]:
+                missing.append((annotation, row["updated_at"]))
+            annotations.append(annotation)
+        
+        if missing:
+            await simplify_missing_lod(missing, simplify, background_tasks)
         
-        return {"annotations": annotations, "count": len(annotations)}
+        result = {"annotations": annotations, "count": len(annotations)}
+        if limit is not None:
+            result["truncated"] = truncated
+        return result
 
 
 @app.post("/studies/{study_id}/annotations")
@@ -460,8 +735,8 @@ async def create_annotation(
         
         await conn.execute(
             """
-            INSERT INTO annotations (id, study_id, slide_id, user_id, type, tool, geometry, properties, created_at, updated_at)
-            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
+            INSERT INTO annotations (id, study_id, slide_id, user_id, type, tool, geometry, properties, created_at, updated_at, geometry_lod)
+            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11)
             """,
             annotation_id,
             study_id,
@@ -472,10 +747,12 @@ async def create_annotation(
             json.dumps(annotation.geometry.model_dump()),
             json.dumps(annotation.properties),
             now,
-            now
+            now,
+            json.dumps((await annotation_lod([annotation.geometry.model_dump()]))[0])
         )
     
     geometry_data = annotation.geometry.model_dump()
+    invalidate_annotation_tiles(study_id, geometry_data)
     logger.info(f"Created annotation {annotation_id} for slide {study_id} (user: {user_id})")
     logger.debug(f"Annotation geometry: {geometry_data}")
     
@@ -491,11 +768,32 @@ async def create_annotation(
     }
 
 
-# NOTE: Export route MUST come before {annotation_id} routes to avoid path matching issues
-@app.get("/studies/{study_id}/annotations/export")
-async def export_annotations(study_id: str, format: str = "json", user: User = Depends(require_user)):
-    """Export annotations as JSON or GeoJSON"""
-    # Check access
+ANNOTATION_COPY_COLUMNS = (
+    "id", "study_id", "slide_id", "user_id", "type", "tool", "geometry", "properties", "created_at", "updated_at",
+    "geometry_lod",
+)
+# Invalid features reported back by a bulk import
+MAX_IMPORT_ERRORS = 20
+
+
+@app.post("/studies/{study_id}/annotations:bulk")
+async def bulk_import_annotations(
+    study_id: str,
+    request: Request,
+    skip_invalid: bool = False,
+    user: User = Depends(require_user)
+):
+    """
+    Import many annotations in one request.
+    
+    The body is a GeoJSON FeatureCollection, or NDJSON (Content-Type
+    application/x-ndjson) with one Feature or annotation object per line.
+    It is parsed and validated as it streams in, and loaded with COPY in
+    batches of ANNOTATION_IMPORT_BATCH_SIZE inside one transaction: an
+    invalid feature aborts the whole import (422) unless ``skip_invalid``.
+    Areas missing a ``measurement`` property get one from the slide
+    calibration. A single ``bulk_import`` annotation event is recorded.
+    """
     if not user.id or not await can_access_study(user.id, study_id):
         raise HTTPException(status_code=403, detail="Access denied to this slide")
     
@@ -503,80 +801,237 @@ async def export_annotations(study_id: str, format: str = "json", user: User = D
     if pool is None:
         raise HTTPException(status_code=503, detail="Database unavailable")
     
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    ndjson = content_type in NDJSON_MEDIA_TYPES
+    try:
+        stored = await load_manifest(pool, study_id)
+    except Exception as e:
+        logger.warning(f"Could not load calibration for {study_id}: {e}")
+        stored = None
+    pixel_spacing = ((stored[0] if stored else {}).get("calibration") or {}).get("pixel_spacing_um") or [0.25, 0.25]
+    
+    now = datetime.utcnow()
+    imported = 0
+    invalid = 0
+    errors = []
+    extent = None
+    tools: dict[str, int] = {}
+    
     async with pool.acquire() as conn:
-        rows = await conn.fetch(
-            """
-            SELECT id, study_id, type, tool, geometry, properties, created_at, updated_at
-            FROM annotations
-            WHERE study_id = $1
-            ORDER BY created_at ASC
-            """,
-            study_id
-        )
+        slide_id = await conn.fetchval("SELECT id FROM slides WHERE orthanc_study_id = $1", study_id)
+        if slide_id is None:
+            raise HTTPException(status_code=404, detail="Slide not found")
         
-        # Parse all rows with proper JSON handling
-        parsed_annotations = []
-        for row in rows:
-            geom = row["geometry"]
-            if isinstance(geom, str):
-                try:
-                    geom = json.loads(geom)
-                except:
-                    geom = {"type": "Unknown", "coordinates": []}
-            
-            props = row["properties"] or {}
-            if isinstance(props, str):
-                try:
-                    props = json.loads(props)
-                except:
-                    props = {}
-            
-            parsed_annotations.append({
-                "id": row["id"],
-                "study_id": row["study_id"],
-                "type": row["type"],
-                "tool": row["tool"],
-                "geometry": geom,
-                "properties": props,
-                "created_at": row["created_at"].isoformat() if row["created_at"] else None,
-                "updated_at": row["updated_at"].isoformat() if row["updated_at"] else None
-            })
+        async def flush(batch: list):
+            nonlocal imported, extent
+            bboxes, areas = measure_batch(batch)
+            lods = await annotation_lod([annotation.geometry for annotation in batch])
+            records = []
+            for annotation, area, lod in zip(batch, areas, lods):
+                if area > 0 and "measurement" not in annotation.properties:
+                    annotation.properties["measurement"] = area_measurement(float(area), pixel_spacing)
+                tools[annotation.tool] = tools.get(annotation.tool, 0) + 1
+                records.append((
+                    uuid.uuid4().hex, study_id, slide_id, user.id, annotation.type, annotation.tool,
+                    json.dumps(annotation.geometry), json.dumps(annotation.properties), now, now,
+                    json.dumps(lod)
+                ))
+            await conn.copy_records_to_table("annotations", records=records, columns=ANNOTATION_COPY_COLUMNS)
+            batch_extent = (*bboxes[:, :2].min(axis=0), *bboxes[:, 2:].max(axis=0))
+            extent = batch_extent if extent is None else (
+                min(extent[0], batch_extent[0]), min(extent[1], batch_extent[1]),
+                max(extent[2], batch_extent[2]), max(extent[3], batch_extent[3]),
+            )
+            imported += len(records)
         
-        if format == "geojson":
-            # Export as GeoJSON FeatureCollection
-            features = []
-            for ann in parsed_annotations:
-                feature = {
-                    "type": "Feature",
-                    "id": ann["id"],
-                    "geometry": ann["geometry"],
-                    "properties": {
-                        **ann["properties"],
-                        "tool": ann["tool"],
-                        "annotation_type": ann["type"],
-                        "created_at": ann["created_at"]
-                    }
-                }
-                features.append(feature)
-            
-            return {
-                "type": "FeatureCollection",
-                "features": features,
-                "properties": {
-                    "study_id": study_id,
-                    "count": len(features),
-                    "exported_at": datetime.utcnow().isoformat()
+        try:
+            async with conn.transaction():
+                batch = []
+                index = 0
+                async for item in iter_features(request.stream(), ndjson):
+                    index += 1
+                    if index > settings.annotation_import_max_features:
+                        raise BulkImportError(
+                            f"More than {settings.annotation_import_max_features} annotations in one import"
+                        )
+                    try:
+                        batch.append(normalize_feature(item))
+                    except ValueError as e:
+                        invalid += 1
+                        if len(errors) < MAX_IMPORT_ERRORS:
+                            errors.append({"index": index - 1, "error": str(e)})
+                        if not skip_invalid:
+                            raise HTTPException(
+                                status_code=422,
+                                detail={"message": "Invalid annotation, nothing imported", "errors": errors}
+                            )
+                        continue
+                    if len(batch) >= settings.annotation_import_batch_size:
+                        await flush(batch)
+                        batch = []
+                if batch:
+                    await flush(batch)
+                
+                if imported:
+                    await conn.execute(
+                        """
+                        INSERT INTO annotation_events (slide_id, annotation_id, user_id, event_type, event_data)
+                        VALUES ($1, NULL, $2, 'bulk_import', $3)
+                        """,
+                        slide_id, user.id,
+                        json.dumps({"count": imported, "tools": tools, "bbox": [float(v) for v in extent]})
+                    )
+        except BulkImportError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    
+    if extent is not None:
+        annotation_tile_cache.invalidate(study_id, tuple(float(v) for v in extent))
+    logger.info(f"📥 Imported {imported} annotations into {study_id} ({invalid} invalid skipped)")
+    return {
+        "imported": imported,
+        "skipped": invalid,
+        "errors": errors,
+        "bbox": [float(v) for v in extent] if extent else None,
+    }
+
+
+@app.get("/studies/{study_id}/annotations/tiles/{level}/{x}/{y}.mvt")
+async def get_annotation_tile(
+    study_id: str,
+    level: int,
+    x: int,
+    y: int,
+    request: Request,
+    user: User = Depends(require_user)
+):
+    """
+    Annotations as a Mapbox Vector Tile on the image pyramid's tile grid.
+    
+    Tile (level, x, y) covers the same pixels as image tile (level, x, y);
+    coordinates are quantised to an extent of 4096 in one layer named
+    "annotations" (attributes id, type, tool and the scalar properties).
+    Geometries use the simplified variant for the level's downsample and
+    annotations smaller than one tile unit are left out. Tiles are cached
+    and evicted individually when an annotation inside them changes.
+    """
+    if not user.id or not await can_access_study(user.id, study_id):
+        raise HTTPException(status_code=403, detail="Access denied to this slide")
+    if level < 0:
+        raise HTTPException(status_code=400, detail="Level must be >= 0")
+    
+    grid = await pyramid_level(study_id, level)
+    if not (0 <= x < grid.tiles_x and 0 <= y < grid.tiles_y):
+        raise HTTPException(status_code=404, detail="Tile out of range")
+    span_x = grid.tile_width * grid.downsample
+    span_y = grid.tile_height * grid.downsample
+    tile_box = (x * span_x, y * span_y, (x + 1) * span_x, (y + 1) * span_y)
+    
+    content = annotation_tile_cache.get(study_id, level, x, y)
+    if content is None:
+        pool = await get_db_pool()
+        if pool is None:
+            raise HTTPException(status_code=503, detail="Database unavailable")
+        generation = annotation_tile_cache.generation(study_id)
+        clip_box = buffered_box(tile_box)
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(
+                f"""
+                SELECT id, type, tool, COALESCE(lod.lod_geometry, geometry) AS geometry, properties
+                FROM annotations{lod_join_sql(6)}
+                WHERE study_id = $1
+                  AND bbox && box(point($2, $3), point($4, $5))
+                  AND (width(bbox) + height(bbox) = 0 OR width(bbox) + height(bbox) >= $7)
+                ORDER BY created_at ASC
+                LIMIT $8
+                """,
+                study_id, *clip_box, lod_keys(grid.downsample),
+                max(span_x, span_y) / MVT_EXTENT, settings.annotation_tile_max_features
+            )
+        if len(rows) == settings.annotation_tile_max_features:
+            logger.warning(f"⚠️ Annotation tile {study_id} {level}/{x}/{y} capped at {len(rows)} features")
+        
+        def encode():
+            decoded = [
+                {
+                    "id": row["id"], "type": row["type"], "tool": row["tool"],
+                    "geometry": json.loads(row["geometry"]) if isinstance(row["geometry"], str) else row["geometry"],
+                    "properties": json.loads(row["properties"]) if isinstance(row["properties"], str) else row["properties"],
                 }
-            }
-        else:
-            # Export as PathView Pro JSON format
-            return {
-                "version": "1.0",
-                "study_id": study_id,
-                "count": len(parsed_annotations),
-                "exported_at": datetime.utcnow().isoformat(),
-                "annotations": parsed_annotations
-            }
+                for row in rows
+            ]
+            return encode_tile(decoded, tile_box)
+        
+        content = await asyncio.to_thread(encode)
+        annotation_tile_cache.set(study_id, level, x, y, clip_box, content, generation)
+    
+    etag = content_etag(content)
+    headers = {"Cache-Control": REVALIDATE_CACHE_CONTROL}
+    cached = not_modified(request, etag, headers, exists=True)
+    if cached:
+        return cached
+    return Response(content=content, media_type=MVT_MEDIA_TYPE, headers={**headers, "ETag": etag})
+
+
+# NOTE: Export route MUST come before {annotation_id} routes to avoid path matching issues
+@app.get("/studies/{study_id}/annotations/export")
+async def export_annotations(
+    study_id: str,
+    format: str = "json",
+    gzip: bool = False,
+    user: User = Depends(require_user)
+):
+    """
+    Export annotations as PathView JSON, GeoJSON, NDJSON, QuPath GeoJSON or
+    ASAP XML.
+    
+    The rows are read through a server-side cursor and written out as they
+    arrive, so memory stays flat however many annotations the slide has.
+    ``?gzip=true`` compresses the stream into a .gz download.
+    """
+    # Check access
+    if not user.id or not await can_access_study(user.id, study_id):
+        raise HTTPException(status_code=403, detail="Access denied to this slide")
+    
+    if format not in EXPORT_WRITERS:
+        raise HTTPException(status_code=400, detail=f"Format must be one of: {', '.join(EXPORT_WRITERS)}")
+    
+    pool = await get_db_pool()
+    if pool is None:
+        raise HTTPException(status_code=503, detail="Database unavailable")
+    
+    writer = EXPORT_WRITERS[format](study_id, datetime.utcnow().isoformat())
+    
+    async def annotations():
+        # The connection is held for the whole download; the cursor needs a transaction
+        async with pool.acquire() as conn:
+            async with conn.transaction(readonly=True):
+                cursor = conn.cursor(
+                    """
+                    SELECT id, study_id, type, tool, geometry, properties, created_at, updated_at
+                    FROM annotations
+                    WHERE study_id = $1
+                    ORDER BY created_at ASC
+                    """,
+                    study_id,
+                    prefetch=settings.annotation_export_prefetch
+                )
+                async for row in cursor:
+                    yield annotation_from_row(row, raw_geometry=writer.raw_geometry)
+        logger.info(f"📤 Exported {writer.count} annotations of {study_id} as {format}")
+    
+    filename = f"annotations_{study_id[:8]}.{writer.extension}"
+    media_type = writer.media_type
+    if gzip:
+        filename += ".gz"
+        media_type = "application/gzip"
+    return StreamingResponse(
+        export_stream(annotations(), writer, gzip=gzip),
+        media_type=media_type,
+        headers={
+            "Cache-Control": "private, no-store",
+            "Content-Disposition": f'attachment; filename="{filename}"',
+        }
+    )
 
 
 @app.get("/studies/{study_id}/annotations/{annotation_id}")
@@ -637,8 +1092,9 @@ async def update_annotation(study_id: str, annotation_id: str, update: Annotatio
         if not existing:
             raise HTTPException(status_code=404, detail="Annotation not found")
         
-        # Build update
+        # Build update (simplified variants follow a new geometry)
         new_geometry = json.dumps(update.geometry.model_dump()) if update.geometry else existing["geometry"]
+        new_lod = json.dumps((await annotation_lod([update.geometry.model_dump()]))[0]) if update.geometry else None
         new_properties = existing["properties"] or {}
         if update.properties:
             if isinstance(new_properties, str):
@@ -650,16 +1106,18 @@ async def update_annotation(study_id: str, annotation_id: str, update: Annotatio
         await conn.execute(
             """
             UPDATE annotations 
-            SET geometry = $1, properties = $2, updated_at = $3
+            SET geometry = $1, properties = $2, updated_at = $3, geometry_lod = COALESCE($6, geometry_lod)
             WHERE id = $4 AND study_id = $5
             """,
             new_geometry if isinstance(new_geometry, str) else json.dumps(new_geometry),
             json.dumps(new_properties),
             now,
             annotation_id,
-            study_id
+            study_id,
+            new_lod
         )
         
+        invalidate_annotation_tiles(study_id, existing["geometry"], new_geometry)
         logger.info(f"Updated annotation {annotation_id}")
         
         # Fetch and return updated annotation
@@ -678,16 +1136,17 @@ async def delete_annotation(study_id: str, annotation_id: str, user: User = Depe
         raise HTTPException(status_code=503, detail="Database unavailable")
     
     async with pool.acquire() as conn:
-        result = await conn.execute(
-            "DELETE FROM annotations WHERE id = $1 AND study_id = $2",
+        deleted = await conn.fetchrow(
+            "DELETE FROM annotations WHERE id = $1 AND study_id = $2 RETURNING geometry",
             annotation_id,
             study_id
         )
         
         # Check if deletion happened
-        if "DELETE 0" in result:
+        if deleted is None:
             raise HTTPException(status_code=404, detail="Annotation not found")
         
+        invalidate_annotation_tiles(study_id, deleted["geometry"])
         logger.info(f"Deleted annotation {annotation_id}")
         return {"message": "Annotation deleted"}
 
@@ -711,140 +1170,24 @@ async def clear_annotations(study_id: str, user: User = Depends(require_user)):
         
         # Extract count from result like "DELETE 5"
         count = int(result.split()[-1]) if result else 0
+        annotation_tile_cache.invalidate(study_id)
         logger.info(f"Cleared {count} annotations for slide {study_id}")
         return {"message": f"Deleted {count} annotations", "count": count}
 
 
 @app.get("/studies/{study_id}/calibration")
 async def get_calibration(study_id: str, user: User = Depends(require_user)):
-    """Get pixel spacing calibration for measurements"""
+    """Get pixel spacing calibration for measurements (from the slide manifest)"""
     # Check access
     if not user.id or not await can_access_study(user.id, study_id):
         raise HTTPException(status_code=403, detail="Access denied to this slide")
     
-    try:
-        async with httpx.AsyncClient() as client:
-            # Get study info
-            response = await client.get(
-                f"{settings.orthanc_url}/studies/{study_id}",
-                auth=(settings.orthanc_username, settings.orthanc_password),
-                timeout=30.0
-            )
-            
-            if response.status_code != 200:
-                raise HTTPException(status_code=404, detail="Study not found")
-            
-            study_data = response.json()
-            series_ids = study_data.get("Series", [])
-            
-            if not series_ids:
-                raise HTTPException(status_code=404, detail="No series found")
-            
-            # Get first series
-            series_response = await client.get(
-                f"{settings.orthanc_url}/series/{series_ids[0]}",
-                auth=(settings.orthanc_username, settings.orthanc_password),
-                timeout=30.0
-            )
-            
-            series_data = series_response.json()
-            instance_ids = series_data.get("Instances", [])
-            
-            if not instance_ids:
-                raise HTTPException(status_code=404, detail="No instances found")
-            
-            # Get instance metadata
-            meta_response = await client.get(
-                f"{settings.orthanc_url}/instances/{instance_ids[0]}/tags",
-                auth=(settings.orthanc_username, settings.orthanc_password),
-                timeout=30.0
-            )
-            
-            tags = meta_response.json()
-            
-            # Extract pixel spacing
-            # Try different DICOM tags that may contain spacing info
-            pixel_spacing = None
-            
-            # Standard PixelSpacing (0028,0030)
-            if "0028,0030" in tags:
-                ps = tags["0028,0030"].get("Value", [])
-                if ps:
-                    try:
-                        # Validate values are actual numbers, not just "." or empty
-                        ps0 = str(ps[0]).strip()
-                        ps1 = str(ps[1]).strip() if len(ps) > 1 else ps0
-                        if ps0 and ps0 != "." and ps1 and ps1 != ".":
-                            pixel_spacing = [float(ps0), float(ps1)]
-                    except (ValueError, IndexError) as e:
-                        logger.warning(f"Invalid PixelSpacing value: {ps}, skipping")
-            
-            # SharedFunctionalGroupsSequence for WSI
-            if not pixel_spacing and "5200,9229" in tags:
-                sfgs = tags["5200,9229"].get("Value", [{}])
-                if sfgs and isinstance(sfgs[0], dict):
-                    # PixelMeasuresSequence
-                    pms = sfgs[0].get("0028,9110", {}).get("Value", [{}])
-                    if pms and "0028,0030" in pms[0]:
-                        ps = pms[0]["0028,0030"].get("Value", [])
-                        if ps:
-                            try:
-                                ps0 = str(ps[0]).strip()
-                                ps1 = str(ps[1]).strip() if len(ps) > 1 else ps0
-                                if ps0 and ps0 != "." and ps1 and ps1 != ".":
-                                    pixel_spacing = [float(ps0), float(ps1)]
-                            except (ValueError, IndexError) as e:
-                                logger.warning(f"Invalid PixelSpacing in SFGS: {ps}, skipping")
-            
-            # ImagedVolumeWidth/Height for WSI (in mm)
-            imaged_volume_width = None
-            imaged_volume_height = None
-            total_pixel_cols = None
-            total_pixel_rows = None
-            
-            if "0048,0001" in tags:  # ImagedVolumeWidth
-                imaged_volume_width = float(tags["0048,0001"].get("Value", [0])[0])
-            if "0048,0002" in tags:  # ImagedVolumeHeight
-                imaged_volume_height = float(tags["0048,0002"].get("Value", [0])[0])
-            if "0048,0006" in tags:  # TotalPixelMatrixColumns
-                total_pixel_cols = int(tags["0048,0006"].get("Value", [0])[0])
-            if "0048,0007" in tags:  # TotalPixelMatrixRows
-                total_pixel_rows = int(tags["0048,0007"].get("Value", [0])[0])
-            
-            # Calculate pixel spacing from volume dimensions
-            if not pixel_spacing and imaged_volume_width and total_pixel_cols:
-                spacing_x = imaged_volume_width / total_pixel_cols * 1000  # Convert mm to µm
-                spacing_y = spacing_x
-                if imaged_volume_height and total_pixel_rows:
-                    spacing_y = imaged_volume_height / total_pixel_rows * 1000
-                pixel_spacing = [spacing_x, spacing_y]
-            
-            # Default fallback (common 40x objective ~0.25µm/pixel)
-            if not pixel_spacing:
-                pixel_spacing = [0.25, 0.25]
-                logger.warning(f"No pixel spacing found for {study_id}, using default 0.25 µm/pixel")
-            
-            return {
-                "study_id": study_id,
-                "pixel_spacing_um": pixel_spacing,  # µm per pixel [x, y]
-                "unit": "µm",
-                "source": "dicom" if pixel_spacing != [0.25, 0.25] else "default",
-                "total_pixel_matrix": [total_pixel_cols, total_pixel_rows] if total_pixel_cols else None,
-                "imaged_volume_mm": [imaged_volume_width, imaged_volume_height] if imaged_volume_width else None
-            }
-            
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"Error getting calibration for {study_id}: {e}")
-        # Return default calibration
-        return {
-            "study_id": study_id,
-            "pixel_spacing_um": [0.25, 0.25],
-            "unit": "µm",
-            "source": "default",
-            "error": str(e)
-        }
+    manifest, _ = await require_study_manifest(study_id)
+    calibration = manifest.get("calibration")
+    if calibration is None:
+        raise HTTPException(status_code=404, detail="No instances found")
+    
+    return {"study_id": study_id, **calibration}
 
 
 # =============================================================================
@@ -860,93 +1203,18 @@ async def health_check():
 async def get_leica_pyramid_info(study_id: str, user: User = Depends(require_user)):
     """
     Check if a study contains Leica-style separate resolution files
-    and return virtual pyramid information
+    and return virtual pyramid information (from the slide manifest)
     """
     # Check access
     if not user.id or not await can_access_study(user.id, study_id):
         raise HTTPException(status_code=403, detail="Access denied to this slide")
     
-    try:
-        # Query Orthanc for study info
-        async with httpx.AsyncClient() as client:
-            auth = httpx.BasicAuth("admin", "orthanc")
-            
-            # Get all series in the study
-            study_response = await client.get(
-                f"{settings.orthanc_url}/studies/{study_id}",
-                auth=auth
-            )
-            study_response.raise_for_status()
-            study_data = study_response.json()
-            
-            # Collect all instances across all series
-            all_instances = []
-            for series_id in study_data['Series']:
-                series_response = await client.get(
-                    f"{settings.orthanc_url}/series/{series_id}/instances",
-                    auth=auth
-                )
-                series_response.raise_for_status()
-                instances = series_response.json()
-                
-                for instance in instances:
-                    # Get instance tags
-                    tags_response = await client.get(
-                        f"{settings.orthanc_url}/instances/{instance['ID']}/simplified-tags",
-                        auth=auth
-                    )
-                    tags_response.raise_for_status()
-                    tags = tags_response.json()
-                    
-                    # Check if it's a WSI file (SM modality)
-                    if tags.get('Modality') == 'SM':
-                        all_instances.append({
-                            'id': instance['ID'],
-                            'width': int(tags.get('Columns', 0)),
-                            'height': int(tags.get('Rows', 0)),
-                            'series_id': series_id
-                        })
-            
-            # Sort by resolution (largest first)
-            all_instances.sort(key=lambda x: x['width'] * x['height'], reverse=True)
-            
-            if len(all_instances) >= 2:  # Need at least 2 levels for a pyramid
-                # Build virtual pyramid structure
-                base_width = all_instances[0]['width']
-                base_height = all_instances[0]['height']
-                
-                resolutions = []
-                sizes = []
-                instance_ids = []
-                
-                for inst in all_instances:
-                    downsample = base_width / inst['width']
-                    resolutions.append(downsample)
-                    sizes.append([inst['width'], inst['height']])
-                    instance_ids.append(inst['id'])
-                
-                pyramid_info = {
-                    'ID': study_id,
-                    'TotalWidth': base_width,
-                    'TotalHeight': base_height,
-                    'Resolutions': resolutions,
-                    'Sizes': sizes,
-                    'TilesSizes': [[256, 256]] * len(resolutions),
-                    'TilesCount': [[int((w + 255) / 256), int((h + 255) / 256)] for w, h in sizes],
-                    'BackgroundColor': '#ffffff',
-                    'InstanceIDs': instance_ids,
-                    'IsVirtualPyramid': True,
-                    'Type': 'LeicaMultiFile'
-                }
-                
-                logger.info(f"Created virtual Leica pyramid with {len(resolutions)} levels")
-                return pyramid_info
-            
-        return {"error": "Not a Leica multi-file pyramid"}
-        
-    except Exception as e:
-        logger.error(f"Error checking Leica pyramid: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+    manifest, _ = await require_study_manifest(study_id)
+    pyramid_info = manifest.get("leicaPyramid")
+    if pyramid_info:
+        return pyramid_info
+    
+    return {"error": "Not a Leica multi-file pyramid"}
 
 @app.post("/aggregate-leica")
 async def aggregate_leica_studies():
@@ -955,7 +1223,7 @@ async def aggregate_leica_studies():
         from leica_aggregator import aggregate_all_leica_studies
         
         # Run aggregation in background
-        asyncio.create_task(aggregate_all_leica_studies())
+        asyncio.create_task(aggregate_all_leica_studies(orthanc_client, orthanc_index))
         
         return {"status": "Leica aggregation started in background"}
         
@@ -971,15 +1239,10 @@ async def service_status():
     orthanc_version = None
     
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{settings.orthanc_url}/system",
-                auth=(settings.orthanc_username, settings.orthanc_password),
-                timeout=5.0
-            )
-            if response.status_code == 200:
-                orthanc_status = "connected"
-                orthanc_version = response.json().get("Version")
+        response = await orthanc_client.get("/system")
+        if response.status_code == 200:
+            orthanc_status = "connected"
+            orthanc_version = response.json().get("Version")
     except Exception as e:
         orthanc_status = f"error: {str(e)}"
     
@@ -989,25 +1252,55 @@ async def service_status():
         "orthanc": {
             "url": settings.orthanc_url,
             "status": orthanc_status,
-            "version": orthanc_version
+            "version": orthanc_version,
+            "pool": orthanc_client.get_metrics()
         },
+        "tile_cache": tile_cache.get_stats(),
+        "annotation_tiles": annotation_tile_cache.get_stats(),
+        "frame_server": frame_server.get_stats(),
+        "prefetch": tile_prefetcher.get_stats(),
+        "tile_transcoding": tile_transcoder.get_stats(),
+        "icc_correction": icc_corrector.get_stats(),
+        "conversion_pool": conversion_executor.get_stats(),
+        "conversion_queue": job_queue.get_stats(),
+        "orthanc_index": orthanc_index.get_stats(),
         "active_jobs": len([j for j in conversion_jobs.values() if j.status == "processing"]),
         "total_jobs": len(conversion_jobs)
     }
 
 
+class TileTranscodingUpdate(BaseModel):
+    policy: str
+    default_quality: Optional[int] = None
+
+
+@app.get("/admin/tile-transcoding")
+async def get_tile_transcoding(user: User = Depends(require_admin)):
+    """Current tile transcoding policy and encoder statistics"""
+    return tile_transcoder.get_stats()
+
+
+@app.put("/admin/tile-transcoding")
+async def update_tile_transcoding(update: TileTranscodingUpdate, user: User = Depends(require_admin)):
+    """
+    Switch the bandwidth-vs-CPU policy at runtime (this process only;
+    set TILE_TRANSCODE_POLICY to make it permanent).
+    """
+    if update.policy not in TRANSCODE_POLICIES:
+        raise HTTPException(status_code=400, detail=f"Policy must be one of: {', '.join(TRANSCODE_POLICIES)}")
+    if update.default_quality is not None and not 1 <= update.default_quality <= 100:
+        raise HTTPException(status_code=400, detail="default_quality must be between 1 and 100")
+    tile_transcoder.set_policy(update.policy, update.default_quality)
+    return tile_transcoder.get_stats()
+
+
 @app.get("/system")
 async def get_orthanc_system():
     """Proxy Orthanc system info - used by viewer for health check"""
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{settings.orthanc_url}/system",
-                auth=(settings.orthanc_username, settings.orthanc_password),
-                timeout=10.0
-            )
-            response.raise_for_status()
-            return response.json()
+        response = await orthanc_client.get("/system")
+        response.raise_for_status()
+        return response.json()
     except httpx.HTTPError as e:
         raise HTTPException(status_code=502, detail=f"Orthanc error: {str(e)}")
 
@@ -1034,55 +1327,56 @@ async def upload_dicom_instance(
         )
 
         # Stream request body directly to Orthanc to avoid loading large instances into RAM.
-        upload_timeout = httpx.Timeout(1800.0, connect=30.0)
-        async with httpx.AsyncClient(timeout=upload_timeout) as client:
-            response = await client.post(
-                f"{settings.orthanc_url}/instances",
-                content=request.stream(),
-                headers={"Content-Type": content_type},
-                auth=(settings.orthanc_username, settings.orthanc_password)
-            )
-            
-            if response.status_code in [200, 201]:
-                result = response.json()
-                
-                # Set study ownership if user is authenticated
-                if current_user and current_user.id and isinstance(result, dict):
-                    study_id = result.get("ParentStudy")
-                    if study_id:
-                        try:
-                            # Check if study already has an owner
-                            existing_owner = await get_study_owner(study_id)
-                            
-                            if existing_owner is None:
-                                # Unowned study - claim it
-                                success = await set_study_owner(study_id, current_user.id)
-                                if success:
-                                    logger.info(f"✅ DICOM upload: Claimed ownership of study {study_id} for user {current_user.id} ({current_user.email})")
-                                else:
-                                    logger.warning(f"⚠️ DICOM upload: Failed to claim study {study_id}")
-                            elif existing_owner == current_user.id:
-                                # Already owned by this user
-                                logger.debug(f"📤 DICOM upload: Study {study_id} already owned by current user")
+        response = await orthanc_client.post(
+            "/instances",
+            content=request.stream(),
+            headers={"Content-Type": content_type},
+        )
+        
+        if response.status_code in [200, 201]:
+            result = response.json()
+            if isinstance(result, dict) and result.get("ParentStudy"):
+                await orthanc_index.mark_changed(result["ParentStudy"])
+                invalidate_wsi_metadata(result["ParentStudy"])
+                schedule_manifest_refresh(orthanc_client, get_db_pool, result["ParentStudy"])
+            
+            # Set study ownership if user is authenticated
+            if current_user and current_user.id and isinstance(result, dict):
+                study_id = result.get("ParentStudy")
+                if study_id:
+                    try:
+                        # Check if study already has an owner
+                        existing_owner = await get_study_owner(study_id)
+                        
+                        if existing_owner is None:
+                            # Unowned study - claim it
+                            success = await set_study_owner(study_id, current_user.id)
+                            if success:
+                                logger.info(f"✅ DICOM upload: Claimed ownership of study {study_id} for user {current_user.id} ({current_user.email})")
                             else:
-                                # Owned by someone else - just add to their collection
-                                logger.info(f"📤 DICOM upload: Study {study_id} owned by user {existing_owner}, not changing ownership")
-                        except Exception as e:
-                            logger.warning(f"❌ Failed to set DICOM study owner: {e}")
-                    else:
-                        logger.warning(f"⚠️ DICOM upload: No ParentStudy in response: {result}")
+                                logger.warning(f"⚠️ DICOM upload: Failed to claim study {study_id}")
+                        elif existing_owner == current_user.id:
+                            # Already owned by this user
+                            logger.debug(f"📤 DICOM upload: Study {study_id} already owned by current user")
+                        else:
+                            # Owned by someone else - just add to their collection
+                            logger.info(f"📤 DICOM upload: Study {study_id} owned by user {existing_owner}, not changing ownership")
+                    except Exception as e:
+                        logger.warning(f"❌ Failed to set DICOM study owner: {e}")
                 else:
-                    if not current_user:
-                        logger.info("📤 DICOM upload: Anonymous upload (no auth token) - study will be unowned")
-                    elif not current_user.id:
-                        logger.warning(f"📤 DICOM upload: User {current_user.email} has no DB ID - cannot set ownership")
-                
-                return result
+                    logger.warning(f"⚠️ DICOM upload: No ParentStudy in response: {result}")
             else:
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail=f"Orthanc error: {response.text}"
-                )
+                if not current_user:
+                    logger.info("📤 DICOM upload: Anonymous upload (no auth token) - study will be unowned")
+                elif not current_user.id:
+                    logger.warning(f"📤 DICOM upload: User {current_user.email} has no DB ID - cannot set ownership")
+            
+            return result
+        else:
+            raise HTTPException(
+                status_code=response.status_code,
+                detail=f"Orthanc error: {response.text}"
+            )
     except httpx.TimeoutException:
         raise HTTPException(status_code=504, detail="Upload timed out")
     except Exception as e:
@@ -1099,22 +1393,25 @@ async def upload_dicom(file: UploadFile = File(...)):
     try:
         content = await file.read()
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{settings.orthanc_url}/instances",
-                content=content,
-                headers={"Content-Type": "application/dicom"},
-                auth=(settings.orthanc_username, settings.orthanc_password),
-                timeout=300.0  # 5 minute timeout for large files
+        response = await orthanc_client.post(
+            "/instances",
+            content=content,
+            headers={"Content-Type": "application/dicom"},
+            timeout=300.0  # 5 minute timeout for large files
+        )
+        
+        if response.status_code == 200:
+            result = response.json()
+            if isinstance(result, dict) and result.get("ParentStudy"):
+                await orthanc_index.mark_changed(result["ParentStudy"])
+                invalidate_wsi_metadata(result["ParentStudy"])
+                schedule_manifest_refresh(orthanc_client, get_db_pool, result["ParentStudy"])
+            return result
+        else:
+            raise HTTPException(
+                status_code=response.status_code,
+                detail=f"Orthanc error: {response.text}"
             )
-            
-            if response.status_code == 200:
-                return response.json()
-            else:
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail=f"Orthanc error: {response.text}"
-                )
     except httpx.TimeoutException:
         raise HTTPException(status_code=504, detail="Upload timed out")
     except Exception as e:
@@ -1125,20 +1422,15 @@ async def upload_dicom(file: UploadFile = File(...)):
 async def get_series(series_id: str, user: User = Depends(require_user)):
     """Get series details from Orthanc"""
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{settings.orthanc_url}/series/{series_id}",
-                auth=(settings.orthanc_username, settings.orthanc_password),
-                timeout=10.0
-            )
-            if response.status_code == 200:
-                series_data = response.json()
-                # Check access via the parent study
-                study_id = series_data.get("ParentStudy")
-                if study_id and user.id and not await can_access_study(user.id, study_id):
-                    raise HTTPException(status_code=403, detail="Access denied to this slide")
-                return series_data
-            raise HTTPException(status_code=response.status_code, detail="Series not found")
+        response = await orthanc_client.get(f"/series/{series_id}")
+        if response.status_code == 200:
+            series_data = response.json()
+            # Check access via the parent study
+            study_id = series_data.get("ParentStudy")
+            if study_id and user.id and not await can_access_study(user.id, study_id):
+                raise HTTPException(status_code=403, detail="Access denied to this slide")
+            return series_data
+        raise HTTPException(status_code=response.status_code, detail="Series not found")
     except HTTPException:
         raise
     except Exception as e:
@@ -1149,516 +1441,78 @@ async def get_series(series_id: str, user: User = Depends(require_user)):
 async def get_instance_tags(instance_id: str, user: User = Depends(require_user)):
     """Get simplified DICOM tags for an instance"""
     try:
-        async with httpx.AsyncClient() as client:
-            # First get instance to find parent study
-            instance_response = await client.get(
-                f"{settings.orthanc_url}/instances/{instance_id}",
-                auth=(settings.orthanc_username, settings.orthanc_password),
-                timeout=10.0
-            )
-            if instance_response.status_code == 200:
-                instance_data = instance_response.json()
-                parent_study = instance_data.get("ParentStudy")
-                if parent_study and user.id and not await can_access_study(user.id, parent_study):
-                    raise HTTPException(status_code=403, detail="Access denied to this slide")
-            
-            response = await client.get(
-                f"{settings.orthanc_url}/instances/{instance_id}/simplified-tags",
-                auth=(settings.orthanc_username, settings.orthanc_password),
-                timeout=10.0
-            )
-            if response.status_code == 200:
-                return response.json()
-            raise HTTPException(status_code=response.status_code, detail="Instance not found")
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-
-
-@app.get("/instances/{instance_id}")
-async def get_instance_info(instance_id: str, user: User = Depends(require_user)):
-    """Get Orthanc instance info for an instance (used by upload fallback logic)."""
-    try:
-        async with httpx.AsyncClient() as client:
-            instance_response = await client.get(
-                f"{settings.orthanc_url}/instances/{instance_id}",
-                auth=(settings.orthanc_username, settings.orthanc_password),
-                timeout=10.0
-            )
-            if instance_response.status_code != 200:
-                raise HTTPException(status_code=instance_response.status_code, detail="Instance not found")
-
+        # First get instance to find parent study
+        instance_response = await orthanc_client.get(f"/instances/{instance_id}")
+        if instance_response.status_code == 200:
             instance_data = instance_response.json()
             parent_study = instance_data.get("ParentStudy")
             if parent_study and user.id and not await can_access_study(user.id, parent_study):
-                raise HTTPException(status_code=403, detail="Access denied to this slide")
-
-            return instance_data
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-
-
-# =============================================================================
-# File Upload & Conversion
-# =============================================================================
-
-def detect_format(filename: str) -> str:
-    """Detect WSI format from filename"""
-    ext = Path(filename).suffix.lower()
-    format_map = {
-        ".ndpi": "hamamatsu",
-        ".svs": "aperio",
-        ".tif": "generic_tiff",
-        ".tiff": "generic_tiff",
-        ".dcx": "generic_tiff",  # DCX multiresolution TIFF
-        ".isyntax": "philips",
-        ".mrxs": "mirax",
-        ".scn": "leica",
-        ".bif": "ventana",
-        ".vsi": "olympus",
-        ".dcm": "dicom",
-        ".zip": "zip_archive",  # Multi-file format in ZIP
-    }
-    return format_map.get(ext, "unknown")
-
-
-def find_wsi_index_file(folder: Path) -> Optional[Path]:
-    """
-    Find the main WSI index file in a folder (for multi-file formats).
-    Returns the path to the main file, or None if not found.
-    """
-    # Priority order for index files
-    index_patterns = [
-        "**/*.mrxs",   # 3DHISTECH MIRAX
-        "**/*.vms",    # Hamamatsu VMS
-        "**/*.vmu",    # Hamamatsu VMU
-        "**/*.ets",    # Hamamatsu ETS (multi-file)
-        "**/*.svslide",  # Aperio multi-file
-    ]
-    
-    for pattern in index_patterns:
-        matches = list(folder.glob(pattern))
-        if matches:
-            # Return the first match (should only be one)
-            logger.info(f"Found WSI index file: {matches[0]}")
-            return matches[0]
-    
-    return None
-
-
-def get_multifile_format(index_file: Path) -> str:
-    """Get the format name for a multi-file WSI index file"""
-    ext = index_file.suffix.lower()
-    format_map = {
-        ".mrxs": "mirax",
-        ".vms": "hamamatsu_vms",
-        ".vmu": "hamamatsu_vmu",
-        ".ets": "hamamatsu_ets",
-        ".svslide": "aperio_multifile",
-    }
-    return format_map.get(ext, "unknown")
-
-
-# Mapping of formats to manufacturer info
-FORMAT_METADATA = {
-    "hamamatsu": {
-        "manufacturer": "Hamamatsu Photonics",
-        "model": "NanoZoomer",
-        "format_name": "NDPI",
-    },
-    "hamamatsu_vms": {
-        "manufacturer": "Hamamatsu Photonics",
-        "model": "NanoZoomer VMS",
-        "format_name": "VMS",
-    },
-    "hamamatsu_vmu": {
-        "manufacturer": "Hamamatsu Photonics",
-        "model": "NanoZoomer VMU",
-        "format_name": "VMU",
-    },
-    "hamamatsu_ets": {
-        "manufacturer": "Hamamatsu Photonics",
-        "model": "NanoZoomer ETS",
-        "format_name": "ETS",
-    },
-    "aperio": {
-        "manufacturer": "Leica Biosystems (Aperio)",
-        "model": "Aperio Scanner",
-        "format_name": "SVS",
-    },
-    "aperio_multifile": {
-        "manufacturer": "Leica Biosystems (Aperio)",
-        "model": "Aperio Scanner",
-        "format_name": "SVSlide",
-    },
-    "philips": {
-        "manufacturer": "Philips",
-        "model": "IntelliSite Ultra Fast Scanner",
-        "format_name": "iSyntax",
-    },
-    "leica": {
-        "manufacturer": "Leica Biosystems",
-        "model": "Leica Scanner",
-        "format_name": "SCN",
-    },
-    "ventana": {
-        "manufacturer": "Roche (Ventana)",
-        "model": "Ventana Scanner",
-        "format_name": "BIF",
-    },
-    "mirax": {
-        "manufacturer": "3DHISTECH",
-        "model": "Pannoramic Scanner",
-        "format_name": "MRXS",
-    },
-    "olympus": {
-        "manufacturer": "Olympus",
-        "model": "VS Series",
-        "format_name": "VSI",
-    },
-    "generic_tiff": {
-        "manufacturer": "Unknown",
-        "model": "Unknown",
-        "format_name": "TIFF",
-    },
-    "zip_archive": {
-        "manufacturer": "Unknown",
-        "model": "Unknown",
-        "format_name": "ZIP (multi-file)",
-    },
-}
+                raise HTTPException(status_code=403, detail="Access denied to this slide")
+        
+        response = await orthanc_client.get(f"/instances/{instance_id}/simplified-tags")
+        if response.status_code == 200:
+            return response.json()
+        raise HTTPException(status_code=response.status_code, detail="Instance not found")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
 
-def get_format_metadata(source_format: str) -> dict:
-    """Get manufacturer metadata for a format"""
-    return FORMAT_METADATA.get(source_format, {
-        "manufacturer": "Unknown",
-        "model": "Unknown", 
-        "format_name": source_format.upper(),
-    })
+@app.get("/instances/{instance_id}")
+async def get_instance_info(instance_id: str, user: User = Depends(require_user)):
+    """Get Orthanc instance info for an instance (used by upload fallback logic)."""
+    try:
+        instance_response = await orthanc_client.get(f"/instances/{instance_id}")
+        if instance_response.status_code != 200:
+            raise HTTPException(status_code=instance_response.status_code, detail="Instance not found")
 
+        instance_data = instance_response.json()
+        parent_study = instance_data.get("ParentStudy")
+        if parent_study and user.id and not await can_access_study(user.id, parent_study):
+            raise HTTPException(status_code=403, detail="Access denied to this slide")
 
-async def convert_isyntax_to_dicom(job_id: str, file_path: Path, output_dir: Path):
-    """
-    Convert Philips iSyntax file to DICOM using pyisyntax.
-    Note: wsidicomizer does not support iSyntax directly, so we use pyisyntax
-    to create a simple DICOM representation at a reduced resolution level.
-    """
-    job = conversion_jobs[job_id]
-    
-    try:
-        from isyntax import ISyntax
-        import numpy as np
-        import pydicom
-        from pydicom.uid import generate_uid
-        import datetime
-        
-        job.message = "Opening iSyntax file..."
-        job.progress = 15
-        
-        with ISyntax.open(str(file_path)) as isyntax:
-            # Get image dimensions
-            width, height = isyntax.dimensions
-            num_levels = isyntax.level_count
-            
-            job.message = f"iSyntax: {width}x{height}, {num_levels} levels"
-            job.progress = 25
-            
-            # Use a mid-resolution level for reasonable file size and quality
-            level = min(3, num_levels - 1)  # Use level 3 or lowest available
-            
-            level_obj = isyntax.wsi.get_level(level)
-            level_width = level_obj.width
-            level_height = level_obj.height
-            
-            job.message = f"Reading level {level} ({level_width}x{level_height})..."
-            job.progress = 35
-            
-            # Read the whole image at this resolution
-            pixels = isyntax.read_region(0, 0, level_width, level_height, level=level)
-            
-            job.message = "Creating DICOM..."
-            job.progress = 50
-            
-            # Create DICOM dataset
-            ds = pydicom.Dataset()
-            ds.SOPClassUID = '1.2.840.10008.5.1.4.1.1.77.1.6'  # VL Whole Slide Microscopy
-            ds.SOPInstanceUID = generate_uid()
-            ds.StudyInstanceUID = generate_uid()
-            ds.SeriesInstanceUID = generate_uid()
-            ds.PatientName = file_path.stem
-            ds.PatientID = 'ISYNTAX-CONVERT'
-            ds.StudyDate = datetime.datetime.now().strftime('%Y%m%d')
-            ds.StudyTime = datetime.datetime.now().strftime('%H%M%S')
-            ds.StudyDescription = f"Philips iSyntax (level {level} of {num_levels})"
-            ds.SeriesDescription = f"Converted from iSyntax"
-            ds.Modality = 'SM'
-            ds.Manufacturer = 'Philips (converted via pyisyntax)'
-            ds.ImageType = ['ORIGINAL', 'PRIMARY', 'VOLUME']
-            ds.SamplesPerPixel = 3
-            ds.PhotometricInterpretation = 'RGB'
-            ds.Rows = pixels.shape[0]
-            ds.Columns = pixels.shape[1]
-            ds.BitsAllocated = 8
-            ds.BitsStored = 8
-            ds.HighBit = 7
-            ds.PixelRepresentation = 0
-            ds.PlanarConfiguration = 0
-            
-            # Handle RGBA -> RGB if needed
-            if pixels.shape[2] == 4:
-                pixel_data = pixels[:, :, :3].tobytes()
-            else:
-                pixel_data = pixels.tobytes()
-            ds.PixelData = pixel_data
-            
-            ds.file_meta = pydicom.Dataset()
-            ds.file_meta.MediaStorageSOPClassUID = ds.SOPClassUID
-            ds.file_meta.MediaStorageSOPInstanceUID = ds.SOPInstanceUID
-            ds.file_meta.TransferSyntaxUID = pydicom.uid.ExplicitVRLittleEndian
-            
-            output_file = output_dir / f"{file_path.stem}_level{level}.dcm"
-            ds.save_as(str(output_file))
-            
-            job.message = f"iSyntax conversion complete ({level_width}x{level_height})"
-            job.progress = 70
-            
-            return [output_file]
-            
-    except ImportError as e:
-        raise Exception(f"pyisyntax not available: {e}")
+        return instance_data
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
 
-async def convert_wsi_to_dicom(job_id: str, file_path: Path):
+# =============================================================================
+# File Upload & Conversion
+# =============================================================================
+
+async def convert_wsi_to_dicom(job: ConversionJob) -> Optional[str]:
     """
     Convert WSI file to DICOM and upload to Orthanc
     
     This is the main conversion pipeline using wsidicomizer
     Supports both single-file formats (SVS, NDPI, etc.) and 
     multi-file formats via ZIP archives (MIRAX, VMS, etc.)
-    """
-    import zipfile
     
-    job = conversion_jobs[job_id]
-    job.status = "processing"
-    job.message = "Starting conversion..."
+    Extraction, pre-processing and pyramid generation run in the
+    conversion pool (see conversion_worker.py); upload stays on the loop.
+    Runs as the job queue's runner: returns the Orthanc study ID, raises on
+    failure (the queue decides between retry and giving up).
+    """
+    job_id = job.job_id
+    file_path = Path(job.file_path)
+    job.message = "Waiting for a conversion worker..."
     
     output_dir = Path(settings.watch_folder) / "processing" / job_id
     output_dir.mkdir(parents=True, exist_ok=True)
     
-    # Track extracted folder for cleanup
-    extracted_dir = None
-    actual_file_path = file_path
-    original_filename = file_path.name
+    # Where ZIP archives (multi-file formats) are extracted; removed afterwards
+    extracted_dir = Path(settings.watch_folder) / "processing" / f"{job_id}_extracted"
     
     try:
-        # Detect format first
-        source_format = detect_format(file_path.name)
-        job.message = f"Detected format: {source_format}"
-        job.progress = 10
-        
-        # Handle ZIP archives (multi-file formats like MIRAX)
-        if source_format == "zip_archive":
-            job.message = "Extracting ZIP archive..."
-            job.progress = 15
-            
-            extracted_dir = Path(settings.watch_folder) / "processing" / f"{job_id}_extracted"
-            extracted_dir.mkdir(parents=True, exist_ok=True)
-            
-            try:
-                with zipfile.ZipFile(file_path, 'r') as zip_ref:
-                    zip_ref.extractall(extracted_dir)
-                logger.info(f"Extracted ZIP to {extracted_dir}")
-                
-                # List extracted contents for debugging
-                extracted_files = list(extracted_dir.rglob("*"))
-                logger.info(f"Extracted {len(extracted_files)} files/folders")
-                
-            except zipfile.BadZipFile:
-                raise Exception("Invalid ZIP file")
-            
-            # Find the main WSI index file
-            index_file = find_wsi_index_file(extracted_dir)
-            
-            if not index_file:
-                raise Exception("No supported WSI index file found in ZIP archive. "
-                              "Supported formats: MRXS, VMS, VMU, ETS, SVSlide")
-            
-            # Update paths and format
-            actual_file_path = index_file
-            source_format = get_multifile_format(index_file)
-            original_filename = index_file.name
-            
-            job.message = f"Found {source_format.upper()} file: {index_file.name}"
-            logger.info(f"Processing multi-file WSI: {source_format} from {index_file}")
-        
-        # Pre-process files with unsupported compression (LZW, Deflate, etc.)
-        # This converts them to JPEG-compressed pyramid TIFF using pyvips
-        job.progress = 18
-        job.message = "Checking file compression..."
-        actual_file_path = preprocess_for_conversion(actual_file_path, output_dir, job)
-        
-        # Use wsidicomizer for all supported formats (including iSyntax)
-        from wsidicomizer import WsiDicomizer
-        
-        job.progress = 20
-        job.message = f"Opening {source_format} file..."
-        
-        # Special check for iSyntax to ensure isyntax module is available
-        if source_format == "philips":
-            try:
-                import isyntax
-                logger.info("isyntax module available for iSyntax support")
-            except ImportError:
-                logger.warning("isyntax module not available, trying anyway...")
-        
-        # Get format metadata for proper manufacturer/model tagging
-        format_meta = get_format_metadata(source_format)
-        # Use original_filename from ZIP extraction if applicable, otherwise file_path.name
-        if not original_filename or original_filename == file_path.name:
-            original_filename = actual_file_path.name
-        
-        # Helper to truncate strings to DICOM VR limits
-        def truncate_lo(value: str, max_len: int = 64) -> str:
-            """Truncate string to fit DICOM LO (Long String) VR limit of 64 chars"""
-            if value and len(value) > max_len:
-                return value[:max_len-3] + "..."
-            return value
-        
-        # Create metadata post-processor to add source tracking
-        def metadata_post_processor(ds, wsi_metadata):
-            """Add source format tracking to DICOM metadata"""
-            # Set manufacturer info
-            ds.Manufacturer = truncate_lo(format_meta["manufacturer"])
-            ds.ManufacturerModelName = truncate_lo(format_meta["model"])
-            ds.SoftwareVersions = ["DICOM Server Converter v1.0", f"Converted from {format_meta['format_name']}"]
-            
-            # Store original filename in InstitutionName (visible in metadata) - truncated
-            ds.InstitutionName = truncate_lo(f"Converted: {original_filename}")
-            
-            # Update series description to include source format (LO max 64)
-            if hasattr(ds, 'SeriesDescription'):
-                ds.SeriesDescription = truncate_lo(f"{ds.SeriesDescription} [Source: {format_meta['format_name']}]")
-            else:
-                ds.SeriesDescription = truncate_lo(f"Converted from {format_meta['format_name']}")
-            
-            # Set ContentLabel from original filename (CS VR - max 16 chars, uppercase only)
-            # ContentLabel uses CS VR: uppercase letters, digits, space, underscore only
-            import re
-            clean_label = re.sub(r'[^A-Z0-9_ ]', '', original_filename.upper().replace('.', '_'))[:16]
-            if clean_label:
-                ds.ContentLabel = clean_label
-            
-            # Truncate any other LO fields that might be too long from source metadata
-            lo_fields = ['InstitutionName', 'StationName', 'PatientID', 'AccessionNumber', 
-                        'SpecimenIdentifier', 'ContainerIdentifier']
-            for field in lo_fields:
-                if hasattr(ds, field):
-                    val = getattr(ds, field)
-                    if isinstance(val, str) and len(val) > 64:
-                        setattr(ds, field, truncate_lo(val))
-                        logger.info(f"Truncated {field} from {len(val)} to 64 chars")
-            
-            return ds
-        
-        # Convert to DICOM using wsidicomizer
-        # wsidicomizer supports: SVS, NDPI, iSyntax, MRXS, SCN, CZI, TIFF, and more
-        job.message = "Converting to DICOM WSI pyramid (this may take a while)..."
-        job.progress = 30
-        
-        logger.info(f"Converting {format_meta['format_name']} from {format_meta['manufacturer']}")
-        
-        # Special handling for iSyntax files - try wsidicomizer first (more stable)
-        if source_format == "philips":
-            logger.info("Converting iSyntax using wsidicomizer...")
-            try:
-                with WsiDicomizer.open(str(actual_file_path), metadata_post_processor=metadata_post_processor) as wsi:
-                    logger.info(f"Opened iSyntax: {wsi.size.width}x{wsi.size.height}")
-                    num_levels = len(wsi.levels) if hasattr(wsi, 'levels') else 1
-                    logger.info(f"Source has {num_levels} pyramid levels")
-                    job.message = f"Generating DICOM pyramid ({wsi.size.width}x{wsi.size.height})..."
-                    job.progress = 40
-                    # add_missing_levels=True generates downsampled pyramid levels
-                    wsi.save(str(output_dir), add_missing_levels=True)
-                    generated_files = list(output_dir.glob("*.dcm"))
-                    logger.info(f"wsidicomizer generated {len(generated_files)} DICOM files (with pyramid)")
-            except Exception as e:
-                logger.warning(f"wsidicomizer failed for iSyntax: {e}")
-                # Fall back to simple single-level conversion
-                logger.info("Falling back to simple iSyntax conversion...")
-                try:
-                    dicom_files = await convert_isyntax_to_dicom(job_id, actual_file_path, output_dir)
-                    logger.info(f"Simple converter generated {len(dicom_files)} DICOM files")
-                except Exception as e2:
-                    logger.error(f"All iSyntax converters failed: {e2}")
-                    raise Exception(f"iSyntax conversion failed: {e2}")
-        else:
-            # Use wsidicomizer for other formats (including multi-file from ZIP)
-            try:
-                with WsiDicomizer.open(str(actual_file_path), metadata_post_processor=metadata_post_processor) as wsi:
-                    # Log pyramid information
-                    logger.info(f"Opened WSI: {wsi.size.width}x{wsi.size.height}")
-                    num_levels = len(wsi.levels) if hasattr(wsi, 'levels') else 1
-                    logger.info(f"Source has {num_levels} pyramid levels")
-                    
-                    job.message = f"Generating DICOM pyramid ({wsi.size.width}x{wsi.size.height})..."
-                    job.progress = 40
-                    
-                    # add_missing_levels=True ensures full pyramid is generated
-                    wsi.save(str(output_dir), add_missing_levels=True)
-                    
-                    # Log generated files
-                    generated_files = list(output_dir.glob("*.dcm"))
-                    logger.info(f"Generated {len(generated_files)} DICOM files (with pyramid)")
-                    
-            except Exception as e:
-                error_msg = str(e).lower()
-                # Check if this is an error we can recover from with pyvips
-                recoverable_errors = [
-                    'compression', 'unsupported', 'decode',  # Compression issues
-                    'levels needs to be integer', 'tolerance',  # Pyramid level issues
-                    'cannot read', 'failed to read', 'openslide',  # Read issues
-                    "'h' format", 'struct.error', '65535'  # opentile JPEG encoding limits (tiles > 65535 px)
-                ]
-                is_recoverable = any(err in error_msg for err in recoverable_errors)
-                
-                if is_recoverable:
-                    logger.warning(f"wsidicomizer failed with recoverable error: {e}")
-                    logger.info("Attempting pyvips fallback conversion...")
-                    
-                    job.message = "Trying alternative conversion method..."
-                    job.progress = 25
-                    
-                    try:
-                        # Force conversion through pyvips
-                        converted_path = convert_to_jpeg_tiff(file_path, output_dir)
-                        
-                        job.message = "Re-attempting DICOM conversion..."
-                        job.progress = 35
-                        
-                        with WsiDicomizer.open(str(converted_path), metadata_post_processor=metadata_post_processor) as wsi:
-                            logger.info(f"Opened converted WSI: {wsi.size.width}x{wsi.size.height}")
-                            num_levels = len(wsi.levels) if hasattr(wsi, 'levels') else 1
-                            logger.info(f"Source has {num_levels} pyramid levels")
-                            
-                            job.message = f"Generating DICOM pyramid ({wsi.size.width}x{wsi.size.height})..."
-                            job.progress = 45
-                            
-                            wsi.save(str(output_dir), add_missing_levels=True)
-                            
-                            generated_files = list(output_dir.glob("*.dcm"))
-                            logger.info(f"Fallback generated {len(generated_files)} DICOM files")
-                    except Exception as fallback_error:
-                        logger.error(f"Fallback conversion also failed: {fallback_error}")
-                        raise Exception(f"Conversion failed: {e}. Fallback also failed: {fallback_error}")
-                else:
-                    logger.error(f"wsidicomizer failed: {str(e)}")
-                    raise
-        
-        dicom_files = list(output_dir.glob("*.dcm"))
+        dicom_paths = await conversion_executor.submit(
+            job, str(file_path), str(output_dir), str(extracted_dir)
+        )
+        dicom_files = [Path(p) for p in dicom_paths]
+        if job.cancel_requested or job.lease_lost:
+            raise JobCancelled()
         job.message = f"Created {len(dicom_files)} DICOM files"
         
         job.progress = 70
@@ -1667,44 +1521,28 @@ async def convert_wsi_to_dicom(job_id: str, file_path: Path):
         if not dicom_files:
             raise Exception("No DICOM files generated")
         
-        study_uid = None
-        
-        async with httpx.AsyncClient(timeout=300.0) as client:
-            for dcm_file in dicom_files:
-                with open(dcm_file, "rb") as f:
-                    dicom_data = f.read()
-                
-                # Upload via STOW-RS
-                response = await client.post(
-                    f"{settings.orthanc_url}/dicom-web/studies",
-                    content=dicom_data,
-                    headers={
-                        "Content-Type": "application/dicom",
-                        "Accept": "application/dicom+json"
-                    },
-                    auth=(settings.orthanc_username, settings.orthanc_password)
-                )
-                
-                if response.status_code not in [200, 201]:
-                    # Fallback: use Orthanc REST API
-                    response = await client.post(
-                        f"{settings.orthanc_url}/instances",
-                        content=dicom_data,
-                        headers={"Content-Type": "application/dicom"},
-                        auth=(settings.orthanc_username, settings.orthanc_password)
-                    )
-                
-                if response.status_code in [200, 201]:
-                    result = response.json()
-                    if isinstance(result, dict) and "ParentStudy" in result:
-                        study_uid = result.get("ParentStudy")
+        def report_upload(upload: UploadProgress):
+            job.progress = 70 + int(25 * upload.fraction)
+            job.message = (
+                f"Uploading to Orthanc: {upload.files_done}/{upload.total_files} files, "
+                f"{upload.bytes_sent / (1024 * 1024):.0f}/{upload.total_bytes / (1024 * 1024):.0f} MB "
+                f"({upload.mb_per_second:.1f} MB/s)"
+            )
+
+        # Streamed from disk, batched into STOW-RS requests, sent in parallel
+        upload = await stow_uploader.upload(dicom_files, on_progress=report_upload)
+        study_uid = upload["study_id"]
+        job.message = f"Uploaded {upload['files']} files at {upload['mb_per_s']} MB/s"
+
+        if study_uid:
+            await orthanc_index.mark_changed(study_uid)
+            invalidate_wsi_metadata(study_uid)
+            # Conversion is a single write, so build the manifest right away
+            await refresh_manifest(orthanc_client, await get_db_pool(), study_uid)
         
         job.progress = 100
-        job.status = "completed"
         job.study_uid = study_uid
         job.study_id = study_uid  # Store Orthanc study ID
-        job.message = f"Conversion complete. Study: {study_uid}"
-        job.completed_at = datetime.utcnow()
         
         # Set study owner if user was authenticated during upload
         logger.info(f"🔍 Ownership check: study_uid={study_uid}, job.owner_id={job.owner_id}")
@@ -1724,36 +1562,37 @@ async def convert_wsi_to_dicom(job_id: str, file_path: Path):
             if not job.owner_id:
                 logger.warning(f"   → owner_id is missing - user was not authenticated during upload")
         
-        # Move original to completed
+        # Move original to completed (unless another worker has reclaimed the job and is reading it)
+        if job.lease_lost:
+            raise JobCancelled()
         completed_path = Path(settings.watch_folder) / "completed" / file_path.name
-        shutil.move(str(file_path), str(completed_path))
-        
-        # Clean up processing directory and extracted folder
-        shutil.rmtree(output_dir, ignore_errors=True)
-        if extracted_dir and extracted_dir.exists():
-            shutil.rmtree(extracted_dir, ignore_errors=True)
-        
-    except Exception as e:
-        job.status = "failed"
-        job.message = f"Conversion failed: {str(e)}"
-        job.completed_at = datetime.utcnow()
+        await asyncio.to_thread(shutil.move, str(file_path), str(completed_path))
+        return study_uid
         
-        # Move to failed
-        failed_path = Path(settings.watch_folder) / "failed" / file_path.name
+    finally:
+        # Clean up processing directory and extracted folder (retries start fresh);
+        # after a lost lease they belong to the worker that reclaimed the job
+        if not job.lease_lost:
+            await asyncio.to_thread(shutil.rmtree, output_dir, ignore_errors=True)
+            if extracted_dir.exists():
+                await asyncio.to_thread(shutil.rmtree, extracted_dir, ignore_errors=True)
+
+
+async def move_failed_input(job: ConversionJob):
+    """Move the input of a failed/cancelled job to failed/ (called by the queue)"""
+    if not job.file_path:
+        return
+    file_path = Path(job.file_path)
+    failed_path = Path(settings.watch_folder) / "failed" / file_path.name
+    try:
         if file_path.exists():
-            shutil.move(str(file_path), str(failed_path))
-        
-        # Clean up processing and extracted directories
-        shutil.rmtree(output_dir, ignore_errors=True)
-        if extracted_dir and extracted_dir.exists():
-            shutil.rmtree(extracted_dir, ignore_errors=True)
-        
-        raise
+            await asyncio.to_thread(shutil.move, str(file_path), str(failed_path))
+    except Exception as e:
+        logger.warning(f"Could not move {file_path.name} to failed/: {e}")
 
 
 @app.post("/upload", response_model=UploadResponse)
 async def upload_wsi(
-    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     current_user: Optional[User] = Depends(get_current_user)
 ):
@@ -1821,17 +1660,19 @@ async def upload_wsi(
         status="pending",
         message=f"Queued for conversion (format: {source_format})",
         owner_id=owner_id,
-        created_at=datetime.utcnow()
+        created_at=datetime.utcnow(),
+        file_path=str(file_path),
+        source_format=source_format,
+        priority=file_path.stat().st_size,
     )
-    conversion_jobs[job_id] = job
     
     if current_user:
         logger.info(f"📤 Upload from authenticated user: {current_user.email}, user.id={current_user.id}, owner_id={owner_id}")
     else:
         logger.warning(f"📤 Upload from ANONYMOUS user (no auth token) - study will NOT be owned")
     
-    # Start conversion in background
-    background_tasks.add_task(convert_wsi_to_dicom, job_id, file_path)
+    # Any converter process with a free worker picks it up
+    await job_queue.enqueue(job)
     
     return UploadResponse(
         job_id=job_id,
@@ -1842,33 +1683,50 @@ async def upload_wsi(
 
 @app.get("/jobs")
 async def list_jobs():
-    """List all conversion jobs"""
+    """List conversion jobs (most recent first)"""
+    jobs = await job_queue.list()
     return {
-        "jobs": [job.model_dump() for job in conversion_jobs.values()],
-        "total": len(conversion_jobs)
+        "jobs": [job.model_dump() for job in jobs],
+        "total": len(jobs)
     }
 
 
 @app.get("/jobs/{job_id}")
 async def get_job(job_id: str):
     """Get status of a specific conversion job"""
-    if job_id not in conversion_jobs:
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    return job.model_dump()
+
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str, user: User = Depends(require_user)):
+    """Cancel a queued or running conversion job (its uploader or an admin)"""
+    job = await job_queue.get(job_id)
+    if job is None:
         raise HTTPException(status_code=404, detail="Job not found")
+    if job.owner_id != user.id and user.role != "admin":
+        raise HTTPException(status_code=403, detail="Not authorized to cancel this job")
     
-    return conversion_jobs[job_id].model_dump()
+    job = await job_queue.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    return job.model_dump()
 
 
 @app.delete("/jobs/{job_id}")
 async def delete_job(job_id: str):
     """Delete a completed/failed job from history"""
-    if job_id not in conversion_jobs:
-        raise HTTPException(status_code=404, detail="Job not found")
-    
-    job = conversion_jobs[job_id]
-    if job.status == "processing":
+    try:
+        deleted = await job_queue.delete(job_id)
+    except ValueError:
         raise HTTPException(status_code=400, detail="Cannot delete job in progress")
     
-    del conversion_jobs[job_id]
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Job not found")
     return {"message": "Job deleted"}
 
 
@@ -1876,6 +1734,18 @@ async def delete_job(job_id: str):
 # Orthanc Proxy Endpoints
 # =============================================================================
 
+async def list_orthanc_study_ids() -> list[str]:
+    """Orthanc study IDs from the local index, or from Orthanc until the index has synced"""
+    if await orthanc_index.is_ready():
+        try:
+            return await orthanc_index.study_ids()
+        except Exception as e:
+            logger.warning(f"⚠️ Orthanc index read failed, listing from Orthanc: {e}")
+    response = await orthanc_client.get("/studies")
+    response.raise_for_status()
+    return response.json()
+
+
 @app.get("/studies")
 async def list_studies(
     current_user: Optional[User] = Depends(get_current_user),
@@ -1891,46 +1761,39 @@ async def list_studies(
     - include_samples: Include unowned "sample" studies (default: true)
     """
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{settings.orthanc_url}/studies",
-                auth=(settings.orthanc_username, settings.orthanc_password),
-                timeout=30.0
-            )
-            response.raise_for_status()
-            all_studies = response.json()
+        all_studies = await list_orthanc_study_ids()
+        
+        # If no user authenticated, return all studies (public demo mode)
+        if current_user is None:
+            logger.info("No authenticated user - returning all studies as samples")
+            return all_studies
+        
+        # Admin sees everything
+        if current_user.role == "admin":
+            return all_studies
+        
+        # Regular user
+        if current_user.id:
+            user_study_ids = await get_user_slide_ids(current_user.id)
             
-            # If no user authenticated, return all studies (public demo mode)
-            if current_user is None:
-                logger.info("No authenticated user - returning all studies as samples")
-                return all_studies
+            # Check if user has hidden samples
+            hide_samples = not include_samples or localStorage_hidden_samples(current_user.id)
             
-            # Admin sees everything
-            if current_user.role == "admin":
-                return all_studies
+            # Get owned/shared studies
+            owned_studies = [s for s in all_studies if s in user_study_ids]
             
-            # Regular user
-            if current_user.id:
-                user_study_ids = await get_user_slide_ids(current_user.id)
-                
-                # Check if user has hidden samples
-                hide_samples = not include_samples or localStorage_hidden_samples(current_user.id)
-                
-                # Get owned/shared studies
-                owned_studies = [s for s in all_studies if s in user_study_ids]
-                
-                if hide_samples:
-                    return owned_studies
-                
-                # Include unowned studies as "samples"
-                # Get all owned study IDs from DB
-                all_owned_ids = await get_all_owned_study_ids()
-                sample_studies = [s for s in all_studies if s not in all_owned_ids]
-                
-                return owned_studies + sample_studies
+            if hide_samples:
+                return owned_studies
             
-            # Fallback - show all (DB not available)
-            return all_studies
+            # Include unowned studies as "samples"
+            # Get all owned study IDs from DB
+            all_owned_ids = await get_all_owned_study_ids()
+            sample_studies = [s for s in all_studies if s not in all_owned_ids]
+            
+            return owned_studies + sample_studies
+        
+        # Fallback - show all (DB not available)
+        return all_studies
             
     except httpx.HTTPError as e:
         raise HTTPException(status_code=502, detail=f"Orthanc error: {str(e)}")
@@ -1960,14 +1823,7 @@ async def get_all_owned_study_ids() -> set[str]:
 async def get_studies_ownership(current_user: Optional[User] = Depends(get_current_user)):
     """Get ownership info for all studies visible to user"""
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{settings.orthanc_url}/studies",
-                auth=(settings.orthanc_username, settings.orthanc_password),
-                timeout=30.0
-            )
-            response.raise_for_status()
-            all_studies = response.json()
+        all_studies = await list_orthanc_study_ids()
         
         # If no user authenticated, mark all as samples
         if current_user is None:
@@ -2047,37 +1903,31 @@ async def debug_studies(current_user: Optional[User] = Depends(get_current_user)
     
     # Orthanc check
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{settings.orthanc_url}/studies",
-                auth=(settings.orthanc_username, settings.orthanc_password),
-                timeout=10.0
-            )
-            response.raise_for_status()
-            all_studies = response.json()
-            
-            debug_info["orthanc"]["status"] = "connected"
-            debug_info["studies"]["total"] = len(all_studies)
-            
-            # Categorize studies
-            owned_study_ids = {r["study_id"] for r in debug_info["ownership_table"]}
-            user_study_ids = set()
-            
-            if current_user and current_user.id:
-                user_study_ids = {
-                    r["study_id"] for r in debug_info["ownership_table"] 
-                    if r["user_id"] == current_user.id
-                }
-            
-            for study_id in all_studies:
-                if study_id in user_study_ids:
-                    debug_info["studies"]["owned_by_user"] += 1
-                elif study_id in owned_study_ids:
-                    debug_info["studies"]["owned_by_others"] += 1
-                else:
-                    debug_info["studies"]["unowned"] += 1
-            
-            debug_info["orthanc"]["all_study_ids"] = all_studies[:20]  # First 20
+        all_studies = await list_orthanc_study_ids()
+        
+        debug_info["orthanc"]["status"] = "connected"
+        debug_info["orthanc"]["index"] = orthanc_index.get_stats()
+        debug_info["studies"]["total"] = len(all_studies)
+        
+        # Categorize studies
+        owned_study_ids = {r["study_id"] for r in debug_info["ownership_table"]}
+        user_study_ids = set()
+        
+        if current_user and current_user.id:
+            user_study_ids = {
+                r["study_id"] for r in debug_info["ownership_table"] 
+                if r["user_id"] == current_user.id
+            }
+        
+        for study_id in all_studies:
+            if study_id in user_study_ids:
+                debug_info["studies"]["owned_by_user"] += 1
+            elif study_id in owned_study_ids:
+                debug_info["studies"]["owned_by_others"] += 1
+            else:
+                debug_info["studies"]["unowned"] += 1
+        
+        debug_info["orthanc"]["all_study_ids"] = all_studies[:20]  # First 20
             
     except Exception as e:
         debug_info["orthanc"] = {"status": "error", "error": str(e)}
@@ -2145,18 +1995,21 @@ async def delete_study_endpoint(study_id: str, user: User = Depends(require_user
     # Delete from Orthanc storage
     logger.info(f"🗑️ Database delete successful, now deleting from Orthanc...")
     orthanc_deleted = False
+    await invalidate_study_tiles(study_id)
+    invalidate_wsi_metadata(study_id)
     try:
-        async with httpx.AsyncClient() as client:
-            orthanc_response = await client.delete(
-                f"{ORTHANC_URL}/studies/{study_id}",
-                auth=(ORTHANC_USER, ORTHANC_PASS),
-                timeout=30.0
-            )
-            if orthanc_response.status_code == 200:
-                orthanc_deleted = True
-                logger.info(f"Deleted study {study_id} from Orthanc")
-            else:
-                logger.warning(f"Orthanc delete returned {orthanc_response.status_code} for {study_id}")
+        await delete_manifest(await get_db_pool(), study_id)
+    except Exception as e:
+        logger.warning(f"Failed to delete manifest for {study_id}: {e}")
+    try:
+        orthanc_response = await orthanc_client.delete(f"/studies/{study_id}")
+        if orthanc_response.status_code == 200:
+            orthanc_deleted = True
+            logger.info(f"Deleted study {study_id} from Orthanc")
+            await orthanc_index.mark_changed(study_id)
+            invalidate_wsi_metadata(study_id)
+        else:
+            logger.warning(f"Orthanc delete returned {orthanc_response.status_code} for {study_id}")
     except Exception as e:
         logger.error(f"Failed to delete from Orthanc: {e}")
     
@@ -2439,14 +2292,7 @@ async def get_categorized_studies(
         raise HTTPException(status_code=400, detail="User not fully registered")
     
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{settings.orthanc_url}/studies",
-                auth=(settings.orthanc_username, settings.orthanc_password),
-                timeout=30.0
-            )
-            response.raise_for_status()
-            all_studies = response.json()
+        all_studies = await list_orthanc_study_ids()
         
         # Get user's owned and shared slides
         owned_ids = await get_owned_slide_ids(user.id)
@@ -2559,21 +2405,16 @@ async def get_slide(orthanc_id: str, user: Optional[User] = Depends(get_current_
     
     # If no slide record exists, return basic info from Orthanc
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{settings.orthanc_url}/studies/{orthanc_id}",
-                auth=(settings.orthanc_username, settings.orthanc_password),
-                timeout=30.0
-            )
-            if response.status_code == 200:
-                orthanc_data = response.json()
-                return {
-                    "orthanc_study_id": orthanc_id,
-                    "display_name": orthanc_data.get("MainDicomTags", {}).get("StudyDescription"),
-                    "stain": None,
-                    "owner_id": None,
-                    "orthanc_data": orthanc_data
-                }
+        response = await orthanc_client.get(f"/studies/{orthanc_id}")
+        if response.status_code == 200:
+            orthanc_data = response.json()
+            return {
+                "orthanc_study_id": orthanc_id,
+                "display_name": orthanc_data.get("MainDicomTags", {}).get("StudyDescription"),
+                "stain": None,
+                "owner_id": None,
+                "orthanc_data": orthanc_data
+            }
     except:
         pass
     
@@ -2797,20 +2638,15 @@ async def get_study(study_id: str, user: User = Depends(require_user)):
         raise HTTPException(status_code=403, detail="Access denied to this slide")
     
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{settings.orthanc_url}/studies/{study_id}",
-                auth=(settings.orthanc_username, settings.orthanc_password),
-                timeout=30.0
-            )
-            response.raise_for_status()
-            return response.json()
+        response = await orthanc_client.get(f"/studies/{study_id}")
+        response.raise_for_status()
+        return response.json()
     except httpx.HTTPError as e:
         raise HTTPException(status_code=502, detail=f"Orthanc error: {str(e)}")
 
 
 @app.get("/studies/{study_id}/wsi-metadata")
-async def get_wsi_metadata(study_id: str, user: User = Depends(require_user)):
+async def get_wsi_metadata(study_id: str, request: Request, user: User = Depends(require_user)):
     """
     Get WSI pyramid metadata for OpenSeadragon tile source.
     Supports multi-series DICOM WSI (Pramana/Leica format) with:
@@ -2819,230 +2655,126 @@ async def get_wsi_metadata(study_id: str, user: User = Depends(require_user)):
     - Label and macro images
     
     Returns tile dimensions, pyramid levels, focal planes, and instance mappings.
+    Built from bulk tag requests and cached per study until new instances arrive.
+    Carries an ETag of its content; If-None-Match gets a 304.
     """
     # Check access
     if not user.id or not await can_access_study(user.id, study_id):
         raise HTTPException(status_code=403, detail="Access denied to this slide")
     
     try:
-        async with httpx.AsyncClient() as client:
-            # Get study details
-            study_response = await client.get(
-                f"{settings.orthanc_url}/studies/{study_id}",
-                auth=(settings.orthanc_username, settings.orthanc_password),
-                timeout=30.0
-            )
-            study_response.raise_for_status()
-            study = study_response.json()
-            
-            # Collect all instances grouped by series
-            series_instances = {}  # seriesUID -> list of instances
-            label_instance = None
-            macro_instance = None
-            
-            for series_id in study.get("Series", []):
-                series_response = await client.get(
-                    f"{settings.orthanc_url}/series/{series_id}",
-                    auth=(settings.orthanc_username, settings.orthanc_password)
-                )
-                if series_response.status_code != 200:
-                    continue
-                    
-                series = series_response.json()
-                
-                for instance_id in series.get("Instances", []):
-                    # Get instance tags
-                    tags_response = await client.get(
-                        f"{settings.orthanc_url}/instances/{instance_id}/simplified-tags",
-                        auth=(settings.orthanc_username, settings.orthanc_password)
-                    )
-                    if tags_response.status_code != 200:
-                        continue
-                        
-                    tags = tags_response.json()
-                    
-                    # Parse ImageType to identify LABEL, OVERVIEW/MACRO, or VOLUME
-                    image_type = tags.get("ImageType", "")
-                    if isinstance(image_type, str):
-                        image_type_list = [t.strip() for t in image_type.split("\\")]
-                    else:
-                        image_type_list = image_type if image_type else []
-                    
-                    instance_data = {
-                        "id": instance_id,
-                        "seriesId": series_id,
-                        "seriesInstanceUID": tags.get("SeriesInstanceUID", ""),
-                        "instanceNumber": int(tags.get("InstanceNumber", 0) or 0),
-                        "width": int(tags.get("TotalPixelMatrixColumns", 0) or 0),
-                        "height": int(tags.get("TotalPixelMatrixRows", 0) or 0),
-                        "tileWidth": int(tags.get("Columns", 256) or 256),
-                        "tileHeight": int(tags.get("Rows", 256) or 256),
-                        "numberOfFrames": int(tags.get("NumberOfFrames", 1) or 1),
-                        "imageType": image_type_list,
-                        "extendedDepthOfField": tags.get("ExtendedDepthOfField", "").upper() == "YES",
-                        "numberOfFocalPlanes": int(tags.get("NumberOfFocalPlanes", 0) or 0),
-                    }
-                    
-                    # Categorize by ImageType
-                    if "LABEL" in image_type_list:
-                        label_instance = instance_data
-                    elif "OVERVIEW" in image_type_list or "THUMBNAIL" in image_type_list:
-                        macro_instance = instance_data
-                    elif "VOLUME" in image_type_list and instance_data["numberOfFrames"] > 1:
-                        # Group VOLUME instances by series
-                        series_uid = instance_data["seriesInstanceUID"]
-                        if series_uid not in series_instances:
-                            series_instances[series_uid] = []
-                        series_instances[series_uid].append(instance_data)
-            
-            if not series_instances:
-                raise HTTPException(status_code=404, detail="No WSI instances found in study")
-            
-            # Identify main pyramid vs z-stack focal planes
-            # Main pyramid: ExtendedDepthOfField=YES or the series with the most levels
-            main_series_uid = None
-            focal_plane_series = []
-            
-            for series_uid, instances in series_instances.items():
-                # Sort instances by width (descending) to get pyramid order
-                instances.sort(key=lambda x: x["width"], reverse=True)
-                
-                # Check if this series has ExtendedDepthOfField=YES (composite best-focus)
-                has_edof = any(inst["extendedDepthOfField"] for inst in instances)
-                
-                if has_edof:
-                    main_series_uid = series_uid
-                else:
-                    # This is a z-stack focal plane series
-                    focal_plane_series.append({
-                        "seriesUID": series_uid,
-                        "instances": instances,
-                        # Use instance number of highest res to determine focal plane order
-                        "instanceNumber": instances[0]["instanceNumber"] if instances else 0
-                    })
-            
-            # If no EDOF series found, use the series with most instances as main
-            if not main_series_uid:
-                main_series_uid = max(series_instances.keys(), key=lambda k: len(series_instances[k]))
-                # Remove from focal planes if it was added
-                focal_plane_series = [fp for fp in focal_plane_series if fp["seriesUID"] != main_series_uid]
-            
-            main_instances = series_instances[main_series_uid]
-            main_instance = main_instances[0]  # Highest resolution
-            
-            # Sort focal planes by instance number
-            focal_plane_series.sort(key=lambda x: x["instanceNumber"])
-            
-            # Calculate tiles per row/column
-            tiles_x = (main_instance["width"] + main_instance["tileWidth"] - 1) // main_instance["tileWidth"]
-            tiles_y = (main_instance["height"] + main_instance["tileHeight"] - 1) // main_instance["tileHeight"]
-            
-            # Build response
-            response = {
-                "studyId": study_id,
-                "instanceId": main_instance["id"],
-                "width": main_instance["width"],
-                "height": main_instance["height"],
-                "tileWidth": main_instance["tileWidth"],
-                "tileHeight": main_instance["tileHeight"],
-                "tilesX": tiles_x,
-                "tilesY": tiles_y,
-                "numberOfFrames": main_instance["numberOfFrames"],
-                "extendedDepthOfField": main_instance["extendedDepthOfField"],
-                "numberOfFocalPlanes": main_instance["numberOfFocalPlanes"],
-                "levels": [
-                    {
-                        "instanceId": inst["id"],
-                        "width": inst["width"],
-                        "height": inst["height"],
-                        "numberOfFrames": inst["numberOfFrames"]
-                    }
-                    for inst in main_instances
-                ],
-            }
-            
-            # Add focal planes if z-stacks exist
-            if focal_plane_series:
-                response["focalPlanes"] = []
-                for idx, fp in enumerate(focal_plane_series):
-                    fp_levels = [
-                        {
-                            "instanceId": inst["id"],
-                            "width": inst["width"],
-                            "height": inst["height"],
-                            "numberOfFrames": inst["numberOfFrames"]
-                        }
-                        for inst in fp["instances"]
-                    ]
-                    response["focalPlanes"].append({
-                        "index": idx,
-                        "seriesUID": fp["seriesUID"],
-                        "instanceId": fp["instances"][0]["id"] if fp["instances"] else None,
-                        "levels": fp_levels
-                    })
-                logger.info(f"📸 Study {study_id} has {len(focal_plane_series)} z-stack focal planes")
-            
-            # Add label and macro if present
-            if label_instance:
-                response["labelInstance"] = {
-                    "instanceId": label_instance["id"],
-                    "width": label_instance["width"],
-                    "height": label_instance["height"]
-                }
-            
-            if macro_instance:
-                response["macroInstance"] = {
-                    "instanceId": macro_instance["id"],
-                    "width": macro_instance["width"],
-                    "height": macro_instance["height"]
-                }
-            
-            return response
-            
+        metadata = await load_wsi_metadata(orthanc_client, study_id, index=orthanc_index)
     except httpx.HTTPError as e:
         raise HTTPException(status_code=502, detail=f"Orthanc error: {str(e)}")
+    
+    if metadata is None:
+        raise HTTPException(status_code=404, detail="No WSI instances found in study")
+    
+    etag = json_etag(metadata)
+    headers = {"Cache-Control": REVALIDATE_CACHE_CONTROL}
+    cached = not_modified(request, etag, headers, exists=True)
+    if cached:
+        return cached
+    return JSONResponse(content=metadata, headers={**headers, "ETag": etag})
 
 
 from fastapi.responses import Response
 
+async def study_manifest(study_id: str) -> Optional[tuple[dict, str]]:
+    """(manifest, etag) of a study, built on first request for older studies"""
+    pool = await get_db_pool()
+    stored = await load_manifest(pool, study_id)
+    if stored is None:
+        stored = await refresh_manifest(orthanc_client, pool, study_id)
+    return stored
+
+
+async def require_study_manifest(study_id: str) -> tuple[dict, str]:
+    stored = await study_manifest(study_id)
+    if stored is None:
+        raise HTTPException(status_code=404, detail="Manifest unavailable for this study")
+    return stored
+
+
+@app.get("/studies/{study_id}/manifest")
+async def get_slide_manifest(study_id: str, request: Request, user: User = Depends(require_user)):
+    """
+    Get the precomputed slide manifest: pyramid levels with tile grids,
+    focal planes, calibration, ICC transform and Leica virtual pyramid.
+
+    Written at upload/conversion time; built on first request for older studies.
+    Supports If-None-Match so the viewer can revalidate without a body.
+    """
+    # Check access
+    if not user.id or not await can_access_study(user.id, study_id):
+        raise HTTPException(status_code=403, detail="Access denied to this slide")
+
+    manifest, etag = await require_study_manifest(study_id)
+    headers = {"Cache-Control": REVALIDATE_CACHE_CONTROL}
+    cached = not_modified(request, etag, headers, exists=True)
+    if cached:
+        return cached
+    return JSONResponse(content=manifest, headers={**headers, "ETag": etag})
+
+
 @app.get("/instances/{instance_id}/frames/{frame_number}")
-async def get_frame(instance_id: str, frame_number: int, user: User = Depends(require_user)):
+async def get_frame(instance_id: str, frame_number: int, request: Request, user: User = Depends(require_user)):
     """
-    Proxy frame requests to Orthanc
-    Returns JPEG image of the specified frame
+    Serve a frame of an instance
+    Returns the stored compressed frame as-is (no decode/re-encode) when the
+    browser can display it or the client accepts its media type; otherwise
+    falls back to Orthanc's rendered JPEG preview.
+    
+    Frames are immutable per SOP instance: the ETag is derived from the
+    instance, frame number and accepted codecs, so revalidation is answered
+    with a 304 before touching Orthanc.
     
     Note: Full access check per tile is too slow - authentication ensures user is logged in.
     The access check is done when loading wsi-metadata which gates the viewer.
     """
+    accepted = accepted_media_types(request.headers.get("accept", ""))
+    etag = strong_etag("frame", instance_id, frame_number, *accepted)
+    headers = {
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL,
+        "Access-Control-Allow-Origin": "*",
+        "Vary": "Accept",
+    }
+    cached = not_modified(request, etag, headers)
+    if cached:
+        return cached
+    headers["ETag"] = etag
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{settings.orthanc_url}/instances/{instance_id}/frames/{frame_number}/preview",
-                auth=(settings.orthanc_username, settings.orthanc_password),
-                timeout=30.0
-            )
-            response.raise_for_status()
-            
-            return Response(
-                content=response.content,
-                media_type="image/jpeg",
-                headers={
-                    "Cache-Control": "public, max-age=31536000",
-                    "Access-Control-Allow-Origin": "*"
-                }
-            )
+        content, media_type = await fetch_frame(instance_id, frame_number, accepted)
+        return Response(content=content, media_type=media_type, headers=headers)
     except httpx.HTTPError as e:
         raise HTTPException(status_code=502, detail=f"Orthanc error: {str(e)}")
 
 
+async def fetch_frame(instance_id: str, frame_number: int, accepted: list[str]) -> tuple[bytes, str]:
+    """
+    Stored compressed frame if the client can display it, else Orthanc's
+    rendered JPEG preview. Returns (content, media_type).
+    """
+    frame = await frame_server.get_frame(instance_id, frame_number)
+    if frame is not None:
+        content, media_type, transfer_syntax = frame
+        if transfer_syntax in BROWSER_TRANSFER_SYNTAXES or media_type in accepted:
+            return content, media_type
+    
+    response = await orthanc_client.get(f"/instances/{instance_id}/frames/{frame_number}/preview")
+    response.raise_for_status()
+    return response.content, "image/jpeg"
+
+
 # =============================================================================
 # ICC Profile Extraction
 # =============================================================================
 
 @app.get("/studies/{study_id}/icc-profile")
-async def get_icc_profile(study_id: str, include_transform: bool = False, user: User = Depends(require_user)):
+async def get_icc_profile(study_id: str, request: Request, response: Response,
+                          include_transform: bool = False, user: User = Depends(require_user)):
     """
-    Extract ICC color profile from a DICOM WSI study.
+    Get the ICC color profile of a DICOM WSI study from its slide manifest.
     Returns the ICC profile metadata and optionally the color transformation data.
     
     Query params:
@@ -3051,177 +2783,73 @@ async def get_icc_profile(study_id: str, include_transform: bool = False, user:
     # Check access
     if not user.id or not await can_access_study(user.id, study_id):
         raise HTTPException(status_code=403, detail="Access denied to this slide")
-    
-    import pydicom
-    import io
-    import base64
-    from icc_parser import parse_icc_profile
-    
-    try:
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            # Get study info
-            study_response = await client.get(
-                f"{settings.orthanc_url}/studies/{study_id}",
-                auth=(settings.orthanc_username, settings.orthanc_password)
-            )
-            study_response.raise_for_status()
-            study = study_response.json()
-            
-            if not study.get('Series'):
-                raise HTTPException(status_code=404, detail="No series in study")
-            
-            # Get first series
-            series_id = study['Series'][0]
-            series_response = await client.get(
-                f"{settings.orthanc_url}/series/{series_id}",
-                auth=(settings.orthanc_username, settings.orthanc_password)
-            )
-            series_response.raise_for_status()
-            series = series_response.json()
-            
-            if not series.get('Instances'):
-                raise HTTPException(status_code=404, detail="No instances in series")
-            
-            # Get first instance DICOM file
-            instance_id = series['Instances'][0]
-            file_response = await client.get(
-                f"{settings.orthanc_url}/instances/{instance_id}/file",
-                auth=(settings.orthanc_username, settings.orthanc_password)
-            )
-            file_response.raise_for_status()
-            
-            # Parse DICOM
-            ds = pydicom.dcmread(io.BytesIO(file_response.content), force=True)
-            
-            # Look for ICC profile
-            icc_data = None
-            icc_location = None
-            
-            # Check OpticalPathSequence first (most common for WSI)
-            if hasattr(ds, 'OpticalPathSequence'):
-                for i, item in enumerate(ds.OpticalPathSequence):
-                    icc = getattr(item, 'ICCProfile', None)
-                    if icc and len(icc) > 0:
-                        icc_data = bytes(icc)
-                        icc_location = f"OpticalPathSequence[{i}]"
-                        break
-            
-            # Check top-level ICCProfile
-            if not icc_data and hasattr(ds, 'ICCProfile') and ds.ICCProfile:
-                icc_data = bytes(ds.ICCProfile)
-                icc_location = "TopLevel"
-            
-            if not icc_data:
-                return {
-                    "study_id": study_id,
-                    "has_icc": False,
-                    "message": "No ICC profile found in DICOM"
-                }
-            
-            # Parse ICC profile header
-            profile_info = {}
-            if len(icc_data) >= 128:
-                profile_info['size'] = int.from_bytes(icc_data[0:4], 'big')
-                profile_info['preferred_cmm'] = icc_data[4:8].decode('ascii', errors='replace').strip()
-                profile_info['version'] = f"{icc_data[8]}.{icc_data[9]}.{icc_data[10]}"
-                profile_info['profile_class'] = icc_data[12:16].decode('ascii', errors='replace').strip()
-                profile_info['color_space'] = icc_data[16:20].decode('ascii', errors='replace').strip()
-                profile_info['pcs'] = icc_data[20:24].decode('ascii', errors='replace').strip()
-            
-            result = {
-                "study_id": study_id,
-                "has_icc": True,
-                "location": icc_location,
-                "size_bytes": len(icc_data),
-                "profile_info": profile_info,
-            }
-            
-            # Include color transformation data if requested
-            if include_transform:
-                try:
-                    parsed = parse_icc_profile(icc_data)
-                    result["color_transform"] = parsed
-                except Exception as e:
-                    logger.warning(f"Failed to parse ICC profile: {e}")
-                    result["color_transform"] = None
-            
-            return result
-            
-    except httpx.HTTPError as e:
-        raise HTTPException(status_code=502, detail=f"Orthanc error: {str(e)}")
-    except Exception as e:
-        logger.error(f"Error extracting ICC profile: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+    
+    # The manifest is rewritten whenever instances are added, so it versions the profile
+    manifest, version = await require_study_manifest(study_id)
+    etag = strong_etag("icc", study_id, version, include_transform)
+    response.headers["Cache-Control"] = REVALIDATE_CACHE_CONTROL
+    cached = not_modified(request, etag, {"Cache-Control": REVALIDATE_CACHE_CONTROL}, exists=True)
+    if cached:
+        return cached
+    response.headers["ETag"] = etag
+    
+    icc = manifest.get("icc") or {}
+    if not icc.get("has_icc"):
+        return {
+            "study_id": study_id,
+            "has_icc": False,
+            "message": "No ICC profile found in DICOM"
+        }
+    
+    result = {
+        "study_id": study_id,
+        "has_icc": True,
+        "location": icc.get("location"),
+        "size_bytes": icc.get("size_bytes"),
+        "profile_info": icc.get("profile_info"),
+    }
+    
+    # Include color transformation data if requested
+    if include_transform:
+        result["color_transform"] = icc.get("color_transform")
+    
+    return result
 
 
 @app.get("/studies/{study_id}/icc-profile/raw")
-async def get_icc_profile_raw(study_id: str):
+async def get_icc_profile_raw(study_id: str, request: Request):
     """
     Get the raw ICC profile binary data.
     Can be used directly by color management systems.
     """
-    import pydicom
-    import io
+    headers = {
+        "Content-Disposition": f"attachment; filename={study_id}.icc",
+        "Cache-Control": "public, max-age=86400"
+    }
+    manifest, version = await require_study_manifest(study_id)
+    icc = manifest.get("icc") or {}
+    if not icc.get("has_icc"):
+        raise HTTPException(status_code=404, detail="No ICC profile in study")
+    
+    etag = strong_etag("icc", study_id, version, "raw")
+    cached = not_modified(request, etag, headers, exists=True)
+    if cached:
+        return cached
+    headers["ETag"] = etag
     
     try:
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            # Get study -> series -> instance
-            study_response = await client.get(
-                f"{settings.orthanc_url}/studies/{study_id}",
-                auth=(settings.orthanc_username, settings.orthanc_password)
-            )
-            study_response.raise_for_status()
-            study = study_response.json()
-            
-            if not study.get('Series'):
-                raise HTTPException(status_code=404, detail="No series in study")
-            
-            series_id = study['Series'][0]
-            series_response = await client.get(
-                f"{settings.orthanc_url}/series/{series_id}",
-                auth=(settings.orthanc_username, settings.orthanc_password)
-            )
-            series_response.raise_for_status()
-            series = series_response.json()
-            
-            if not series.get('Instances'):
-                raise HTTPException(status_code=404, detail="No instances in series")
-            
-            instance_id = series['Instances'][0]
-            file_response = await client.get(
-                f"{settings.orthanc_url}/instances/{instance_id}/file",
-                auth=(settings.orthanc_username, settings.orthanc_password)
-            )
-            file_response.raise_for_status()
-            
-            ds = pydicom.dcmread(io.BytesIO(file_response.content), force=True)
-            
-            # Extract ICC
-            icc_data = None
-            if hasattr(ds, 'OpticalPathSequence'):
-                for item in ds.OpticalPathSequence:
-                    icc = getattr(item, 'ICCProfile', None)
-                    if icc and len(icc) > 0:
-                        icc_data = bytes(icc)
-                        break
-            
-            if not icc_data and hasattr(ds, 'ICCProfile') and ds.ICCProfile:
-                icc_data = bytes(ds.ICCProfile)
-            
-            if not icc_data:
-                raise HTTPException(status_code=404, detail="No ICC profile in study")
-            
-            return Response(
-                content=icc_data,
-                media_type="application/vnd.iccprofile",
-                headers={
-                    "Content-Disposition": f"attachment; filename={study_id}.icc",
-                    "Cache-Control": "public, max-age=86400"
-                }
-            )
-            
+        # Same instance the manifest read the profile from, through the /content route
+        fetched = await fetch_icc_profile(orthanc_client, icc["instanceId"])
     except httpx.HTTPError as e:
         raise HTTPException(status_code=502, detail=f"Orthanc error: {str(e)}")
+    if fetched is None:
+        raise HTTPException(status_code=404, detail="No ICC profile in study")
+    
+    return Response(
+        content=fetched[0],
+        media_type="application/vnd.iccprofile",
+        headers=headers
+    )
 
 
 # =============================================================================
@@ -3251,13 +2879,93 @@ class ChunkedUploadStatus(BaseModel):
     created_at: datetime
     expires_at: datetime
 
-# In-memory storage for chunked uploads (use Redis in production for persistence)
+# Chunked upload sessions, cached per process and mirrored to session.json in
+# the chunk directory on the shared uploads volume so that any converter
+# process can receive chunks, complete the upload or report its status
 chunked_uploads: dict[str, dict] = {}
 
 # Directory for storing chunks
 chunks_dir = Path(settings.watch_folder) / "chunks"
 chunks_dir.mkdir(parents=True, exist_ok=True)
 
+UPLOAD_SESSION_FILE = "session.json"
+UPLOAD_ID_RE = re.compile(r"^[0-9a-f-]{1,36}$")
+
+
+def save_upload_session(upload: dict):
+    """Persist session state; the chunk list itself is derived from the chunk files"""
+    upload_dir = Path(upload["upload_dir"])
+    upload_dir.mkdir(parents=True, exist_ok=True)
+    state = {k: v for k, v in upload.items() if k not in ("uploaded_chunks", "bytes_uploaded")}
+    tmp_path = upload_dir / f".{UPLOAD_SESSION_FILE}.{os.getpid()}"
+    tmp_path.write_text(json.dumps(state, default=str))
+    tmp_path.replace(upload_dir / UPLOAD_SESSION_FILE)
+
+
+def sync_uploaded_chunks(upload: dict):
+    """Refresh the received chunk list from disk (chunks may arrive at other processes)"""
+    uploaded = []
+    bytes_uploaded = 0
+    upload_dir = Path(upload["upload_dir"])
+    if upload_dir.exists():
+        for chunk_path in upload_dir.glob("chunk_*"):
+            index = chunk_path.name[len("chunk_"):]
+            if index.isdigit():
+                uploaded.append(int(index))
+                bytes_uploaded += chunk_path.stat().st_size
+    upload["uploaded_chunks"] = sorted(uploaded)
+    upload["bytes_uploaded"] = bytes_uploaded
+
+
+def get_upload_session(upload_id: str, refresh: bool = False) -> Optional[dict]:
+    """
+    Look up a chunked upload session. ``refresh`` re-reads the shared state,
+    use it before status transitions that another process may have made.
+    """
+    if not UPLOAD_ID_RE.match(upload_id):
+        return None
+    upload = chunked_uploads.get(upload_id)
+    if upload is not None and not refresh:
+        return upload
+    
+    session_path = chunks_dir / upload_id / UPLOAD_SESSION_FILE
+    try:
+        state = json.loads(session_path.read_text())
+    except (OSError, ValueError):
+        # Not on disk (yet): only a local session, if any
+        return upload
+    
+    for key in ("created_at", "expires_at"):
+        state[key] = datetime.fromisoformat(state[key])
+    if upload is None:
+        upload = chunked_uploads[upload_id] = state
+    else:
+        upload.update(state)
+    sync_uploaded_chunks(upload)
+    return upload
+
+
+def remove_chunk_files(upload: dict):
+    """Delete received chunks but keep session.json for status lookups"""
+    for chunk_path in Path(upload["upload_dir"]).glob("chunk_*"):
+        chunk_path.unlink(missing_ok=True)
+
+
+def cleanup_expired_upload_sessions() -> int:
+    """Remove chunk directories of sessions past their expiry"""
+    removed = 0
+    now = datetime.utcnow()
+    for session_path in chunks_dir.glob(f"*/{UPLOAD_SESSION_FILE}"):
+        try:
+            expires_at = datetime.fromisoformat(json.loads(session_path.read_text())["expires_at"])
+        except (OSError, ValueError, KeyError):
+            continue
+        if expires_at < now:
+            shutil.rmtree(session_path.parent, ignore_errors=True)
+            chunked_uploads.pop(session_path.parent.name, None)
+            removed += 1
+    return removed
+
 
 @app.post("/upload/init")
 async def init_chunked_upload(
@@ -3298,7 +3006,7 @@ async def init_chunked_upload(
         
         # Store upload session
         now = datetime.utcnow()
-        chunked_uploads[upload_id] = {
+        upload = chunked_uploads[upload_id] = {
             "upload_id": upload_id,
             "filename": request.filename,
             "file_size": request.file_size,
@@ -3316,6 +3024,7 @@ async def init_chunked_upload(
             "expires_at": now + timedelta(hours=24),  # 24 hour expiry
             "upload_dir": str(upload_dir)
         }
+        save_upload_session(upload)
         
         # Log auth state for debugging ownership issues
         if current_user:
@@ -3347,11 +3056,10 @@ async def upload_chunk(
     """
     Upload a single chunk. Chunks can be uploaded in any order and retried.
     """
-    if upload_id not in chunked_uploads:
+    upload = get_upload_session(upload_id)
+    if upload is None:
         raise HTTPException(status_code=404, detail="Upload session not found or expired")
     
-    upload = chunked_uploads[upload_id]
-    
     if upload["status"] not in ["uploading"]:
         raise HTTPException(
             status_code=400, 
@@ -3379,12 +3087,15 @@ async def upload_chunk(
             detail=f"Chunk size mismatch. Expected {expected_size}, got {len(chunk_data)}"
         )
     
-    # Save chunk to disk
+    # Save chunk to disk (renamed into place so other processes never see partial chunks)
     chunk_path = Path(upload["upload_dir"]) / f"chunk_{chunk_index:06d}"
+    part_path = chunk_path.with_name(f".{chunk_path.name}.{uuid.uuid4().hex[:8]}")
     try:
-        with open(chunk_path, "wb") as f:
+        with open(part_path, "wb") as f:
             f.write(chunk_data)
+        part_path.replace(chunk_path)
     except Exception as e:
+        part_path.unlink(missing_ok=True)
         raise HTTPException(status_code=500, detail=f"Failed to save chunk: {str(e)}")
     
     # Update upload status
@@ -3415,15 +3126,12 @@ async def complete_chunked_upload(
 ):
     """
     Complete the chunked upload - assembles chunks and starts conversion.
-    Returns immediately while conversion runs in background thread.
+    Returns immediately while assembly and conversion run in the background.
     """
-    import threading
-    
-    if upload_id not in chunked_uploads:
+    upload = get_upload_session(upload_id, refresh=True)
+    if upload is None:
         raise HTTPException(status_code=404, detail="Upload session not found or expired")
     
-    upload = chunked_uploads[upload_id]
-    
     if upload["status"] != "uploading":
         raise HTTPException(
             status_code=400,
@@ -3441,21 +3149,11 @@ async def complete_chunked_upload(
     upload["status"] = "assembling"
     upload["message"] = "Assembling chunks..."
     upload["progress"] = 50
+    save_upload_session(upload)
     
-    # Run assembly and conversion in a separate thread to not block the response
-    # This ensures the endpoint returns immediately while conversion runs in background
-    def run_in_thread():
-        import asyncio
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            loop.run_until_complete(assemble_and_convert(upload_id))
-        finally:
-            loop.close()
-    
-    thread = threading.Thread(target=run_in_thread, daemon=True)
-    thread.start()
-    logger.info(f"📦 Started background conversion thread for {upload_id}")
+    # Assembly runs in a thread; the assembled file then goes to the job queue
+    background_tasks.add_task(assemble_and_convert, upload_id)
+    logger.info(f"📦 Started background conversion for {upload_id}")
     
     return {
         "upload_id": upload_id,
@@ -3473,11 +3171,10 @@ async def complete_dicom_chunked_upload(
     Complete a chunked DICOM upload - assembles chunks and sends directly to Orthanc.
     Unlike conversion uploads, this sends the assembled file to Orthanc immediately.
     """
-    if upload_id not in chunked_uploads:
+    upload = get_upload_session(upload_id, refresh=True)
+    if upload is None:
         raise HTTPException(status_code=404, detail="Upload session not found or expired")
     
-    upload = chunked_uploads[upload_id]
-    
     if upload["status"] != "uploading":
         raise HTTPException(
             status_code=400,
@@ -3495,6 +3192,7 @@ async def complete_dicom_chunked_upload(
     upload["status"] = "assembling"
     upload["message"] = "Assembling DICOM file..."
     upload["progress"] = 80
+    save_upload_session(upload)
     
     try:
         upload_dir = Path(upload["upload_dir"])
@@ -3535,18 +3233,15 @@ async def complete_dicom_chunked_upload(
         total_size = int(upload["file_size"])
         logger.info(f"📦 Streaming DICOM to Orthanc: {total_size / (1024*1024):.1f} MB")
 
-        upload_timeout = httpx.Timeout(1800.0, connect=30.0)
-        async with httpx.AsyncClient(timeout=upload_timeout) as client:  # 30 minute timeout for very large files
-            response = await client.post(
-                f"{settings.orthanc_url}/instances",
-                content=chunked_file_stream(),
-                headers={
-                    "Content-Type": "application/dicom",
-                    # Ensure Orthanc/HTTP layer knows the full size up front
-                    "Content-Length": str(total_size),
-                },
-                auth=(settings.orthanc_username, settings.orthanc_password)
-            )
+        response = await orthanc_client.post(
+            "/instances",
+            content=chunked_file_stream(),
+            headers={
+                "Content-Type": "application/dicom",
+                # Ensure Orthanc/HTTP layer knows the full size up front
+                "Content-Length": str(total_size),
+            },
+        )
         
         if response.status_code not in (200, 201):
             raise HTTPException(
@@ -3559,6 +3254,10 @@ async def complete_dicom_chunked_upload(
         
         # Claim ownership (best-effort; uploads can be anonymous like /instances)
         study_id = result.get("ParentStudy")
+        if study_id:
+            await orthanc_index.mark_changed(study_id)
+            invalidate_wsi_metadata(study_id)
+            schedule_manifest_refresh(orthanc_client, get_db_pool, study_id)
         if study_id and current_user and current_user.id:
             try:
                 await set_study_owner(study_id, current_user.id)
@@ -3567,11 +3266,12 @@ async def complete_dicom_chunked_upload(
                 logger.warning(f"Failed to claim study {study_id}: {e}")
         
         # Clean up chunk files once Orthanc has accepted the instance
-        shutil.rmtree(upload_dir, ignore_errors=True)
+        remove_chunk_files(upload)
         
         upload["status"] = "complete"
         upload["message"] = "DICOM uploaded successfully"
         upload["progress"] = 100
+        save_upload_session(upload)
         
         return {
             "status": "complete",
@@ -3590,7 +3290,8 @@ async def complete_dicom_chunked_upload(
         
         # Clean up on error
         try:
-            shutil.rmtree(upload_dir, ignore_errors=True)
+            remove_chunk_files(upload)
+            save_upload_session(upload)
         except:
             pass
         
@@ -3598,8 +3299,8 @@ async def complete_dicom_chunked_upload(
 
 
 async def assemble_and_convert(upload_id: str):
-    """Background task to assemble chunks and start conversion"""
-    upload = chunked_uploads.get(upload_id)
+    """Background task to assemble chunks and queue the conversion"""
+    upload = get_upload_session(upload_id)
     if not upload:
         return
     
@@ -3615,14 +3316,17 @@ async def assemble_and_convert(upload_id: str):
         # Assemble chunks
         logger.info(f"📦 Assembling {upload['total_chunks']} chunks for {upload_id}")
         
-        with open(final_path, "wb") as outfile:
-            for i in range(upload["total_chunks"]):
-                chunk_path = upload_dir / f"chunk_{i:06d}"
-                with open(chunk_path, "rb") as chunk_file:
-                    outfile.write(chunk_file.read())
-                
-                # Update progress (assembling is 50-60%)
-                upload["progress"] = 50 + int((i / upload["total_chunks"]) * 10)
+        def assemble():
+            with open(final_path, "wb") as outfile:
+                for i in range(upload["total_chunks"]):
+                    chunk_path = upload_dir / f"chunk_{i:06d}"
+                    with open(chunk_path, "rb") as chunk_file:
+                        shutil.copyfileobj(chunk_file, outfile, 16 * 1024 * 1024)
+                    
+                    # Update progress (assembling is 50-60%)
+                    upload["progress"] = 50 + int((i / upload["total_chunks"]) * 10)
+        
+        await asyncio.to_thread(assemble)
         
         # Verify file size
         actual_size = final_path.stat().st_size
@@ -3630,16 +3334,11 @@ async def assemble_and_convert(upload_id: str):
             raise Exception(f"Assembled file size mismatch: expected {upload['file_size']}, got {actual_size}")
         
         # Clean up chunks
-        shutil.rmtree(upload_dir, ignore_errors=True)
-        
-        upload["status"] = "converting"
-        upload["message"] = "Starting conversion..."
-        upload["progress"] = 60
-        upload["job_id"] = job_id
+        await asyncio.to_thread(remove_chunk_files, upload)
         
         # Create conversion job
         owner_id = upload.get("owner_id")
-        logger.info(f"📦 Assembly complete for {upload_id}, starting conversion job {job_id}")
+        logger.info(f"📦 Assembly complete for {upload_id}, queueing conversion job {job_id}")
         logger.info(f"   👤 Owner ID from upload session: {owner_id}")
         job = ConversionJob(
             job_id=job_id,
@@ -3647,26 +3346,27 @@ async def assemble_and_convert(upload_id: str):
             status="pending",
             message=f"Queued for conversion (format: {upload['source_format']})",
             owner_id=owner_id,
-            created_at=datetime.utcnow()
+            created_at=datetime.utcnow(),
+            file_path=str(final_path),
+            source_format=upload["source_format"],
+            upload_id=upload_id,
+            priority=actual_size,
         )
-        conversion_jobs[job_id] = job
+        await job_queue.enqueue(job)
         
-        # Start conversion
-        await convert_wsi_to_dicom(job_id, final_path)
-        
-        # Update upload status from job
-        job = conversion_jobs.get(job_id)
-        if job:
-            upload["status"] = "completed" if job.status == "completed" else "failed"
-            upload["progress"] = 100 if job.status == "completed" else upload["progress"]
-            upload["message"] = job.message
+        upload["status"] = "converting"
+        upload["message"] = job.message
+        upload["progress"] = 60
+        upload["job_id"] = job_id
+        save_upload_session(upload)
         
     except Exception as e:
         logger.error(f"❌ Chunked upload assembly failed for {upload_id}: {e}")
         upload["status"] = "failed"
         upload["message"] = str(e)
         # Clean up
-        shutil.rmtree(Path(upload["upload_dir"]), ignore_errors=True)
+        remove_chunk_files(upload)
+        save_upload_session(upload)
 
 
 @app.get("/upload/{upload_id}/status")
@@ -3674,30 +3374,24 @@ async def get_chunked_upload_status(upload_id: str):
     """
     Get the status of a chunked upload, including conversion progress.
     """
-    if upload_id not in chunked_uploads:
+    upload = get_upload_session(upload_id, refresh=True)
+    if upload is None:
         raise HTTPException(status_code=404, detail="Upload session not found or expired")
     
-    upload = chunked_uploads[upload_id]
-    
     # If converting, sync progress from conversion job
-    if upload["status"] == "converting" and upload["job_id"]:
-        job = conversion_jobs.get(upload["job_id"])
-        if job:
-            # Conversion progress is 60-100%
-            upload["progress"] = 60 + int(job.progress * 0.4)
-            upload["message"] = job.message
-            if job.status == "completed":
-                upload["status"] = "completed"
-                upload["progress"] = 100
-            elif job.status == "failed":
-                upload["status"] = "failed"
+    job = await job_queue.get(upload["job_id"]) if upload["job_id"] else None
+    if upload["status"] == "converting" and job:
+        # Conversion progress is 60-100%
+        upload["progress"] = 60 + int(job.progress * 0.4)
+        upload["message"] = job.message
+        if job.status == "completed":
+            upload["status"] = "completed"
+            upload["progress"] = 100
+        elif job.status in ("failed", "cancelled"):
+            upload["status"] = job.status
     
     # Get study_id from completed job
-    study_id = None
-    if upload["job_id"]:
-        job = conversion_jobs.get(upload["job_id"])
-        if job and job.study_id:
-            study_id = job.study_id
+    study_id = job.study_id if job else None
     
     return {
         "upload_id": upload["upload_id"],
@@ -3719,16 +3413,19 @@ async def get_chunked_upload_status(upload_id: str):
 @app.delete("/upload/{upload_id}")
 async def cancel_chunked_upload(upload_id: str):
     """Cancel and clean up a chunked upload"""
-    if upload_id not in chunked_uploads:
+    upload = get_upload_session(upload_id, refresh=True)
+    if upload is None:
         raise HTTPException(status_code=404, detail="Upload session not found")
     
-    upload = chunked_uploads[upload_id]
+    # Stop the conversion if it already started
+    if upload["job_id"]:
+        await job_queue.cancel(upload["job_id"])
     
     # Clean up chunks
     shutil.rmtree(Path(upload["upload_dir"]), ignore_errors=True)
     
     # Remove from tracking
-    del chunked_uploads[upload_id]
+    chunked_uploads.pop(upload_id, None)
     
     logger.info(f"📦 Chunked upload {upload_id} cancelled and cleaned up")
     
@@ -3742,6 +3439,17 @@ async def cancel_chunked_upload(upload_id: str):
 import re
 from starlette.responses import StreamingResponse
 
+# tiles/{series_id}/{level}/{x}/{y}
+WSI_TILE_PATH_RE = re.compile(r'^tiles/([a-f0-9-]+)/(\d+)/(\d+)/(\d+)$')
+# Query parameters a cached tile request may carry (the viewer's cache buster,
+# a quality hint and ICC correction)
+TILE_QUERY_PARAMS = {"_", "quality", "icc"}
+
+# Series -> parent study mapping (Orthanc IDs never change, so this only needs
+# dropping when a study is deleted)
+_SERIES_STUDY_CACHE_TTL_SECONDS = 600
+_series_study_cache: dict[str, tuple[float, str]] = {}
+
 async def extract_study_id_from_wsi_path(path: str) -> Optional[str]:
     """Extract study ID from WSI plugin paths.
     
@@ -3759,28 +3467,34 @@ async def extract_study_id_from_wsi_path(path: str) -> Optional[str]:
     # Check for tiles path (series ID - need to lookup)
     tiles_match = re.match(r'^tiles/([a-f0-9-]+)/', path)
     if tiles_match:
-        series_id = tiles_match.group(1)
-        # Lookup parent study from Orthanc
-        try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    f"{settings.orthanc_url}/series/{series_id}",
-                    auth=(settings.orthanc_username, settings.orthanc_password),
-                    timeout=10.0
-                )
-                if response.status_code == 200:
-                    series_data = response.json()
-                    parent_study = series_data.get("ParentStudy")
-                    logger.debug(f"WSI path tile: series {series_id} -> study {parent_study}")
-                    return parent_study
-                else:
-                    logger.warning(f"Series lookup failed: {series_id}, status={response.status_code}")
-        except Exception as e:
-            logger.warning(f"Failed to lookup study for series {series_id}: {e}")
+        return await lookup_series_study(tiles_match.group(1))
     
     return None
 
 
+async def lookup_series_study(series_id: str) -> Optional[str]:
+    """Parent study of a series (cached)"""
+    now = time.monotonic()
+    cached = _series_study_cache.get(series_id)
+    if cached and cached[0] > now:
+        return cached[1]
+    # Lookup parent study from Orthanc
+    try:
+        response = await orthanc_client.get(f"/series/{series_id}")
+        if response.status_code == 200:
+            series_data = response.json()
+            parent_study = series_data.get("ParentStudy")
+            logger.debug(f"WSI path tile: series {series_id} -> study {parent_study}")
+            if parent_study:
+                _series_study_cache[series_id] = (now + _SERIES_STUDY_CACHE_TTL_SECONDS, parent_study)
+            return parent_study
+        else:
+            logger.warning(f"Series lookup failed: {series_id}, status={response.status_code}")
+    except Exception as e:
+        logger.warning(f"Failed to lookup study for series {series_id}: {e}")
+    return None
+
+
 async def extract_study_id_from_dicomweb_path(path: str) -> Optional[str]:
     """Extract study ID from DICOMweb paths.
     
@@ -3796,24 +3510,53 @@ async def extract_study_id_from_dicomweb_path(path: str) -> Optional[str]:
         study_uid = studies_match.group(1)
         # DICOMweb uses DICOM UIDs, need to find Orthanc ID
         try:
-            async with httpx.AsyncClient() as client:
-                # Search for study by DICOM UID
-                response = await client.post(
-                    f"{settings.orthanc_url}/tools/lookup",
-                    auth=(settings.orthanc_username, settings.orthanc_password),
-                    json=study_uid,
-                    timeout=10.0
-                )
-                if response.status_code == 200:
-                    results = response.json()
-                    if results and len(results) > 0:
-                        return results[0].get("ID")
+            # Search for study by DICOM UID
+            response = await orthanc_client.post(
+                "/tools/lookup",
+                json=study_uid
+            )
+            if response.status_code == 200:
+                results = response.json()
+                if results and len(results) > 0:
+                    return results[0].get("ID")
         except Exception as e:
             logger.warning(f"Failed to lookup study for UID {study_uid}: {e}")
     
     return None
 
 
+# Request headers relayed to Orthanc by the streaming proxies
+PROXY_REQUEST_HEADERS = (
+    "accept", "range", "if-range", "if-none-match", "if-modified-since",
+    "content-type", "content-length",
+)
+# Upstream headers relayed back (content-type carries multipart/related boundaries)
+PROXY_RESPONSE_HEADERS = (
+    "content-type", "content-length", "content-encoding", "content-range",
+    "accept-ranges", "content-disposition", "etag", "last-modified",
+)
+
+
+async def open_orthanc_stream(request: Request, target_url: str, timeout: float) -> OrthancStream:
+    """Forward a client request to Orthanc, streaming any request body upstream"""
+    headers = {h: request.headers[h] for h in PROXY_REQUEST_HEADERS if h in request.headers}
+    # Bodies are relayed as-is, so only ask for encodings the client understands
+    headers["accept-encoding"] = request.headers.get("accept-encoding", "identity")
+    body = request.stream() if request.method in ("POST", "PUT") else None
+    return await orthanc_client.stream(request.method, target_url, content=body, headers=headers, timeout=timeout)
+
+
+def relay_orthanc_stream(upstream: OrthancStream, headers: dict) -> StreamingResponse:
+    """Relay an upstream response chunk by chunk - memory stays at one chunk per request"""
+    relayed = {h: upstream.headers[h] for h in PROXY_RESPONSE_HEADERS if h in upstream.headers}
+    return StreamingResponse(
+        upstream.aiter_raw(),
+        status_code=upstream.status_code,
+        headers={**relayed, **headers},
+        background=BackgroundTask(upstream.aclose),
+    )
+
+
 @app.api_route("/wsi/{path:path}", methods=["GET", "HEAD", "OPTIONS"])
 async def secure_wsi_proxy(path: str, request: Request, user: Optional[User] = Depends(get_current_user)):
     """
@@ -3844,45 +3587,59 @@ async def secure_wsi_proxy(path: str, request: Request, user: Optional[User] = D
     
     # Proxy to Orthanc
     try:
-        async with httpx.AsyncClient() as client:
-            # Build target URL
-            target_url = f"{settings.orthanc_url}/wsi/{path}"
-            if request.query_params:
-                target_url += f"?{request.query_params}"
-            
-            # Forward request
-            response = await client.request(
-                method=request.method,
-                url=target_url,
-                auth=(settings.orthanc_username, settings.orthanc_password),
-                timeout=60.0
-            )
-            
-            # Handle missing tiles (Orthanc returns 403/404 for non-existent frames)
-            if response.status_code in (403, 404) and '/tiles/' in path:
-                # Return 404 for missing tiles (clearer than 403)
+        # Serve plain tile GETs through the tile cache
+        tile_match = WSI_TILE_PATH_RE.match(path)
+        if tile_match and request.method == "GET" and set(request.query_params) <= TILE_QUERY_PARAMS:
+            series_id, level, x, y = tile_match.groups()
+            fmt = negotiate_tile_format(request)
+            icc = wants_icc_correction(request)
+            etag = strong_etag("tile", series_id, level, x, y, tile_variant(fmt, icc))
+            headers = {
+                **tile_response_headers(),
+                "Access-Control-Allow-Origin": "*"
+            }
+            cached = not_modified(request, etag, headers)
+            if cached:
+                return cached
+            tile = await fetch_wsi_tile_as(series_id, int(level), int(x), int(y), fmt, icc)
+            if tile is None:
                 logger.debug(f"Tile not found in Orthanc: {path}")
                 return Response(
                     content=b'',
                     status_code=404,
                     headers={"Cache-Control": "no-cache"}
                 )
-            
-            # Return response with caching headers for tiles
-            headers = {
-                "Cache-Control": "public, max-age=604800",
-                "Access-Control-Allow-Origin": "*"
-            }
-            
-            # Copy content-type if present
-            if "content-type" in response.headers:
-                headers["Content-Type"] = response.headers["content-type"]
-            
+            content, media_type = tile
             return Response(
-                content=response.content,
-                status_code=response.status_code,
-                headers=headers
+                content=content,
+                media_type=media_type,
+                headers={**headers, "ETag": etag}
+            )
+
+        # Build target URL
+        target_url = f"/wsi/{path}"
+        if request.query_params:
+            target_url += f"?{request.query_params}"
+        
+        # Forward request; the body is streamed back, never buffered
+        upstream = await open_orthanc_stream(request, target_url, timeout=60.0)
+        
+        # Handle missing tiles (Orthanc returns 403/404 for non-existent frames)
+        if upstream.status_code in (403, 404) and '/tiles/' in path:
+            await upstream.aclose()
+            # Return 404 for missing tiles (clearer than 403)
+            logger.debug(f"Tile not found in Orthanc: {path}")
+            return Response(
+                content=b'',
+                status_code=404,
+                headers={"Cache-Control": "no-cache"}
             )
+        
+        # Return response with caching headers for tiles
+        return relay_orthanc_stream(upstream, {
+            "Cache-Control": "public, max-age=604800",
+            "Access-Control-Allow-Origin": "*"
+        })
     except httpx.HTTPError as e:
         logger.error(f"WSI proxy error: {e}")
         raise HTTPException(status_code=502, detail=f"Orthanc error: {str(e)}")
@@ -3905,47 +3662,452 @@ async def secure_dicomweb_proxy(path: str, request: Request, user: User = Depend
     
     # Proxy to Orthanc
     try:
-        async with httpx.AsyncClient() as client:
-            # Build target URL
-            target_url = f"{settings.orthanc_url}/dicom-web/{path}"
-            if request.query_params:
-                target_url += f"?{request.query_params}"
-            
-            # Stream request body for POST requests to avoid buffering large STOW-RS payloads
-            body = None
-            if request.method == "POST":
-                body = request.stream()
-            
-            # Forward request
-            response = await client.request(
-                method=request.method,
-                url=target_url,
-                auth=(settings.orthanc_username, settings.orthanc_password),
-                content=body,
-                headers={"Content-Type": request.headers.get("content-type", "application/json")},
-                timeout=120.0
-            )
-            
-            # Build response headers
-            headers = {
-                "Access-Control-Allow-Origin": "*"
-            }
-            
-            # Copy relevant headers
-            for header in ["content-type", "content-length", "content-disposition"]:
-                if header in response.headers:
-                    headers[header.title()] = response.headers[header]
-            
-            return Response(
-                content=response.content,
-                status_code=response.status_code,
-                headers=headers
-            )
+        # Build target URL
+        target_url = f"/dicom-web/{path}"
+        if request.query_params:
+            target_url += f"?{request.query_params}"
+        
+        # Stream both ways: STOW-RS uploads go up and WADO-RS retrieves come
+        # back chunk by chunk, so multi-GB series never sit in memory
+        upstream = await open_orthanc_stream(request, target_url, timeout=120.0)
+        return relay_orthanc_stream(upstream, {"Access-Control-Allow-Origin": "*"})
     except httpx.HTTPError as e:
         logger.error(f"DICOMweb proxy error: {e}")
         raise HTTPException(status_code=502, detail=f"Orthanc error: {str(e)}")
 
 
+class TileBatchKey(BaseModel):
+    level: int
+    x: int
+    y: int
+    # Focal plane tiles: the plane's instance for this level and the frame for (x, y)
+    instance: Optional[str] = None
+    frame: Optional[int] = None
+    # Colour-correct to sRGB with the series' ICC profile
+    icc: bool = False
+
+
+class TileBatchRequest(BaseModel):
+    series_id: str
+    tiles: list[TileBatchKey]
+    # Transcoding quality hint (low/medium/high or 1-100)
+    quality: Optional[str] = None
+
+
+# Focal plane instance -> parent series (same lifetime as the series cache)
+_instance_series_cache: dict[str, tuple[float, str]] = {}
+
+
+async def lookup_instance_series(instance_id: str) -> Optional[str]:
+    """Parent series of an instance (cached)"""
+    now = time.monotonic()
+    cached = _instance_series_cache.get(instance_id)
+    if cached and cached[0] > now:
+        return cached[1]
+    response = await orthanc_client.get(f"/instances/{instance_id}")
+    if response.status_code != 200:
+        return None
+    series_id = response.json().get("ParentSeries")
+    if series_id:
+        _instance_series_cache[instance_id] = (now + _SERIES_STUDY_CACHE_TTL_SECONDS, series_id)
+    return series_id
+
+
+@app.post("/studies/{study_id}/tiles:batch")
+async def get_tile_batch(
+    study_id: str,
+    batch: TileBatchRequest,
+    request: Request,
+    user: Optional[User] = Depends(get_current_user)
+):
+    """
+    Fetch many tiles in one request.
+    
+    The viewer sends every tile of the visible viewport at once, so auth,
+    the access check and the series lookup run once per batch instead of
+    once per tile. Missing tiles are fetched from Orthanc concurrently
+    through the tile cache.
+    
+    Returns a tile pack (see tile_batch.py): one status/type/length header
+    entry per requested key, in request order, followed by the payloads.
+    """
+    if len(batch.tiles) > settings.tile_batch_max_tiles:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {settings.tile_batch_max_tiles} tiles per batch"
+        )
+    
+    user_id = user.id if user else None
+    if not await can_access_study(user_id, study_id):
+        raise HTTPException(status_code=403, detail="Access denied to this slide")
+    if await lookup_series_study(batch.series_id) != study_id:
+        raise HTTPException(status_code=404, detail="Series not found in study")
+    
+    # Focal plane instances must belong to this study too
+    instances = {key.instance for key in batch.tiles if key.instance}
+    for instance_id in instances:
+        series_id = await lookup_instance_series(instance_id)
+        if not series_id or await lookup_series_study(series_id) != study_id:
+            raise HTTPException(status_code=404, detail="Instance not found in study")
+    
+    accepted = accepted_media_types(request.headers.get("accept", ""))
+    fmt = negotiate_tile_format(request, batch.quality)
+    
+    async def fetch(key: TileBatchKey):
+        if key.instance:
+            return await fetch_frame(key.instance, key.frame or 0, accepted)
+        return await fetch_wsi_tile_as(batch.series_id, key.level, key.x, key.y, fmt, key.icc)
+    
+    results = await fetch_tiles(batch.tiles, fetch, concurrency=settings.tile_batch_concurrency)
+    return Response(
+        content=pack_tiles(results),
+        media_type=TILE_PACK_MEDIA_TYPE,
+        headers={"Cache-Control": "no-store"}
+    )
+
+
+class PrefetchViewport(BaseModel):
+    x: float
+    y: float
+    width: float
+    height: float
+
+
+class PrefetchVelocity(BaseModel):
+    x: float = 0.0
+    y: float = 0.0
+
+
+class PrefetchRequest(BaseModel):
+    series_id: str
+    # Random id of the viewer tab, so its predictions only replace its own
+    viewer_id: Optional[str] = None
+    # Visible region and velocity in full-resolution pixels (per second)
+    viewport: PrefetchViewport
+    velocity: PrefetchVelocity = PrefetchVelocity()
+    # Full-resolution pixels per screen pixel (picks the pyramid level)
+    scale: float = 1.0
+    # Pyramid levels per second, positive when zooming in
+    zoom_velocity: float = 0.0
+
+
+@app.post("/studies/{study_id}/prefetch", status_code=202)
+async def prefetch_viewport(
+    study_id: str,
+    prefetch: PrefetchRequest,
+    request: Request,
+    user: Optional[User] = Depends(get_current_user)
+):
+    """
+    Warm the tile cache for where a moving viewport is heading.
+    
+    The viewer reports its viewport, zoom and pan/zoom velocity while the
+    slide is moving; the tiles of the predicted next viewports and of the
+    adjacent pyramid level are queued for background fetching. Prefetches
+    run on a few low-priority workers that give way to interactive tile
+    requests, and each client's newer prediction replaces its older one.
+    
+    Hit rates are reported under "prefetch" and "tile_cache" in /status.
+    """
+    if not settings.prefetch_enabled:
+        return {"queued": 0, "enabled": False}
+    
+    user_id = user.id if user else None
+    if not await can_access_study(user_id, study_id):
+        raise HTTPException(status_code=403, detail="Access denied to this slide")
+    if await lookup_series_study(prefetch.series_id) != study_id:
+        raise HTTPException(status_code=404, detail="Series not found in study")
+    
+    levels = await pyramid_cache.get(prefetch.series_id)
+    if not levels:
+        return {"queued": 0, "enabled": True}
+    
+    viewport = prefetch.viewport
+    level = choose_level(levels, prefetch.scale)
+    tiles = predict_tiles(
+        levels,
+        level,
+        (viewport.x, viewport.y, viewport.width, viewport.height),
+        velocity=(prefetch.velocity.x, prefetch.velocity.y),
+        zoom_velocity=prefetch.zoom_velocity,
+        max_tiles=settings.prefetch_max_tiles,
+    )
+    # Anonymous viewers all have user_id None: tell them apart by viewer id or address
+    viewer = (prefetch.viewer_id or "")[:64] or (request.client.host if request.client else "")
+    queued = tile_prefetcher.submit(
+        f"{user_id}:{viewer}:{prefetch.series_id}",
+        [(prefetch.series_id, lvl, x, y) for lvl, x, y in tiles]
+    )
+    return {"queued": queued, "level": level, "enabled": True}
+
+
+async def resolve_region_source(study_id: str, series_id: Optional[str]) -> tuple[str, float]:
+    """Series to cut a region from (default: the main pyramid) and its level-0 µm per pixel"""
+    stored = await study_manifest(study_id)
+    manifest = stored[0] if stored else {}
+    if series_id is None:
+        wsi = manifest.get("wsi")
+        if not wsi:
+            raise HTTPException(status_code=404, detail="No WSI pyramid in this study")
+        series_id = await lookup_instance_series(wsi["instanceId"])
+    elif await lookup_series_study(series_id) != study_id:
+        raise HTTPException(status_code=404, detail="Series not found in study")
+    if not series_id:
+        raise HTTPException(status_code=404, detail="No WSI pyramid in this study")
+    spacing = (manifest.get("calibration") or {}).get("pixel_spacing_um") or [0.25, 0.25]
+    return series_id, float(spacing[0])
+
+
+@app.get("/studies/{study_id}/region")
+async def get_region(
+    study_id: str,
+    request: Request,
+    x: int = Query(..., ge=0),
+    y: int = Query(..., ge=0),
+    w: int = Query(..., gt=0),
+    h: int = Query(..., gt=0),
+    level: Optional[int] = None,
+    mpp: Optional[float] = Query(None, gt=0),
+    format: str = "png",
+    series: Optional[str] = None,
+    user: User = Depends(require_user)
+):
+    """
+    Extract an arbitrary region of a slide.
+    
+    x, y, w and h are in full-resolution (level 0) pixels. The resolution is
+    either a pyramid ``level`` or a target ``mpp`` (µm per pixel), which picks
+    the coarsest level at least that fine; without either, level 0 is used.
+    The level and its actual µm per pixel are returned in X-Region-Level and
+    X-Region-Mpp. ``?icc=1`` colour-corrects the tiles first.
+    
+    The covering tiles are fetched concurrently through the tile cache and
+    stitched with NumPy. Regions up to REGION_BUFFER_MAX_PIXELS are
+    encoded whole; larger ones are streamed band by band (PNG or tiled
+    uncompressed TIFF), so memory stays at one band whatever the size.
+    """
+    if not user.id or not await can_access_study(user.id, study_id):
+        raise HTTPException(status_code=403, detail="Access denied to this slide")
+    if format not in REGION_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Format must be one of: {', '.join(REGION_MEDIA_TYPES)}")
+    if level is not None and mpp is not None:
+        raise HTTPException(status_code=400, detail="Give either level or mpp, not both")
+    
+    series_id, base_mpp = await resolve_region_source(study_id, series)
+    levels = await pyramid_cache.get(series_id)
+    if not levels:
+        raise HTTPException(status_code=404, detail="No WSI pyramid for this series")
+    if mpp is not None:
+        level = level_for_mpp(levels, base_mpp, mpp)
+    try:
+        plan = plan_region(levels, level or 0, x, y, w, h)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if plan.pixels > settings.region_max_pixels:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Region is {plan.pixels} pixels at level {plan.level}; at most {settings.region_max_pixels}"
+        )
+    
+    icc = wants_icc_correction(request)
+    region_mpp = base_mpp * plan.downsample
+    
+    async def fetch(tile_x: int, tile_y: int):
+        return await fetch_wsi_tile_as(series_id, plan.level, tile_x, tile_y, None, icc)
+    
+    headers = {
+        "Cache-Control": "private, no-store",
+        "Content-Disposition": f'inline; filename="{study_id}_{x}_{y}_{w}x{h}_L{plan.level}.{format}"',
+        "X-Region-Level": str(plan.level),
+        "X-Region-Mpp": f"{region_mpp:.6g}",
+        "X-Region-Size": f"{plan.width}x{plan.height}",
+    }
+    media_type = REGION_MEDIA_TYPES[format]
+    
+    if plan.pixels <= settings.region_buffer_max_pixels:
+        try:
+            pixels = await stitch_region(plan, fetch, settings.region_concurrency)
+        except httpx.HTTPError as e:
+            raise HTTPException(status_code=502, detail=f"Orthanc error: {str(e)}")
+        content = await asyncio.to_thread(encode_region, pixels, format, region_mpp)
+        return Response(content=content, media_type=media_type, headers=headers)
+    
+    if format == "jpeg":
+        raise HTTPException(
+            status_code=400,
+            detail=f"Regions over {settings.region_buffer_max_pixels} pixels are streamed as png or tiff"
+        )
+    if format == "tiff":
+        if tiff_size(plan.width, plan.height) >= 1 << 32:
+            raise HTTPException(status_code=400, detail="Region too large for a TIFF; use png")
+        headers["Content-Length"] = str(tiff_size(plan.width, plan.height))
+        body = tiff_stream(plan.width, plan.height,
+                           iter_bands(plan, fetch, TIFF_TILE_SIZE, settings.region_concurrency), region_mpp)
+    else:
+        body = png_stream(plan.width, plan.height,
+                          iter_bands(plan, fetch, PNG_BAND_HEIGHT, settings.region_concurrency), region_mpp)
+    logger.info(f"✂️ Streaming {plan.width}x{plan.height} {format} region of {study_id} at level {plan.level}")
+    return StreamingResponse(body, media_type=media_type, headers=headers)
+
+
+# =============================================================================
+# IIIF IMAGE API 3 / DEEP ZOOM - Standard tile services for external viewers
+# =============================================================================
+
+IIIF_PROFILE_LINK = '<http://iiif.io/api/image/3/level2.json>;rel="profile"'
+
+
+def iiif_base_url(request: Request) -> str:
+    """Externally visible URL of the IIIF service"""
+    if settings.iiif_base_url:
+        return settings.iiif_base_url.rstrip("/")
+    scheme = request.headers.get("x-forwarded-proto", request.url.scheme)
+    host = request.headers.get("host", request.url.netloc)
+    prefix = request.headers.get("x-forwarded-prefix", "").rstrip("/")
+    return f"{scheme}://{host}{prefix}/iiif/3"
+
+
+async def load_image_pyramid(study_id: str, user: Optional[User]) -> tuple[str, list]:
+    """Main pyramid series of a study and its levels, after the access check"""
+    user_id = user.id if user else None
+    if not await can_access_study(user_id, study_id):
+        raise HTTPException(status_code=403, detail="Access denied to this slide")
+    series_id, _ = await resolve_region_source(study_id, None)
+    levels = await pyramid_cache.get(series_id)
+    if not levels:
+        raise HTTPException(status_code=404, detail="No WSI pyramid for this study")
+    return series_id, levels
+
+
+async def render_image_request(series_id: str, levels: list, image: ImageRequest) -> Optional[tuple[bytes, str]]:
+    """
+    Image for a IIIF/DZI request. A request that is exactly one native tile
+    in its stored format is that tile, byte for byte; anything else is
+    stitched from the closest finer level, resampled and cached.
+    """
+    native = native_tile(levels, image)
+    if native:
+        tile = await fetch_wsi_tile(series_id, *native)
+        if tile and tile[1] == image.media_type:
+            return tile
+
+    region = image.region
+    level = choose_level(levels, region.width / image.width)
+    plan = plan_region(levels, level, *region)
+    if plan.pixels > settings.region_buffer_max_pixels:
+        raise HTTPException(status_code=400, detail="Region too large for the available pyramid levels")
+
+    async def resample():
+        pixels = await stitch_region(
+            plan, lambda x, y: fetch_wsi_tile(series_id, level, x, y), settings.region_concurrency
+        )
+        return await asyncio.to_thread(render, pixels, image), image.media_type
+
+    return await tile_cache.get_or_fetch(tile_key(series_id, level, region.x, region.y, image.variant), resample)
+
+
+async def image_response(request: Request, series_id: str, levels: list, image: ImageRequest) -> Response:
+    etag = strong_etag("iiif", series_id, *image.region, image.variant)
+    headers = {
+        "Cache-Control": TILE_CACHE_CONTROL,
+        "Access-Control-Allow-Origin": "*",
+        "Link": IIIF_PROFILE_LINK,
+    }
+    cached = not_modified(request, etag, headers)
+    if cached:
+        return cached
+    try:
+        result = await render_image_request(series_id, levels, image)
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"Orthanc error: {str(e)}")
+    if result is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    content, media_type = result
+    return Response(content=content, media_type=media_type, headers={**headers, "ETag": etag})
+
+
+@app.get("/iiif/3/{study_id}")
+async def iiif_base(study_id: str, request: Request):
+    """IIIF base URI: redirects to the image information"""
+    return RedirectResponse(f"{iiif_base_url(request)}/{study_id}/info.json", status_code=303)
+
+
+@app.get("/iiif/3/{study_id}/info.json")
+async def iiif_info(study_id: str, request: Request, user: Optional[User] = Depends(get_current_user)):
+    """
+    IIIF Image API 3 image information for a study's main pyramid.
+    
+    Tiles are the native tile size with one scale factor per pyramid
+    level, so viewers such as OpenSeadragon, Mirador or QuPath request
+    exactly the stored tiles.
+    """
+    _, levels = await load_image_pyramid(study_id, user)
+    info = info_json(f"{iiif_base_url(request)}/{study_id}", levels, settings.iiif_max_area)
+    media_type = IIIF_LD_MEDIA_TYPE if "application/ld+json" in request.headers.get("accept", "") \
+        else "application/json"
+    etag = json_etag(info)
+    headers = {
+        "Cache-Control": REVALIDATE_CACHE_CONTROL,
+        "Access-Control-Allow-Origin": "*",
+        "Link": IIIF_PROFILE_LINK,
+    }
+    cached = not_modified(request, etag, headers, exists=True)
+    if cached:
+        return cached
+    return JSONResponse(content=info, media_type=media_type, headers={**headers, "ETag": etag})
+
+
+@app.get("/iiif/3/{study_id}/{region}/{size}/{rotation}/{quality_format}")
+async def iiif_image(
+    study_id: str,
+    region: str,
+    size: str,
+    rotation: str,
+    quality_format: str,
+    request: Request,
+    user: Optional[User] = Depends(get_current_user)
+):
+    """IIIF Image API 3 image request: /{region}/{size}/{rotation}/{quality}.{format}"""
+    series_id, levels = await load_image_pyramid(study_id, user)
+    try:
+        image = parse_image_request(
+            region, size, rotation, quality_format, levels[0].width, levels[0].height, settings.iiif_max_area
+        )
+    except IiifError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    return await image_response(request, series_id, levels, image)
+
+
+@app.get("/dzi/{study_id}.dzi")
+async def dzi_info(study_id: str, user: Optional[User] = Depends(get_current_user)):
+    """Deep Zoom descriptor for a study's main pyramid (native tile size, no overlap)"""
+    _, levels = await load_image_pyramid(study_id, user)
+    return Response(
+        content=dzi_descriptor(levels),
+        media_type="application/xml",
+        headers={"Cache-Control": REVALIDATE_CACHE_CONTROL, "Access-Control-Allow-Origin": "*"}
+    )
+
+
+@app.get("/dzi/{study_id}_files/{level:int}/{column:int}_{row:int}.{fmt}")
+async def dzi_tile(
+    study_id: str,
+    level: int,
+    column: int,
+    row: int,
+    fmt: str,
+    request: Request,
+    user: Optional[User] = Depends(get_current_user)
+):
+    """Deep Zoom tile; levels that match a pyramid level are served as native tiles"""
+    series_id, levels = await load_image_pyramid(study_id, user)
+    try:
+        image = dzi_tile_request(levels, level, column, row, fmt)
+    except IiifError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    return await image_response(request, series_id, levels, image)
+
+
 # =============================================================================
 # PUBLIC SHARING - Anonymous link-based access
 # =============================================================================
@@ -4290,23 +4452,26 @@ async def get_public_tile(token: str, series_id: str, level: int, x: int, y: int
             if expected_series_id and series_id != expected_series_id:
                 raise HTTPException(status_code=404, detail="Not found")
         
-        # Fetch tile from Orthanc
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{settings.orthanc_url}/wsi/tiles/{series_id}/{level}/{x}/{y}",
-                auth=(settings.orthanc_username, settings.orthanc_password),
-                timeout=30.0
-            )
-            
-            if response.status_code in (403, 404):
-                return Response(content=b'', status_code=404)
-            
-            return Response(
-                content=response.content,
-                status_code=response.status_code,
-                media_type=response.headers.get("content-type", "image/jpeg"),
-                headers={"Cache-Control": "public, max-age=604800"}
-            )
+        # Token checks passed: answer revalidation without touching Orthanc
+        fmt = negotiate_tile_format(request)
+        icc = wants_icc_correction(request)
+        etag = strong_etag("tile", series_id, level, x, y, tile_variant(fmt, icc))
+        headers = tile_response_headers()
+        cached = not_modified(request, etag, headers)
+        if cached:
+            return cached
+        
+        # Fetch tile (cached, transcoded if negotiated) from Orthanc
+        tile = await fetch_wsi_tile_as(series_id, level, x, y, fmt, icc)
+        if tile is None:
+            return Response(content=b'', status_code=404)
+        
+        content, media_type = tile
+        return Response(
+            content=content,
+            media_type=media_type,
+            headers={**headers, "ETag": etag}
+        )
     except HTTPException:
         raise
     except Exception as e:
@@ -4343,14 +4508,9 @@ async def get_public_pyramid(token: str, series_id: str, request: Request):
                 raise HTTPException(status_code=404, detail="Not found")
         
         # Fetch pyramid from Orthanc
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{settings.orthanc_url}/wsi/pyramids/{series_id}",
-                auth=(settings.orthanc_username, settings.orthanc_password),
-                timeout=30.0
-            )
-            response.raise_for_status()
-            return response.json()
+        response = await orthanc_client.get(f"/wsi/pyramids/{series_id}")
+        response.raise_for_status()
+        return response.json()
     except HTTPException:
         raise
     except Exception as e:
@@ -0,0 +1,446 @@
+"""
+Slide Manifest
+Precomputed per-study description of everything the viewer needs to open a
+slide: pyramid levels and tile grid, focal planes, calibration, ICC transform
+and Leica virtual pyramids. Built once at upload/conversion time, stored in
+Postgres and served with an ETag from /studies/{id}/manifest.
+"""
+
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from datetime import datetime
+from typing import Optional
+
+from wsi_metadata import fetch_study_instance_tags, build_wsi_metadata
+
+logger = logging.getLogger(__name__)
+
+# Stored manifests of an older version are rebuilt on their next read
+MANIFEST_VERSION = 3
+
+# Coalesce bursts of per-instance uploads into one rebuild per study
+MANIFEST_REFRESH_DELAY_SECONDS = 5.0
+
+# In-process copy of stored manifests: study_id -> (expires, manifest, etag)
+MANIFEST_CACHE_TTL_SECONDS = 600
+_manifest_cache: dict[str, tuple[float, dict, str]] = {}
+_pending_refreshes: dict[str, asyncio.Task] = {}
+
+# Orthanc content paths where WSI ICC profiles live, in lookup order
+ICC_CONTENT_PATHS = [
+    ("OpticalPathSequence[0]", "0048-0105/0/0028-2000"),
+    ("TopLevel", "0028-2000"),
+]
+
+
+# =============================================================================
+# Calibration
+# =============================================================================
+
+def _parse_spacing(ps: list) -> Optional[list[float]]:
+    # Validate values are actual numbers, not just "." or empty
+    ps0 = str(ps[0]).strip()
+    ps1 = str(ps[1]).strip() if len(ps) > 1 else ps0
+    if ps0 and ps0 != "." and ps1 and ps1 != ".":
+        return [float(ps0), float(ps1)]
+    return None
+
+
+def extract_calibration(tags: dict) -> dict:
+    """
+    Extract pixel spacing calibration from Orthanc /instances/{id}/tags output.
+    Falls back to ImagedVolume dimensions, then to a 0.25 µm/pixel default.
+    """
+    pixel_spacing = None
+
+    # Standard PixelSpacing (0028,0030)
+    if "0028,0030" in tags:
+        ps = tags["0028,0030"].get("Value", [])
+        if ps:
+            try:
+                pixel_spacing = _parse_spacing(ps)
+            except (ValueError, IndexError):
+                logger.warning(f"Invalid PixelSpacing value: {ps}, skipping")
+
+    # SharedFunctionalGroupsSequence for WSI
+    if not pixel_spacing and "5200,9229" in tags:
+        sfgs = tags["5200,9229"].get("Value", [{}])
+        if sfgs and isinstance(sfgs[0], dict):
+            # PixelMeasuresSequence
+            pms = sfgs[0].get("0028,9110", {}).get("Value", [{}])
+            if pms and "0028,0030" in pms[0]:
+                ps = pms[0]["0028,0030"].get("Value", [])
+                if ps:
+                    try:
+                        pixel_spacing = _parse_spacing(ps)
+                    except (ValueError, IndexError):
+                        logger.warning(f"Invalid PixelSpacing in SFGS: {ps}, skipping")
+
+    # ImagedVolumeWidth/Height for WSI (in mm)
+    imaged_volume_width = None
+    imaged_volume_height = None
+    total_pixel_cols = None
+    total_pixel_rows = None
+
+    if "0048,0001" in tags:  # ImagedVolumeWidth
+        imaged_volume_width = float(tags["0048,0001"].get("Value", [0])[0])
+    if "0048,0002" in tags:  # ImagedVolumeHeight
+        imaged_volume_height = float(tags["0048,0002"].get("Value", [0])[0])
+    if "0048,0006" in tags:  # TotalPixelMatrixColumns
+        total_pixel_cols = int(tags["0048,0006"].get("Value", [0])[0])
+    if "0048,0007" in tags:  # TotalPixelMatrixRows
+        total_pixel_rows = int(tags["0048,0007"].get("Value", [0])[0])
+
+    # Calculate pixel spacing from volume dimensions
+    if not pixel_spacing and imaged_volume_width and total_pixel_cols:
+        spacing_x = imaged_volume_width / total_pixel_cols * 1000  # Convert mm to µm
+        spacing_y = spacing_x
+        if imaged_volume_height and total_pixel_rows:
+            spacing_y = imaged_volume_height / total_pixel_rows * 1000
+        pixel_spacing = [spacing_x, spacing_y]
+
+    # Default fallback (common 40x objective ~0.25µm/pixel)
+    if not pixel_spacing:
+        pixel_spacing = [0.25, 0.25]
+
+    return {
+        "pixel_spacing_um": pixel_spacing,  # µm per pixel [x, y]
+        "unit": "µm",
+        "source": "dicom" if pixel_spacing != [0.25, 0.25] else "default",
+        "total_pixel_matrix": [total_pixel_cols, total_pixel_rows] if total_pixel_cols else None,
+        "imaged_volume_mm": [imaged_volume_width, imaged_volume_height] if imaged_volume_width else None
+    }
+
+
+# =============================================================================
+# Leica virtual pyramids
+# =============================================================================
+
+def build_leica_pyramid(study_id: str, instances: list[dict]) -> Optional[dict]:
+    """
+    Build a virtual pyramid for Leica-style studies that store each resolution
+    as a separate SM instance. Returns None if there are fewer than 2 levels.
+    """
+    sm_instances = [
+        {
+            "id": inst["id"],
+            "width": int(inst["tags"].get("Columns", 0) or 0),
+            "height": int(inst["tags"].get("Rows", 0) or 0),
+            "series_id": inst.get("seriesId"),
+        }
+        for inst in instances
+        if inst["tags"].get("Modality") == "SM"
+    ]
+    sm_instances = [inst for inst in sm_instances if inst["width"] > 0]
+
+    # Sort by resolution (largest first)
+    sm_instances.sort(key=lambda x: x["width"] * x["height"], reverse=True)
+
+    if len(sm_instances) < 2:  # Need at least 2 levels for a pyramid
+        return None
+
+    base_width = sm_instances[0]["width"]
+    base_height = sm_instances[0]["height"]
+    sizes = [[inst["width"], inst["height"]] for inst in sm_instances]
+
+    return {
+        "ID": study_id,
+        "TotalWidth": base_width,
+        "TotalHeight": base_height,
+        "Resolutions": [base_width / inst["width"] for inst in sm_instances],
+        "Sizes": sizes,
+        "TilesSizes": [[256, 256]] * len(sizes),
+        "TilesCount": [[int((w + 255) / 256), int((h + 255) / 256)] for w, h in sizes],
+        "BackgroundColor": "#ffffff",
+        "InstanceIDs": [inst["id"] for inst in sm_instances],
+        "IsVirtualPyramid": True,
+        "Type": "LeicaMultiFile"
+    }
+
+
+# =============================================================================
+# ICC profile
+# =============================================================================
+
+def icc_profile_info(icc_data: bytes) -> dict:
+    """Summarize the 128-byte ICC header"""
+    if len(icc_data) < 128:
+        return {}
+    return {
+        "size": int.from_bytes(icc_data[0:4], "big"),
+        "preferred_cmm": icc_data[4:8].decode("ascii", errors="replace").strip(),
+        "version": f"{icc_data[8]}.{icc_data[9]}.{icc_data[10]}",
+        "profile_class": icc_data[12:16].decode("ascii", errors="replace").strip(),
+        "color_space": icc_data[16:20].decode("ascii", errors="replace").strip(),
+        "pcs": icc_data[20:24].decode("ascii", errors="replace").strip(),
+    }
+
+
+async def fetch_icc_profile(client, instance_id: str) -> Optional[tuple[bytes, str]]:
+    """
+    Read the ICC profile of an instance through Orthanc's /content route,
+    without downloading the whole DICOM file. Returns (icc_bytes, location).
+    """
+    for location, content_path in ICC_CONTENT_PATHS:
+        response = await client.get(f"/instances/{instance_id}/content/{content_path}")
+        if response.status_code == 200 and response.content:
+            return response.content, location
+    return None
+
+
+# =============================================================================
+# Manifest building
+# =============================================================================
+
+def _position(item: dict) -> Optional[tuple[int, int]]:
+    """1-based (column, row) of a frame in the total pixel matrix"""
+    try:
+        plane = item["PlanePositionSlideSequence"][0]
+        return int(plane["ColumnPositionInTotalImagePixelMatrix"]), int(plane["RowPositionInTotalImagePixelMatrix"])
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None
+
+
+def frame_index(tags: dict, tiles_x: int, tiles_y: int, tile_w: int, tile_h: int) -> Optional[list[int]]:
+    """
+    0-based frame of each tile (list index y * tilesX + x, -1 for tiles
+    without a frame) of a TILED_SPARSE level, from the per-frame plane
+    positions. None when the positions are unavailable.
+    """
+    per_frame = tags.get("PerFrameFunctionalGroupsSequence")
+    if not isinstance(per_frame, list) or not per_frame:
+        return None
+    index = [-1] * (tiles_x * tiles_y)
+    for frame, item in enumerate(per_frame):
+        position = _position(item) if isinstance(item, dict) else None
+        if position is None:
+            return None
+        x, y = (position[0] - 1) // tile_w, (position[1] - 1) // tile_h
+        # Frames of further focal planes / optical paths map onto tiles already seen
+        if 0 <= x < tiles_x and 0 <= y < tiles_y and index[y * tiles_x + x] < 0:
+            index[y * tiles_x + x] = frame
+    return index
+
+
+def _level_grid(inst: dict, tags: dict, transfer_syntax: Optional[str]) -> dict:
+    tile_w = int(tags.get("Columns", 256) or 256)
+    tile_h = int(tags.get("Rows", 256) or 256)
+    tiles_x = (inst["width"] + tile_w - 1) // tile_w
+    tiles_y = (inst["height"] + tile_h - 1) // tile_h
+    organization = tags.get("DimensionOrganizationType") or "TILED_FULL"
+    return {
+        **inst,
+        "tileWidth": tile_w,
+        "tileHeight": tile_h,
+        "tilesX": tiles_x,
+        "tilesY": tiles_y,
+        "frameOrganization": organization,
+        # TILED_FULL: frame = y * tilesX + x (0-based); TILED_SPARSE: frameIndex[y * tilesX + x]
+        "frameIndex": (
+            frame_index(tags, tiles_x, tiles_y, tile_w, tile_h) if organization == "TILED_SPARSE" else None
+        ),
+        "transferSyntax": transfer_syntax,
+    }
+
+
+async def fetch_transfer_syntax(client, instance_id: str) -> Optional[str]:
+    """Transfer syntax UID Orthanc recorded for a stored instance"""
+    response = await client.get(f"/instances/{instance_id}/metadata/TransferSyntax")
+    if response.status_code == 200 and response.text:
+        return response.text.strip()
+    return None
+
+
+async def build_manifest(client, study_id: str) -> dict:
+    """Collect everything the viewer needs for a study into one document"""
+    instances = await fetch_study_instance_tags(client, study_id)
+    tags_by_id = {inst["id"]: inst["tags"] for inst in instances}
+    wsi = build_wsi_metadata(study_id, instances)
+
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "studyId": study_id,
+        "generatedAt": datetime.utcnow().isoformat() + "Z",
+        "instanceCount": len(instances),
+        "wsi": wsi,
+        "levels": [],
+        "focalPlanes": [],
+        "calibration": None,
+        "icc": {"has_icc": False},
+        "leicaPyramid": None,
+    }
+
+    if wsi is None:
+        # Untiled single-frame levels (Leica multi-file) get a virtual pyramid instead
+        leica = manifest["leicaPyramid"] = build_leica_pyramid(study_id, instances)
+        if leica:
+            main_instance_id = leica["InstanceIDs"][0]
+        elif instances:
+            main_instance_id = instances[0]["id"]
+        else:
+            return manifest
+        await _add_calibration_and_icc(client, manifest, main_instance_id)
+        return manifest
+
+    # Simplified tags carry no file meta information: the transfer syntax is instance metadata
+    level_ids = {lvl["instanceId"] for lvl in wsi["levels"]}
+    level_ids.update(lvl["instanceId"] for fp in wsi.get("focalPlanes", []) for lvl in fp["levels"])
+    level_ids = sorted(level_ids)
+    syntaxes = dict(zip(level_ids, await asyncio.gather(
+        *(fetch_transfer_syntax(client, instance_id) for instance_id in level_ids)
+    )))
+
+    def grid(lvl: dict) -> dict:
+        return _level_grid(lvl, tags_by_id.get(lvl["instanceId"], {}), syntaxes.get(lvl["instanceId"]))
+
+    manifest["levels"] = [grid(lvl) for lvl in wsi["levels"]]
+    manifest["focalPlanes"] = [
+        {
+            **fp,
+            "levels": [grid(lvl) for lvl in fp["levels"]],
+        }
+        for fp in wsi.get("focalPlanes", [])
+    ]
+
+    await _add_calibration_and_icc(client, manifest, wsi["instanceId"])
+    return manifest
+
+
+async def _add_calibration_and_icc(client, manifest: dict, main_instance_id: str):
+    """Calibration and ICC profile of the instance the viewer opens"""
+    study_id = manifest["studyId"]
+    tags_response, icc = await asyncio.gather(
+        client.get(f"/instances/{main_instance_id}/tags"),
+        fetch_icc_profile(client, main_instance_id),
+    )
+    if tags_response.status_code == 200:
+        manifest["calibration"] = extract_calibration(tags_response.json())
+
+    if icc:
+        icc_data, location = icc
+        icc_entry = {
+            "has_icc": True,
+            "instanceId": main_instance_id,
+            "location": location,
+            "size_bytes": len(icc_data),
+            "profile_info": icc_profile_info(icc_data),
+            "color_transform": None,
+        }
+        try:
+            from icc_parser import parse_icc_profile
+            icc_entry["color_transform"] = parse_icc_profile(icc_data)
+        except Exception as e:
+            logger.warning(f"Failed to parse ICC profile for {study_id}: {e}")
+        manifest["icc"] = icc_entry
+
+
+def manifest_etag(manifest: dict) -> str:
+    """Strong ETag over the manifest content (generatedAt excluded)"""
+    body = {k: v for k, v in manifest.items() if k != "generatedAt"}
+    digest = hashlib.sha256(json.dumps(body, sort_keys=True, default=str).encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+# =============================================================================
+# Storage
+# =============================================================================
+
+def _cache_manifest(study_id: str, manifest: dict, etag: str):
+    _manifest_cache[study_id] = (time.monotonic() + MANIFEST_CACHE_TTL_SECONDS, manifest, etag)
+
+
+def invalidate_manifest(study_id: str):
+    _manifest_cache.pop(study_id, None)
+
+
+async def save_manifest(pool, study_id: str, manifest: dict) -> str:
+    """Store a manifest in Postgres and the local cache, returns its ETag"""
+    etag = manifest_etag(manifest)
+    if pool is not None:
+        async with pool.acquire() as conn:
+            await conn.execute(
+                """
+                INSERT INTO slide_manifests (orthanc_study_id, manifest, etag, updated_at)
+                VALUES ($1, $2::jsonb, $3, CURRENT_TIMESTAMP)
+                ON CONFLICT (orthanc_study_id) DO UPDATE SET
+                    manifest = EXCLUDED.manifest,
+                    etag = EXCLUDED.etag,
+                    updated_at = CURRENT_TIMESTAMP
+                """,
+                study_id,
+                json.dumps(manifest, default=str),
+                etag
+            )
+    _cache_manifest(study_id, manifest, etag)
+    return etag
+
+
+async def load_manifest(pool, study_id: str) -> Optional[tuple[dict, str]]:
+    """Return (manifest, etag) from the local cache or Postgres"""
+    cached = _manifest_cache.get(study_id)
+    if cached and cached[0] > time.monotonic():
+        return cached[1], cached[2]
+
+    if pool is None:
+        return None
+    async with pool.acquire() as conn:
+        row = await conn.fetchrow(
+            "SELECT manifest, etag FROM slide_manifests WHERE orthanc_study_id = $1",
+            study_id
+        )
+    if not row:
+        return None
+    manifest = row["manifest"]
+    if isinstance(manifest, str):
+        manifest = json.loads(manifest)
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    _cache_manifest(study_id, manifest, row["etag"])
+    return manifest, row["etag"]
+
+
+async def delete_manifest(pool, study_id: str):
+    invalidate_manifest(study_id)
+    if pool is None:
+        return
+    async with pool.acquire() as conn:
+        await conn.execute("DELETE FROM slide_manifests WHERE orthanc_study_id = $1", study_id)
+
+
+async def refresh_manifest(client, pool, study_id: str) -> Optional[tuple[dict, str]]:
+    """Rebuild and store the manifest of a study (best-effort)"""
+    try:
+        manifest = await build_manifest(client, study_id)
+        etag = await save_manifest(pool, study_id, manifest)
+        logger.info(f"🗂️ Manifest written for study {study_id} ({len(manifest['levels'])} levels)")
+        return manifest, etag
+    except Exception as e:
+        logger.warning(f"Failed to build manifest for study {study_id}: {e}")
+        return None
+
+
+def schedule_manifest_refresh(client, pool_getter, study_id: str, delay: float = MANIFEST_REFRESH_DELAY_SECONDS):
+    """
+    Rebuild a study's manifest shortly after uploads stop arriving.
+    Repeated calls within ``delay`` restart the timer, so a multi-instance
+    upload produces a single rebuild.
+    """
+    invalidate_manifest(study_id)
+    pending = _pending_refreshes.get(study_id)
+    if pending and not pending.done():
+        pending.cancel()
+
+    async def run():
+        try:
+            await asyncio.sleep(delay)
+            await refresh_manifest(client, await pool_getter(), study_id)
+        finally:
+            if _pending_refreshes.get(study_id) is task:
+                _pending_refreshes.pop(study_id, None)
+
+    task = asyncio.get_running_loop().create_task(run())
+    _pending_refreshes[study_id] = task
+    return task
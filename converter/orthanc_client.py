@@ -0,0 +1,325 @@
+"""
+Shared Orthanc HTTP Client
+Single pooled, keep-alive connection to Orthanc for the whole converter service
+"""
+
+import time
+import asyncio
+import logging
+from typing import Optional, Union
+
+import anyio
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Streamed bodies are relayed in chunks of this size (bounded memory per request)
+STREAM_CHUNK_SIZE = 256 * 1024
+# Streams at least this large are logged with their throughput
+STREAM_LOG_BYTES = 16 * 1024 * 1024
+
+
+# Default timeouts per endpoint category (seconds)
+DEFAULT_TIMEOUTS = {
+    "tile": httpx.Timeout(30.0, connect=5.0),
+    "metadata": httpx.Timeout(30.0, connect=5.0),
+    "file": httpx.Timeout(120.0, connect=5.0),
+    "dicomweb": httpx.Timeout(120.0, connect=5.0),
+    "upload": httpx.Timeout(1800.0, connect=30.0),
+    "system": httpx.Timeout(5.0, connect=2.0),
+}
+
+
+def classify_endpoint(method: str, path: str) -> str:
+    """Map an Orthanc request onto a timeout/metrics category"""
+    path = path.split("?", 1)[0]
+    if path.startswith("/wsi/tiles/") or "/frames/" in path:
+        return "tile"
+    if method.upper() == "POST" and (path == "/instances" or path.startswith("/dicom-web/studies")):
+        return "upload"
+    if path.startswith("/dicom-web/"):
+        return "dicomweb"
+    if path.endswith("/file"):
+        return "file"
+    if path == "/system":
+        return "system"
+    return "metadata"
+
+
+class EndpointMetrics:
+    """Request counters and latency for one endpoint category"""
+
+    __slots__ = ("requests", "errors", "total_seconds", "max_seconds", "bytes_received")
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.bytes_received = 0
+
+    def observe(self, elapsed: float, ok: bool, nbytes: int = 0):
+        self.requests += 1
+        if not ok:
+            self.errors += 1
+        self.total_seconds += elapsed
+        self.max_seconds = max(self.max_seconds, elapsed)
+        self.bytes_received += nbytes
+
+    def to_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "avg_ms": round(self.total_seconds / self.requests * 1000, 2) if self.requests else 0.0,
+            "max_ms": round(self.max_seconds * 1000, 2),
+            "bytes_received": self.bytes_received,
+            "mb_per_s": round(self.bytes_received / (1024 * 1024) / self.total_seconds, 2)
+            if self.total_seconds else 0.0,
+        }
+
+
+class OrthancStream:
+    """
+    An Orthanc response whose body has not been read yet.
+
+    Iterate ``aiter_raw()`` once to relay the body chunk by chunk; the
+    upstream connection is released (and metrics recorded) when iteration
+    ends, is cancelled (client disconnect), or ``aclose()`` is called.
+    """
+
+    def __init__(self, owner: "OrthancClient", path: str, endpoint: str, started: float,
+                 response: httpx.Response, one_off: Optional[httpx.AsyncClient] = None):
+        self._owner = owner
+        self._path = path
+        self._endpoint = endpoint
+        self._started = started
+        self._one_off = one_off
+        self._closed = False
+        self.response = response
+        self.bytes_sent = 0
+
+    @property
+    def status_code(self) -> int:
+        return self.response.status_code
+
+    @property
+    def headers(self) -> httpx.Headers:
+        return self.response.headers
+
+    async def aiter_raw(self, chunk_size: int = STREAM_CHUNK_SIZE):
+        """Yield the body as received (still content-encoded)"""
+        try:
+            async for chunk in self.response.aiter_raw(chunk_size):
+                self.bytes_sent += len(chunk)
+                yield chunk
+        finally:
+            # Shielded so a cancelled (disconnected) request still closes upstream
+            with anyio.CancelScope(shield=True):
+                await self.aclose()
+
+    async def read(self) -> bytes:
+        """Read the whole body (for small error responses)"""
+        try:
+            return await self.response.aread()
+        finally:
+            await self.aclose()
+
+    async def aclose(self):
+        if self._closed:
+            return
+        self._closed = True
+        await self.response.aclose()
+        if self._one_off is not None:
+            await self._one_off.aclose()
+        elapsed = time.perf_counter() - self._started
+        self._owner._observe(self._endpoint, self._started, self.status_code < 500, self.bytes_sent)
+        if self.bytes_sent >= STREAM_LOG_BYTES:
+            logger.info(
+                f"📡 Streamed {self.bytes_sent / (1024 * 1024):.1f} MB from Orthanc {self._path} "
+                f"in {elapsed:.1f}s ({self.bytes_sent / (1024 * 1024) / max(elapsed, 1e-6):.1f} MB/s)"
+            )
+
+
+class OrthancClient:
+    """
+    Lifespan-managed wrapper around a single httpx.AsyncClient.
+
+    All requests use paths relative to the Orthanc base URL, e.g.
+    ``await orthanc_client.get(f"/studies/{study_id}")``. Basic auth,
+    connection limits and keep-alive are configured once on the pool.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        username: str,
+        password: str,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        http2: bool = False,
+        timeouts: Optional[dict] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.auth = (username, password)
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.http2 = http2
+        self.timeouts = {**DEFAULT_TIMEOUTS, **(timeouts or {})}
+        self.metrics: dict[str, EndpointMetrics] = {}
+        self.unpooled_requests = 0
+        self._transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _build_client(self) -> httpx.AsyncClient:
+        http2 = self.http2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("Orthanc HTTP/2 requested but 'h2' is not installed - using HTTP/1.1")
+                http2 = False
+        return httpx.AsyncClient(
+            base_url=self.base_url,
+            auth=self.auth,
+            limits=self.limits,
+            http2=http2,
+            timeout=self.timeouts["metadata"],
+            transport=self._transport,
+        )
+
+    async def start(self):
+        """Create the connection pool (called from the app lifespan)"""
+        if self._client is None:
+            self._client = self._build_client()
+            self._loop = asyncio.get_running_loop()
+            logger.info(
+                f"Orthanc client pool started: {self.base_url} "
+                f"(max_connections={self.limits.max_connections}, "
+                f"keepalive={self.limits.max_keepalive_connections}, http2={self.http2})"
+            )
+
+    async def close(self):
+        """Close all pooled connections"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._loop = None
+            logger.info("Orthanc client pool closed")
+
+    async def _pooled_client(self) -> Optional[httpx.AsyncClient]:
+        """Return the shared client, or None if called from a foreign event loop"""
+        loop = asyncio.get_running_loop()
+        if self._client is None:
+            # Lazily start outside of the lifespan (scripts, tests)
+            await self.start()
+        if self._loop is not loop:
+            return None
+        return self._client
+
+    def _timeout_for(self, endpoint: str, timeout) -> Union[httpx.Timeout, float]:
+        if timeout is not None:
+            return timeout
+        return self.timeouts.get(endpoint, self.timeouts["metadata"])
+
+    def _observe(self, endpoint: str, started: float, ok: bool, nbytes: int = 0):
+        metrics = self.metrics.get(endpoint)
+        if metrics is None:
+            metrics = self.metrics[endpoint] = EndpointMetrics()
+        metrics.observe(time.perf_counter() - started, ok, nbytes)
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        *,
+        endpoint: Optional[str] = None,
+        timeout=None,
+        **kwargs,
+    ) -> httpx.Response:
+        """Send a request to Orthanc over the shared pool"""
+        endpoint = endpoint or classify_endpoint(method, path)
+        timeout = self._timeout_for(endpoint, timeout)
+        started = time.perf_counter()
+        ok = False
+        response = None
+        try:
+            client = await self._pooled_client()
+            if client is not None:
+                response = await client.request(method, path, timeout=timeout, **kwargs)
+            else:
+                # Background threads run their own event loop and cannot share the pool
+                self.unpooled_requests += 1
+                async with httpx.AsyncClient(
+                    base_url=self.base_url, auth=self.auth, transport=self._transport
+                ) as one_off:
+                    response = await one_off.request(method, path, timeout=timeout, **kwargs)
+            ok = response.status_code < 500
+            return response
+        finally:
+            nbytes = len(response.content) if response is not None and response.is_stream_consumed else 0
+            self._observe(endpoint, started, ok, nbytes)
+
+    async def stream(
+        self,
+        method: str,
+        path: str,
+        *,
+        endpoint: Optional[str] = None,
+        timeout=None,
+        **kwargs,
+    ) -> OrthancStream:
+        """
+        Send a request and return as soon as the response headers arrive.
+
+        The body is left unread so proxies can relay it without buffering;
+        the caller must consume ``aiter_raw()`` or call ``aclose()``.
+        """
+        endpoint = endpoint or classify_endpoint(method, path)
+        timeout = self._timeout_for(endpoint, timeout)
+        started = time.perf_counter()
+        client = await self._pooled_client()
+        one_off = None
+        if client is None:
+            self.unpooled_requests += 1
+            client = one_off = httpx.AsyncClient(
+                base_url=self.base_url, auth=self.auth, transport=self._transport
+            )
+        try:
+            request = client.build_request(method, path, timeout=timeout, **kwargs)
+            response = await client.send(request, stream=True)
+        except BaseException:
+            self._observe(endpoint, started, False)
+            if one_off is not None:
+                await one_off.aclose()
+            raise
+        return OrthancStream(self, path, endpoint, started, response, one_off)
+
+    async def get(self, path: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", path, **kwargs)
+
+    async def post(self, path: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", path, **kwargs)
+
+    async def put(self, path: str, **kwargs) -> httpx.Response:
+        return await self.request("PUT", path, **kwargs)
+
+    async def delete(self, path: str, **kwargs) -> httpx.Response:
+        return await self.request("DELETE", path, **kwargs)
+
+    def get_metrics(self) -> dict:
+        """Snapshot of per-endpoint metrics and pool configuration"""
+        return {
+            "base_url": self.base_url,
+            "pool_started": self._client is not None,
+            "http2": self.http2,
+            "max_connections": self.limits.max_connections,
+            "max_keepalive_connections": self.limits.max_keepalive_connections,
+            "unpooled_requests": self.unpooled_requests,
+            "endpoints": {name: m.to_dict() for name, m in sorted(self.metrics.items())},
+        }
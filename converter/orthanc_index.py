@@ -0,0 +1,511 @@
+"""
+Orthanc Resource Index
+Local Postgres index of Orthanc studies, series and instances kept current by
+tailing Orthanc's ``/changes`` feed.
+
+Study listings and WSI metadata read the index instead of walking ``/studies``
+→ series → instances on every request. One converter process at a time holds
+the consumer lease (same host:pid lease as the conversion queue); every process
+reads. Each change page re-indexes the touched studies wholesale, so replaying
+a page after a crash is harmless, and the sequence number is persisted after
+every page.
+"""
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional
+
+import httpx
+
+from job_queue import worker_identity
+from wsi_metadata import fetch_study_instance_tags
+
+logger = logging.getLogger(__name__)
+
+STATE_NAME = "changes"
+DEFAULT_POLL_SECONDS = 2.0
+DEFAULT_PAGE_SIZE = 500
+DEFAULT_LEASE_SECONDS = 60
+# Parallel study re-indexes / change resolutions against Orthanc
+DEFAULT_CONCURRENCY = 4
+
+
+def _int(value) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _image_type(tags: dict) -> str:
+    image_type = tags.get("ImageType", "")
+    if isinstance(image_type, list):
+        return "\\".join(image_type)
+    return image_type or ""
+
+
+def study_rows(study: dict, instances: list[dict]) -> tuple[tuple, list[tuple], list[tuple]]:
+    """
+    Index rows of one study: ``(study_row, series_rows, instance_rows)``.
+
+    ``study`` is Orthanc's ``/studies/{id}`` resource, ``instances`` the output
+    of fetch_study_instance_tags.
+    """
+    study_id = study["ID"]
+    tags = study.get("MainDicomTags", {})
+    patient = study.get("PatientMainDicomTags", {})
+    study_row = (
+        study_id,
+        study.get("ParentPatient"),
+        tags.get("StudyInstanceUID"),
+        patient.get("PatientName"),
+        tags.get("StudyDate"),
+        tags.get("StudyDescription"),
+        bool(study.get("IsStable", False)),
+    )
+
+    series_rows = {}
+    instance_rows = []
+    for inst in instances:
+        series_id = inst.get("seriesId")
+        if series_id is None:
+            continue
+        inst_tags = inst["tags"]
+        if series_id not in series_rows:
+            series_rows[series_id] = (
+                series_id,
+                study_id,
+                inst_tags.get("SeriesInstanceUID"),
+                inst_tags.get("Modality"),
+                inst_tags.get("Manufacturer"),
+            )
+        edof = inst_tags.get("ExtendedDepthOfField")
+        instance_rows.append((
+            inst["id"],
+            series_id,
+            study_id,
+            _int(inst_tags.get("InstanceNumber")),
+            _image_type(inst_tags),
+            _int(inst_tags.get("TotalPixelMatrixColumns")),
+            _int(inst_tags.get("TotalPixelMatrixRows")),
+            _int(inst_tags.get("Columns")),
+            _int(inst_tags.get("Rows")),
+            _int(inst_tags.get("NumberOfFrames")),
+            _int(inst_tags.get("NumberOfFocalPlanes")),
+            None if edof is None else str(edof).upper() == "YES",
+        ))
+    return study_row, list(series_rows.values()), instance_rows
+
+
+def instance_from_row(row) -> dict:
+    """Rebuild the ``{"id", "seriesId", "tags"}`` shape build_wsi_metadata expects"""
+    tags = {"SeriesInstanceUID": row["series_instance_uid"] or "", "ImageType": row["image_type"] or ""}
+    for tag, column in (
+        ("InstanceNumber", "instance_number"),
+        ("TotalPixelMatrixColumns", "total_columns"),
+        ("TotalPixelMatrixRows", "total_rows"),
+        ("Columns", "frame_columns"),
+        ("Rows", "frame_rows"),
+        ("NumberOfFrames", "number_of_frames"),
+        ("NumberOfFocalPlanes", "focal_planes"),
+    ):
+        if row[column] is not None:
+            tags[tag] = row[column]
+    if row["extended_depth_of_field"] is not None:
+        tags["ExtendedDepthOfField"] = "YES" if row["extended_depth_of_field"] else "NO"
+    return {"id": row["instance_id"], "seriesId": row["series_id"], "tags": tags}
+
+
+class OrthancIndex:
+    """
+    Change-feed consumer and reader of the ``orthanc_*`` index tables.
+
+    Readers call is_ready() first and fall back to Orthanc while the index has
+    not completed its initial sync (or there is no database).
+    """
+
+    def __init__(
+        self,
+        client,
+        pool_getter: Callable[[], Awaitable],
+        poll_seconds: float = DEFAULT_POLL_SECONDS,
+        page_size: int = DEFAULT_PAGE_SIZE,
+        lease_seconds: int = DEFAULT_LEASE_SECONDS,
+        concurrency: int = DEFAULT_CONCURRENCY,
+    ):
+        self.client = client
+        self._pool_getter = pool_getter
+        self.poll_seconds = poll_seconds
+        self.page_size = page_size
+        self.lease_seconds = lease_seconds
+        self.concurrency = concurrency
+        self.worker_id = worker_identity()
+
+        self._ready = False
+        self._leader = False
+        self._checked_reset = False
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.last_seq: Optional[int] = None
+        self.changes_applied = 0
+        self.studies_indexed = 0
+        self.resyncs = 0
+        self.errors = 0
+
+    # =========================================================================
+    # Lifecycle
+    # =========================================================================
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        pool = await self._pool_getter() if self._leader else None
+        if pool is not None:
+            try:
+                async with pool.acquire() as conn:
+                    await conn.execute(
+                        "UPDATE orthanc_index_state SET lease_expires_at = NOW() "
+                        "WHERE name = $1 AND lease_owner = $2",
+                        STATE_NAME, self.worker_id
+                    )
+            except Exception as e:
+                logger.debug(f"Could not release Orthanc index lease: {e}")
+        self._leader = False
+
+    def poke(self):
+        """Read the change feed now instead of at the next poll (e.g. after an upload)"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def mark_changed(self, study_id: str):
+        """
+        Stop serving a study this process just wrote to from the index.
+
+        The study's rows stay as they were until the consumer handles the
+        change, which may be a poll (or another process's lease) away; until
+        then study_instances() sends readers to Orthanc. Re-indexing restores
+        Orthanc's own stability flag.
+        """
+        self.poke()
+        pool = await self._pool_getter()
+        if pool is None:
+            return
+        try:
+            async with pool.acquire() as conn:
+                await conn.execute("UPDATE orthanc_studies SET is_stable = FALSE WHERE study_id = $1", study_id)
+        except Exception as e:
+            logger.warning(f"⚠️ Could not mark study {study_id} changed in the Orthanc index: {e}")
+
+    async def _run(self):
+        while True:
+            try:
+                caught_up = await self._step()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                caught_up = True
+                logger.warning(f"⚠️ Orthanc index update failed: {e}")
+            if caught_up:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+
+    async def _step(self) -> bool:
+        """Consume one page of changes; True once caught up (or not the consumer)"""
+        pool = await self._pool_getter()
+        if pool is None:
+            return True
+        leased, last_seq = await self._acquire_lease(pool)
+        self._leader = leased
+        if not leased:
+            self._checked_reset = False
+            return True
+
+        if last_seq is not None and not self._checked_reset:
+            # A rebuilt Orthanc restarts its sequence numbers
+            self._checked_reset = True
+            if await self._current_seq() < last_seq:
+                logger.warning("⚠️ Orthanc change sequence went backwards, re-indexing")
+                last_seq = None
+        if last_seq is None:
+            await self._resync(pool)
+            return False
+
+        response = await self.client.get(f"/changes?since={last_seq}&limit={self.page_size}")
+        response.raise_for_status()
+        page = response.json()
+        changes = page.get("Changes", [])
+        if changes:
+            await self._apply(pool, changes)
+            self.changes_applied += len(changes)
+        next_seq = max(int(page.get("Last", last_seq)), last_seq)
+        await self._save_seq(pool, next_seq)
+        self._ready = True
+        return bool(page.get("Done", True)) or not changes
+
+    # =========================================================================
+    # Consumer
+    # =========================================================================
+
+    async def _acquire_lease(self, pool) -> tuple[bool, Optional[int]]:
+        async with pool.acquire() as conn:
+            row = await conn.fetchrow(
+                """
+                INSERT INTO orthanc_index_state (name, lease_owner, lease_expires_at)
+                VALUES ($1, $2, NOW() + make_interval(secs => $3))
+                ON CONFLICT (name) DO UPDATE SET
+                    lease_owner = EXCLUDED.lease_owner,
+                    lease_expires_at = EXCLUDED.lease_expires_at
+                WHERE orthanc_index_state.lease_owner = EXCLUDED.lease_owner
+                   OR orthanc_index_state.lease_expires_at IS NULL
+                   OR orthanc_index_state.lease_expires_at < NOW()
+                RETURNING last_seq
+                """,
+                STATE_NAME, self.worker_id, float(self.lease_seconds)
+            )
+        if row is None:
+            return False, None
+        self.last_seq = row["last_seq"]
+        return True, row["last_seq"]
+
+    async def _save_seq(self, pool, seq: int, synced: bool = False):
+        async with pool.acquire() as conn:
+            await conn.execute(
+                """
+                UPDATE orthanc_index_state SET
+                    last_seq = $3,
+                    synced_at = CASE WHEN $4 THEN NOW() ELSE synced_at END,
+                    updated_at = NOW()
+                WHERE name = $1 AND lease_owner = $2
+                """,
+                STATE_NAME, self.worker_id, seq, synced
+            )
+        self.last_seq = seq
+
+    async def _current_seq(self) -> int:
+        response = await self.client.get("/changes?last")
+        response.raise_for_status()
+        return int(response.json().get("Last", 0))
+
+    async def _resync(self, pool):
+        """Index every study in Orthanc, then tail the feed from before the walk"""
+        self.resyncs += 1
+        seq = await self._current_seq()
+        response = await self.client.get("/studies")
+        response.raise_for_status()
+        study_ids = response.json()
+        logger.info(f"🗂️ Indexing {len(study_ids)} Orthanc studies (change {seq})")
+
+        await self._index_studies(pool, study_ids)
+        async with pool.acquire() as conn:
+            await conn.execute("DELETE FROM orthanc_studies WHERE NOT (study_id = ANY($1::text[]))", study_ids)
+        await self._save_seq(pool, seq, synced=True)
+        self._ready = True
+        logger.info(f"✅ Orthanc index synced: {len(study_ids)} studies")
+
+    async def _apply(self, pool, changes: list[dict]):
+        """Apply a page of changes: drop deleted resources, re-index touched studies"""
+        deleted = {"Patient": [], "Study": [], "Series": [], "Instance": []}
+        studies, series, instances = set(), set(), set()
+        for change in changes:
+            kind, resource_id = change.get("ResourceType"), change.get("ID")
+            if change.get("ChangeType") == "Deleted":
+                if kind in deleted:
+                    deleted[kind].append(resource_id)
+            elif kind == "Study":
+                studies.add(resource_id)
+            elif kind == "Series":
+                series.add(resource_id)
+            elif kind == "Instance" and change.get("ChangeType") == "NewInstance":
+                instances.add(resource_id)
+
+        if any(deleted.values()):
+            async with pool.acquire() as conn:
+                async with conn.transaction():
+                    await conn.execute("DELETE FROM orthanc_studies WHERE patient_id = ANY($1::text[])", deleted["Patient"])
+                    await conn.execute("DELETE FROM orthanc_studies WHERE study_id = ANY($1::text[])", deleted["Study"])
+                    await conn.execute("DELETE FROM orthanc_series WHERE series_id = ANY($1::text[])", deleted["Series"])
+                    await conn.execute("DELETE FROM orthanc_instances WHERE instance_id = ANY($1::text[])", deleted["Instance"])
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def parent_study(path: str) -> Optional[str]:
+            async with semaphore:
+                response = await self.client.get(path)
+            if response.status_code == 404:
+                return None  # Deleted since; its own Deleted change follows
+            response.raise_for_status()
+            return response.json().get("ID")
+
+        parents = await asyncio.gather(
+            *(parent_study(f"/series/{s}/study") for s in series),
+            *(parent_study(f"/instances/{i}/study") for i in instances),
+        )
+        studies.update(p for p in parents if p)
+        await self._index_studies(pool, sorted(studies))
+
+    async def _index_studies(self, pool, study_ids: list[str]):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def index_one(study_id: str):
+            async with semaphore:
+                await self._index_study(pool, study_id)
+
+        await asyncio.gather(*(index_one(s) for s in study_ids))
+
+    async def _index_study(self, pool, study_id: str):
+        """Replace the index rows of one study with Orthanc's current view of it"""
+        try:
+            study_response, instances = await asyncio.gather(
+                self.client.get(f"/studies/{study_id}"),
+                fetch_study_instance_tags(self.client, study_id),
+            )
+            study_response.raise_for_status()
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code != 404:
+                raise
+            async with pool.acquire() as conn:
+                await conn.execute("DELETE FROM orthanc_studies WHERE study_id = $1", study_id)
+            return
+
+        study_row, series_rows, instance_rows = study_rows(study_response.json(), instances)
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(
+                    """
+                    INSERT INTO orthanc_studies (
+                        study_id, patient_id, study_instance_uid, patient_name,
+                        study_date, study_description, is_stable
+                    ) VALUES ($1, $2, $3, $4, $5, $6, $7)
+                    ON CONFLICT (study_id) DO UPDATE SET
+                        patient_id = EXCLUDED.patient_id,
+                        study_instance_uid = EXCLUDED.study_instance_uid,
+                        patient_name = EXCLUDED.patient_name,
+                        study_date = EXCLUDED.study_date,
+                        study_description = EXCLUDED.study_description,
+                        is_stable = EXCLUDED.is_stable,
+                        indexed_at = NOW()
+                    """,
+                    *study_row
+                )
+                await conn.execute("DELETE FROM orthanc_series WHERE study_id = $1", study_id)
+                await conn.executemany(
+                    """
+                    INSERT INTO orthanc_series (series_id, study_id, series_instance_uid, modality, manufacturer)
+                    VALUES ($1, $2, $3, $4, $5)
+                    """,
+                    series_rows
+                )
+                await conn.executemany(
+                    """
+                    INSERT INTO orthanc_instances (
+                        instance_id, series_id, study_id, instance_number, image_type,
+                        total_columns, total_rows, frame_columns, frame_rows,
+                        number_of_frames, focal_planes, extended_depth_of_field
+                    ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12)
+                    """,
+                    instance_rows
+                )
+        self.studies_indexed += 1
+
+    # =========================================================================
+    # Readers
+    # =========================================================================
+
+    async def is_ready(self) -> bool:
+        """True once some process has completed the initial sync"""
+        if self._ready:
+            return True
+        pool = await self._pool_getter()
+        if pool is None:
+            return False
+        try:
+            async with pool.acquire() as conn:
+                synced = await conn.fetchval(
+                    "SELECT synced_at IS NOT NULL FROM orthanc_index_state WHERE name = $1", STATE_NAME
+                )
+        except Exception as e:
+            logger.debug(f"Orthanc index unavailable: {e}")
+            return False
+        self._ready = bool(synced)
+        return self._ready
+
+    async def study_ids(self) -> list[str]:
+        pool = await self._pool_getter()
+        async with pool.acquire() as conn:
+            rows = await conn.fetch("SELECT study_id FROM orthanc_studies ORDER BY first_seen_at, study_id")
+        return [row["study_id"] for row in rows]
+
+    async def study_instances(self, study_id: str) -> Optional[list[dict]]:
+        """
+        Indexed instances of a stable study in fetch_study_instance_tags form.
+
+        None when the index cannot answer authoritatively: not synced, study
+        unknown, or still receiving instances (Orthanc's StableStudy not yet
+        signalled), so callers go to Orthanc instead.
+        """
+        if not await self.is_ready():
+            return None
+        try:
+            pool = await self._pool_getter()
+            async with pool.acquire() as conn:
+                stable = await conn.fetchval("SELECT is_stable FROM orthanc_studies WHERE study_id = $1", study_id)
+                if not stable:
+                    return None
+                rows = await conn.fetch(
+                    """
+                    SELECT i.*, s.series_instance_uid
+                    FROM orthanc_instances i
+                    JOIN orthanc_series s ON s.series_id = i.series_id
+                    WHERE i.study_id = $1
+                    """,
+                    study_id
+                )
+        except Exception as e:
+            logger.warning(f"⚠️ Orthanc index read failed for {study_id}: {e}")
+            return None
+        return [instance_from_row(row) for row in rows]
+
+    async def leica_candidates(self) -> list[str]:
+        """Studies with SM instances of several frame sizes (see LeicaAggregator)"""
+        pool = await self._pool_getter()
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(
+                """
+                SELECT i.study_id
+                FROM orthanc_instances i
+                JOIN orthanc_series s ON s.series_id = i.series_id
+                WHERE s.modality = 'SM'
+                  AND (s.manufacturer LIKE '%Leica%'
+                       OR (SELECT COUNT(*) FROM orthanc_instances n WHERE n.series_id = i.series_id) > 1)
+                GROUP BY i.study_id
+                HAVING COUNT(*) >= 2 AND COUNT(DISTINCT (i.frame_columns, i.frame_rows)) > 1
+                ORDER BY i.study_id
+                """
+            )
+        return [row["study_id"] for row in rows]
+
+    def get_stats(self) -> dict:
+        return {
+            "ready": self._ready,
+            "consumer": self._leader,
+            "last_seq": self.last_seq,
+            "changes_applied": self.changes_applied,
+            "studies_indexed": self.studies_indexed,
+            "resyncs": self.resyncs,
+            "errors": self.errors,
+        }
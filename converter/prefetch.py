@@ -0,0 +1,250 @@
+"""
+Viewport Prefetch
+Predict the tiles a moving viewport is about to need and warm the tile cache
+with them at low priority
+"""
+
+import math
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+# Look-ahead points along the motion, as fractions of the horizon
+PREDICTION_STEPS = (0.25, 0.5, 1.0)
+DEFAULT_HORIZON_SECONDS = 1.0
+DEFAULT_MAX_TILES = 48
+DEFAULT_CONCURRENCY = 2
+DEFAULT_MAX_PENDING = 512
+# Interactive fetches in flight above which prefetching waits
+DEFAULT_BUSY_INFLIGHT = 16
+BUSY_WAIT_SECONDS = 0.05
+PYRAMID_TTL_SECONDS = 300
+
+# (series_id, level, x, y)
+TileKey = tuple[str, int, int, int]
+
+
+class PyramidLevel(NamedTuple):
+    width: int
+    height: int
+    tile_width: int
+    tile_height: int
+    tiles_x: int
+    tiles_y: int
+    # Level-0 pixels per pixel of this level
+    downsample: float
+
+
+def levels_from_pyramid(pyramid: dict) -> list[PyramidLevel]:
+    """Pyramid levels from an Orthanc /wsi/pyramids/{series} document, finest first"""
+    sizes = pyramid["Sizes"]
+    levels = []
+    for (width, height), (tile_w, tile_h), (tiles_x, tiles_y) in zip(
+        sizes, pyramid["TilesSizes"], pyramid["TilesCount"]
+    ):
+        levels.append(PyramidLevel(width, height, tile_w, tile_h, tiles_x, tiles_y, sizes[0][0] / width))
+    return levels
+
+
+def choose_level(levels: list[PyramidLevel], scale: float) -> int:
+    """Coarsest level still at least as sharp as ``scale`` level-0 pixels per screen pixel"""
+    best = 0
+    for i, level in enumerate(levels):
+        if level.downsample <= scale:
+            best = i
+    return best
+
+
+def tiles_in(level: PyramidLevel, x: float, y: float, width: float, height: float) -> list[tuple[int, int]]:
+    """Tiles of a level covering a rectangle given in level-0 pixels"""
+    x0 = max(0, math.floor(x / level.downsample / level.tile_width))
+    y0 = max(0, math.floor(y / level.downsample / level.tile_height))
+    x1 = min(level.tiles_x - 1, math.floor((x + width) / level.downsample / level.tile_width))
+    y1 = min(level.tiles_y - 1, math.floor((y + height) / level.downsample / level.tile_height))
+    return [(tx, ty) for ty in range(y0, y1 + 1) for tx in range(x0, x1 + 1)]
+
+
+def predict_tiles(
+    levels: list[PyramidLevel],
+    level: int,
+    viewport: tuple[float, float, float, float],
+    velocity: tuple[float, float] = (0.0, 0.0),
+    zoom_velocity: float = 0.0,
+    horizon: float = DEFAULT_HORIZON_SECONDS,
+    max_tiles: int = DEFAULT_MAX_TILES,
+) -> list[tuple[int, int, int]]:
+    """
+    Tiles a viewport will need next, most urgent first, as (level, x, y).
+
+    ``viewport`` is (x, y, width, height) and ``velocity`` is in level-0
+    pixels (per second); ``zoom_velocity`` is in pyramid levels per second,
+    positive when zooming in. Tiles of the current viewport are left out:
+    the client is already fetching those.
+
+    The current level is extrapolated along the motion first, then the
+    adjacent level in the zoom direction (the coarser one when not zooming,
+    which is cheap and is what a fast zoom-out shows first).
+    """
+    x, y, width, height = viewport
+    vx, vy = velocity
+    visible = {(level, tx, ty) for tx, ty in tiles_in(levels[level], x, y, width, height)}
+    seen = set(visible)
+    predicted = []
+
+    def add(lvl: int, rect: tuple[float, float, float, float]):
+        for tx, ty in tiles_in(levels[lvl], *rect):
+            key = (lvl, tx, ty)
+            if key not in seen:
+                seen.add(key)
+                predicted.append(key)
+
+    if vx or vy:
+        for step in PREDICTION_STEPS:
+            t = horizon * step
+            add(level, (x + vx * t, y + vy * t, width, height))
+
+    if zoom_velocity > 0 and level > 0:
+        adjacent = level - 1
+    elif zoom_velocity <= 0 and level + 1 < len(levels):
+        adjacent = level + 1
+    else:
+        adjacent = None
+    if adjacent is not None:
+        # Viewport at the end of the horizon: moved, then scaled about its centre
+        factor = 2.0 ** (-zoom_velocity * horizon)
+        cx = x + width / 2 + vx * horizon
+        cy = y + height / 2 + vy * horizon
+        w, h = width * factor, height * factor
+        add(adjacent, (cx - w / 2, cy - h / 2, w, h))
+
+    return predicted[:max_tiles]
+
+
+class TilePrefetcher:
+    """
+    Low-priority background tile warmer.
+
+    Each client (user + series) has one pending list; a new prediction
+    replaces the previous one, since a stale prediction is worthless once
+    the viewport has moved on. A few workers drain the lists round-robin
+    and back off while interactive fetches are busy.
+    """
+
+    def __init__(
+        self,
+        warm: Callable[[TileKey], Awaitable[bool]],
+        busy: Optional[Callable[[], bool]] = None,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        max_pending: int = DEFAULT_MAX_PENDING,
+    ):
+        self.warm = warm
+        self.busy = busy or (lambda: False)
+        self.concurrency = max(1, concurrency)
+        self.max_pending = max_pending
+        self._pending: OrderedDict[str, deque[TileKey]] = OrderedDict()
+        self._wakeup = asyncio.Event()
+        self._workers: list[asyncio.Task] = []
+        self.stats = {
+            "requests": 0,
+            "predicted": 0,
+            "superseded": 0,
+            "dropped": 0,
+            "warmed": 0,
+            "already_cached": 0,
+            "errors": 0,
+            "busy_waits": 0,
+        }
+
+    @property
+    def pending(self) -> int:
+        return sum(len(tiles) for tiles in self._pending.values())
+
+    def start(self):
+        if not self._workers:
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._pending.clear()
+
+    def submit(self, client: str, tiles: list[TileKey]) -> int:
+        """Replace a client's pending prefetches; returns how many were queued"""
+        self.stats["requests"] += 1
+        self.stats["predicted"] += len(tiles)
+        previous = self._pending.pop(client, None)
+        if previous:
+            self.stats["superseded"] += len(previous)
+        room = self.max_pending - self.pending
+        queued = tiles[:max(0, room)]
+        self.stats["dropped"] += len(tiles) - len(queued)
+        if queued:
+            self._pending[client] = deque(queued)
+            self._wakeup.set()
+        return len(queued)
+
+    def _next(self) -> Optional[TileKey]:
+        """Pop one tile, rotating clients so one fast pan can't starve the rest"""
+        while self._pending:
+            client, tiles = self._pending.popitem(last=False)
+            if tiles:
+                tile = tiles.popleft()
+                if tiles:
+                    self._pending[client] = tiles
+                return tile
+        return None
+
+    async def _worker(self):
+        while True:
+            tile = self._next()
+            if tile is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            # Interactive requests go first
+            while self.busy():
+                self.stats["busy_waits"] += 1
+                await asyncio.sleep(BUSY_WAIT_SECONDS)
+            try:
+                if await self.warm(tile):
+                    self.stats["warmed"] += 1
+                else:
+                    self.stats["already_cached"] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.debug(f"Prefetch of {tile} failed: {e}")
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "pending": self.pending, "workers": len(self._workers)}
+
+
+class PyramidCache:
+    """Per-series pyramid geometry from the WSI plugin (immutable, so cached)"""
+
+    def __init__(self, client, ttl: float = PYRAMID_TTL_SECONDS):
+        self.client = client
+        self.ttl = ttl
+        self._levels: dict[str, tuple[float, Optional[list[PyramidLevel]]]] = {}
+
+    async def get(self, series_id: str) -> Optional[list[PyramidLevel]]:
+        now = time.monotonic()
+        cached = self._levels.get(series_id)
+        if cached and cached[0] > now:
+            return cached[1]
+        levels = None
+        response = await self.client.get(f"/wsi/pyramids/{series_id}", endpoint="metadata")
+        if response.status_code == 200:
+            try:
+                levels = levels_from_pyramid(response.json()) or None
+            except (KeyError, TypeError, ValueError, ZeroDivisionError) as e:
+                logger.warning(f"Unexpected pyramid for series {series_id}: {e}")
+        self._levels[series_id] = (now + self.ttl, levels)
+        return levels
@@ -0,0 +1,325 @@
+"""
+Region Extraction
+Cut an arbitrary rectangle out of a WSI pyramid level: fetch the tiles that
+cover it concurrently, decode and stitch them with NumPy, and encode the
+result whole (small regions) or as a stream of row bands (large regions)
+"""
+
+import io
+import math
+import zlib
+import struct
+import asyncio
+import logging
+from typing import AsyncIterator, Awaitable, Callable, NamedTuple, Optional
+
+import numpy as np
+
+from prefetch import PyramidLevel, choose_level
+from tile_batch import fetch_tiles
+
+logger = logging.getLogger(__name__)
+
+REGION_MEDIA_TYPES = {
+    "png": "image/png",
+    "jpeg": "image/jpeg",
+    "tiff": "image/tiff",
+}
+
+DEFAULT_CONCURRENCY = 16
+# Tile size of streamed TIFFs, which is also the band height they are written in
+TIFF_TILE_SIZE = 256
+# Streamed PNGs are compressed one band of this many rows at a time
+PNG_BAND_HEIGHT = 256
+# Fill for tiles missing from the pyramid (slide background)
+BACKGROUND = 255
+REGION_JPEG_QUALITY = 90
+
+# fetch(tile_x, tile_y) -> (content, media_type), or None for a missing tile
+TileFetch = Callable[[int, int], Awaitable[Optional[tuple[bytes, str]]]]
+
+
+class RegionPlan(NamedTuple):
+    """A region in the pixels of one pyramid level"""
+    level: int
+    x: int
+    y: int
+    width: int
+    height: int
+    tile_width: int
+    tile_height: int
+    # Level-0 pixels per pixel of this level
+    downsample: float
+
+    @property
+    def pixels(self) -> int:
+        return self.width * self.height
+
+    def tile_columns(self) -> range:
+        return range(self.x // self.tile_width, (self.x + self.width - 1) // self.tile_width + 1)
+
+    def tile_rows(self) -> range:
+        return range(self.y // self.tile_height, (self.y + self.height - 1) // self.tile_height + 1)
+
+
+def level_for_mpp(levels: list[PyramidLevel], base_mpp: float, mpp: float) -> int:
+    """Coarsest level whose resolution is at least as fine as ``mpp`` µm per pixel"""
+    return choose_level(levels, mpp / base_mpp)
+
+
+def plan_region(levels: list[PyramidLevel], level: int, x: float, y: float,
+                width: float, height: float) -> RegionPlan:
+    """
+    Map a rectangle given in level-0 pixels onto ``level``, clipped to the
+    image. Raises ValueError if nothing of it is inside the image.
+    """
+    if not 0 <= level < len(levels):
+        raise ValueError(f"Level must be between 0 and {len(levels) - 1}")
+    lvl = levels[level]
+    x0 = max(0, math.floor(x / lvl.downsample))
+    y0 = max(0, math.floor(y / lvl.downsample))
+    x1 = min(lvl.width, math.ceil((x + width) / lvl.downsample))
+    y1 = min(lvl.height, math.ceil((y + height) / lvl.downsample))
+    if x1 <= x0 or y1 <= y0:
+        raise ValueError("Region is outside the image")
+    return RegionPlan(level, x0, y0, x1 - x0, y1 - y0, lvl.tile_width, lvl.tile_height, lvl.downsample)
+
+
+def _row_span(plan: RegionPlan, tile_y: int) -> tuple[int, int]:
+    """Rows of the region (top, bottom) covered by a tile row"""
+    top = max(tile_y * plan.tile_height, plan.y)
+    bottom = min((tile_y + 1) * plan.tile_height, plan.y + plan.height)
+    return top - plan.y, bottom - plan.y
+
+
+def decode_row(plan: RegionPlan, tile_y: int, tiles: list, out: np.ndarray):
+    """
+    Decode one row of tiles into ``out`` (that row's slice of the region,
+    blocking, run on a thread). Missing tiles are left as background.
+    """
+    from PIL import Image
+
+    top, _ = _row_span(plan, tile_y)
+    # Region row 0 of ``out`` is this level row
+    src_top = plan.y + top - tile_y * plan.tile_height
+    out[...] = BACKGROUND
+    for tile_x, tile in zip(plan.tile_columns(), tiles):
+        if tile is None:
+            continue
+        left = tile_x * plan.tile_width
+        x0 = max(left, plan.x)
+        x1 = min(left + plan.tile_width, plan.x + plan.width)
+        with Image.open(io.BytesIO(tile[0])) as image:
+            pixels = np.asarray(image.convert("RGB"))
+        crop = pixels[src_top:src_top + out.shape[0], x0 - left:x1 - left]
+        out[:crop.shape[0], x0 - plan.x:x0 - plan.x + crop.shape[1]] = crop
+
+
+async def _fetch_row(plan: RegionPlan, tile_y: int, fetch: TileFetch, concurrency: int) -> list:
+    results = await fetch_tiles(list(plan.tile_columns()), lambda tile_x: fetch(tile_x, tile_y), concurrency)
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+    return results
+
+
+async def iter_rows(plan: RegionPlan, fetch: TileFetch,
+                    concurrency: int = DEFAULT_CONCURRENCY) -> AsyncIterator[tuple[int, list]]:
+    """
+    Fetched tile rows as (tile_y, tiles). The next row is fetched while the
+    caller decodes the current one, so Orthanc and the decoder overlap.
+    """
+    rows = list(plan.tile_rows())
+    pending = asyncio.create_task(_fetch_row(plan, rows[0], fetch, concurrency))
+    try:
+        for i, tile_y in enumerate(rows):
+            tiles = await pending
+            if i + 1 < len(rows):
+                pending = asyncio.create_task(_fetch_row(plan, rows[i + 1], fetch, concurrency))
+            yield tile_y, tiles
+    finally:
+        if not pending.done():
+            pending.cancel()
+
+
+async def stitch_region(plan: RegionPlan, fetch: TileFetch,
+                        concurrency: int = DEFAULT_CONCURRENCY) -> np.ndarray:
+    """The whole region as one (height, width, 3) uint8 array"""
+    region = np.empty((plan.height, plan.width, 3), dtype=np.uint8)
+    async for tile_y, tiles in iter_rows(plan, fetch, concurrency):
+        top, bottom = _row_span(plan, tile_y)
+        await asyncio.to_thread(decode_row, plan, tile_y, tiles, region[top:bottom])
+    return region
+
+
+async def iter_bands(plan: RegionPlan, fetch: TileFetch, band_height: int,
+                     concurrency: int = DEFAULT_CONCURRENCY) -> AsyncIterator[np.ndarray]:
+    """
+    The region as consecutive bands of ``band_height`` rows (the last one may
+    be shorter). Memory stays at one band plus one tile row whatever the
+    region size; each yielded band is only valid until the next is requested.
+    """
+    band = np.empty((band_height, plan.width, 3), dtype=np.uint8)
+    row = np.empty((plan.tile_height, plan.width, 3), dtype=np.uint8)
+    filled = 0
+    async for tile_y, tiles in iter_rows(plan, fetch, concurrency):
+        top, bottom = _row_span(plan, tile_y)
+        rows = row[:bottom - top]
+        await asyncio.to_thread(decode_row, plan, tile_y, tiles, rows)
+        while len(rows):
+            take = min(band_height - filled, len(rows))
+            band[filled:filled + take] = rows[:take]
+            filled += take
+            rows = rows[take:]
+            if filled == band_height:
+                yield band
+                filled = 0
+    if filled:
+        yield band[:filled]
+
+
+def encode_region(pixels: np.ndarray, fmt: str, mpp: Optional[float] = None) -> bytes:
+    """Encode a stitched region as PNG, JPEG or TIFF"""
+    from PIL import Image
+
+    image = Image.fromarray(pixels, "RGB")
+    out = io.BytesIO()
+    options = {"dpi": (25400 / mpp, 25400 / mpp)} if mpp else {}
+    if fmt == "jpeg":
+        image.save(out, "JPEG", quality=REGION_JPEG_QUALITY, **options)
+    elif fmt == "tiff":
+        image.save(out, "TIFF", compression="tiff_deflate", **options)
+    else:
+        image.save(out, "PNG", **options)
+    return out.getvalue()
+
+
+# =============================================================================
+# Streamed PNG
+# =============================================================================
+
+def _png_chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def _png_filter_sub(band: np.ndarray) -> bytes:
+    """Scanlines with PNG filter type 1 (Sub): each byte minus the one a pixel to its left"""
+    rows = band.reshape(band.shape[0], -1)
+    filtered = np.empty((rows.shape[0], rows.shape[1] + 1), dtype=np.uint8)
+    filtered[:, 0] = 1
+    filtered[:, 1:4] = rows[:, :3]
+    np.subtract(rows[:, 3:], rows[:, :-3], out=filtered[:, 4:])
+    return filtered.tobytes()
+
+
+async def png_stream(width: int, height: int, bands: AsyncIterator[np.ndarray],
+                     mpp: Optional[float] = None) -> AsyncIterator[bytes]:
+    """A PNG written band by band: one IDAT chunk per compressed band"""
+    yield b"\x89PNG\r\n\x1a\n"
+    yield _png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+    if mpp:
+        pixels_per_metre = round(1e6 / mpp)
+        yield _png_chunk(b"pHYs", struct.pack(">IIB", pixels_per_metre, pixels_per_metre, 1))
+    compressor = zlib.compressobj(6)
+    async for band in bands:
+        data = await asyncio.to_thread(lambda: compressor.compress(_png_filter_sub(band)))
+        if data:
+            yield _png_chunk(b"IDAT", data)
+    yield _png_chunk(b"IDAT", compressor.flush())
+    yield _png_chunk(b"IEND", b"")
+
+
+# =============================================================================
+# Streamed tiled TIFF
+# =============================================================================
+
+# TIFF tag type codes
+SHORT, LONG, RATIONAL = 3, 4, 5
+
+
+def tiff_size(width: int, height: int, tile_size: int = TIFF_TILE_SIZE) -> int:
+    """Bytes of a streamed TIFF (header, IFD, tile tables and padded tiles)"""
+    tiles = math.ceil(width / tile_size) * math.ceil(height / tile_size)
+    return len(_tiff_header(width, height, tile_size, None)) + tiles * tile_size * tile_size * 3
+
+
+def _tiff_header(width: int, height: int, tile_size: int, mpp: Optional[float]) -> bytes:
+    """
+    Little-endian TIFF header and IFD for an uncompressed, tiled RGB image.
+
+    Tiles are uncompressed so every tile offset is known before the first
+    pixel is written; that is what lets the file be streamed front to back.
+    """
+    across = math.ceil(width / tile_size)
+    down = math.ceil(height / tile_size)
+    count = across * down
+    tile_bytes = tile_size * tile_size * 3
+
+    entries = [
+        (256, LONG, 1, width),                  # ImageWidth
+        (257, LONG, 1, height),                 # ImageLength
+        (258, SHORT, 3, None),                  # BitsPerSample (8, 8, 8)
+        (259, SHORT, 1, 1),                     # Compression: none
+        (262, SHORT, 1, 2),                     # PhotometricInterpretation: RGB
+        (277, SHORT, 1, 3),                     # SamplesPerPixel
+        (282, RATIONAL, 1, None),               # XResolution
+        (283, RATIONAL, 1, None),               # YResolution
+        (284, SHORT, 1, 1),                     # PlanarConfiguration: chunky
+        (296, SHORT, 1, 3 if mpp else 1),       # ResolutionUnit: centimetre / none
+        (322, LONG, 1, tile_size),              # TileWidth
+        (323, LONG, 1, tile_size),              # TileLength
+        (324, LONG, count, None),               # TileOffsets
+        (325, LONG, count, None),               # TileByteCounts
+    ]
+    ifd_size = 2 + 12 * len(entries) + 4
+    extra_offset = 8 + ifd_size
+    bits_offset = extra_offset
+    resolution_offset = bits_offset + 6 + 2
+    offsets_offset = resolution_offset + 8
+    counts_offset = offsets_offset + 4 * count
+    data_offset = counts_offset + 4 * count
+
+    # Pixels per centimetre as a rational with micrometre precision
+    resolution = (round(1e7 / mpp), 1000) if mpp else (1, 1)
+    external = {258: bits_offset, 282: resolution_offset, 283: resolution_offset,
+                324: offsets_offset, 325: counts_offset}
+
+    ifd = struct.pack("<H", len(entries))
+    for tag, kind, n, value in entries:
+        if tag in external:
+            if tag in (324, 325) and count == 1:
+                value = data_offset if tag == 324 else tile_bytes
+            else:
+                value = external[tag]
+        ifd += struct.pack("<HHII", tag, kind, n, value) if kind != SHORT or n > 1 \
+            else struct.pack("<HHIHH", tag, kind, n, value, 0)
+    ifd += struct.pack("<I", 0)
+
+    return b"".join([
+        b"II*\x00" + struct.pack("<I", 8),
+        ifd,
+        struct.pack("<3H", 8, 8, 8) + b"\x00\x00",
+        struct.pack("<II", *resolution),
+        struct.pack(f"<{count}I", *(data_offset + i * tile_bytes for i in range(count))),
+        struct.pack(f"<{count}I", *([tile_bytes] * count)),
+    ])
+
+
+async def tiff_stream(width: int, height: int, bands: AsyncIterator[np.ndarray],
+                      mpp: Optional[float] = None, tile_size: int = TIFF_TILE_SIZE) -> AsyncIterator[bytes]:
+    """
+    A tiled TIFF written one row of tiles at a time. ``bands`` must be
+    ``tile_size`` rows high (the last one may be shorter).
+    """
+    yield _tiff_header(width, height, tile_size, mpp)
+    across = math.ceil(width / tile_size)
+    padded = np.full((tile_size, across * tile_size, 3), BACKGROUND, dtype=np.uint8)
+    async for band in bands:
+        if band.shape[0] < tile_size:
+            # Last row of tiles: pad below the image
+            padded[...] = BACKGROUND
+        padded[:band.shape[0], :width] = band
+        yield b"".join(
+            np.ascontiguousarray(padded[:, i * tile_size:(i + 1) * tile_size]).tobytes()
+            for i in range(across)
+        )
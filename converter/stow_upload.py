@@ -0,0 +1,303 @@
+"""
+Parallel STOW-RS Upload
+Streams converted DICOM files from disk to Orthanc over the shared client
+"""
+
+import time
+import uuid
+import asyncio
+import logging
+from pathlib import Path
+from typing import AsyncIterator, Callable, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+STREAM_CHUNK_SIZE = 8 * 1024 * 1024      # 8MB reads, same as chunked DICOM uploads
+DEFAULT_CONCURRENCY = 4
+DEFAULT_BATCH_BYTES = 64 * 1024 * 1024   # 0 = one /instances request per file
+DEFAULT_MAX_ATTEMPTS = 3
+RETRY_BASE_DELAY_SECONDS = 1.0
+PROGRESS_INTERVAL_SECONDS = 0.5
+
+# DICOM JSON keys of a STOW-RS response
+RETRIEVE_URL = "00081190"
+FAILED_SOP_SEQUENCE = "00081198"
+
+
+class UploadProgress:
+    """Byte/file counters shared by all concurrent uploads of one job"""
+
+    def __init__(self, total_files: int, total_bytes: int,
+                 on_progress: Optional[Callable[["UploadProgress"], None]] = None):
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.files_done = 0
+        self.bytes_sent = 0
+        self.requests = 0
+        self.retries = 0
+        self.fallbacks = 0
+        self.started = time.monotonic()
+        self._on_progress = on_progress
+        self._last_report = 0.0
+
+    @property
+    def fraction(self) -> float:
+        return min(1.0, self.bytes_sent / self.total_bytes) if self.total_bytes else 1.0
+
+    @property
+    def mb_per_second(self) -> float:
+        elapsed = time.monotonic() - self.started
+        return self.bytes_sent / (1024 * 1024) / elapsed if elapsed > 0 else 0.0
+
+    def add(self, nbytes: int, force: bool = False):
+        self.bytes_sent += nbytes
+        now = time.monotonic()
+        if self._on_progress and (force or now - self._last_report >= PROGRESS_INTERVAL_SECONDS):
+            self._last_report = now
+            self._on_progress(self)
+
+    def to_dict(self) -> dict:
+        return {
+            "files": self.files_done,
+            "bytes": self.bytes_sent,
+            "seconds": round(time.monotonic() - self.started, 2),
+            "mb_per_s": round(self.mb_per_second, 1),
+            "requests": self.requests,
+            "retries": self.retries,
+            "fallbacks": self.fallbacks,
+        }
+
+
+async def iter_file_chunks(path: Path, counter: list, progress: Optional[UploadProgress] = None,
+                           chunk_size: int = STREAM_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """Yield a file from disk without buffering it; counter[0] tracks bytes yielded"""
+    f = await asyncio.to_thread(open, path, "rb")
+    try:
+        while True:
+            data = await asyncio.to_thread(f.read, chunk_size)
+            if not data:
+                break
+            counter[0] += len(data)
+            if progress is not None:
+                progress.add(len(data))
+            yield data
+    finally:
+        f.close()
+
+
+def plan_batches(files: list[tuple[Path, int]], batch_bytes: int) -> list[list[tuple[Path, int]]]:
+    """Group (path, size) pairs into STOW batches of at most batch_bytes (oversized files go alone)"""
+    if batch_bytes <= 0:
+        return [[f] for f in files]
+    batches, current, current_bytes = [], [], 0
+    for path, size in files:
+        if current and current_bytes + size > batch_bytes:
+            batches.append(current)
+            current, current_bytes = [], 0
+        current.append((path, size))
+        current_bytes += size
+    if current:
+        batches.append(current)
+    return batches
+
+
+def multipart_related(batch: list[tuple[Path, int]], counter: list,
+                      progress: Optional[UploadProgress] = None) -> tuple[AsyncIterator[bytes], int, str]:
+    """Build a streamed multipart/related body; returns (body, content_length, content_type)"""
+    boundary = uuid.uuid4().hex
+    part_header = f"--{boundary}\r\nContent-Type: application/dicom\r\n\r\n".encode()
+    closing = f"--{boundary}--\r\n".encode()
+    length = sum(len(part_header) + size + 2 for _, size in batch) + len(closing)
+
+    async def body():
+        for path, _ in batch:
+            yield part_header
+            async for data in iter_file_chunks(path, counter, progress):
+                yield data
+            yield b"\r\n"
+        yield closing
+
+    content_type = f'multipart/related; type="application/dicom"; boundary={boundary}'
+    return body(), length, content_type
+
+
+def parse_stow_response(result) -> tuple[Optional[str], int]:
+    """Return (StudyInstanceUID, failed instance count) from a STOW-RS response"""
+    if not isinstance(result, dict):
+        return None, 0
+    study_uid = None
+    urls = (result.get(RETRIEVE_URL) or {}).get("Value") or []
+    if urls and "/studies/" in urls[0]:
+        study_uid = urls[0].rsplit("/studies/", 1)[1].split("/", 1)[0]
+    failed = (result.get(FAILED_SOP_SEQUENCE) or {}).get("Value") or []
+    return study_uid, len(failed)
+
+
+class StowUploader:
+    """
+    Uploads a set of DICOM files to Orthanc.
+
+    Files are batched into multipart/related STOW-RS requests and sent with
+    bounded concurrency; a batch that fails is retried with backoff and then
+    falls back to per-file POST /instances (also retried). Bodies are always
+    streamed from disk.
+    """
+
+    def __init__(
+        self,
+        client,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        batch_bytes: int = DEFAULT_BATCH_BYTES,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        retry_delay: float = RETRY_BASE_DELAY_SECONDS,
+    ):
+        self.client = client
+        self.concurrency = max(1, concurrency)
+        self.batch_bytes = batch_bytes
+        self.max_attempts = max(1, max_attempts)
+        self.retry_delay = retry_delay
+
+    async def _send(self, progress: UploadProgress, make_request):
+        """Run one streamed request, undoing its byte count if it has to be re-sent"""
+        counter = [0]
+        progress.requests += 1
+        try:
+            response = await make_request(counter)
+        except httpx.HTTPError:
+            progress.add(-counter[0])
+            raise
+        if response.status_code not in (200, 201, 202):
+            progress.add(-counter[0])
+        return response
+
+    async def _backoff(self, progress: UploadProgress, attempt: int):
+        progress.retries += 1
+        await asyncio.sleep(self.retry_delay * 2 ** attempt)
+
+    async def _stow_batch(self, batch, progress: UploadProgress) -> Optional[set]:
+        """POST one multipart batch; returns {StudyInstanceUID} or None to fall back to /instances"""
+        async def make_request(counter):
+            body, length, content_type = multipart_related(batch, counter, progress)
+            return await self.client.post(
+                "/dicom-web/studies",
+                content=body,
+                headers={
+                    "Content-Type": content_type,
+                    "Content-Length": str(length),
+                    "Accept": "application/dicom+json",
+                },
+            )
+
+        for attempt in range(self.max_attempts):
+            try:
+                response = await self._send(progress, make_request)
+            except httpx.HTTPError as e:
+                logger.warning(f"⚠️ STOW batch of {len(batch)} failed ({e}), attempt {attempt + 1}")
+            else:
+                if response.status_code in (200, 202):
+                    study_uid, failed = parse_stow_response(response.json())
+                    if not failed:
+                        return {study_uid} if study_uid else set()
+                    # Partially stored: re-send the batch file by file (Orthanc ignores duplicates)
+                    logger.warning(f"⚠️ STOW stored {len(batch) - failed}/{len(batch)} instances")
+                    return None
+                if response.status_code < 500:
+                    # DICOMweb plugin missing or request rejected - retrying won't help
+                    logger.warning(f"⚠️ STOW rejected with {response.status_code}: {response.text[:200]}")
+                    return None
+                logger.warning(f"⚠️ STOW batch returned {response.status_code}, attempt {attempt + 1}")
+            if attempt + 1 < self.max_attempts:
+                await self._backoff(progress, attempt)
+        return None
+
+    async def _post_instance(self, path: Path, size: int, progress: UploadProgress) -> Optional[str]:
+        """POST one file to /instances with retries; returns the Orthanc study ID"""
+        async def make_request(counter):
+            return await self.client.post(
+                "/instances",
+                content=iter_file_chunks(path, counter, progress),
+                headers={"Content-Type": "application/dicom", "Content-Length": str(size)},
+            )
+
+        error = None
+        for attempt in range(self.max_attempts):
+            try:
+                response = await self._send(progress, make_request)
+                if response.status_code in (200, 201):
+                    result = response.json()
+                    return result.get("ParentStudy") if isinstance(result, dict) else None
+                error = f"Orthanc returned {response.status_code}: {response.text[:200]}"
+                if response.status_code < 500:
+                    break
+            except httpx.HTTPError as e:
+                error = str(e) or type(e).__name__
+            if attempt + 1 < self.max_attempts:
+                await self._backoff(progress, attempt)
+        raise Exception(f"Upload of {path.name} failed: {error}")
+
+    async def _upload_batch(self, batch, progress: UploadProgress, semaphore, study_uids: set, study_ids: set):
+        async with semaphore:
+            stored = None
+            if self.batch_bytes > 0:
+                stored = await self._stow_batch(batch, progress)
+            if stored is not None:
+                study_uids.update(stored)
+            else:
+                if self.batch_bytes > 0:
+                    progress.fallbacks += 1
+                for path, size in batch:
+                    study_id = await self._post_instance(path, size, progress)
+                    if study_id:
+                        study_ids.add(study_id)
+            progress.files_done += len(batch)
+            progress.add(0, force=True)
+
+    async def _lookup_study(self, study_uid: str) -> Optional[str]:
+        """Map a StudyInstanceUID onto the Orthanc study ID"""
+        response = await self.client.post("/tools/lookup", content=study_uid)
+        if response.status_code != 200:
+            return None
+        for match in response.json():
+            if match.get("Type") == "Study":
+                return match.get("ID")
+        return None
+
+    async def upload(self, paths: list[Path],
+                     on_progress: Optional[Callable[[UploadProgress], None]] = None) -> dict:
+        """
+        Upload all files; returns the Orthanc study ID plus throughput stats.
+
+        Raises if any file could not be stored after all retries.
+        """
+        files = [(Path(p), Path(p).stat().st_size) for p in paths]
+        progress = UploadProgress(len(files), sum(size for _, size in files), on_progress)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        study_uids: set = set()
+        study_ids: set = set()
+
+        try:
+            # First failure cancels the remaining batches
+            async with asyncio.TaskGroup() as tg:
+                for batch in plan_batches(files, self.batch_bytes):
+                    tg.create_task(self._upload_batch(batch, progress, semaphore, study_uids, study_ids))
+        except ExceptionGroup as eg:
+            raise eg.exceptions[0]
+
+        if not study_ids:
+            for study_uid in study_uids:
+                study_id = await self._lookup_study(study_uid)
+                if study_id:
+                    study_ids.add(study_id)
+        if len(study_ids) > 1:
+            logger.warning(f"⚠️ Converted files landed in {len(study_ids)} studies: {sorted(study_ids)}")
+
+        stats = progress.to_dict()
+        logger.info(
+            f"✅ Uploaded {stats['files']} files ({progress.total_bytes / (1024 * 1024):.1f} MB) "
+            f"in {stats['seconds']}s ({stats['mb_per_s']} MB/s, {stats['requests']} requests, "
+            f"{stats['retries']} retries, {stats['fallbacks']} fallbacks)"
+        )
+        return {"study_id": sorted(study_ids)[0] if study_ids else None, **stats}
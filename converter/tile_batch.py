@@ -0,0 +1,80 @@
+"""
+Tile Batching
+Fetch many tiles concurrently and return them in one length-prefixed pack
+"""
+
+import json
+import struct
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# Pack layout (all integers big-endian):
+#   uint32 header length | JSON header | tile payloads, concatenated
+# The header is a list with one {"status", "type", "length"} entry per
+# requested key, in request order; a payload follows only for status 200.
+TILE_PACK_MEDIA_TYPE = "application/vnd.pathview.tile-pack"
+
+DEFAULT_MAX_TILES = 64
+DEFAULT_CONCURRENCY = 16
+
+# A fetched tile is (content, media_type); None means Orthanc has no such tile
+TileResult = Optional[tuple[bytes, str]]
+
+
+async def fetch_tiles(
+    keys: Sequence,
+    fetch: Callable[..., Awaitable[TileResult]],
+    concurrency: int = DEFAULT_CONCURRENCY,
+) -> list:
+    """
+    Run ``fetch(key)`` for every key with at most ``concurrency`` in flight.
+
+    Results keep request order. A failing key yields its exception instead of
+    failing the whole batch, so one bad tile never blanks the viewport.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def fetch_one(key):
+        async with semaphore:
+            try:
+                return await fetch(key)
+            except Exception as e:
+                logger.warning(f"Tile batch fetch failed for {key}: {e}")
+                return e
+
+    return await asyncio.gather(*(fetch_one(key) for key in keys))
+
+
+def pack_tiles(results: Sequence) -> bytes:
+    """Encode fetch_tiles() results as a tile pack"""
+    header = []
+    payloads = []
+    for result in results:
+        if isinstance(result, Exception):
+            header.append({"status": 502, "type": None, "length": 0})
+        elif result is None:
+            header.append({"status": 404, "type": None, "length": 0})
+        else:
+            content, media_type = result
+            header.append({"status": 200, "type": media_type, "length": len(content)})
+            payloads.append(content)
+    encoded = json.dumps(header, separators=(",", ":")).encode()
+    return b"".join([struct.pack(">I", len(encoded)), encoded, *payloads])
+
+
+def unpack_tiles(data: bytes) -> list[tuple[int, Optional[str], bytes]]:
+    """Decode a tile pack into (status, media_type, content) per key"""
+    (header_length,) = struct.unpack_from(">I", data)
+    header = json.loads(data[4:4 + header_length])
+    offset = 4 + header_length
+    tiles = []
+    for entry in header:
+        length = entry["length"]
+        tiles.append((entry["status"], entry["type"], data[offset:offset + length]))
+        offset += length
+    if offset != len(data):
+        raise ValueError(f"Tile pack has {len(data) - offset} trailing bytes")
+    return tiles
@@ -0,0 +1,338 @@
+"""
+Tile Cache
+Two-tier cache for WSI tiles: in-process LRU bounded by bytes + shared Redis
+"""
+
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# A cached tile is its encoded bytes plus the media type Orthanc returned
+Tile = tuple[bytes, str]
+
+REDIS_RETRY_SECONDS = 30.0
+# Prefetched keys remembered for prefetch hit accounting
+PREFETCH_TRACKED_KEYS = 10_000
+
+
+def tile_key(series_id: str, level: int, x: int, y: int, fmt: str = "native") -> str:
+    """Cache key for a single tile"""
+    return f"tile:{series_id}:{level}:{x}:{y}:{fmt}"
+
+
+class ByteLRUCache:
+    """
+    In-process LRU cache bounded by total payload size.
+
+    Entries expire after ``ttl`` seconds; the least recently used entries
+    are evicted once ``max_bytes`` is exceeded.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.current_bytes = 0
+        self.evictions = 0
+        self._entries: OrderedDict[str, tuple[float, bytes, str]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[Tile]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, content, media_type = entry
+        if expires <= time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return content, media_type
+
+    def set(self, key: str, content: bytes, media_type: str):
+        size = len(content)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + self.ttl, content, media_type)
+        self.current_bytes += size
+        while self.current_bytes > self.max_bytes and self._entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def delete(self, key: str) -> bool:
+        if key not in self._entries:
+            return False
+        self._remove(key)
+        return True
+
+    def delete_prefix(self, prefix: str) -> int:
+        keys = [k for k in self._entries if k.startswith(prefix)]
+        for key in keys:
+            self._remove(key)
+        return len(keys)
+
+    def clear(self):
+        self._entries.clear()
+        self.current_bytes = 0
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= len(entry[1])
+
+
+class TileCache:
+    """
+    Memory + Redis tile cache with single-flight fetches.
+
+    Redis is optional: if the package is missing or the server is
+    unreachable the cache keeps working in memory only and retries
+    Redis periodically.
+    """
+
+    def __init__(
+        self,
+        max_memory_bytes: int = 256 * 1024 * 1024,
+        memory_ttl: float = 3600.0,
+        redis_url: Optional[str] = None,
+        redis_ttl: int = 86400,
+    ):
+        self.memory = ByteLRUCache(max_memory_bytes, memory_ttl)
+        self.redis_url = redis_url
+        self.redis_ttl = redis_ttl
+        self._redis = None
+        self._redis_down_until = 0.0
+        # One fetch task per key shared by every caller, and how many callers await it
+        self._inflight: dict[str, asyncio.Task] = {}
+        self._waiters: dict[str, int] = {}
+        # Keys warmed by prefetch and not yet requested (bounded, oldest dropped)
+        self._prefetched: OrderedDict[str, None] = OrderedDict()
+        self._warming = 0
+        self.stats = {
+            "memory_hits": 0,
+            "redis_hits": 0,
+            "misses": 0,
+            "coalesced": 0,
+            "redis_errors": 0,
+            "invalidations": 0,
+            "prefetched": 0,
+            "prefetch_hits": 0,
+        }
+
+    # -------------------------------------------------------------------------
+    # Redis connection
+    # -------------------------------------------------------------------------
+
+    def _get_redis(self):
+        if not self.redis_url or time.monotonic() < self._redis_down_until:
+            return None
+        if self._redis is None:
+            try:
+                import redis.asyncio as aioredis
+            except ImportError:
+                logger.warning("redis package not installed - tile cache is memory-only")
+                self.redis_url = None
+                return None
+            self._redis = aioredis.from_url(self.redis_url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        return self._redis
+
+    def _redis_failed(self, e: Exception):
+        self.stats["redis_errors"] += 1
+        self._redis_down_until = time.monotonic() + REDIS_RETRY_SECONDS
+        logger.warning(f"Tile cache Redis unavailable, using memory only for {REDIS_RETRY_SECONDS:.0f}s: {e}")
+
+    async def close(self):
+        if self._redis is not None:
+            try:
+                await self._redis.aclose()
+            except Exception:
+                pass
+            self._redis = None
+
+    # -------------------------------------------------------------------------
+    # Get / set
+    # -------------------------------------------------------------------------
+
+    async def _lookup(self, key: str) -> tuple[Optional[Tile], Optional[str]]:
+        """Cached tile and the tier it came from, without touching stats"""
+        tile = self.memory.get(key)
+        if tile is not None:
+            return tile, "memory"
+
+        redis = self._get_redis()
+        if redis is not None:
+            try:
+                raw = await redis.get(key)
+            except Exception as e:
+                self._redis_failed(e)
+                raw = None
+            if raw:
+                media_type, _, content = raw.partition(b"\0")
+                tile = (content, media_type.decode())
+                self.memory.set(key, *tile)
+                return tile, "redis"
+        return None, None
+
+    async def get(self, key: str) -> Optional[Tile]:
+        tile, tier = await self._lookup(key)
+        if tile is None:
+            self.stats["misses"] += 1
+            return None
+        self.stats[f"{tier}_hits"] += 1
+        self._count_prefetch_hit(key)
+        return tile
+
+    def _count_prefetch_hit(self, key: str):
+        if self._prefetched:
+            try:
+                del self._prefetched[key]
+            except KeyError:
+                return
+            self.stats["prefetch_hits"] += 1
+
+    async def set(self, key: str, content: bytes, media_type: str):
+        self.memory.set(key, content, media_type)
+        redis = self._get_redis()
+        if redis is not None:
+            try:
+                await redis.set(key, media_type.encode() + b"\0" + content, ex=self.redis_ttl)
+            except Exception as e:
+                self._redis_failed(e)
+
+    async def get_or_fetch(self, key: str, fetch: Callable[[], Awaitable[Optional[Tile]]]) -> Optional[Tile]:
+        """
+        Return a cached tile or fetch it once for all concurrent callers.
+
+        ``fetch`` returns ``(content, media_type)`` or None for a missing
+        tile; None results are not cached.
+        """
+        tile = await self.get(key)
+        if tile is not None:
+            return tile
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.stats["coalesced"] += 1
+            self._count_prefetch_hit(key)
+            return await self._join(key, pending)
+
+        return await self._fetch_once(key, fetch)
+
+    async def _fetch_once(self, key: str, fetch: Callable[[], Awaitable[Optional[Tile]]]) -> Optional[Tile]:
+        """Start ``fetch`` as the single in-flight fetch for ``key`` and wait for it"""
+        task = asyncio.create_task(self._fetch_and_store(key, fetch))
+        # Retrieve the outcome even if every caller has gone away
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        self._inflight[key] = task
+        return await self._join(key, task)
+
+    async def _fetch_and_store(self, key: str, fetch: Callable[[], Awaitable[Optional[Tile]]]) -> Optional[Tile]:
+        try:
+            tile = await fetch()
+            if tile is not None:
+                await self.set(key, *tile)
+            return tile
+        finally:
+            if self._inflight.get(key) is asyncio.current_task():
+                del self._inflight[key]
+
+    async def _join(self, key: str, task: asyncio.Task) -> Optional[Tile]:
+        """
+        Wait for a shared fetch. A caller that is cancelled (client gone,
+        prefetch stopped) leaves the fetch running for the others; the fetch
+        is only cancelled once nobody is waiting for it.
+        """
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiters[key] == 1 and not task.done():
+                task.cancel()
+            raise
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+
+    # -------------------------------------------------------------------------
+    # Prefetch
+    # -------------------------------------------------------------------------
+
+    def interactive_inflight(self) -> int:
+        """Fetches in flight on behalf of clients (prefetches excluded)"""
+        return len(self._inflight) - self._warming
+
+    async def warm(self, key: str, fetch: Callable[[], Awaitable[Optional[Tile]]]) -> bool:
+        """
+        Fetch a tile into the cache ahead of need.
+
+        Returns True if the tile was fetched, False if it was already cached,
+        in flight or missing. Not counted as a lookup in the hit/miss stats;
+        a later get() of a warmed key counts as a prefetch hit instead.
+        """
+        if key in self._inflight:
+            return False
+        tile, _ = await self._lookup(key)
+        if tile is not None or key in self._inflight:
+            return False
+
+        self._warming += 1
+        self._prefetched[key] = None
+        try:
+            tile = await self._fetch_once(key, fetch)
+        except BaseException:
+            self._prefetched.pop(key, None)
+            raise
+        finally:
+            self._warming -= 1
+        if tile is None:
+            self._prefetched.pop(key, None)
+            return False
+        self.stats["prefetched"] += 1
+        while len(self._prefetched) > PREFETCH_TRACKED_KEYS:
+            self._prefetched.popitem(last=False)
+        return True
+
+    # -------------------------------------------------------------------------
+    # Invalidation
+    # -------------------------------------------------------------------------
+
+    async def invalidate_series(self, series_id: str) -> int:
+        """Drop every cached tile of a series from both tiers"""
+        prefix = f"tile:{series_id}:"
+        removed = self.memory.delete_prefix(prefix)
+        redis = self._get_redis()
+        if redis is not None:
+            try:
+                keys = [k async for k in redis.scan_iter(match=prefix + "*", count=500)]
+                if keys:
+                    removed += await redis.delete(*keys)
+            except Exception as e:
+                self._redis_failed(e)
+        self.stats["invalidations"] += 1
+        return removed
+
+    def get_stats(self) -> dict:
+        lookups = self.stats["memory_hits"] + self.stats["redis_hits"] + self.stats["misses"]
+        hits = self.stats["memory_hits"] + self.stats["redis_hits"]
+        return {
+            **self.stats,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            # Share of prefetched tiles a client went on to request
+            "prefetch_hit_rate": (
+                round(self.stats["prefetch_hits"] / self.stats["prefetched"], 4)
+                if self.stats["prefetched"] else 0.0
+            ),
+            "memory_entries": len(self.memory),
+            "memory_bytes": self.memory.current_bytes,
+            "memory_max_bytes": self.memory.max_bytes,
+            "memory_evictions": self.memory.evictions,
+            "redis_enabled": bool(self.redis_url),
+        }
@@ -0,0 +1,207 @@
+"""
+Tile Transcoding
+Re-encode tiles as AVIF/WebP or lower-quality JPEG, negotiated from the
+Accept header and a quality hint
+"""
+
+import io
+import time
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+TRANSCODE_MEDIA_TYPES = {
+    "avif": "image/avif",
+    "webp": "image/webp",
+    "jpeg": "image/jpeg",
+}
+
+QUALITY_PRESETS = {"low": 50, "medium": 70, "high": 85}
+
+# off:       always serve tiles as Orthanc produced them
+# balanced:  transcode only when the client asks (quality hint or Save-Data),
+#            preferring WebP, which is cheap to encode
+# bandwidth: transcode every tile the client can take as AVIF/WebP, preferring
+#            AVIF (smallest, but several times the encode CPU)
+POLICIES = ("off", "balanced", "bandwidth")
+FORMAT_PREFERENCE = {
+    "balanced": ("webp", "avif", "jpeg"),
+    "bandwidth": ("avif", "webp", "jpeg"),
+}
+
+DEFAULT_QUALITY = 75
+DEFAULT_WORKERS = 2
+
+
+class TileFormat(NamedTuple):
+    name: str
+    quality: int
+
+    @property
+    def key(self) -> str:
+        """Tile cache format suffix"""
+        return f"{self.name}-q{self.quality}"
+
+    @property
+    def media_type(self) -> str:
+        return TRANSCODE_MEDIA_TYPES[self.name]
+
+
+def supported_formats() -> set[str]:
+    """Output formats the installed Pillow can encode"""
+    try:
+        from PIL import features
+    except ImportError:
+        return set()
+    formats = {"jpeg"}
+    for name in ("webp", "avif"):
+        try:
+            if features.check(name):
+                formats.add(name)
+        except ValueError:
+            # Pillow too old to know the feature
+            pass
+    return formats
+
+
+def parse_quality(hint: Optional[str]) -> Optional[int]:
+    """Quality hint as a preset name (low/medium/high) or 1-100; None if absent or invalid"""
+    if not hint:
+        return None
+    hint = hint.strip().lower()
+    if hint in QUALITY_PRESETS:
+        return QUALITY_PRESETS[hint]
+    try:
+        quality = int(hint)
+    except ValueError:
+        return None
+    return quality if 1 <= quality <= 100 else None
+
+
+def negotiate(
+    accept: str,
+    quality_hint: Optional[str],
+    policy: str,
+    save_data: bool = False,
+    default_quality: int = DEFAULT_QUALITY,
+    formats: Optional[set[str]] = None,
+) -> Optional[TileFormat]:
+    """
+    Output format for a tile request, or None to serve the native tile.
+
+    JPEG is only chosen when the client asked for a lower quality and
+    accepts nothing better; a plain request never re-encodes JPEG to JPEG.
+    """
+    if policy not in FORMAT_PREFERENCE:
+        return None
+    quality = parse_quality(quality_hint)
+    if quality is None and save_data:
+        quality = QUALITY_PRESETS["low"]
+    if quality is None and policy == "bandwidth":
+        quality = default_quality
+    if quality is None:
+        return None
+
+    accept = accept or ""
+    formats = supported_formats() if formats is None else formats
+    for name in FORMAT_PREFERENCE[policy]:
+        if name not in formats:
+            continue
+        if name == "jpeg":
+            if quality_hint or save_data:
+                return TileFormat("jpeg", quality)
+            continue
+        if TRANSCODE_MEDIA_TYPES[name] in accept:
+            return TileFormat(name, quality)
+    return None
+
+
+def transcode(content: bytes, fmt: TileFormat) -> bytes:
+    """Decode a tile and encode it in ``fmt`` (blocking, run on a thread)"""
+    from PIL import Image
+
+    with Image.open(io.BytesIO(content)) as image:
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        out = io.BytesIO()
+        if fmt.name == "jpeg":
+            image.save(out, "JPEG", quality=fmt.quality, optimize=True)
+        elif fmt.name == "webp":
+            image.save(out, "WEBP", quality=fmt.quality, method=4)
+        else:
+            image.save(out, "AVIF", quality=fmt.quality, speed=8)
+        return out.getvalue()
+
+
+class TileTranscoder:
+    """
+    Thread-pool tile transcoder with a runtime-switchable policy.
+
+    Pillow releases the GIL while decoding/encoding, so a small thread pool
+    keeps transcodes off the event loop without process overhead.
+    """
+
+    def __init__(self, policy: str = "balanced", default_quality: int = DEFAULT_QUALITY,
+                 workers: int = DEFAULT_WORKERS):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown transcode policy: {policy}")
+        self.policy = policy
+        self.default_quality = default_quality
+        self.workers = max(1, workers)
+        self.formats = supported_formats()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.stats = {
+            "transcoded": 0,
+            "errors": 0,
+            "bytes_in": 0,
+            "bytes_out": 0,
+            "seconds": 0.0,
+        }
+
+    def set_policy(self, policy: str, default_quality: Optional[int] = None):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown transcode policy: {policy}")
+        self.policy = policy
+        if default_quality is not None:
+            self.default_quality = default_quality
+        logger.info(f"🗜️ Tile transcode policy: {policy} (default quality {self.default_quality})")
+
+    def negotiate(self, accept: str, quality_hint: Optional[str], save_data: bool = False) -> Optional[TileFormat]:
+        return negotiate(accept, quality_hint, self.policy, save_data, self.default_quality, self.formats)
+
+    async def transcode(self, content: bytes, fmt: TileFormat) -> bytes:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="transcode")
+        started = time.perf_counter()
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self._executor, transcode, content, fmt)
+        except Exception:
+            self.stats["errors"] += 1
+            raise
+        self.stats["transcoded"] += 1
+        self.stats["bytes_in"] += len(content)
+        self.stats["bytes_out"] += len(result)
+        self.stats["seconds"] += time.perf_counter() - started
+        return result
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def get_stats(self) -> dict:
+        count = self.stats["transcoded"]
+        return {
+            **self.stats,
+            "seconds": round(self.stats["seconds"], 3),
+            "policy": self.policy,
+            "default_quality": self.default_quality,
+            "formats": sorted(self.formats),
+            "workers": self.workers,
+            "avg_ms": round(self.stats["seconds"] * 1000 / count, 2) if count else 0.0,
+            # Output size relative to the native tiles
+            "size_ratio": round(self.stats["bytes_out"] / self.stats["bytes_in"], 4) if self.stats["bytes_in"] else 0.0,
+        }
@@ -0,0 +1,242 @@
+"""
+WSI Metadata Builder
+Builds the viewer's pyramid / focal-plane / label / macro description of a study
+from bulk Orthanc tag requests instead of one request per instance
+"""
+
+import time
+import asyncio
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Parallel per-instance tag fetches when the bulk endpoint is unavailable
+DEFAULT_FETCH_CONCURRENCY = 8
+
+# Safety net for instances that reach Orthanc without passing through the
+# converter (e.g. C-STORE); uploads through the converter invalidate explicitly
+METADATA_CACHE_TTL_SECONDS = 300
+
+_metadata_cache: dict[str, tuple[float, dict]] = {}
+
+
+def invalidate_wsi_metadata(study_id: Optional[str] = None):
+    """Drop the cached metadata of a study (or of all studies)"""
+    if study_id is None:
+        _metadata_cache.clear()
+    else:
+        _metadata_cache.pop(study_id, None)
+
+
+def get_cached_wsi_metadata(study_id: str) -> Optional[dict]:
+    cached = _metadata_cache.get(study_id)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+    return None
+
+
+def cache_wsi_metadata(study_id: str, metadata: dict):
+    _metadata_cache[study_id] = (time.monotonic() + METADATA_CACHE_TTL_SECONDS, metadata)
+
+
+async def fetch_study_instance_tags(client, study_id: str, concurrency: int = DEFAULT_FETCH_CONCURRENCY) -> list[dict]:
+    """
+    Fetch simplified tags of every instance in a study.
+
+    Uses Orthanc's bulk ``/studies/{id}/instances-tags?simplify`` (Orthanc >= 1.x)
+    alongside ``/studies/{id}/instances`` for the parent series; falls back to
+    concurrent per-instance requests bounded by ``concurrency``.
+
+    Returns a list of ``{"id", "seriesId", "tags"}`` dicts.
+    Raises httpx.HTTPStatusError if the study cannot be listed.
+    """
+    instances_response, tags_response = await asyncio.gather(
+        client.get(f"/studies/{study_id}/instances"),
+        client.get(f"/studies/{study_id}/instances-tags?simplify"),
+    )
+    instances_response.raise_for_status()
+    instances = instances_response.json()
+
+    if tags_response.status_code == 200:
+        bulk_tags = tags_response.json()
+        return [
+            {"id": inst["ID"], "seriesId": inst.get("ParentSeries"), "tags": bulk_tags[inst["ID"]]}
+            for inst in instances
+            if inst["ID"] in bulk_tags
+        ]
+
+    logger.debug(f"Bulk instances-tags unavailable ({tags_response.status_code}), fetching per instance")
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch_one(inst: dict) -> Optional[dict]:
+        async with semaphore:
+            response = await client.get(f"/instances/{inst['ID']}/simplified-tags")
+        if response.status_code != 200:
+            return None
+        return {"id": inst["ID"], "seriesId": inst.get("ParentSeries"), "tags": response.json()}
+
+    results = await asyncio.gather(*(fetch_one(inst) for inst in instances))
+    return [r for r in results if r is not None]
+
+
+def _instance_data(instance_id: str, series_id: Optional[str], tags: dict) -> dict:
+    # Parse ImageType to identify LABEL, OVERVIEW/MACRO, or VOLUME
+    image_type = tags.get("ImageType", "")
+    if isinstance(image_type, str):
+        image_type_list = [t.strip() for t in image_type.split("\\")]
+    else:
+        image_type_list = image_type if image_type else []
+
+    return {
+        "id": instance_id,
+        "seriesId": series_id,
+        "seriesInstanceUID": tags.get("SeriesInstanceUID", ""),
+        "instanceNumber": int(tags.get("InstanceNumber", 0) or 0),
+        "width": int(tags.get("TotalPixelMatrixColumns", 0) or 0),
+        "height": int(tags.get("TotalPixelMatrixRows", 0) or 0),
+        "tileWidth": int(tags.get("Columns", 256) or 256),
+        "tileHeight": int(tags.get("Rows", 256) or 256),
+        "numberOfFrames": int(tags.get("NumberOfFrames", 1) or 1),
+        "imageType": image_type_list,
+        "extendedDepthOfField": tags.get("ExtendedDepthOfField", "").upper() == "YES",
+        "numberOfFocalPlanes": int(tags.get("NumberOfFocalPlanes", 0) or 0),
+    }
+
+
+def build_wsi_metadata(study_id: str, instances: list[dict]) -> Optional[dict]:
+    """
+    Classify instances into main pyramid, z-stack focal planes, label and macro.
+
+    ``instances`` is the output of fetch_study_instance_tags. Returns None if
+    the study has no multi-frame VOLUME instances.
+    """
+    series_instances = {}  # seriesUID -> list of instances
+    label_instance = None
+    macro_instance = None
+
+    for inst in instances:
+        instance_data = _instance_data(inst["id"], inst.get("seriesId"), inst["tags"])
+        image_type_list = instance_data["imageType"]
+
+        # Categorize by ImageType
+        if "LABEL" in image_type_list:
+            label_instance = instance_data
+        elif "OVERVIEW" in image_type_list or "THUMBNAIL" in image_type_list:
+            macro_instance = instance_data
+        elif "VOLUME" in image_type_list and instance_data["numberOfFrames"] > 1:
+            # Group VOLUME instances by series
+            series_instances.setdefault(instance_data["seriesInstanceUID"], []).append(instance_data)
+
+    if not series_instances:
+        return None
+
+    # Identify main pyramid vs z-stack focal planes
+    # Main pyramid: ExtendedDepthOfField=YES or the series with the most levels
+    main_series_uid = None
+    focal_plane_series = []
+
+    for series_uid, series in series_instances.items():
+        # Sort instances by width (descending) to get pyramid order
+        series.sort(key=lambda x: x["width"], reverse=True)
+
+        # Check if this series has ExtendedDepthOfField=YES (composite best-focus)
+        if any(inst["extendedDepthOfField"] for inst in series):
+            main_series_uid = series_uid
+        else:
+            # This is a z-stack focal plane series
+            focal_plane_series.append({
+                "seriesUID": series_uid,
+                "instances": series,
+                # Use instance number of highest res to determine focal plane order
+                "instanceNumber": series[0]["instanceNumber"] if series else 0
+            })
+
+    # If no EDOF series found, use the series with most instances as main
+    if not main_series_uid:
+        main_series_uid = max(series_instances.keys(), key=lambda k: len(series_instances[k]))
+    focal_plane_series = [fp for fp in focal_plane_series if fp["seriesUID"] != main_series_uid]
+
+    main_instances = series_instances[main_series_uid]
+    main_instance = main_instances[0]  # Highest resolution
+
+    # Sort focal planes by instance number
+    focal_plane_series.sort(key=lambda x: x["instanceNumber"])
+
+    # Calculate tiles per row/column
+    tiles_x = (main_instance["width"] + main_instance["tileWidth"] - 1) // main_instance["tileWidth"]
+    tiles_y = (main_instance["height"] + main_instance["tileHeight"] - 1) // main_instance["tileHeight"]
+
+    def level_entry(inst: dict) -> dict:
+        return {
+            "instanceId": inst["id"],
+            "width": inst["width"],
+            "height": inst["height"],
+            "numberOfFrames": inst["numberOfFrames"]
+        }
+
+    metadata = {
+        "studyId": study_id,
+        "instanceId": main_instance["id"],
+        "width": main_instance["width"],
+        "height": main_instance["height"],
+        "tileWidth": main_instance["tileWidth"],
+        "tileHeight": main_instance["tileHeight"],
+        "tilesX": tiles_x,
+        "tilesY": tiles_y,
+        "numberOfFrames": main_instance["numberOfFrames"],
+        "extendedDepthOfField": main_instance["extendedDepthOfField"],
+        "numberOfFocalPlanes": main_instance["numberOfFocalPlanes"],
+        "levels": [level_entry(inst) for inst in main_instances],
+    }
+
+    # Add focal planes if z-stacks exist
+    if focal_plane_series:
+        metadata["focalPlanes"] = [
+            {
+                "index": idx,
+                "seriesUID": fp["seriesUID"],
+                "instanceId": fp["instances"][0]["id"] if fp["instances"] else None,
+                "levels": [level_entry(inst) for inst in fp["instances"]]
+            }
+            for idx, fp in enumerate(focal_plane_series)
+        ]
+        logger.info(f"📸 Study {study_id} has {len(focal_plane_series)} z-stack focal planes")
+
+    # Add label and macro if present
+    if label_instance:
+        metadata["labelInstance"] = {
+            "instanceId": label_instance["id"],
+            "width": label_instance["width"],
+            "height": label_instance["height"]
+        }
+
+    if macro_instance:
+        metadata["macroInstance"] = {
+            "instanceId": macro_instance["id"],
+            "width": macro_instance["width"],
+            "height": macro_instance["height"]
+        }
+
+    return metadata
+
+
+async def load_wsi_metadata(client, study_id: str, use_cache: bool = True, index=None) -> Optional[dict]:
+    """
+    Return (cached) WSI metadata for a study, or None if it has no WSI instances.
+
+    With an OrthancIndex, stable studies are read from the local index and only
+    studies it cannot answer for go to Orthanc.
+    """
+    if use_cache:
+        cached = get_cached_wsi_metadata(study_id)
+        if cached is not None:
+            return cached
+
+    instances = await index.study_instances(study_id) if index is not None else None
+    if instances is None:
+        instances = await fetch_study_instance_tags(client, study_id)
+    metadata = build_wsi_metadata(study_id, instances)
+    if metadata is not None:
+        cache_wsi_metadata(study_id, metadata)
+    return metadata
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+DCX Deobfuscation Micro-Benchmark
+Builds a synthetic DCX (BigTIFF with XOR-obfuscated tiles) and measures tiles/sec
+Usage: python benchmark_dcx.py [TILES] [TILE_KB]
+"""
+import os
+import sys
+import time
+import logging
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "converter"))
+
+from dcx_lossless import KEY_SIZE, BigTiffWriter, deobfuscate_tile, convert_dcx_lossless
+
+TILES = int(sys.argv[1]) if len(sys.argv) > 1 else 4096
+TILE_KB = int(sys.argv[2]) if len(sys.argv) > 2 else 24
+
+logging.disable(logging.WARNING)
+
+
+def deobfuscate_tile_loop(tile_data: bytes) -> bytes:
+    """The original per-byte Python loop, for comparison"""
+    if len(tile_data) <= KEY_SIZE:
+        return tile_data
+    data = bytearray(tile_data)
+    key_offset = len(data) - KEY_SIZE
+    key = data[key_offset:]
+    for i in range(min(KEY_SIZE, key_offset)):
+        data[i] ^= key[i]
+    return bytes(data[:key_offset])
+
+
+def obfuscate(payload: bytes) -> bytes:
+    key = bytes((b % 255) + 1 for b in os.urandom(KEY_SIZE))
+    head = bytes(a ^ b for a, b in zip(payload[:KEY_SIZE], key))
+    return head + payload[KEY_SIZE:] + key
+
+
+def write_synthetic_dcx(path: Path, tiles: list[bytes]):
+    side = 1
+    while side * side < len(tiles):
+        side += 1
+    with BigTiffWriter(path) as writer:
+        writer.write_page(side * 256, side * 256, 256, 256, tiles)
+        writer.finalize()
+
+
+def rate(label: str, count: int, seconds: float, baseline: float = None):
+    extra = f"  ({baseline / seconds:.1f}x)" if baseline else ""
+    print(f"  {label:<28} {count / seconds:>12,.0f} tiles/s{extra}")
+    return seconds
+
+
+def main():
+    print("=" * 50)
+    print("  DCX Deobfuscation Benchmark")
+    print("=" * 50)
+    print(f"Tiles: {TILES} x {TILE_KB} KB\n")
+
+    payloads = [os.urandom(TILE_KB * 1024) for _ in range(64)]
+    tiles = [obfuscate(payloads[i % len(payloads)]) for i in range(TILES)]
+    assert all(deobfuscate_tile(t) == deobfuscate_tile_loop(t) for t in tiles[:64])
+
+    print("=== 1. XOR kernel ===")
+    start = time.perf_counter()
+    for t in tiles:
+        deobfuscate_tile_loop(t)
+    baseline = rate("python loop", TILES, time.perf_counter() - start)
+    start = time.perf_counter()
+    for t in tiles:
+        deobfuscate_tile(t)
+    rate("numpy", TILES, time.perf_counter() - start, baseline)
+
+    print("\n=== 2. Full transcode (mmap + streaming writer) ===")
+    with tempfile.TemporaryDirectory() as tmp:
+        src = Path(tmp) / "synthetic.dcx"
+        write_synthetic_dcx(src, tiles)
+        baseline = None
+        for workers in (1, 2, 4):
+            start = time.perf_counter()
+            convert_dcx_lossless(src, Path(tmp) / f"out_{workers}.tiff", workers=workers)
+            seconds = rate(f"workers={workers}", TILES, time.perf_counter() - start, baseline)
+            baseline = baseline or seconds
+
+
+if __name__ == "__main__":
+    main()
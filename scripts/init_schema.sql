@@ -189,6 +189,31 @@ CREATE TABLE IF NOT EXISTS annotations (
 
 CREATE INDEX IF NOT EXISTS idx_annotations_slide ON annotations(slide_id);
 
+-- Bounding box of an annotation geometry (level-0 pixels): the extent of every
+-- [x, y] pair nested anywhere in "coordinates"; NULL without points
+CREATE OR REPLACE FUNCTION annotation_bbox(g JSONB)
+RETURNS BOX AS $$
+    SELECT box(point(MIN(x), MIN(y)), point(MAX(x), MAX(y)))
+    FROM (
+        SELECT (p->>0)::DOUBLE PRECISION AS x, (p->>1)::DOUBLE PRECISION AS y
+        FROM jsonb_path_query(g, 'strict $.coordinates.**', '{}', TRUE) AS p
+        WHERE jsonb_typeof(p) = 'array'
+          AND jsonb_typeof(p->0) = 'number'
+          AND jsonb_typeof(p->1) = 'number'
+    ) points
+    HAVING COUNT(*) > 0
+$$ LANGUAGE SQL IMMUTABLE;
+
+-- Viewport queries (GET /studies/{id}/annotations?bbox=): bbox && box per slide
+CREATE EXTENSION IF NOT EXISTS btree_gist;
+ALTER TABLE annotations ADD COLUMN IF NOT EXISTS bbox BOX
+    GENERATED ALWAYS AS (annotation_bbox(geometry)) STORED;
+CREATE INDEX IF NOT EXISTS idx_annotations_study_bbox ON annotations USING GIST (study_id, bbox);
+
+-- Simplified geometry variants for low magnification, keyed by downsample
+-- ({"4": geometry, ...}); written with the geometry, NULL until computed
+ALTER TABLE annotations ADD COLUMN IF NOT EXISTS geometry_lod JSONB;
+
 -- =============================================================================
 -- PUBLIC SHARES - Anonymous link-based access (no login required)
 -- =============================================================================
@@ -263,7 +288,7 @@ CREATE TABLE IF NOT EXISTS annotation_events (
     annotation_id VARCHAR(32),               -- May be NULL for delete events
     user_id INTEGER REFERENCES users(id) ON DELETE SET NULL,
     
-    event_type VARCHAR(50) NOT NULL,         -- 'create', 'update', 'delete', 'comment'
+    event_type VARCHAR(50) NOT NULL,         -- 'create', 'update', 'delete', 'comment', 'bulk_import'
     event_data JSONB,                        -- Full annotation data or diff
     
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
@@ -272,6 +297,106 @@ CREATE TABLE IF NOT EXISTS annotation_events (
 CREATE INDEX IF NOT EXISTS idx_events_slide ON annotation_events(slide_id);
 CREATE INDEX IF NOT EXISTS idx_events_created ON annotation_events(created_at DESC);
 
+-- =============================================================================
+-- SLIDE MANIFESTS - Precomputed viewer metadata, written at upload/conversion
+-- =============================================================================
+CREATE TABLE IF NOT EXISTS slide_manifests (
+    orthanc_study_id VARCHAR(255) PRIMARY KEY,   -- Not FK: written for anonymous uploads too
+    manifest JSONB NOT NULL,                     -- Levels, tile grid, focal planes, calibration, ICC
+    etag VARCHAR(64) NOT NULL,
+
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- =============================================================================
+-- CONVERSION JOBS - Durable queue shared by all converter processes
+-- =============================================================================
+CREATE TABLE IF NOT EXISTS conversion_jobs (
+    job_id VARCHAR(32) PRIMARY KEY,
+    filename VARCHAR(500) NOT NULL,
+    file_path TEXT,                          -- Input on the shared uploads volume
+    source_format VARCHAR(50),
+    upload_id VARCHAR(64),                   -- Chunked upload session, if any
+    owner_id INTEGER REFERENCES users(id) ON DELETE SET NULL,
+
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',  -- pending, processing, completed, failed, cancelled
+    progress INTEGER DEFAULT 0,
+    message TEXT DEFAULT '',
+    study_uid VARCHAR(255),
+    study_id VARCHAR(255),                   -- Orthanc study ID
+
+    priority BIGINT DEFAULT 0,               -- Lower first (file size: small slides first)
+    attempts INTEGER DEFAULT 0,
+    max_attempts INTEGER DEFAULT 3,
+    available_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,  -- Retry backoff
+    lease_owner VARCHAR(255),                -- host:pid of the claiming worker
+    lease_expires_at TIMESTAMP,
+    cancel_requested BOOLEAN DEFAULT FALSE,
+
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP,
+    completed_at TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_conversion_jobs_queue ON conversion_jobs(priority, created_at)
+    WHERE status IN ('pending', 'processing');
+CREATE INDEX IF NOT EXISTS idx_conversion_jobs_created ON conversion_jobs(created_at DESC);
+
+-- =============================================================================
+-- ORTHANC INDEX - Studies/series/instances mirrored from Orthanc's /changes feed
+-- =============================================================================
+CREATE TABLE IF NOT EXISTS orthanc_index_state (
+    name VARCHAR(50) PRIMARY KEY,            -- 'changes'
+    last_seq BIGINT,                         -- Last applied /changes sequence number
+    synced_at TIMESTAMP,                     -- Initial full sync completed
+    lease_owner VARCHAR(255),                -- host:pid of the consuming process
+    lease_expires_at TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS orthanc_studies (
+    study_id VARCHAR(255) PRIMARY KEY,       -- Orthanc study ID
+    patient_id VARCHAR(255),                 -- Orthanc patient ID
+    study_instance_uid VARCHAR(255),
+    patient_name VARCHAR(255),
+    study_date VARCHAR(16),
+    study_description TEXT,
+    is_stable BOOLEAN DEFAULT FALSE,         -- Orthanc's StableStudy seen (no new instances expected)
+
+    first_seen_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    indexed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS orthanc_series (
+    series_id VARCHAR(255) PRIMARY KEY,      -- Orthanc series ID
+    study_id VARCHAR(255) NOT NULL REFERENCES orthanc_studies(study_id) ON DELETE CASCADE,
+    series_instance_uid VARCHAR(255),
+    modality VARCHAR(16),
+    manufacturer VARCHAR(255)
+);
+
+CREATE TABLE IF NOT EXISTS orthanc_instances (
+    instance_id VARCHAR(255) PRIMARY KEY,    -- Orthanc instance ID
+    series_id VARCHAR(255) NOT NULL REFERENCES orthanc_series(series_id) ON DELETE CASCADE,
+    study_id VARCHAR(255) NOT NULL REFERENCES orthanc_studies(study_id) ON DELETE CASCADE,
+    instance_number INTEGER,
+    image_type VARCHAR(255),                 -- Backslash-separated, e.g. ORIGINAL\PRIMARY\VOLUME\NONE
+    total_columns INTEGER,                   -- TotalPixelMatrixColumns/Rows
+    total_rows INTEGER,
+    frame_columns INTEGER,                   -- Columns/Rows (tile size)
+    frame_rows INTEGER,
+    number_of_frames INTEGER,
+    focal_planes INTEGER,
+    extended_depth_of_field BOOLEAN
+);
+
+CREATE INDEX IF NOT EXISTS idx_orthanc_studies_patient ON orthanc_studies(patient_id);
+CREATE INDEX IF NOT EXISTS idx_orthanc_series_study ON orthanc_series(study_id);
+CREATE INDEX IF NOT EXISTS idx_orthanc_instances_study ON orthanc_instances(study_id);
+CREATE INDEX IF NOT EXISTS idx_orthanc_instances_series ON orthanc_instances(series_id);
+
 -- =============================================================================
 -- HELPER FUNCTIONS
 -- =============================================================================
@@ -7,11 +7,12 @@ import sys
 import asyncio
 from pathlib import Path
 from datetime import datetime
+from contextlib import asynccontextmanager
 from unittest.mock import AsyncMock, MagicMock, patch
 from typing import AsyncGenerator, Generator
 
 import pytest
-from httpx import AsyncClient
+from httpx import AsyncClient, ASGITransport
 
 # Add converter module to path
 sys.path.insert(0, str(Path(__file__).parent.parent / "converter"))
@@ -55,6 +56,17 @@ def mock_env_vars(monkeypatch):
     return env_vars
 
 
+@pytest.fixture(autouse=True)
+def clear_auth_caches():
+    """Reset module-level auth caches so tests don't see each other's decisions."""
+    import auth
+    auth.invalidate_access_cache()
+    auth.invalidate_user_cache()
+    yield
+    auth.invalidate_access_cache()
+    auth.invalidate_user_cache()
+
+
 # =============================================================================
 # Database Mock Fixtures
 # =============================================================================
@@ -82,6 +94,97 @@ def mock_db_connection():
     return conn
 
 
+class FakeConnection:
+    """
+    Recording asyncpg connection for endpoint tests.
+
+    Every statement is appended to ``queries`` as (whitespace-normalised SQL,
+    args). fetch/cursor answer with ``rows``, fetchrow with ``row``, fetchval
+    with ``value`` and execute with ``status``; executemany and COPY batches
+    are kept in ``executemany_calls`` and ``copies``.
+    """
+
+    def __init__(self):
+        self.rows = []
+        self.row = None
+        self.value = None
+        self.status = "UPDATE 1"
+        self.queries = []
+        self.executemany_calls = []
+        self.copies = []
+        self.cursor_prefetch = None
+        self.readonly = None
+
+    def _record(self, sql, args):
+        self.queries.append((" ".join(sql.split()), args))
+
+    async def fetch(self, sql, *args):
+        self._record(sql, args)
+        return self.rows
+
+    async def fetchrow(self, sql, *args):
+        self._record(sql, args)
+        return self.row
+
+    async def fetchval(self, sql, *args):
+        self._record(sql, args)
+        return self.value
+
+    async def execute(self, sql, *args):
+        self._record(sql, args)
+        return self.status
+
+    async def executemany(self, sql, records):
+        self.executemany_calls.append((" ".join(sql.split()), list(records)))
+
+    async def copy_records_to_table(self, table, records, columns):
+        self.copies.append([dict(zip(columns, record)) for record in records])
+
+    def cursor(self, sql, *args, prefetch=None):
+        self._record(sql, args)
+        self.cursor_prefetch = prefetch
+        rows = self.rows
+
+        class Cursor:
+            async def __aiter__(self):
+                for row in rows:
+                    yield row
+
+        return Cursor()
+
+    @asynccontextmanager
+    async def transaction(self, readonly=False):
+        self.readonly = readonly
+        yield
+
+
+class FakePool:
+    """asyncpg pool handing out a single connection"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield self.conn
+
+
+@pytest.fixture
+def fake_db():
+    """
+    A FakeConnection behind main.get_db_pool, with study access granted.
+    Set ``rows`` / ``row`` / ``value`` on it before making requests.
+    """
+    conn = FakeConnection()
+
+    async def get_db_pool():
+        return FakePool(conn)
+
+    with patch("main.can_access_study", AsyncMock(return_value=True)), \
+            patch("main.get_db_pool", get_db_pool):
+        yield conn
+
+
 # =============================================================================
 # User Fixtures
 # =============================================================================
@@ -343,6 +446,18 @@ async def async_client():
         yield client
 
 
+@pytest.fixture
+async def user_client():
+    """ASGI client for the app with require_user resolving to user 1"""
+    import main
+    main.app.dependency_overrides[main.require_user] = lambda: main.User(id=1, auth0_id="a", email="a@b.c")
+    try:
+        async with AsyncClient(transport=ASGITransport(app=main.app), base_url="http://test") as client:
+            yield client
+    finally:
+        main.app.dependency_overrides.clear()
+
+
 # =============================================================================
 # Email Fixtures
 # =============================================================================
@@ -0,0 +1,172 @@
+"""
+Unit tests for the annotation_export.py module.
+
+Tests cover:
+- Viewer geometries converted to standard GeoJSON (rectangles, ellipses, flat polygons)
+- Every export writer producing a well-formed document
+- Chunked and gzipped streaming
+- The streamed /studies/{id}/annotations/export endpoint
+"""
+
+import gzip
+import json
+import sys
+from datetime import datetime
+from pathlib import Path
+from xml.etree import ElementTree
+
+import pytest
+
+# Add converter module to path
+sys.path.insert(0, str(Path(__file__).parent.parent / "converter"))
+
+
+def annotation(annotation_id, kind, coordinates, **properties):
+    return {
+        "id": annotation_id, "study_id": "s", "type": "region", "tool": kind.lower(),
+        "geometry": {"type": kind, "coordinates": coordinates}, "properties": properties,
+        "created_at": "2026-01-01T00:00:00", "updated_at": None,
+    }
+
+
+ANNOTATIONS = [
+    annotation("p", "Polygon", [[0, 0], [4, 0], [4, 4]], color="#ff0000", classification="Tumor"),
+    annotation("r", "Rectangle", [[10, 20], [2, 8]], label="box"),
+    annotation("e", "Ellipse", [[0, 0], [4, 2]]),
+    annotation("pt", "Point", [1.5, 2]),
+    annotation("l", "LineString", [[0, 0], [3, 4]], measurement={"value": 5, "unit": "µm", "display": "5 µm"}),
+    annotation("bad", "Unknown", []),
+]
+
+
+async def aiter(items):
+    for item in items:
+        yield item
+
+
+async def export(fmt, items=ANNOTATIONS, compress=False, chunk_chars=64):
+    from annotation_export import EXPORT_WRITERS, export_stream
+    writer = EXPORT_WRITERS[fmt]("s", "2026-01-02T00:00:00")
+    chunks = [chunk async for chunk in export_stream(aiter(items), writer, gzip=compress, chunk_chars=chunk_chars)]
+    return writer, chunks
+
+
+class TestStandardGeometry:
+    """Tests for standard_geometry."""
+
+    def test_rectangle_and_flat_polygon_are_closed(self):
+        from annotation_export import standard_geometry
+        assert standard_geometry({"type": "Rectangle", "coordinates": [[10, 20], [2, 8]]}) == {
+            "type": "Polygon", "coordinates": [[[2, 8], [10, 8], [10, 20], [2, 20], [2, 8]]],
+        }
+        polygon = standard_geometry({"type": "Polygon", "coordinates": [[0, 0], [4, 0], [4, 4]]})
+        assert polygon["coordinates"] == [[[0, 0], [4, 0], [4, 4], [0, 0]]]
+        rings = [[[0, 0], [9, 0], [9, 9], [0, 0]]]
+        assert standard_geometry({"type": "Polygon", "coordinates": rings})["coordinates"] == rings
+
+    def test_ellipse_is_inscribed_polygon(self):
+        from annotation_export import standard_geometry, ELLIPSE_VERTICES
+        ring = standard_geometry({"type": "Ellipse", "coordinates": [[0, 0], [4, 2]]})["coordinates"][0]
+        assert len(ring) == ELLIPSE_VERTICES + 1 and ring[0] == ring[-1]
+        assert ring[0] == [4, 1]
+        assert all(((x - 2) / 2) ** 2 + (y - 1) ** 2 == pytest.approx(1) for x, y in ring)
+
+    def test_unusable(self):
+        from annotation_export import standard_geometry
+        assert standard_geometry({"type": "Unknown", "coordinates": []}) is None
+        assert standard_geometry({"type": "Rectangle", "coordinates": [[1, 2]]}) is None
+
+
+class TestWriters:
+    """Tests for the export writers and export_stream."""
+
+    async def test_pathview_json(self):
+        writer, chunks = await export("json")
+        document = json.loads(b"".join(chunks))
+        assert len(chunks) > 1
+        assert document["count"] == len(ANNOTATIONS)
+        assert document["annotations"] == ANNOTATIONS
+
+    async def test_geojson_matches_previous_shape(self):
+        writer, chunks = await export("geojson")
+        document = json.loads(b"".join(chunks))
+        assert document["type"] == "FeatureCollection"
+        assert document["properties"]["count"] == len(ANNOTATIONS)
+        assert document["features"][1]["properties"] == {
+            "label": "box", "tool": "rectangle", "annotation_type": "region", "created_at": "2026-01-01T00:00:00",
+        }
+
+    async def test_ndjson_reimports(self):
+        from annotation_import import normalize_feature
+        writer, chunks = await export("ndjson", ANNOTATIONS[:5])
+        lines = b"".join(chunks).decode().splitlines()
+        assert len(lines) == 5
+        restored = normalize_feature(json.loads(lines[0]))
+        assert (restored.type, restored.tool, restored.properties["color"]) == ("region", "polygon", "#ff0000")
+
+    async def test_qupath(self):
+        writer, chunks = await export("qupath")
+        features = json.loads(b"".join(chunks))["features"]
+        assert writer.count == 5  # The unknown geometry is skipped
+        assert features[0]["properties"] == {
+            "objectType": "annotation", "classification": {"name": "Tumor", "color": [255, 0, 0]},
+        }
+        assert features[1]["geometry"]["type"] == "Polygon"
+        assert features[1]["properties"]["name"] == "box"
+        assert features[4]["properties"]["measurements"] == {"Length µm": 5}
+
+    async def test_asap(self):
+        writer, chunks = await export("asap")
+        root = ElementTree.fromstring(b"".join(chunks))
+        annotations = root.find("Annotations")
+        assert [a.get("Type") for a in annotations] == ["Polygon", "Rectangle", "Polygon", "Dot", "Measurement"]
+        polygon = annotations[0]
+        assert polygon.get("PartOfGroup") == "Tumor" and polygon.get("Color") == "#ff0000"
+        assert [(c.get("X"), c.get("Y")) for c in polygon.find("Coordinates")] == [("0", "0"), ("4", "0"), ("4", "4")]
+        assert annotations[3].find("Coordinates")[0].get("X") == "1.5"
+        assert [g.get("Name") for g in root.find("AnnotationGroups")] == ["Tumor"]
+
+    async def test_gzip(self):
+        plain = b"".join((await export("geojson"))[1])
+        writer, chunks = await export("geojson", compress=True)
+        assert gzip.decompress(b"".join(chunks)) == plain
+
+
+def annotation_row(annotation_id):
+    return {
+        "id": annotation_id, "study_id": "s", "type": "region", "tool": "point",
+        "geometry": '{"type": "Point", "coordinates": [1, 2]}', "properties": None,
+        "created_at": datetime(2026, 1, 1), "updated_at": None,
+    }
+
+
+class TestExportEndpoint:
+    """Tests for GET /studies/{id}/annotations/export."""
+
+    async def get(self, client, conn, query, rows):
+        conn.rows = rows
+        response = await client.get(f"/studies/s/annotations/export{query}")
+        return response, conn
+
+    async def test_streams_from_cursor(self, user_client, fake_db):
+        response, conn = await self.get(user_client, fake_db, "?format=geojson", [annotation_row(str(i)) for i in range(3)])
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/geo+json"
+        assert 'filename="annotations_s.geojson"' in response.headers["content-disposition"]
+        document = response.json()
+        assert [f["id"] for f in document["features"]] == ["0", "1", "2"]
+        assert document["features"][0]["geometry"] == {"type": "Point", "coordinates": [1, 2]}
+        assert conn.queries[-1][1] == ("s",)
+        assert conn.cursor_prefetch == 1000
+        assert conn.readonly is True
+
+    async def test_gzip_download(self, user_client, fake_db):
+        response, conn = await self.get(user_client, fake_db, "?format=asap&gzip=true", [annotation_row("a")])
+        assert response.headers["content-type"] == "application/gzip"
+        assert response.headers["content-disposition"].endswith('.xml.gz"')
+        assert gzip.decompress(response.content).startswith(b"<?xml")
+
+    async def test_unknown_format(self, user_client, fake_db):
+        response, conn = await self.get(user_client, fake_db, "?format=csv", [])
+        assert response.status_code == 400
+        assert conn.queries == []
@@ -0,0 +1,103 @@
+"""
+Unit tests for the annotation_geometry.py module.
+
+Tests cover:
+- Point extraction and bounding boxes of every viewer geometry type
+- bbox query parameter parsing
+- Viewport (?bbox=&level=) and ?limit= queries on the annotations endpoint
+"""
+
+import sys
+from datetime import datetime
+from pathlib import Path
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+# Add converter module to path
+sys.path.insert(0, str(Path(__file__).parent.parent / "converter"))
+
+
+class TestGeometryBBox:
+    """Tests for iter_points and geometry_bbox."""
+
+    @pytest.mark.parametrize("geometry, expected", [
+        ({"type": "Point", "coordinates": [5, 7]}, (5, 7, 5, 7)),
+        ({"type": "Rectangle", "coordinates": [[10, 40], [2, 8]]}, (2, 8, 10, 40)),
+        ({"type": "Polygon", "coordinates": [[0, 0], [4, 1], [2, 9]]}, (0, 0, 4, 9)),
+        ({"type": "Polygon", "coordinates": [[[0, 0], [4, 1], [2, 9], [0, 0]]]}, (0, 0, 4, 9)),
+        ({"type": "Point", "coordinates": [1.5, 2.5, 0]}, (1.5, 2.5, 1.5, 2.5)),
+    ])
+    def test_bbox(self, geometry, expected):
+        from annotation_geometry import geometry_bbox
+        assert geometry_bbox(geometry) == expected
+
+    def test_no_points(self):
+        from annotation_geometry import geometry_bbox
+        assert geometry_bbox({"type": "Point", "coordinates": []}) is None
+        assert geometry_bbox({"type": "Point"}) is None
+        assert geometry_bbox({"type": "Point", "coordinates": ["a", "b"]}) is None
+
+
+class TestParseBBox:
+    """Tests for parse_bbox."""
+
+    def test_corners_are_normalised(self):
+        from annotation_geometry import parse_bbox
+        assert parse_bbox("100,200,10,20") == (10, 20, 100, 200)
+        assert parse_bbox("0.5,1,2,3.5") == (0.5, 1, 2, 3.5)
+
+    @pytest.mark.parametrize("value", ["1,2,3", "a,b,c,d", "1,2,3,nan", "1,2,inf,4"])
+    def test_invalid(self, value):
+        from annotation_geometry import parse_bbox
+        with pytest.raises(ValueError):
+            parse_bbox(value)
+
+
+def annotation_row(annotation_id):
+    now = datetime(2026, 1, 1)
+    return {
+        "id": annotation_id, "study_id": "s", "type": "region", "tool": "point",
+        "geometry": {"type": "Point", "coordinates": [1, 2]}, "properties": {},
+        "created_at": now, "updated_at": now,
+    }
+
+
+class TestViewportQuery:
+    """Tests for GET /studies/{id}/annotations?bbox=&level=&limit=."""
+
+    @pytest.fixture(autouse=True)
+    def downsample(self):
+        with patch("main.level_downsample", AsyncMock(return_value=4.0)):
+            yield
+
+    async def query(self, client, db, url, rows):
+        db.rows = rows
+        response = await client.get(url)
+        return response, db.queries
+
+    async def test_bbox_is_scaled_to_level_zero(self, user_client, fake_db):
+        response, queries = await self.query(
+            user_client, fake_db, "/studies/s/annotations?bbox=10,20,0,5&level=2", [annotation_row("a")]
+        )
+        assert response.status_code == 200
+        sql, args = queries[0]
+        assert "bbox && box(point($2, $3), point($4, $5))" in sql
+        assert args == ("s", 0.0, 20.0, 40.0, 80.0)
+        assert response.json()["count"] == 1
+        assert "truncated" not in response.json()
+
+    async def test_limit_reports_truncation(self, user_client, fake_db):
+        rows = [annotation_row(str(i)) for i in range(3)]
+        response, queries = await self.query(user_client, fake_db, "/studies/s/annotations?limit=2", rows)
+        sql, args = queries[0]
+        assert sql.endswith("LIMIT $2")
+        assert args == ("s", 3)
+        body = response.json()
+        assert body["truncated"] is True
+        assert [a["id"] for a in body["annotations"]] == ["0", "1"]
+
+    async def test_bad_bbox_rejected(self, user_client, fake_db):
+        response, queries = await self.query(user_client, fake_db, "/studies/s/annotations?bbox=1,2,3", [])
+        assert response.status_code == 400
+        assert queries == []
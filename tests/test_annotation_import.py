@@ -0,0 +1,193 @@
+"""
+Unit tests for the annotation_import.py module.
+
+Tests cover:
+- Incremental FeatureCollection and NDJSON parsing across arbitrary chunk boundaries
+- Feature validation and normalisation
+- Vectorized bounding boxes and areas
+- The /studies/{id}/annotations:bulk endpoint (COPY batches, one event, atomic failure)
+"""
+
+import json
+import math
+import sys
+from pathlib import Path
+from unittest.mock import AsyncMock, patch
+
+import numpy as np
+import pytest
+
+# Add converter module to path
+sys.path.insert(0, str(Path(__file__).parent.parent / "converter"))
+
+
+def square(x, y, size):
+    return [[x, y], [x + size, y], [x + size, y + size], [x, y + size]]
+
+
+def feature(coordinates, kind="Polygon", **properties):
+    return {"type": "Feature", "geometry": {"type": kind, "coordinates": coordinates}, "properties": properties}
+
+
+def collection(features) -> str:
+    return json.dumps({
+        "type": "FeatureCollection",
+        "properties": {"source": "stardist", "n": 12345},
+        "features": features,
+        "bbox": [0, 0, 1, 1],
+    }, indent=1)
+
+
+def parse_in_chunks(parser, text, size):
+    items = []
+    for start in range(0, len(text), size):
+        items += parser.feed(text[start:start + size])
+    return items + parser.close()
+
+
+class TestParsers:
+    """Tests for FeatureCollectionParser and NdjsonParser."""
+
+    @pytest.mark.parametrize("chunk_size", [1, 7, 4096])
+    def test_feature_collection_chunking(self, chunk_size):
+        from annotation_import import FeatureCollectionParser
+        features = [feature([square(i, i, 2)], label=f"cell {i}") for i in range(25)]
+        parsed = parse_in_chunks(FeatureCollectionParser(), collection(features), chunk_size)
+        assert parsed == features
+
+    def test_empty_collection(self):
+        from annotation_import import FeatureCollectionParser
+        assert parse_in_chunks(FeatureCollectionParser(), collection([]), 3) == []
+
+    @pytest.mark.parametrize("text", [
+        '{"type": "Feature", "features": []}',
+        '{"features": [{"type": "Feature"},]}',
+        '{"features": [{"type": "Feature"}',
+        '[{"type": "Feature"}]',
+        '{"features": []} trailing',
+    ])
+    def test_malformed_collection(self, text):
+        from annotation_import import FeatureCollectionParser, BulkImportError
+        with pytest.raises(BulkImportError):
+            parse_in_chunks(FeatureCollectionParser(), text, 5)
+
+    def test_ndjson_chunking(self):
+        from annotation_import import NdjsonParser, BulkImportError
+        items = [feature([square(0, 0, i + 1)]) for i in range(5)]
+        text = "\n".join(json.dumps(item) for item in items) + "\n\n"
+        assert parse_in_chunks(NdjsonParser(), text, 11) == items
+        with pytest.raises(BulkImportError) as error:
+            parse_in_chunks(NdjsonParser(), '{"a": 1}\n{"a": \n', 4)
+        assert "line 2" in str(error.value)
+
+
+class TestNormalize:
+    """Tests for normalize_feature."""
+
+    def test_exported_feature_round_trips(self):
+        from annotation_import import normalize_feature
+        annotation = normalize_feature(feature(
+            square(0, 0, 4), tool="polygon", annotation_type="measurement", created_at="x", color="#fff"
+        ))
+        assert (annotation.type, annotation.tool) == ("measurement", "polygon")
+        assert annotation.properties == {"color": "#fff"}
+        assert annotation.signs == [1]
+
+    def test_pathview_object_and_defaults(self):
+        from annotation_import import normalize_feature
+        marker = normalize_feature({"type": "marker", "geometry": {"type": "Point", "coordinates": [3, 4]}})
+        assert (marker.type, marker.tool) == ("marker", "point")
+        cell = normalize_feature(feature([square(0, 0, 4)]))
+        assert (cell.type, cell.tool) == ("region", "polygon")
+
+    @pytest.mark.parametrize("geometry", [
+        None,
+        {"type": "Circle", "coordinates": [1, 2]},
+        {"type": "Polygon", "coordinates": []},
+        {"type": "Polygon", "coordinates": [[0, 0], [1, "a"]]},
+        {"type": "LineString", "coordinates": [[0, 0], [1, float("nan")]]},
+        {"type": "Polygon", "coordinates": [[[0, 0], [1, 1]], []]},
+    ])
+    def test_invalid_geometry(self, geometry):
+        from annotation_import import normalize_feature
+        with pytest.raises(ValueError):
+            normalize_feature({"type": "Feature", "geometry": geometry})
+
+
+class TestMeasureBatch:
+    """Tests for measure_batch and area_measurement."""
+
+    def test_bboxes_and_areas(self):
+        from annotation_import import normalize_feature, measure_batch
+        batch = [normalize_feature(item) for item in [
+            feature(square(10, 20, 4)),                                   # flat viewer polygon
+            feature([square(0, 0, 10), square(2, 2, 2)]),                 # GeoJSON polygon with a hole
+            feature([[square(0, 0, 1)], [square(5, 5, 2)]], "MultiPolygon"),
+            feature([[0, 0], [4, 2]], "Rectangle"),
+            feature([[0, 0], [4, 2]], "Ellipse"),
+            feature([7, 8], "Point"),
+            feature([[0, 0], [3, 4]], "LineString"),
+        ]]
+        bboxes, areas = measure_batch(batch)
+        assert bboxes.tolist() == [
+            [10, 20, 14, 24], [0, 0, 10, 10], [0, 0, 7, 7], [0, 0, 4, 2], [0, 0, 4, 2], [7, 8, 7, 8], [0, 0, 3, 4],
+        ]
+        assert np.allclose(areas, [16, 96, 5, 8, math.pi * 2, 0, 0])
+
+    def test_measurement_matches_viewer(self):
+        from annotation_import import area_measurement
+        assert area_measurement(1600, [0.25, 0.25])["display"] == "100 µm²"
+        assert area_measurement(4e7, [0.25, 0.25])["unit"] == "mm²"
+
+
+class TestBulkEndpoint:
+    """Tests for POST /studies/{id}/annotations:bulk."""
+
+    @pytest.fixture(autouse=True)
+    def settings(self):
+        import main
+        with patch("main.load_manifest", AsyncMock(return_value=None)), \
+                patch.object(main.settings, "annotation_import_batch_size", 2):
+            yield
+
+    async def post(self, client, conn, body, content_type="application/geo+json", query=""):
+        conn.value = 7
+        response = await client.post(
+            f"/studies/s/annotations:bulk{query}", content=body, headers={"Content-Type": content_type}
+        )
+        return response, conn
+
+    async def test_feature_collection_is_copied_in_batches(self, user_client, fake_db):
+        features = [feature(square(i * 10, 0, 4)) for i in range(5)]
+        response, conn = await self.post(user_client, fake_db, collection(features))
+        assert response.status_code == 200
+        body = response.json()
+        assert body["imported"] == 5
+        assert body["bbox"] == [0, 0, 44, 4]
+        assert [len(batch) for batch in conn.copies] == [2, 2, 1]
+        row = conn.copies[0][0]
+        assert row["slide_id"] == 7 and row["user_id"] == 1 and row["tool"] == "polygon"
+        assert json.loads(row["properties"])["measurement"]["display"] == "1 µm²"
+        events = [args for sql, args in conn.queries if "annotation_events" in sql]
+        assert len(events) == 1
+        assert json.loads(events[0][2])["count"] == 5
+
+    async def test_invalid_feature_aborts(self, user_client, fake_db):
+        lines = [feature(square(0, 0, 4)), feature([], "Polygon"), feature(square(5, 5, 1))]
+        body = "\n".join(json.dumps(line) for line in lines)
+        response, conn = await self.post(user_client, fake_db, body, "application/x-ndjson")
+        assert response.status_code == 422
+        assert response.json()["detail"]["errors"][0]["index"] == 1
+        assert not any("annotation_events" in sql for sql, args in conn.queries)
+
+    async def test_skip_invalid(self, user_client, fake_db):
+        lines = [feature(square(0, 0, 4)), {"geometry": "nope"}, feature(square(5, 5, 1))]
+        body = "\n".join(json.dumps(line) for line in lines)
+        response, conn = await self.post(user_client, fake_db, body, "application/x-ndjson", "?skip_invalid=true")
+        assert response.status_code == 200
+        assert response.json()["imported"] == 2
+        assert response.json()["skipped"] == 1
+
+    async def test_malformed_body(self, user_client, fake_db):
+        response, conn = await self.post(user_client, fake_db, '{"features": [')
+        assert response.status_code == 400
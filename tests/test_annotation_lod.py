@@ -0,0 +1,145 @@
+"""
+Unit tests for the annotation_lod.py module.
+
+Tests cover:
+- Batched Douglas-Peucker simplification of open and closed point lists
+- Per-downsample variants of viewer and GeoJSON geometries
+- Variant selection for a requested downsample
+- ?simplify= on the annotations endpoint, including rows without variants yet
+"""
+
+import json
+import math
+import sys
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+# Add converter module to path
+sys.path.insert(0, str(Path(__file__).parent.parent / "converter"))
+
+
+def circle(cx, cy, radius, vertices=200):
+    return [
+        [cx + radius * math.cos(2 * math.pi * i / vertices), cy + radius * math.sin(2 * math.pi * i / vertices)]
+        for i in range(vertices)
+    ]
+
+
+class TestSimplifyRings:
+    """Tests for simplify_rings."""
+
+    def test_open_line(self):
+        from annotation_lod import simplify_rings
+        line = np.array([[0, 0], [1, 0.1], [2, 0], [3, 5], [4, 0]], dtype=float)
+        straight = np.column_stack((np.arange(50), np.zeros(50)))
+        simplified = simplify_rings([line, straight], [False, False], 0.5)
+        assert simplified[0].tolist() == [[0, 0], [2, 0], [3, 5], [4, 0]]
+        assert simplified[1].tolist() == [[0, 0], [49, 0]]
+
+    def test_closed_ring_keeps_an_area(self):
+        from annotation_lod import simplify_rings
+        ring = np.array(circle(0, 0, 10, 40))
+        [simplified] = simplify_rings([ring], [True], 1000)
+        assert len(simplified) >= 4
+        x, y = simplified[:, 0], simplified[:, 1]
+        assert abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))) > 0
+
+    def test_rings_are_independent(self):
+        from annotation_lod import simplify_rings
+        rings = [np.array(circle(0, 0, 100)), np.array(circle(500, 0, 20, 30))]
+        together = simplify_rings(rings, [True, True], 2)
+        for ring, simplified in zip(rings, together):
+            assert np.array_equal(simplify_rings([ring], [True], 2)[0], simplified)
+
+
+class TestBuildLod:
+    """Tests for build_lod_batch and pick_lod."""
+
+    def test_variants_shrink_with_downsample(self):
+        from annotation_lod import build_lod_batch, LOD_MAX_RATIO
+        [lod] = build_lod_batch([{"type": "Polygon", "coordinates": circle(1000, 1000, 100)}], 0.5)
+        sizes = [len(lod[key]["coordinates"]) for key in sorted(lod, key=int)]
+        assert sizes[0] < 200 and len(sizes) > 2
+        assert all(b <= LOD_MAX_RATIO * a for a, b in zip(sizes, sizes[1:]))
+        # Flat viewer polygons stay flat, coordinates rounded to whole pixels
+        assert all(isinstance(x, int) for x in lod["2"]["coordinates"][0])
+
+    def test_geojson_structure_preserved(self):
+        from annotation_lod import build_lod_batch
+        ring = circle(0, 0, 100) + [circle(0, 0, 100)[0]]
+        hole = circle(0, 0, 50) + [circle(0, 0, 50)[0]]
+        polygon, multi = build_lod_batch([
+            {"type": "Polygon", "coordinates": [ring, hole]},
+            {"type": "MultiPolygon", "coordinates": [[ring], [hole]]},
+        ], 0.5)
+        variant = polygon["4"]["coordinates"]
+        assert len(variant) == 2 and all(r[0] == r[-1] for r in variant)
+        assert [len(p) for p in multi["4"]["coordinates"]] == [1, 1]
+
+    def test_nothing_to_simplify(self):
+        from annotation_lod import build_lod_batch
+        lods = build_lod_batch([
+            {"type": "Point", "coordinates": [1, 2]},
+            {"type": "Rectangle", "coordinates": [[0, 0], [9, 9]]},
+            {"type": "Polygon", "coordinates": [[0, 0], [9, 0], [9, 9]]},
+            {"type": "Polygon", "coordinates": [[0, 0], [1, "a"]]},
+        ], 0.5)
+        assert lods == [{}, {}, {}, {}]
+
+    def test_pick(self):
+        from annotation_lod import pick_lod, lod_keys
+        lod = {"2": "a", "8": "b"}
+        assert lod_keys(5) == ["4", "2"]
+        assert pick_lod(lod, 1) is None
+        assert pick_lod(lod, 7.9) == ("2", "a")
+        assert pick_lod(lod, 300) == ("8", "b")
+
+
+def annotation_row(annotation_id, geometry, lod=None, missing=False):
+    now = datetime(2026, 1, 1)
+    return {
+        "id": annotation_id, "study_id": "s", "type": "region", "tool": "polygon",
+        "geometry": json.dumps(geometry), "properties": {}, "created_at": now, "updated_at": now,
+        "lod_geometry": json.dumps(lod[1]) if lod else None, "lod": lod[0] if lod else None, "lod_missing": missing,
+    }
+
+
+class TestSimplifyQuery:
+    """Tests for GET /studies/{id}/annotations?simplify=."""
+
+    async def query(self, client, conn, url, rows):
+        conn.rows = rows
+        response = await client.get(url)
+        return response, conn
+
+    async def test_stored_and_missing_variants(self, user_client, fake_db):
+        dense = {"type": "Polygon", "coordinates": circle(1000, 1000, 100)}
+        small = {"type": "Polygon", "coordinates": [[0, 0], [1, 0], [1, 1], [0, 1]]}
+        rows = [
+            annotation_row("stored", dense, lod=("4", {"type": "Polygon", "coordinates": [[0, 0], [1, 0], [1, 1]]})),
+            annotation_row("legacy", dense, missing=True),
+            annotation_row("small", small),
+        ]
+        response, conn = await self.query(user_client, fake_db, "/studies/s/annotations?simplify=5&limit=10", rows)
+        assert response.status_code == 200
+        sql, args = conn.queries[0]
+        assert "LEFT JOIN LATERAL" in sql and "geometry_lod ? k" in sql
+        assert args == ("s", ["4", "2"], 11)
+
+        stored, legacy, small_annotation = response.json()["annotations"]
+        assert stored["lod"] == 4 and len(stored["geometry"]["coordinates"]) == 3
+        assert legacy["lod"] in (2, 4) and len(legacy["geometry"]["coordinates"]) < 200
+        assert "lod" not in small_annotation
+
+        # The legacy row's variants are stored afterwards, guarded by its version
+        [(update_sql, update_rows)] = conn.executemany_calls
+        assert update_sql.endswith("WHERE id = $1 AND updated_at = $3")
+        assert update_rows[0][0] == "legacy" and update_rows[0][2] == datetime(2026, 1, 1)
+        assert "4" in json.loads(update_rows[0][1])
+
+    async def test_full_detail_without_simplify(self, user_client, fake_db):
+        response, conn = await self.query(user_client, fake_db, "/studies/s/annotations?simplify=1.5", [])
+        sql, args = conn.queries[0]
+        assert "LATERAL" not in sql and args == ("s",)
@@ -0,0 +1,303 @@
+"""
+Unit tests for the annotation_tiles.py module.
+
+Tests cover:
+- Protobuf varint / zigzag encoding
+- Polygon and polyline clipping, quantisation and ring winding
+- Round trip of encoded tiles through a minimal MVT decoder
+- Per-tile cache invalidation and the generation guard
+- The /studies/{id}/annotations/tiles/{level}/{x}/{y}.mvt endpoint
+"""
+
+import json
+import struct
+import sys
+from pathlib import Path
+from unittest.mock import AsyncMock, patch
+
+import numpy as np
+import pytest
+
+# Add converter module to path
+sys.path.insert(0, str(Path(__file__).parent.parent / "converter"))
+
+
+# =============================================================================
+# Minimal MVT decoder
+# =============================================================================
+
+def read_varint(data, position):
+    value = shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if byte < 0x80:
+            return value, position
+
+
+def read_message(data):
+    """(field number, value) pairs of a protobuf message"""
+    fields, position = [], 0
+    while position < len(data):
+        tag, position = read_varint(data, position)
+        number, wire = tag >> 3, tag & 7
+        if wire == 0:
+            value, position = read_varint(data, position)
+        elif wire == 1:
+            value, position = struct.unpack("<d", data[position:position + 8])[0], position + 8
+        else:
+            length, position = read_varint(data, position)
+            value, position = data[position:position + length], position + length
+        fields.append((number, value))
+    return fields
+
+
+def unzigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+def decode_geometry(data):
+    """Paths of a packed geometry: lists of (x, y), plus whether each was closed"""
+    integers, position = [], 0
+    while position < len(data):
+        value, position = read_varint(data, position)
+        integers.append(value)
+    paths, x, y, i = [], 0, 0, 0
+    while i < len(integers):
+        command, count = integers[i] & 7, integers[i] >> 3
+        i += 1
+        if command == 7:
+            paths[-1][1] = True
+            continue
+        for _ in range(count):
+            x += unzigzag(integers[i])
+            y += unzigzag(integers[i + 1])
+            i += 2
+            if command == 1:
+                paths.append([[(x, y)], False])
+            else:
+                paths[-1][0].append((x, y))
+    return paths
+
+
+def decode_tile(data):
+    """{name, extent, features: [{type, properties, paths}]} of a single-layer tile"""
+    [(number, layer_data)] = read_message(data)
+    assert number == 3
+    layer = read_message(layer_data)
+    keys = [v.decode() for n, v in layer if n == 3]
+    values = []
+    for n, v in layer:
+        if n == 4:
+            [(kind, value)] = read_message(v)
+            values.append(value.decode() if kind == 1 else value)
+    features = []
+    for n, v in layer:
+        if n != 2:
+            continue
+        feature = dict(read_message(v))
+        tags, position = [], 0
+        while position < len(feature.get(2, b"")):
+            tag, position = read_varint(feature[2], position)
+            tags.append(tag)
+        features.append({
+            "type": feature[3],
+            "properties": {keys[tags[i]]: values[tags[i + 1]] for i in range(0, len(tags), 2)},
+            "paths": decode_geometry(feature[4]),
+        })
+    fields = dict(layer)
+    return {"version": fields[15], "name": fields[1].decode(), "extent": fields[5], "features": features}
+
+
+def area(path):
+    return sum(x0 * y1 - x1 * y0 for (x0, y0), (x1, y1) in zip(path, path[1:] + path[:1])) / 2
+
+
+# =============================================================================
+# Encoding
+# =============================================================================
+
+class TestEncoding:
+    """Tests for the protobuf primitives."""
+
+    def test_varints_match_scalar_encoding(self):
+        from annotation_tiles import _varint, _varints
+        values = np.array([0, 1, 127, 128, 300, 16383, 16384, 2 ** 28, 2 ** 32 - 1])
+        data, ends = _varints(values)
+        assert data == b"".join(_varint(int(v)) for v in values)
+        assert ends[-1] == len(data) and ends[0] == 1
+
+    def test_zigzag(self):
+        from annotation_tiles import _zigzag
+        assert _zigzag(np.array([0, -1, 1, -2, 2])).tolist() == [0, 1, 2, 3, 4]
+
+
+class TestClipping:
+    """Tests for clip_ring, clip_line and tile_feature."""
+
+    def test_clip_ring_to_box(self):
+        from annotation_tiles import clip_ring
+        square = np.array([[-5, -5], [5, -5], [5, 5], [-5, 5]], dtype=float)
+        clipped = clip_ring(square, (0, 0, 10, 10))
+        assert sorted(map(tuple, clipped.tolist())) == [(0, 0), (0, 5), (5, 0), (5, 5)]
+        assert len(clip_ring(square, (20, 20, 30, 30))) == 0
+
+    def test_clip_line_pieces(self):
+        from annotation_tiles import clip_line
+        zigzag = np.array([[-5, 5], [5, 5], [5, 20], [8, 20], [8, 5]], dtype=float)
+        pieces = clip_line(zigzag, (0, 0, 10, 10))
+        assert [piece.tolist() for piece in pieces] == [
+            [[0, 5], [5, 5], [5, 10]],
+            [[8, 10], [8, 5]],
+        ]
+
+    def test_polygon_winding_and_holes(self):
+        from annotation_tiles import tile_feature, _varints, POLYGON
+        exterior = [[10, 10], [10, 90], [90, 90], [90, 10], [10, 10]]  # Negative area in tile coordinates
+        hole = [[40, 40], [60, 40], [60, 60], [40, 60], [40, 40]]
+        kind, commands = tile_feature({"type": "Polygon", "coordinates": [exterior, hole]}, (0, 0, 100, 100), 100, 0)
+        assert kind == POLYGON
+        paths = decode_geometry(_varints(commands)[0])
+        assert [closed for _, closed in paths] == [True, True]
+        assert area(paths[0][0]) > 0 and area(paths[1][0]) < 0
+
+    def test_outside_and_degenerate(self):
+        from annotation_tiles import tile_feature
+        box = (0, 0, 1000, 1000)
+        assert tile_feature({"type": "Polygon", "coordinates": [[5000, 5000], [6000, 5000], [6000, 6000]]}, box) is None
+        # Collapses to a single tile unit once quantised
+        assert tile_feature({"type": "Polygon", "coordinates": [[1, 1], [1.01, 1], [1.01, 1.01]]}, box) is None
+        assert tile_feature({"type": "Unknown", "coordinates": []}, box) is None
+
+
+class TestEncodeTile:
+    """Tests for encode_tile."""
+
+    def test_round_trip(self):
+        from annotation_tiles import encode_tile, MVT_EXTENT, POINT, LINESTRING, POLYGON
+        rows = [
+            {"id": "r", "type": "region", "tool": "rectangle",
+             "geometry": {"type": "Rectangle", "coordinates": [[256, 256], [768, 768]]},
+             "properties": {"label": "Tumor", "score": 0.5, "count": -3, "reviewed": True, "_internal": 1}},
+            {"id": "p", "type": "marker", "tool": "point",
+             "geometry": {"type": "Point", "coordinates": [512, 128]}, "properties": None},
+            {"id": "l", "type": "measurement", "tool": "line",
+             "geometry": {"type": "LineString", "coordinates": [[0, 0], [2048, 1024]]},
+             "properties": {"measurement": {"value": 5, "display": "5 µm"}}},
+            {"id": "far", "type": "marker", "tool": "point",
+             "geometry": {"type": "Point", "coordinates": [5000, 5000]}, "properties": {}},
+        ]
+        tile = decode_tile(encode_tile(rows, (0, 0, 1024, 1024)))
+        assert (tile["version"], tile["name"], tile["extent"]) == (2, "annotations", MVT_EXTENT)
+        rectangle, point, line = tile["features"]
+
+        assert rectangle["type"] == POLYGON
+        assert rectangle["properties"] == {
+            "id": "r", "type": "region", "tool": "rectangle",
+            "label": "Tumor", "score": 0.5, "count": 5, "reviewed": 1,
+        }
+        [(ring, closed)] = rectangle["paths"]
+        assert closed and sorted(ring) == [(1024, 1024), (1024, 3072), (3072, 1024), (3072, 3072)]
+        assert area(ring) > 0
+
+        assert point["type"] == POINT and point["paths"] == [[[(2048, 512)], False]]
+        # Clipped at the buffer edge (64 units beyond the tile)
+        assert line["type"] == LINESTRING and line["paths"][0][0][-1] == (4160, 2080)
+        assert line["properties"]["measurement"] == "5 µm"
+
+    def test_empty_tile(self):
+        from annotation_tiles import encode_tile
+        assert encode_tile([], (0, 0, 256, 256)) == b""
+
+
+class TestAnnotationTileCache:
+    """Tests for AnnotationTileCache."""
+
+    def test_invalidate_only_touched_tiles(self):
+        from annotation_tiles import AnnotationTileCache
+        cache = AnnotationTileCache()
+        generation = cache.generation("s")
+        cache.set("s", 0, 0, 0, (0, 0, 256, 256), b"a", generation)
+        cache.set("s", 0, 1, 0, (256, 0, 512, 256), b"b", generation)
+        cache.set("s", 2, 0, 0, (0, 0, 1024, 1024), b"c", generation)
+        cache.set("other", 0, 0, 0, (0, 0, 256, 256), b"d", cache.generation("other"))
+
+        assert cache.invalidate("s", (300, 10, 310, 20)) == 2
+        assert cache.get("s", 0, 0, 0) == b"a"
+        assert cache.get("s", 0, 1, 0) is None and cache.get("s", 2, 0, 0) is None
+        assert cache.get("other", 0, 0, 0) == b"d"
+
+        assert cache.invalidate("s") == 1
+        assert cache.get("s", 0, 0, 0) is None
+
+    def test_stale_generation_not_cached(self):
+        from annotation_tiles import AnnotationTileCache
+        cache = AnnotationTileCache()
+        generation = cache.generation("s")
+        cache.invalidate("s", (0, 0, 1, 1))  # A write lands while the tile is being built
+        cache.set("s", 0, 0, 0, (0, 0, 256, 256), b"old", generation)
+        assert cache.get("s", 0, 0, 0) is None
+
+
+# =============================================================================
+# Endpoint
+# =============================================================================
+
+class TestTileEndpoint:
+    """Tests for GET /studies/{id}/annotations/tiles/{level}/{x}/{y}.mvt."""
+
+    @pytest.fixture(autouse=True)
+    def level(self):
+        import main
+        from prefetch import PyramidLevel
+        main.annotation_tile_cache.invalidate("s")
+        level = PyramidLevel(4096, 4096, 256, 256, 16, 16, 4.0)
+        with patch("main.pyramid_level", AsyncMock(return_value=level)):
+            yield
+
+    async def test_tile_query_and_cache(self, user_client, fake_db):
+        rows = [{
+            "id": "a", "type": "region", "tool": "polygon", "properties": '{"label": "x"}',
+            "geometry": json.dumps({"type": "Polygon", "coordinates": [[1100, 100], [1500, 100], [1500, 500]]}),
+        }]
+        fake_db.rows = rows
+        response = await user_client.get("/studies/s/annotations/tiles/2/1/0.mvt")
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/vnd.mapbox-vector-tile"
+        [feature] = decode_tile(response.content)["features"]
+        assert feature["properties"]["label"] == "x"
+
+        [(sql, args)] = fake_db.queries
+        assert "bbox && box(point($2, $3), point($4, $5))" in sql and "geometry_lod ? k" in sql
+        assert args[0] == "s" and args[1:5] == (1008.0, -16.0, 2064.0, 1040.0)
+        assert args[5] == ["4", "2"] and args[6] == 0.25
+
+        # Served from the cache, then revalidated
+        again = await user_client.get("/studies/s/annotations/tiles/2/1/0.mvt",
+                                      headers={"If-None-Match": response.headers["etag"]})
+        assert again.status_code == 304
+        assert len(fake_db.queries) == 1
+
+    async def test_out_of_range(self, user_client, fake_db):
+        response = await user_client.get("/studies/s/annotations/tiles/2/16/0.mvt")
+        assert response.status_code == 404
+        assert fake_db.queries == []
+
+    async def test_delete_evicts_tiles(self, user_client, fake_db):
+        import main
+        geometry = {"type": "Point", "coordinates": [1200, 200]}
+        generation = main.annotation_tile_cache.generation("s")
+        main.annotation_tile_cache.set("s", 2, 1, 0, (1008, -16, 2064, 1040), b"x", generation)
+        main.annotation_tile_cache.set("s", 2, 3, 3, (3056, 3056, 4112, 4112), b"y", generation)
+
+        fake_db.row = {"geometry": json.dumps(geometry)}
+        response = await user_client.delete("/studies/s/annotations/a")
+        assert response.status_code == 200
+        assert main.annotation_tile_cache.get("s", 2, 1, 0) is None
+        assert main.annotation_tile_cache.get("s", 2, 3, 3) == b"y"
+
+        fake_db.row = None
+        response = await user_client.delete("/studies/s/annotations/a")
+        assert response.status_code == 404
@@ -599,3 +599,47 @@ class TestErrorHandling:
             response = await client.post("/health")
             
             assert response.status_code == 405
+
+
+# =============================================================================
+# Test Streaming Proxies
+# =============================================================================
+
+class TestDicomwebProxy:
+    """Tests for the streaming /dicom-web proxy."""
+
+    @pytest.mark.asyncio
+    async def test_retrieve_is_streamed_with_headers(self):
+        """WADO-RS bodies, multipart boundaries and Range are relayed."""
+        import httpx
+        import main
+        from orthanc_client import OrthancClient
+        seen = {}
+
+        def handler(request):
+            seen["accept"] = request.headers.get("accept")
+            seen["range"] = request.headers.get("range")
+            return httpx.Response(
+                200,
+                headers={"content-type": 'multipart/related; type="application/dicom"; boundary=xyz'},
+                stream=httpx.ByteStream(b"--xyz\r\n" + b"d" * 5000 + b"\r\n--xyz--"),
+            )
+
+        client = OrthancClient("http://orthanc", "u", "p", transport=httpx.MockTransport(handler))
+        main.app.dependency_overrides[main.require_user] = lambda: main.User(id=1, auth0_id="a", email="a@b.c")
+        try:
+            with patch.object(main, "orthanc_client", client):
+                transport = ASGITransport(app=main.app)
+                async with AsyncClient(transport=transport, base_url="http://test") as http:
+                    response = await http.get(
+                        "/dicom-web/studies",
+                        headers={"Accept": 'multipart/related; type="application/dicom"', "Range": "bytes=0-99"},
+                    )
+        finally:
+            main.app.dependency_overrides.clear()
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].endswith("boundary=xyz")
+        assert len(response.content) == 5016
+        assert seen["accept"] == 'multipart/related; type="application/dicom"'
+        assert seen["range"] == "bytes=0-99"
@@ -10,6 +10,7 @@ Tests cover:
 """
 
 import sys
+import time
 from pathlib import Path
 from datetime import datetime
 from unittest.mock import AsyncMock, MagicMock, patch
@@ -158,6 +159,30 @@ class TestJWKSFunctions:
             # Should only call once due to caching
             assert mock_client.get.call_count == 1
 
+    @pytest.mark.asyncio
+    async def test_get_jwks_force_refresh(self, mock_jwks):
+        """Test that force_refresh re-fetches JWKS, but not more than once a minute."""
+        import auth
+        
+        auth._jwks_cache = {"keys": []}
+        auth._jwks_fetched_at = 0.0
+        
+        mock_response = MagicMock()
+        mock_response.json.return_value = mock_jwks
+        mock_response.raise_for_status = MagicMock()
+        
+        with patch("auth.httpx.AsyncClient") as mock_client_class:
+            mock_client = AsyncMock()
+            mock_client.get = AsyncMock(return_value=mock_response)
+            mock_client.__aenter__ = AsyncMock(return_value=mock_client)
+            mock_client.__aexit__ = AsyncMock(return_value=None)
+            mock_client_class.return_value = mock_client
+            
+            assert await auth.get_jwks(force_refresh=True) == mock_jwks
+            # Immediate second refresh is rate limited
+            assert await auth.get_jwks(force_refresh=True) == mock_jwks
+            assert mock_client.get.call_count == 1
+
 
 # =============================================================================
 # Test Token Verification
@@ -319,6 +344,108 @@ class TestGetOrCreateUser:
             assert user.email == token.email
 
 
+# =============================================================================
+# Test Token / User Caches
+# =============================================================================
+
+class TestAuthCaches:
+    """Tests for verified-token, user and last_login caching."""
+
+    @pytest.mark.asyncio
+    async def test_verified_token_is_cached_until_exp(self, mock_jwks):
+        """Test that a verified token skips signature checks until it expires."""
+        import auth
+        
+        auth._jwks_cache = mock_jwks
+        kid = mock_jwks["keys"][0]["kid"]
+        claims = {"sub": "auth0|cached", "email": "c@example.com", "exp": time.time() + 3600}
+        
+        with patch.object(auth, "AUTH0_DOMAIN", "test.auth0.com"), \
+             patch.object(auth, "AUTH0_AUDIENCE", "https://test-api.example.com"), \
+             patch.object(auth.jwt, "get_unverified_header", return_value={"kid": kid}), \
+             patch.object(auth.jwt, "decode", return_value=claims) as mock_decode:
+            first = await auth.verify_token("token-a")
+            second = await auth.verify_token("token-a")
+            
+            assert first.sub == second.sub == "auth0|cached"
+            assert mock_decode.call_count == 1
+            
+            # Expired entries are verified again
+            key = auth._token_hash("token-a")
+            auth._token_cache[key] = (time.time() - 1, first)
+            await auth.verify_token("token-a")
+            assert mock_decode.call_count == 2
+
+    @pytest.mark.asyncio
+    async def test_unknown_kid_refreshes_jwks(self, mock_jwks):
+        """Test that an unknown kid triggers a JWKS refresh."""
+        import auth
+        
+        auth._jwks_cache = {"keys": []}
+        auth._jwks_fetched_at = 0.0
+        kid = mock_jwks["keys"][0]["kid"]
+        claims = {"sub": "auth0|rotated", "exp": time.time() + 3600}
+        
+        with patch.object(auth, "AUTH0_DOMAIN", "test.auth0.com"), \
+             patch.object(auth, "AUTH0_AUDIENCE", "https://test-api.example.com"), \
+             patch.object(auth, "get_jwks", new=AsyncMock(side_effect=[{"keys": []}, mock_jwks])) as mock_get, \
+             patch.object(auth.jwt, "get_unverified_header", return_value={"kid": kid}), \
+             patch.object(auth.jwt, "decode", return_value=claims):
+            payload = await auth.verify_token("token-rotated")
+        
+        assert payload.sub == "auth0|rotated"
+        mock_get.assert_awaited_with(force_refresh=True)
+
+    @pytest.mark.asyncio
+    async def test_user_cached_and_last_login_debounced(self, sample_token_payload, sample_user):
+        """Test that repeat lookups hit the cache and last_login is written once."""
+        from auth import get_or_create_user, TokenPayload
+        import auth
+        
+        token = TokenPayload(**sample_token_payload)
+        
+        mock_conn = AsyncMock()
+        mock_conn.fetchrow = AsyncMock(return_value=sample_user)
+        mock_conn.execute = AsyncMock()
+        mock_pool = create_mock_pool(mock_conn)
+        
+        async def mock_get_pool():
+            return mock_pool
+        
+        with patch.object(auth, "get_db_pool", mock_get_pool):
+            user1 = await get_or_create_user(token)
+            user2 = await get_or_create_user(token)
+            
+            assert user1.id == user2.id == sample_user["id"]
+            assert mock_conn.fetchrow.await_count == 1
+            assert mock_conn.execute.await_count == 1
+            
+            # Callers get independent copies
+            user2.role = "admin"
+            user3 = await get_or_create_user(token)
+            assert user3.role == sample_user["role"]
+
+    @pytest.mark.asyncio
+    async def test_profile_update_invalidates_user_cache(self, sample_user):
+        """Test that update_user_profile drops the cached user."""
+        import auth
+        
+        user = auth.User(**{k: sample_user[k] for k in ("id", "auth0_id", "email", "name", "picture", "role")})
+        auth._user_cache[user.auth0_id] = (time.monotonic() + 60, user)
+        
+        mock_conn = AsyncMock()
+        mock_conn.execute = AsyncMock(return_value="UPDATE 1")
+        mock_pool = create_mock_pool(mock_conn)
+        
+        async def mock_get_pool():
+            return mock_pool
+        
+        with patch.object(auth, "get_db_pool", mock_get_pool):
+            assert await auth.update_user_profile(user.id, name="New Name") is True
+        
+        assert user.auth0_id not in auth._user_cache
+
+
 # =============================================================================
 # Test Study Ownership Functions
 # =============================================================================
@@ -419,20 +546,15 @@ class TestCanAccessStudy:
         import auth
         
         mock_conn = AsyncMock()
-        # Study exists and user owns it
-        mock_conn.fetchrow = AsyncMock(side_effect=[
-            {"id": 1, "owner_id": 1, "is_sample": False},  # slide_exists
-            {"1": 1},  # access check
-        ])
-        
-        mock_pool = AsyncMock()
-        mock_pool.acquire.return_value.__aenter__ = AsyncMock(return_value=mock_conn)
-        mock_pool.acquire.return_value.__aexit__ = AsyncMock(return_value=None)
+        # Study exists and user owns it (single query returns slide + access flag)
+        mock_conn.fetchrow = AsyncMock(return_value={"is_sample": False, "has_access": True})
+        mock_pool = create_mock_pool(mock_conn)
         
         with patch.object(auth, "get_db_pool", return_value=mock_pool):
             result = await auth.can_access_study(1, sample_study_id)
             
             assert result is True
+            assert mock_conn.fetchrow.await_count == 1
 
     @pytest.mark.asyncio
     async def test_can_access_sample_study(self, sample_study_id):
@@ -440,15 +562,8 @@ class TestCanAccessStudy:
         import auth
         
         mock_conn = AsyncMock()
-        mock_conn.fetchrow = AsyncMock(return_value={
-            "id": 1,
-            "owner_id": 2,
-            "is_sample": True,  # Sample study
-        })
-        
-        mock_pool = AsyncMock()
-        mock_pool.acquire.return_value.__aenter__ = AsyncMock(return_value=mock_conn)
-        mock_pool.acquire.return_value.__aexit__ = AsyncMock(return_value=None)
+        mock_conn.fetchrow = AsyncMock(return_value={"is_sample": True, "has_access": False})
+        mock_pool = create_mock_pool(mock_conn)
         
         with patch.object(auth, "get_db_pool", return_value=mock_pool):
             # Even unauthenticated users can access samples
@@ -456,26 +571,44 @@ class TestCanAccessStudy:
             
             assert result is True
 
+    @pytest.mark.asyncio
+    async def test_can_access_unowned_study(self, sample_study_id):
+        """Test access to a study without a slide record."""
+        import auth
+        
+        mock_conn = AsyncMock()
+        mock_conn.fetchrow = AsyncMock(return_value=None)
+        mock_pool = create_mock_pool(mock_conn)
+        
+        with patch.object(auth, "get_db_pool", return_value=mock_pool):
+            assert await auth.can_access_study(1, sample_study_id) is True
+
     @pytest.mark.asyncio
     async def test_cannot_access_others_study(self, sample_study_id):
         """Test denied access to another user's study."""
         import auth
         
         mock_conn = AsyncMock()
-        mock_conn.fetchrow = AsyncMock(side_effect=[
-            {"id": 1, "owner_id": 2, "is_sample": False},  # Study owned by user 2
-            None,  # No access found
-        ])
-        
-        mock_pool = AsyncMock()
-        mock_pool.acquire.return_value.__aenter__ = AsyncMock(return_value=mock_conn)
-        mock_pool.acquire.return_value.__aexit__ = AsyncMock(return_value=None)
+        mock_conn.fetchrow = AsyncMock(return_value={"is_sample": False, "has_access": False})
+        mock_pool = create_mock_pool(mock_conn)
         
         with patch.object(auth, "get_db_pool", return_value=mock_pool):
             result = await auth.can_access_study(1, sample_study_id)  # User 1 tries to access
             
             assert result is False
 
+    @pytest.mark.asyncio
+    async def test_unauthenticated_cannot_access_private_study(self, sample_study_id):
+        """Test denied access for anonymous requests to non-sample slides."""
+        import auth
+        
+        mock_conn = AsyncMock()
+        mock_conn.fetchrow = AsyncMock(return_value={"is_sample": False, "has_access": False})
+        mock_pool = create_mock_pool(mock_conn)
+        
+        with patch.object(auth, "get_db_pool", return_value=mock_pool):
+            assert await auth.can_access_study(None, sample_study_id) is False
+
     @pytest.mark.asyncio
     async def test_can_access_no_database(self, sample_study_id):
         """Test access when database unavailable (fail open)."""
@@ -487,6 +620,57 @@ class TestCanAccessStudy:
             # Should allow access when DB unavailable (fail open for development)
             assert result is True
 
+    @pytest.mark.asyncio
+    async def test_access_decision_is_cached(self, sample_study_id):
+        """Test repeated checks are served from the access cache."""
+        import auth
+        
+        mock_conn = AsyncMock()
+        mock_conn.fetchrow = AsyncMock(return_value={"is_sample": False, "has_access": True})
+        mock_pool = create_mock_pool(mock_conn)
+        
+        with patch.object(auth, "get_db_pool", return_value=mock_pool):
+            assert await auth.can_access_study(1, sample_study_id) is True
+            assert await auth.can_access_study(1, sample_study_id) is True
+            
+            assert mock_conn.fetchrow.await_count == 1
+
+    @pytest.mark.asyncio
+    async def test_access_cache_invalidation(self, sample_study_id):
+        """Test invalidation by study and by user forces a fresh check."""
+        import auth
+        
+        mock_conn = AsyncMock()
+        mock_conn.fetchrow = AsyncMock(return_value={"is_sample": False, "has_access": True})
+        mock_pool = create_mock_pool(mock_conn)
+        
+        with patch.object(auth, "get_db_pool", return_value=mock_pool):
+            await auth.can_access_study(1, sample_study_id)
+            auth.invalidate_access_cache(study_id=sample_study_id)
+            await auth.can_access_study(1, sample_study_id)
+            auth.invalidate_access_cache(user_id=1)
+            await auth.can_access_study(1, sample_study_id)
+            
+            assert mock_conn.fetchrow.await_count == 3
+
+    @pytest.mark.asyncio
+    async def test_unshare_invalidates_access_cache(self, sample_study_id):
+        """Test unshare_slide drops cached decisions for the study."""
+        import auth
+        
+        auth._cache_access_decision(2, sample_study_id, True)
+        
+        mock_conn = AsyncMock()
+        mock_conn.fetchrow = AsyncMock(return_value={"id": 1, "owner_id": 1, "case_id": None})
+        mock_conn.execute = AsyncMock(return_value="DELETE 1")
+        mock_pool = create_mock_pool(mock_conn)
+        
+        with patch.object(auth, "get_db_pool", return_value=mock_pool):
+            result = await auth.unshare_slide(sample_study_id, owner_id=1, unshare_user_id=2)
+        
+        assert result["success"] is True
+        assert (2, sample_study_id) not in auth._access_cache
+
 
 # =============================================================================
 # Test Slide Sharing Functions
@@ -0,0 +1,120 @@
+"""
+Unit tests for the conversion_worker.py module.
+
+Tests cover:
+- Progress reporting from workers to ConversionJob
+- Thread and process pool execution
+- Error propagation
+- ZIP handling in the conversion pipeline
+"""
+
+import sys
+import time
+import queue
+import zipfile
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+# Add converter module to path
+sys.path.insert(0, str(Path(__file__).parent.parent / "converter"))
+
+
+def fake_conversion(job_id, label, progress_queue, cancel_flags, memory_limit_mb):
+    """Module-level so it can be pickled into a spawned worker."""
+    from conversion_worker import JobProgress
+    job = JobProgress(job_id, progress_queue, cancel_flags)
+    job.progress = 40
+    job.message = f"converting {label}"
+    time.sleep(0.05)
+    return [f"{label}.dcm"]
+
+
+def failing_conversion(job_id, progress_queue, cancel_flags, memory_limit_mb):
+    raise ValueError("unsupported file")
+
+
+def make_job(job_id="job1"):
+    return SimpleNamespace(job_id=job_id, status="pending", progress=0, message="")
+
+
+class TestJobProgress:
+    """Tests for JobProgress."""
+
+    def test_updates_are_queued(self):
+        from conversion_worker import JobProgress
+        q = queue.Queue()
+        job = JobProgress("j", q)
+        job.progress = 20
+        job.message = "Deobfuscating DCX file..."
+
+        assert job.progress == 20
+        assert q.get_nowait() == ("j", "progress", 20)
+        assert q.get_nowait() == ("j", "message", "Deobfuscating DCX file...")
+
+    def test_cancel_flag_stops_at_next_update(self):
+        from conversion_worker import JobProgress, ConversionCancelled
+        job = JobProgress("j", queue.Queue(), {"j": True})
+
+        with pytest.raises(ConversionCancelled):
+            job.progress = 30
+
+
+class TestConversionExecutor:
+    """Tests for ConversionExecutor."""
+
+    async def test_thread_mode_mirrors_progress(self):
+        from conversion_worker import ConversionExecutor
+        executor = ConversionExecutor(max_workers=0)
+        job = make_job()
+
+        result = await executor.submit(job, "slide", fn=fake_conversion)
+        await executor.close()
+
+        assert result == ["slide.dcm"]
+        assert job.progress == 40
+        assert job.message == "converting slide"
+        assert executor.get_stats()["completed"] == 1
+        assert executor.get_stats()["active_jobs"] == 0
+
+    async def test_errors_propagate(self):
+        from conversion_worker import ConversionExecutor
+        executor = ConversionExecutor(max_workers=0)
+
+        with pytest.raises(ValueError, match="unsupported file"):
+            await executor.submit(make_job(), fn=failing_conversion)
+        await executor.close()
+
+        assert executor.get_stats()["failed"] == 1
+
+    async def test_process_mode(self):
+        from conversion_worker import ConversionExecutor
+        executor = ConversionExecutor(max_workers=1)
+        job = make_job()
+
+        try:
+            result = await executor.submit(job, "proc", fn=fake_conversion)
+        finally:
+            await executor.close()
+
+        assert result == ["proc.dcm"]
+        assert job.message == "converting proc"
+        assert executor.get_stats()["mode"] == "process"
+
+
+class TestConvertToDicomFiles:
+    """Tests for the blocking conversion pipeline."""
+
+    def test_zip_without_index_file(self, tmp_path):
+        from conversion_worker import convert_to_dicom_files
+        archive = tmp_path / "slide.zip"
+        with zipfile.ZipFile(archive, "w") as zf:
+            zf.writestr("slide/readme.txt", "no index here")
+        job = make_job()
+
+        with pytest.raises(Exception, match="No supported WSI index file"):
+            convert_to_dicom_files(job, archive, tmp_path / "out", tmp_path / "extracted")
+
+        assert (tmp_path / "extracted" / "slide" / "readme.txt").exists()
+        assert job.progress == 15
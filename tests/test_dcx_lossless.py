@@ -0,0 +1,85 @@
+"""
+Unit tests for the dcx_lossless.py module.
+
+Tests cover:
+- Tile deobfuscation against the reference XOR loop
+- Lossless transcode of a synthetic DCX (serial and thread pool)
+"""
+
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# Add converter module to path
+sys.path.insert(0, str(Path(__file__).parent.parent / "converter"))
+
+
+def reference_deobfuscate(tile_data: bytes, key_size: int = 1024) -> bytes:
+    data = bytearray(tile_data)
+    key_offset = len(data) - key_size
+    key = data[key_offset:]
+    for i in range(min(key_size, key_offset)):
+        data[i] ^= key[i]
+    return bytes(data[:key_offset])
+
+
+def obfuscate(payload: bytes, key_size: int = 1024) -> bytes:
+    key = bytes((b % 255) + 1 for b in os.urandom(key_size))
+    head = bytes(a ^ b for a, b in zip(payload[:key_size], key))
+    return head + payload[key_size:] + key
+
+
+class TestDeobfuscateTile:
+    """Tests for deobfuscate_tile."""
+
+    @pytest.mark.parametrize("size", [1025, 1500, 2048, 50_000])
+    def test_matches_reference(self, size):
+        from dcx_lossless import deobfuscate_tile
+        tile = os.urandom(size)
+        assert deobfuscate_tile(tile) == reference_deobfuscate(tile)
+
+    def test_round_trip_from_memoryview(self):
+        from dcx_lossless import deobfuscate_tile
+        payload = b"\xff\xd8" + os.urandom(4000)
+        assert deobfuscate_tile(memoryview(obfuscate(payload))) == payload
+
+    def test_short_tile_returned_unchanged(self):
+        from dcx_lossless import deobfuscate_tile
+        assert deobfuscate_tile(b"abc") == b"abc"
+
+    def test_handler_uses_same_kernel(self):
+        from dcx_handler import deobfuscate_tile
+        payload = os.urandom(3000)
+        assert deobfuscate_tile(obfuscate(payload)) == payload
+
+
+class TestConvertDcxLossless:
+    """Tests for convert_dcx_lossless on a synthetic DCX."""
+
+    @pytest.mark.parametrize("workers", [1, 3])
+    def test_tiles_are_deobfuscated_in_order(self, tmp_path, monkeypatch, workers):
+        import tifffile
+        import dcx_lossless
+        monkeypatch.setattr(dcx_lossless, "TILE_BATCH_SIZE", 4)
+        payloads = [bytes([i]) * 2000 + os.urandom(100) for i in range(9)]
+        source = tmp_path / "slide.dcx"
+        with dcx_lossless.BigTiffWriter(source) as writer:
+            writer.write_page(768, 768, 256, 256, (obfuscate(p) for p in payloads))
+            writer.finalize()
+
+        output = tmp_path / "slide.tiff"
+        progress = []
+        dcx_lossless.convert_dcx_lossless(
+            source, output, lambda p, m: progress.append(p), workers=workers
+        )
+
+        with tifffile.TiffFile(str(output)) as tif, open(output, "rb") as f:
+            page = tif.pages[0]
+            tiles = []
+            for offset, count in zip(page.dataoffsets, page.databytecounts):
+                f.seek(offset)
+                tiles.append(f.read(count))
+        assert tiles == payloads
+        assert progress[-1] == 100
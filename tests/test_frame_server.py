@@ -0,0 +1,213 @@
+"""
+Unit tests for the frame_server.py module.
+
+Tests cover:
+- Frame index parsing (Basic/Extended Offset Table, fragment list)
+- Serving frames from local storage and Orthanc's raw endpoint, including after the stored file disappears
+- Mapping WSI plugin tile paths onto frames
+"""
+
+import sys
+import struct
+from pathlib import Path
+
+import httpx
+import pytest
+
+# Add converter module to path
+sys.path.insert(0, str(Path(__file__).parent.parent / "converter"))
+
+
+JPEG_BASELINE = "1.2.840.10008.1.2.4.50"
+JPEG_2000 = "1.2.840.10008.1.2.4.91"
+UUID = "0a1b2c3d-0000-0000-0000-000000000000"
+
+
+def element(group, elem, vr, value: bytes) -> bytes:
+    if len(value) % 2:
+        value += b"\0"
+    if vr in (b"OB", b"OV", b"SQ", b"UN"):
+        return struct.pack("<HH", group, elem) + vr + b"\0\0" + struct.pack("<I", len(value)) + value
+    return struct.pack("<HH", group, elem) + vr + struct.pack("<H", len(value)) + value
+
+
+def item(data: bytes) -> bytes:
+    return struct.pack("<HHI", 0xFFFE, 0xE000, len(data)) + data
+
+
+def make_dicom(fragments, frames=None, syntax=JPEG_BASELINE, bot=None, eot=None) -> bytes:
+    """Encapsulated Part 10 file with a nested undefined-length sequence before Pixel Data"""
+    meta = element(0x0002, 0x0010, b"UI", syntax.encode())
+    nested = (
+        struct.pack("<HH", 0x0040, 0x0555) + b"SQ\0\0" + struct.pack("<I", 0xFFFFFFFF)
+        + struct.pack("<HHI", 0xFFFE, 0xE000, 0xFFFFFFFF)
+        + element(0x0008, 0x0100, b"SH", b"CODE")
+        + struct.pack("<HHI", 0xFFFE, 0xE00D, 0)
+        + struct.pack("<HHI", 0xFFFE, 0xE0DD, 0)
+    )
+    dataset = element(0x0028, 0x0008, b"IS", str(frames or len(fragments)).encode()) + nested
+    if eot:
+        dataset += element(0x7FE0, 0x0001, b"OV", struct.pack(f"<{len(eot[0])}Q", *eot[0]))
+        dataset += element(0x7FE0, 0x0002, b"OV", struct.pack(f"<{len(eot[1])}Q", *eot[1]))
+    pixel_data = (
+        struct.pack("<HH", 0x7FE0, 0x0010) + b"OB\0\0" + struct.pack("<I", 0xFFFFFFFF)
+        + item(struct.pack(f"<{len(bot or [])}I", *(bot or [])))
+        + b"".join(item(f) for f in fragments)
+        + struct.pack("<HHI", 0xFFFE, 0xE0DD, 0)
+    )
+    return b"\0" * 128 + b"DICM" + meta + dataset + pixel_data
+
+
+def frame_bytes(buf, index, n):
+    return b"".join(buf[offset:offset + length] for offset, length in index.frames[n])
+
+
+class TestParseFrameIndex:
+    """Tests for parse_frame_index."""
+
+    def test_one_fragment_per_frame(self):
+        from frame_server import parse_frame_index
+        buf = make_dicom([b"\xff\xd8AA", b"\xff\xd8BBBB"])
+        index = parse_frame_index(buf)
+
+        assert index.number_of_frames == 2
+        assert index.media_type == "image/jpeg"
+        assert frame_bytes(buf, index, 1) == b"\xff\xd8BBBB"
+
+    def test_basic_offset_table_multi_fragment_frame(self):
+        from frame_server import parse_frame_index
+        # Frame 0 = two fragments (8 + 4 bytes of item headers/data each), frame 1 = one
+        buf = make_dicom([b"AAAA", b"BB", b"CCCC"], frames=2, bot=[0, 8 + 4 + 8 + 2])
+        index = parse_frame_index(buf)
+
+        assert frame_bytes(buf, index, 0) == b"AAAABB"
+        assert frame_bytes(buf, index, 1) == b"CCCC"
+
+    def test_extended_offset_table(self):
+        from frame_server import parse_frame_index
+        buf = make_dicom([b"AAAA", b"BBBBBB"], eot=([0, 12], [4, 6]))
+        index = parse_frame_index(buf)
+
+        assert [frame_bytes(buf, index, i) for i in range(2)] == [b"AAAA", b"BBBBBB"]
+
+    def test_single_frame_of_many_fragments(self):
+        from frame_server import parse_frame_index
+        buf = make_dicom([b"AA", b"BB"], frames=1)
+        assert frame_bytes(buf, parse_frame_index(buf), 0) == b"AABB"
+
+    def test_native_pixel_data_rejected(self):
+        from frame_server import parse_frame_index
+        buf = make_dicom([b"AA"], syntax="1.2.840.10008.1.2.1")
+        with pytest.raises(ValueError, match="no encapsulated frames"):
+            parse_frame_index(buf)
+
+
+class TestFrameServer:
+    """Tests for FrameServer."""
+
+    @staticmethod
+    def make_client(handler):
+        from orthanc_client import OrthancClient
+        return OrthancClient("http://orthanc", "u", "p", transport=httpx.MockTransport(handler))
+
+    async def test_local_byte_range_read(self, tmp_path):
+        from frame_server import FrameServer
+        data = make_dicom([b"\xff\xd8one", b"\xff\xd8two"])
+        stored = tmp_path / UUID[0:2] / UUID[2:4] / UUID
+        stored.parent.mkdir(parents=True)
+        stored.write_bytes(data)
+        paths = []
+
+        def handler(request):
+            paths.append(request.url.path)
+            info = {"Uuid": UUID, "CompressedSize": len(data), "UncompressedSize": len(data)}
+            return httpx.Response(200, json=info)
+
+        server = FrameServer(self.make_client(handler), storage_dir=str(tmp_path))
+
+        assert await server.get_frame("inst", 1) == (b"\xff\xd8two", "image/jpeg", JPEG_BASELINE)
+        assert await server.get_frame("inst", 0) == (b"\xff\xd8one", "image/jpeg", JPEG_BASELINE)
+        assert await server.get_frame("inst", 2) is None
+        # Index is built once
+        assert paths == ["/instances/inst/attachments/dicom/info"]
+        assert server.get_stats()["local_reads"] == 2
+
+    async def test_deleted_file_falls_back_to_raw(self, tmp_path):
+        from frame_server import FrameServer
+        data = make_dicom([b"\xff\xd8one", b"\xff\xd8two"])
+        stored = tmp_path / UUID[0:2] / UUID[2:4] / UUID
+        stored.parent.mkdir(parents=True)
+        stored.write_bytes(data)
+
+        def handler(request):
+            if request.url.path == "/instances/inst/attachments/dicom/info":
+                info = {"Uuid": UUID, "CompressedSize": len(data), "UncompressedSize": len(data)}
+                return httpx.Response(200, json=info)
+            if request.url.path == "/instances/inst/metadata/TransferSyntax":
+                return httpx.Response(200, text=JPEG_BASELINE)
+            if request.url.path == "/instances/inst/frames/1/raw":
+                return httpx.Response(200, content=b"\xff\xd8raw")
+            return httpx.Response(404)
+
+        server = FrameServer(self.make_client(handler), storage_dir=str(tmp_path))
+        assert await server.get_frame("inst", 0) == (b"\xff\xd8one", "image/jpeg", JPEG_BASELINE)
+
+        stored.unlink()
+        assert await server.get_frame("inst", 1) == (b"\xff\xd8raw", "image/jpeg", JPEG_BASELINE)
+        stats = server.get_stats()
+        assert stats["local_read_failures"] == 1 and stats["raw_fetches"] == 1
+
+    async def test_raw_endpoint_without_storage(self):
+        from frame_server import FrameServer
+
+        def handler(request):
+            if request.url.path == "/instances/inst/metadata/TransferSyntax":
+                return httpx.Response(200, text=JPEG_2000)
+            if request.url.path == "/instances/inst/frames/3/raw":
+                return httpx.Response(200, content=b"j2k")
+            return httpx.Response(404)
+
+        server = FrameServer(self.make_client(handler))
+
+        assert await server.get_frame("inst", 3) == (b"j2k", "image/jp2", JPEG_2000)
+        assert await server.get_frame("inst", 4) is None
+
+    async def test_tile_maps_onto_frame(self):
+        from frame_server import FrameServer
+        requested = []
+
+        def level(width, frames):
+            return {"ImageType": "ORIGINAL\\PRIMARY\\VOLUME\\NONE", "TotalPixelMatrixColumns": str(width),
+                    "TotalPixelMatrixRows": "512", "Columns": "256", "Rows": "256",
+                    "NumberOfFrames": str(frames)}
+
+        def handler(request):
+            path = request.url.path
+            if path == "/series/ser/instances-tags":
+                return httpx.Response(200, json={"small": level(512, 4), "big": level(1024, 8)})
+            if path.endswith("/metadata/TransferSyntax"):
+                return httpx.Response(200, text=JPEG_BASELINE)
+            requested.append(path)
+            return httpx.Response(200, content=b"tile")
+
+        server = FrameServer(self.make_client(handler))
+
+        assert await server.get_tile("ser", 0, 1, 1) == (b"tile", "image/jpeg")
+        assert await server.get_tile("ser", 0, 4, 0) is None
+        assert await server.get_tile("ser", 2, 0, 0) is None
+        assert requested == ["/instances/big/frames/5/raw"]
+
+    async def test_non_browser_codec_tile_falls_back(self):
+        from frame_server import FrameServer
+
+        def handler(request):
+            if request.url.path == "/series/ser/instances-tags":
+                tags = {"ImageType": "VOLUME", "TotalPixelMatrixColumns": "256", "TotalPixelMatrixRows": "256",
+                        "Columns": "256", "Rows": "256", "NumberOfFrames": "1"}
+                return httpx.Response(200, json={"i": tags})
+            if request.url.path.endswith("/metadata/TransferSyntax"):
+                return httpx.Response(200, text=JPEG_2000)
+            return httpx.Response(200, content=b"j2k")
+
+        server = FrameServer(self.make_client(handler))
+        assert await server.get_tile("ser", 0, 0, 0) is None
@@ -0,0 +1,97 @@
+"""
+Unit tests for the http_cache.py module.
+
+Tests cover:
+- Deterministic ETags
+- If-None-Match matching (including '*')
+- 304 short-circuit on the frame endpoint
+"""
+
+import sys
+from pathlib import Path
+from unittest.mock import AsyncMock, patch
+
+import httpx
+import pytest
+from httpx import AsyncClient, ASGITransport
+
+# Add converter module to path
+sys.path.insert(0, str(Path(__file__).parent.parent / "converter"))
+
+
+class TestEtags:
+    """Tests for strong_etag and json_etag."""
+
+    def test_strong_etag_is_deterministic(self):
+        from http_cache import strong_etag
+        assert strong_etag("frame", "abc", 3) == strong_etag("frame", "abc", 3)
+        assert strong_etag("frame", "abc", 3) != strong_etag("frame", "abc", 4)
+        assert strong_etag("frame", "abc", 3).startswith('"')
+
+    def test_json_etag_ignores_key_order(self):
+        from http_cache import json_etag
+        assert json_etag({"a": 1, "b": [1, 2]}) == json_etag({"b": [1, 2], "a": 1})
+        assert json_etag({"a": 1}) != json_etag({"a": 2})
+
+
+class TestEtagMatches:
+    """Tests for etag_matches."""
+
+    @pytest.mark.parametrize("header,expected", [
+        ('"abc"', True),
+        ('W/"abc"', True),
+        ('"x", "abc"', True),
+        ("*", False),  # Only honoured once the resource is known to exist
+        ('"x"', False),
+        ("", False),
+        (None, False),
+    ])
+    def test_if_none_match(self, header, expected):
+        from http_cache import etag_matches
+        assert etag_matches(header, '"abc"') is expected
+
+    def test_wildcard_when_resolved(self):
+        from http_cache import etag_matches
+        assert etag_matches("*", '"abc"', wildcard=True) is True
+        assert etag_matches('"x", *', '"abc"', wildcard=True) is True
+
+
+class TestFrameEndpoint:
+    """Tests for conditional GET /instances/{id}/frames/{n}."""
+
+    @pytest.fixture
+    def client(self):
+        from main import app, User, require_user
+        app.dependency_overrides[require_user] = lambda: User(id=1, auth0_id="a", email="a@b.c")
+        yield AsyncClient(transport=ASGITransport(app=app), base_url="http://test")
+        app.dependency_overrides.clear()
+
+    async def test_revalidation_skips_orthanc(self, client):
+        import main
+        frame = (b"\xff\xd8jpeg", "image/jpeg", "1.2.840.10008.1.2.4.50")
+        with patch.object(main.frame_server, "get_frame", AsyncMock(return_value=frame)) as get_frame:
+            async with client:
+                first = await client.get("/instances/inst/frames/0")
+                etag = first.headers["etag"]
+                second = await client.get("/instances/inst/frames/0", headers={"If-None-Match": etag})
+                other = await client.get("/instances/inst/frames/1", headers={"If-None-Match": etag})
+
+        assert first.status_code == 200
+        assert first.content == b"\xff\xd8jpeg"
+        assert "immutable" in first.headers["cache-control"]
+        assert second.status_code == 304
+        assert second.headers["etag"] == etag
+        assert other.status_code == 200
+        assert get_frame.await_count == 2
+
+    async def test_wildcard_does_not_skip_lookup(self, client):
+        import main
+        missing = httpx.Response(404, request=httpx.Request("GET", "http://orthanc/instances/missing"))
+        with patch.object(main.frame_server, "get_frame", AsyncMock(return_value=None)) as get_frame, \
+                patch.object(main.orthanc_client, "get", AsyncMock(return_value=missing)):
+            async with client:
+                response = await client.get("/instances/missing/frames/0", headers={"If-None-Match": "*"})
+
+        # The frame is looked up (and found missing) instead of answered with a 304
+        assert get_frame.await_count == 1
+        assert response.status_code != 304
@@ -0,0 +1,165 @@
+"""
+Unit tests for the icc_lut.py module.
+
+Tests cover:
+- curv / para tone curve evaluation
+- LUT construction (sRGB profile maps to identity)
+- Trilinear LUT application
+- Per-series LUT caching in IccCorrector
+- ICC-corrected tiles through the WSI proxy
+"""
+
+import io
+import sys
+import struct
+from pathlib import Path
+from unittest.mock import AsyncMock, patch
+
+import numpy as np
+import pytest
+from httpx import AsyncClient, ASGITransport
+
+# Add converter module to path
+sys.path.insert(0, str(Path(__file__).parent.parent / "converter"))
+
+
+def srgb_profile() -> bytes:
+    from PIL import ImageCms
+    return ImageCms.ImageCmsProfile(ImageCms.createProfile("sRGB")).tobytes()
+
+
+def curv(values) -> bytes:
+    return b"curv" + b"\0" * 4 + struct.pack(">I", len(values)) + struct.pack(f">{len(values)}H", *values)
+
+
+def para(func, *params) -> bytes:
+    return b"para" + b"\0" * 4 + struct.pack(">H2x", func) + struct.pack(
+        f">{len(params)}i", *(round(p * 65536) for p in params)
+    )
+
+
+def make_tile(fmt="JPEG") -> bytes:
+    from PIL import Image
+    rng = np.random.default_rng(0)
+    pixels = (rng.random((64, 64, 3)) * 255).astype("uint8")
+    out = io.BytesIO()
+    Image.fromarray(pixels).save(out, fmt)
+    return out.getvalue()
+
+
+class TestEvaluateTrc:
+    """Tests for evaluate_trc."""
+
+    def test_curv_identity_and_gamma(self):
+        from icc_lut import evaluate_trc
+        x = np.linspace(0, 1, 11)
+        assert np.allclose(evaluate_trc(curv([]), 0, x), x)
+        assert np.allclose(evaluate_trc(curv([int(2.2 * 256)]), 0, x), x ** (563 / 256))
+
+    def test_curv_table_is_interpolated(self):
+        from icc_lut import evaluate_trc
+        table = curv([0, 65535 // 4, 65535])
+        assert np.allclose(evaluate_trc(table, 0, np.array([0.25, 0.5, 0.75])), [0.125, 0.25, 0.625], atol=1e-4)
+
+    def test_para_srgb_curve(self):
+        from icc_lut import evaluate_trc
+        curve = para(3, 2.4, 1 / 1.055, 0.055 / 1.055, 1 / 12.92, 0.04045)
+        x = np.array([0.0, 0.02, 0.5, 1.0])
+        expected = np.where(x <= 0.04045, x / 12.92, ((x + 0.055) / 1.055) ** 2.4)
+        assert np.allclose(evaluate_trc(curve, 0, x), expected, atol=1e-4)
+
+    def test_unsupported_type_rejected(self):
+        from icc_lut import evaluate_trc
+        with pytest.raises(ValueError):
+            evaluate_trc(b"mAB " + b"\0" * 12, 0, np.zeros(1))
+
+
+class TestLut:
+    """Tests for build_lut and apply_lut."""
+
+    def test_srgb_profile_is_identity(self):
+        from icc_lut import build_lut, identity_grid
+        lut = build_lut(srgb_profile(), size=17)
+        assert lut.shape == (17, 17, 17, 3)
+        assert np.abs(lut - identity_grid(17)).max() < 1 / 255
+
+    def test_apply_identity_lut(self):
+        from icc_lut import apply_lut, identity_grid
+        rgb = np.random.default_rng(1).integers(0, 256, (32, 32, 3), dtype=np.uint8)
+        out = apply_lut(rgb, identity_grid(9).astype(np.float32))
+        assert out.shape == rgb.shape
+        assert np.abs(out.astype(int) - rgb).max() <= 1
+
+    def test_apply_matches_per_channel_curve(self):
+        from icc_lut import apply_lut, identity_grid
+        # A separable LUT reduces trilinear interpolation to linear per channel
+        lut = (identity_grid(33) ** 2).astype(np.float32)
+        rgb = np.arange(256, dtype=np.uint8).repeat(3).reshape(16, 16, 3)
+        axis = np.linspace(0, 1, 33)
+        expected = np.interp(rgb / 255.0, axis, axis ** 2) * 255
+        assert np.abs(apply_lut(rgb, lut) - expected).max() <= 1
+
+    def test_correct_tile_keeps_png_lossless(self):
+        from icc_lut import correct_tile, identity_grid
+        content, media_type = correct_tile(make_tile("PNG"), identity_grid(9).astype(np.float32))
+        assert media_type == "image/png"
+        content, media_type = correct_tile(make_tile("JPEG"), identity_grid(9).astype(np.float32))
+        assert media_type == "image/jpeg"
+
+
+class TestIccCorrector:
+    """Tests for the per-series LUT cache."""
+
+    async def test_lut_built_once(self):
+        from icc_lut import IccCorrector
+        corrector = IccCorrector(lut_size=9)
+        load = AsyncMock(return_value=srgb_profile())
+        try:
+            first = await corrector.get_lut("series", load)
+            second = await corrector.get_lut("series", load)
+        finally:
+            corrector.close()
+        assert first is second
+        assert load.await_count == 1
+        assert corrector.get_stats()["luts_built"] == 1
+
+    async def test_missing_profile_is_cached(self):
+        from icc_lut import IccCorrector
+        corrector = IccCorrector()
+        load = AsyncMock(return_value=None)
+        assert await corrector.get_lut("series", load) is None
+        assert await corrector.get_lut("series", load) is None
+        assert load.await_count == 1
+        corrector.invalidate("series")
+        await corrector.get_lut("series", load)
+        assert load.await_count == 2
+
+
+class TestIccTileEndpoint:
+    """Tests for ?icc=1 through the WSI proxy."""
+
+    async def test_icc_tiles_cached_separately(self):
+        import main
+        main.tile_cache.memory.clear()
+        main.icc_corrector.invalidate()
+        native = AsyncMock(return_value=(make_tile(), "image/jpeg"))
+        profile = AsyncMock(return_value=srgb_profile())
+        client = AsyncClient(transport=ASGITransport(app=main.app), base_url="http://test")
+
+        with patch("main.can_access_study", AsyncMock(return_value=True)), \
+                patch("main.extract_study_id_from_wsi_path", AsyncMock(return_value="study")), \
+                patch.object(main, "fetch_tile_from_orthanc", native), \
+                patch.object(main, "load_series_icc_profile", profile), \
+                patch.object(main.tile_transcoder, "negotiate", return_value=None):
+            async with client:
+                plain = await client.get("/wsi/tiles/1cc5e/0/1/2?_=1")
+                first = await client.get("/wsi/tiles/1cc5e/0/1/2?_=1&icc=1")
+                second = await client.get("/wsi/tiles/1cc5e/0/1/2?_=2&icc=1")
+
+        assert plain.content == native.return_value[0]
+        assert first.status_code == 200
+        assert first.content == second.content
+        assert first.content != plain.content
+        assert first.headers["etag"] != plain.headers["etag"]
+        assert native.await_count == 1
+        assert profile.await_count == 1
@@ -0,0 +1,198 @@
+"""
+Unit tests for the iiif.py module.
+
+Tests cover:
+- IIIF region/size/rotation/quality parsing
+- info.json scale factors and sizes
+- Native tile detection for IIIF and Deep Zoom requests
+- The IIIF and DZI endpoints (pass-through and resampled images)
+"""
+
+import io
+import sys
+from pathlib import Path
+from unittest.mock import AsyncMock, patch
+
+import numpy as np
+import pytest
+from httpx import AsyncClient, ASGITransport
+
+# Add converter module to path
+sys.path.insert(0, str(Path(__file__).parent.parent / "converter"))
+
+TILE = 256
+# Level 0 is 4x3 tiles (the last column and row clipped), level 1 is 2x2 tiles
+WIDTH, HEIGHT = 1000, 700
+
+
+def make_levels():
+    from prefetch import PyramidLevel
+    return [
+        PyramidLevel(WIDTH, HEIGHT, TILE, TILE, 4, 3, 1.0),
+        PyramidLevel(WIDTH // 2, HEIGHT // 2, TILE, TILE, 2, 2, 2.0),
+    ]
+
+
+def make_tile(level, x, y) -> bytes:
+    from PIL import Image
+    pixels = np.full((TILE, TILE, 3), (level * 80, x * 40, y * 40), dtype=np.uint8)
+    out = io.BytesIO()
+    Image.fromarray(pixels).save(out, "JPEG", quality=95)
+    return out.getvalue()
+
+
+class TestParsing:
+    """Tests for the IIIF path parameter parsers."""
+
+    def test_region(self):
+        from iiif import parse_region, Rect, IiifError
+        assert parse_region("full", WIDTH, HEIGHT) == Rect(0, 0, WIDTH, HEIGHT)
+        assert parse_region("square", WIDTH, HEIGHT) == Rect(150, 0, 700, 700)
+        assert parse_region("900,600,500,500", WIDTH, HEIGHT) == Rect(900, 600, 100, 100)
+        assert parse_region("pct:10,10,50,50", WIDTH, HEIGHT) == Rect(100, 70, 500, 350)
+        with pytest.raises(IiifError):
+            parse_region("1000,0,10,10", WIDTH, HEIGHT)
+        with pytest.raises(IiifError):
+            parse_region("0,0,10", WIDTH, HEIGHT)
+
+    def test_size(self):
+        from iiif import parse_size, Rect, IiifError
+        region = Rect(0, 0, 512, 256)
+        assert parse_size("max", region, 10 ** 6) == (512, 256)
+        assert parse_size("256,", region, 10 ** 6) == (256, 128)
+        assert parse_size(",64", region, 10 ** 6) == (128, 64)
+        assert parse_size("pct:50", region, 10 ** 6) == (256, 128)
+        assert parse_size("!100,100", region, 10 ** 6) == (100, 50)
+        assert parse_size("^1024,", region, 10 ** 6) == (1024, 512)
+        assert parse_size("max", region, 512 * 64) == (256, 128)
+        with pytest.raises(IiifError):
+            parse_size("1024,", region, 10 ** 6)
+        with pytest.raises(IiifError):
+            parse_size("256,256", region, 1000)
+
+    def test_rotation_and_quality(self):
+        from iiif import parse_rotation, parse_image_request, IiifError
+        assert parse_rotation("90") == (90, False)
+        assert parse_rotation("!0") == (0, True)
+        with pytest.raises(IiifError) as unsupported:
+            parse_rotation("45")
+        assert unsupported.value.status_code == 501
+        with pytest.raises(IiifError):
+            parse_image_request("full", "max", "0", "sepia.jpg", WIDTH, HEIGHT, 10 ** 6)
+        with pytest.raises(IiifError) as bad_format:
+            parse_image_request("full", "max", "0", "default.gif", WIDTH, HEIGHT, 10 ** 6)
+        assert bad_format.value.status_code == 501
+
+
+class TestMapping:
+    """Tests for info.json, native tile detection and Deep Zoom."""
+
+    def test_info_json(self):
+        from iiif import info_json
+        info = info_json("https://x/iiif/3/s", make_levels(), 300_000)
+        assert info["tiles"] == [{"width": TILE, "height": TILE, "scaleFactors": [1, 2]}]
+        assert info["sizes"] == [{"width": 500, "height": 350}]
+        assert info["id"] == "https://x/iiif/3/s"
+
+    def test_native_tile(self):
+        from iiif import native_tile, parse_image_request
+        levels = make_levels()
+
+        def native(region, size, rotation="0", quality="default.jpg"):
+            request = parse_image_request(region, size, rotation, quality, WIDTH, HEIGHT, 10 ** 6)
+            return native_tile(levels, request)
+
+        assert native("256,0,256,256", "256,") == (0, 1, 0)
+        assert native("0,0,512,512", "256,256") == (1, 0, 0)
+        # Clipped at the image edge, rotated, grey or resampled: not a native tile
+        assert native("768,0,256,256", "232,") is None
+        assert native("256,0,256,256", "256,", rotation="90") is None
+        assert native("256,0,256,256", "256,", quality="gray.jpg") is None
+        assert native("256,0,256,256", "128,") is None
+
+    def test_dzi(self):
+        from iiif import dzi_descriptor, dzi_max_level, dzi_tile_request, native_tile, Rect, IiifError
+        levels = make_levels()
+        assert 'TileSize="256" Overlap="0"' in dzi_descriptor(levels)
+        top = dzi_max_level(WIDTH, HEIGHT)
+        assert top == 10
+        full = dzi_tile_request(levels, top, 1, 0)
+        assert native_tile(levels, full) == (0, 1, 0)
+        half = dzi_tile_request(levels, top - 1, 1, 1)
+        assert half.region == Rect(512, 512, 488, 188)
+        assert (half.width, half.height) == (244, 94)
+        with pytest.raises(IiifError) as outside:
+            dzi_tile_request(levels, top, 4, 0)
+        assert outside.value.status_code == 404
+
+
+class TestEndpoints:
+    """Tests for the IIIF and DZI endpoints."""
+
+    @pytest.fixture
+    def mocks(self):
+        import main
+        main.tile_cache.memory.clear()
+        fetch = AsyncMock(side_effect=lambda series_id, level, x, y: (make_tile(level, x, y), "image/jpeg"))
+        with patch("main.can_access_study", AsyncMock(return_value=True)), \
+                patch("main.resolve_region_source", AsyncMock(return_value=("iiif", 0.25))), \
+                patch.object(main.pyramid_cache, "get", AsyncMock(return_value=make_levels())), \
+                patch.object(main, "fetch_tile_from_orthanc", fetch):
+            yield fetch
+
+    @pytest.fixture
+    def client(self):
+        import main
+        return AsyncClient(transport=ASGITransport(app=main.app), base_url="http://test")
+
+    async def test_info_uses_forwarded_prefix(self, client, mocks):
+        async with client:
+            response = await client.get("/iiif/3/s/info.json", headers={"X-Forwarded-Prefix": "/api"})
+            redirect = await client.get("/iiif/3/s")
+        assert response.status_code == 200
+        assert response.json()["id"] == "http://test/api/iiif/3/s"
+        assert response.headers["access-control-allow-origin"] == "*"
+        assert redirect.status_code == 303
+        assert redirect.headers["location"].endswith("/iiif/3/s/info.json")
+
+    async def test_aligned_tile_is_passed_through(self, client, mocks):
+        async with client:
+            response = await client.get("/iiif/3/s/0,0,512,512/256,/0/default.jpg")
+        assert response.status_code == 200
+        assert response.content == make_tile(1, 0, 0)
+        assert "level2" in response.headers["link"]
+
+    async def test_unaligned_region_is_resampled_and_cached(self, client, mocks):
+        from PIL import Image
+        async with client:
+            first = await client.get("/iiif/3/s/100,100,300,200/150,/90/gray.png")
+            fetches = mocks.await_count
+            second = await client.get("/iiif/3/s/100,100,300,200/150,/90/gray.png")
+        assert first.status_code == 200
+        assert first.headers["content-type"] == "image/png"
+        image = Image.open(io.BytesIO(first.content))
+        assert image.size == (100, 150)
+        assert image.mode == "L"
+        assert second.content == first.content
+        assert mocks.await_count == fetches
+
+    async def test_dzi(self, client, mocks):
+        async with client:
+            descriptor = await client.get("/dzi/s.dzi")
+            tile = await client.get("/dzi/s_files/10/1_0.jpg")
+            edge = await client.get("/dzi/s_files/10/3_0.jpg")
+            outside = await client.get("/dzi/s_files/10/9_0.jpg")
+        assert descriptor.status_code == 200
+        assert "<Size Width=\"1000\" Height=\"700\"/>" in descriptor.text
+        assert tile.content == make_tile(0, 1, 0)
+        assert edge.status_code == 200
+        from PIL import Image
+        assert Image.open(io.BytesIO(edge.content)).size == (232, 256)
+        assert outside.status_code == 404
+
+    async def test_bad_request(self, client, mocks):
+        async with client:
+            response = await client.get("/iiif/3/s/full/max/45/default.jpg")
+            bad = await client.get("/iiif/3/s/full/nope/0/default.jpg")
+        assert response.status_code == 501
+        assert bad.status_code == 400
@@ -0,0 +1,341 @@
+"""
+Unit tests for the job_queue.py module.
+
+Tests cover:
+- Priority ordering (small slides first)
+- Retries with backoff and giving up
+- Cancellation of queued and running jobs
+- Crash recovery of incoming/ and processing/
+- Postgres claim with SKIP LOCKED
+- Lost leases: no outcome written, input left to the new owner
+- POST /jobs/{id}/cancel restricted to the uploader and admins
+"""
+
+import sys
+import asyncio
+from datetime import datetime
+from pathlib import Path
+from contextlib import asynccontextmanager
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+# Add converter module to path
+sys.path.insert(0, str(Path(__file__).parent.parent / "converter"))
+
+
+async def no_pool():
+    return None
+
+
+def make_job(job_id, priority=0, file_path=None):
+    from job_queue import ConversionJob
+    return ConversionJob(
+        job_id=job_id,
+        filename=f"{job_id}.svs",
+        status="pending",
+        created_at=datetime.utcnow(),
+        file_path=file_path,
+        priority=priority,
+    )
+
+
+def make_queue(**kwargs):
+    from job_queue import JobQueue
+    kwargs.setdefault("retry_backoff_seconds", 0)
+    kwargs.setdefault("poll_seconds", 0.01)
+    return JobQueue(no_pool, **kwargs)
+
+
+async def wait_for(predicate, timeout=2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        if asyncio.get_running_loop().time() > deadline:
+            raise AssertionError("condition not reached")
+        await asyncio.sleep(0.01)
+
+
+class TestInProcessQueue:
+    """Tests for the queue without a database."""
+
+    async def test_smallest_job_runs_first(self):
+        queue = make_queue()
+        order = []
+
+        async def runner(job):
+            order.append(job.job_id)
+            return f"study-{job.job_id}"
+
+        await queue.enqueue(make_job("big", priority=5_000_000))
+        await queue.enqueue(make_job("small", priority=10))
+        await queue.start(runner, concurrency=1)
+        await wait_for(lambda: len(order) == 2)
+        await queue.stop()
+
+        assert order == ["small", "big"]
+        job = await queue.get("small")
+        assert job.status == "completed"
+        assert job.study_id == "study-small"
+        assert job.progress == 100
+
+    async def test_retries_then_fails(self):
+        queue = make_queue(max_attempts=2)
+        failed = []
+
+        async def runner(job):
+            raise RuntimeError("wsidicomizer crashed")
+
+        async def on_failed(job):
+            failed.append(job.job_id)
+
+        await queue.enqueue(make_job("j1"))
+        await queue.start(runner, on_failed=on_failed)
+        await wait_for(lambda: failed)
+        await queue.stop()
+
+        job = await queue.get("j1")
+        assert job.attempts == 2
+        assert job.status == "failed"
+        assert "wsidicomizer crashed" in job.message
+
+    async def test_retry_succeeds(self):
+        queue = make_queue(max_attempts=3)
+
+        async def runner(job):
+            if job.attempts == 1:
+                raise RuntimeError("Orthanc unavailable")
+            return "study"
+
+        await queue.enqueue(make_job("j1"))
+        await queue.start(runner)
+        await wait_for(lambda: queue.jobs["j1"].status == "completed")
+        await queue.stop()
+
+        assert queue.jobs["j1"].attempts == 2
+
+    async def test_cancel_pending_job(self):
+        queue = make_queue()
+        failed = []
+
+        async def on_failed(job):
+            failed.append(job.job_id)
+
+        queue._on_failed = on_failed
+        await queue.enqueue(make_job("j1"))
+        job = await queue.cancel("j1")
+
+        assert job.status == "cancelled"
+        assert failed == ["j1"]
+        assert await queue._claim() is None
+
+    async def test_cancel_running_job(self):
+        from job_queue import JobCancelled
+        queue = make_queue()
+        signalled = []
+        started = asyncio.Event()
+
+        async def runner(job):
+            started.set()
+            while not job.cancel_requested:
+                await asyncio.sleep(0.01)
+            raise JobCancelled()
+
+        await queue.enqueue(make_job("j1"))
+        await queue.start(runner, on_cancel=signalled.append)
+        await started.wait()
+        await queue.cancel("j1")
+        await wait_for(lambda: queue.jobs["j1"].status == "cancelled")
+        await queue.stop()
+
+        assert signalled == ["j1"]
+
+    async def test_delete_active_job_refused(self):
+        queue = make_queue()
+        await queue.enqueue(make_job("j1"))
+
+        with pytest.raises(ValueError):
+            await queue.delete("j1")
+        assert await queue.delete("missing") is False
+
+
+class TestRecovery:
+    """Tests for crash recovery."""
+
+    async def test_requeues_incoming_and_clears_processing(self, tmp_path):
+        (tmp_path / "incoming").mkdir()
+        (tmp_path / "processing" / "deadbeef").mkdir(parents=True)
+        (tmp_path / "processing" / "deadbeef_extracted").mkdir()
+        (tmp_path / "incoming" / "deadbeef_slide.svs").write_bytes(b"x" * 100)
+        (tmp_path / "incoming" / "dropped-by-user.svs").write_bytes(b"x")
+        queue = make_queue()
+
+        report = await queue.recover(tmp_path, lambda name: "aperio")
+
+        assert report == {"leases_released": 0, "dirs_removed": 2, "files_requeued": 1}
+        job = queue.jobs["deadbeef"]
+        assert job.filename == "slide.svs"
+        assert job.priority == 100
+        assert job.source_format == "aperio"
+        assert not (tmp_path / "processing" / "deadbeef").exists()
+
+    async def test_known_jobs_are_not_requeued(self, tmp_path):
+        (tmp_path / "incoming").mkdir()
+        (tmp_path / "incoming" / "deadbeef_slide.svs").write_bytes(b"x")
+        queue = make_queue()
+        await queue.enqueue(make_job("deadbeef"))
+
+        report = await queue.recover(tmp_path, lambda name: "aperio")
+
+        assert report["files_requeued"] == 0
+
+
+class TestPostgresQueue:
+    """Tests for the Postgres-backed queue."""
+
+    @staticmethod
+    def pool_with(conn):
+        pool = MagicMock()
+
+        @asynccontextmanager
+        async def acquire():
+            yield conn
+
+        pool.acquire = acquire
+        return pool
+
+    async def test_claim_uses_skip_locked_lease(self):
+        from job_queue import JobQueue
+        conn = MagicMock()
+        conn.fetchrow = AsyncMock(return_value={
+            "job_id": "j1", "filename": "a.svs", "status": "processing", "progress": 0,
+            "message": "", "created_at": datetime.utcnow(), "attempts": 1, "priority": 10,
+            "lease_owner": "host:1",
+        })
+        pool = self.pool_with(conn)
+
+        async def get_pool():
+            return pool
+
+        queue = JobQueue(get_pool, lease_seconds=60)
+        job = await queue._claim()
+
+        sql, worker_id, lease = conn.fetchrow.call_args.args
+        assert "FOR UPDATE SKIP LOCKED" in sql
+        assert "ORDER BY priority, created_at" in sql
+        assert worker_id == queue.worker_id
+        assert lease == 60.0
+        assert job.job_id == "j1" and job.attempts == 1
+        assert queue.durable
+
+    @staticmethod
+    def running_job():
+        from job_queue import _job_from_row
+        return _job_from_row({
+            "job_id": "j1", "filename": "a.svs", "status": "processing", "progress": 0,
+            "message": "", "created_at": datetime.utcnow(), "attempts": 3, "priority": 10,
+        })
+
+    async def test_lost_lease_leaves_job_alone(self, tmp_path):
+        from job_queue import JobQueue
+        conn = MagicMock()
+        conn.fetchrow = AsyncMock(return_value=None)  # Heartbeat: lease reclaimed by another worker
+        conn.execute = AsyncMock(return_value="UPDATE 1")
+        pool = self.pool_with(conn)
+
+        async def get_pool():
+            return pool
+
+        input_file = tmp_path / "j1_a.svs"
+        input_file.write_bytes(b"x")
+        signalled, failed = [], []
+
+        async def on_failed(job):
+            failed.append(job.job_id)
+            input_file.unlink()
+
+        queue = JobQueue(get_pool, max_attempts=3)
+        queue._on_failed = on_failed
+        queue._on_cancel = signalled.append
+        job = self.running_job()
+        job.file_path = str(input_file)
+        queue.jobs["j1"] = job
+
+        async def runner(job):
+            await queue._heartbeat(job)
+            raise RuntimeError("Conversion stopped")  # What the worker raises once signalled
+
+        queue._runner = runner
+        await queue._run(job)
+
+        assert signalled == ["j1"]
+        assert job.lease_lost and not job.cancel_requested
+        conn.execute.assert_not_called()
+        assert failed == [] and input_file.exists()
+        assert "j1" not in queue.jobs
+
+    async def test_finish_requires_lease(self):
+        from job_queue import JobQueue
+        conn = MagicMock()
+        conn.execute = AsyncMock(return_value="UPDATE 0")
+        pool = self.pool_with(conn)
+
+        async def get_pool():
+            return pool
+
+        failed = []
+
+        async def on_failed(job):
+            failed.append(job.job_id)
+
+        async def runner(job):
+            raise RuntimeError("wsidicomizer crashed")
+
+        queue = JobQueue(get_pool, max_attempts=3)
+        queue._runner = runner
+        queue._on_failed = on_failed
+        await queue._run(self.running_job())
+
+        sql, *args = conn.execute.call_args.args
+        assert "WHERE job_id = $1 AND lease_owner = $9" in " ".join(sql.split())
+        assert args[-1] == queue.worker_id
+        assert failed == []
+
+
+class TestCancelEndpoint:
+    """Tests for POST /jobs/{job_id}/cancel."""
+
+    async def enqueue(self, owner_id):
+        queue = make_queue()
+        job = make_job("j1")
+        job.owner_id = owner_id
+        await queue.enqueue(job)
+        return queue
+
+    async def test_non_owner_forbidden(self, user_client):
+        queue = await self.enqueue(owner_id=2)
+        with patch("main.job_queue", queue):
+            response = await user_client.post("/jobs/j1/cancel")
+        assert response.status_code == 403
+        assert queue.jobs["j1"].status == "pending"
+
+    async def test_owner_cancels(self, user_client):
+        queue = await self.enqueue(owner_id=1)
+        with patch("main.job_queue", queue):
+            response = await user_client.post("/jobs/j1/cancel")
+        assert response.status_code == 200
+        assert response.json()["status"] == "cancelled"
+
+    async def test_admin_cancels(self, user_client):
+        import main
+        queue = await self.enqueue(owner_id=2)
+        main.app.dependency_overrides[main.require_user] = lambda: main.User(
+            id=3, auth0_id="b", email="b@c.d", role="admin"
+        )
+        with patch("main.job_queue", queue):
+            response = await user_client.post("/jobs/j1/cancel")
+        assert response.status_code == 200
+
+    async def test_unknown_job(self, user_client):
+        with patch("main.job_queue", make_queue()):
+            response = await user_client.post("/jobs/nope/cancel")
+        assert response.status_code == 404
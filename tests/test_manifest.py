@@ -0,0 +1,260 @@
+"""
+Unit tests for the manifest.py module.
+
+Tests cover:
+- Calibration extraction from DICOM tags
+- Leica virtual pyramid building
+- Manifest building, ETag and storage cache
+- Debounced refresh scheduling
+- Calibration, ICC and Leica endpoints served from the manifest
+"""
+
+import sys
+import asyncio
+from pathlib import Path
+from unittest.mock import patch
+
+import httpx
+import pytest
+
+# Add converter module to path
+sys.path.insert(0, str(Path(__file__).parent.parent / "converter"))
+
+
+def volume_tags(width, edof="YES"):
+    return {
+        "Modality": "SM",
+        "SeriesInstanceUID": "1.2.main",
+        "ImageType": "DERIVED\\PRIMARY\\VOLUME\\NONE",
+        "TotalPixelMatrixColumns": str(width),
+        "TotalPixelMatrixRows": str(width // 2),
+        "Columns": "256",
+        "Rows": "256",
+        "NumberOfFrames": "16",
+        "ExtendedDepthOfField": edof,
+        "DimensionOrganizationType": "TILED_FULL",
+    }
+
+
+STUDY_INSTANCES = {
+    "i0": volume_tags(1000),
+    "i1": volume_tags(500),
+}
+
+FULL_TAGS = {"0028,0030": {"Value": ["0.5", "0.5"]}}
+
+
+class FakeOrthanc:
+    """Async stand-in for OrthancClient serving STUDY_INSTANCES."""
+
+    def __init__(self, icc=None):
+        self.icc = icc
+        self.calls = []
+
+    async def get(self, path):
+        self.calls.append(path)
+        request = httpx.Request("GET", f"http://orthanc{path}")
+        if path == "/studies/st1/instances":
+            body = [{"ID": iid, "ParentSeries": "s1"} for iid in STUDY_INSTANCES]
+            return httpx.Response(200, json=body, request=request)
+        if path.startswith("/studies/st1/instances-tags"):
+            return httpx.Response(200, json=STUDY_INSTANCES, request=request)
+        if path == "/instances/i0/tags":
+            return httpx.Response(200, json=FULL_TAGS, request=request)
+        if path.endswith("/metadata/TransferSyntax"):
+            return httpx.Response(200, text="1.2.840.10008.1.2.4.50", request=request)
+        if path == "/instances/i0/content/0048-0105/0/0028-2000" and self.icc:
+            return httpx.Response(200, content=self.icc, request=request)
+        return httpx.Response(404, request=request)
+
+
+@pytest.fixture(autouse=True)
+def clear_manifest_cache():
+    import manifest
+    manifest._manifest_cache.clear()
+    yield
+    manifest._manifest_cache.clear()
+
+
+class TestExtractCalibration:
+    """Tests for extract_calibration."""
+
+    def test_pixel_spacing(self):
+        from manifest import extract_calibration
+        calibration = extract_calibration(FULL_TAGS)
+        assert calibration["pixel_spacing_um"] == [0.5, 0.5]
+        assert calibration["source"] == "dicom"
+
+    def test_shared_functional_groups(self):
+        from manifest import extract_calibration
+        tags = {"5200,9229": {"Value": [{"0028,9110": {"Value": [{"0028,0030": {"Value": ["0.25", "0.3"]}}]}}]}}
+        assert extract_calibration(tags)["pixel_spacing_um"] == [0.25, 0.3]
+
+    def test_imaged_volume_fallback(self):
+        from manifest import extract_calibration
+        tags = {
+            "0028,0030": {"Value": ["."]},
+            "0048,0001": {"Value": [2.0]},
+            "0048,0006": {"Value": [4000]},
+        }
+        calibration = extract_calibration(tags)
+        assert calibration["pixel_spacing_um"] == [0.5, 0.5]
+        assert calibration["total_pixel_matrix"] == [4000, None]
+
+    def test_default(self):
+        from manifest import extract_calibration
+        calibration = extract_calibration({})
+        assert calibration["pixel_spacing_um"] == [0.25, 0.25]
+        assert calibration["source"] == "default"
+
+
+class TestBuildLeicaPyramid:
+    """Tests for build_leica_pyramid."""
+
+    def test_builds_levels_largest_first(self):
+        from manifest import build_leica_pyramid
+        instances = [
+            {"id": "small", "tags": {"Modality": "SM", "Columns": "512", "Rows": "256"}},
+            {"id": "big", "tags": {"Modality": "SM", "Columns": "2048", "Rows": "1024"}},
+            {"id": "label", "tags": {"Modality": "OT", "Columns": "100", "Rows": "100"}},
+        ]
+        pyramid = build_leica_pyramid("st", instances)
+        assert pyramid["InstanceIDs"] == ["big", "small"]
+        assert pyramid["Resolutions"] == [1.0, 4.0]
+        assert pyramid["TilesCount"] == [[8, 4], [2, 1]]
+
+    def test_single_level_is_not_a_pyramid(self):
+        from manifest import build_leica_pyramid
+        instances = [{"id": "a", "tags": {"Modality": "SM", "Columns": "512", "Rows": "256"}}]
+        assert build_leica_pyramid("st", instances) is None
+
+
+class TestBuildManifest:
+    """Tests for build_manifest and manifest_etag."""
+
+    async def test_levels_and_calibration(self):
+        from manifest import build_manifest
+        manifest = await build_manifest(FakeOrthanc(), "st1")
+
+        assert [lvl["instanceId"] for lvl in manifest["levels"]] == ["i0", "i1"]
+        assert manifest["levels"][0]["tilesX"] == 4
+        assert manifest["levels"][1]["tilesY"] == 1
+        assert manifest["levels"][0]["frameOrganization"] == "TILED_FULL"
+        assert manifest["levels"][0]["frameIndex"] is None
+        assert manifest["levels"][1]["transferSyntax"] == "1.2.840.10008.1.2.4.50"
+        assert manifest["calibration"]["pixel_spacing_um"] == [0.5, 0.5]
+        assert manifest["icc"] == {"has_icc": False}
+        assert manifest["leicaPyramid"] is None
+
+    def test_sparse_frame_index(self):
+        from manifest import frame_index
+
+        def frame(column, row):
+            return {"PlanePositionSlideSequence": [{
+                "ColumnPositionInTotalImagePixelMatrix": str(column), "RowPositionInTotalImagePixelMatrix": str(row),
+            }]}
+
+        tags = {"PerFrameFunctionalGroupsSequence": [frame(257, 1), frame(1, 257), frame(257, 1)]}
+        assert frame_index(tags, 2, 2, 256, 256) == [-1, 0, 1, -1]
+        assert frame_index({}, 2, 2, 256, 256) is None
+
+    async def test_icc_profile_info(self):
+        from manifest import build_manifest
+        header = bytearray(128)
+        header[0:4] = (128).to_bytes(4, "big")
+        header[12:16] = b"mntr"
+        header[16:20] = b"RGB "
+        manifest = await build_manifest(FakeOrthanc(icc=bytes(header)), "st1")
+
+        assert manifest["icc"]["has_icc"] is True
+        assert manifest["icc"]["instanceId"] == "i0"
+        assert manifest["icc"]["location"] == "OpticalPathSequence[0]"
+        assert manifest["icc"]["profile_info"]["color_space"] == "RGB"
+
+    async def test_untiled_study_still_calibrated(self):
+        from manifest import build_manifest
+        instances = {"i0": {"Modality": "SM", "Columns": "800", "Rows": "600"}}
+        with patch.dict(STUDY_INSTANCES, instances, clear=True):
+            manifest = await build_manifest(FakeOrthanc(), "st1")
+
+        assert manifest["wsi"] is None and manifest["leicaPyramid"] is None
+        assert manifest["calibration"]["pixel_spacing_um"] == [0.5, 0.5]
+
+    async def test_etag_ignores_generation_time(self):
+        from manifest import build_manifest, manifest_etag
+        first = await build_manifest(FakeOrthanc(), "st1")
+        second = dict(first, generatedAt="later")
+        assert manifest_etag(first) == manifest_etag(second)
+        assert manifest_etag(first) != manifest_etag(dict(first, instanceCount=3))
+
+
+class TestManifestStorage:
+    """Tests for storage and refresh scheduling."""
+
+    async def test_save_then_load_without_db(self):
+        from manifest import save_manifest, load_manifest, invalidate_manifest
+        etag = await save_manifest(None, "st1", {"studyId": "st1"})
+
+        assert await load_manifest(None, "st1") == ({"studyId": "st1"}, etag)
+        invalidate_manifest("st1")
+        assert await load_manifest(None, "st1") is None
+
+    async def test_refresh_is_debounced(self):
+        from manifest import schedule_manifest_refresh, load_manifest
+        client = FakeOrthanc()
+
+        async def no_pool():
+            return None
+
+        schedule_manifest_refresh(client, no_pool, "st1", delay=0.01)
+        task = schedule_manifest_refresh(client, no_pool, "st1", delay=0.01)
+        await task
+
+        assert client.calls.count("/studies/st1/instances") == 1
+        manifest, _ = await load_manifest(None, "st1")
+        assert manifest["studyId"] == "st1"
+
+
+def icc_header():
+    header = bytearray(128)
+    header[0:4] = (128).to_bytes(4, "big")
+    header[16:20] = b"RGB "
+    return bytes(header)
+
+
+class TestManifestEndpoints:
+    """Tests for the calibration, ICC and Leica endpoints reading the manifest."""
+
+    @pytest.fixture
+    def orthanc(self, fake_db):
+        orthanc = FakeOrthanc(icc=icc_header())
+        with patch("main.orthanc_client", orthanc):
+            yield orthanc
+
+    async def test_one_build_serves_every_endpoint(self, user_client, orthanc):
+        calibration = await user_client.get("/studies/st1/calibration")
+        assert calibration.json()["pixel_spacing_um"] == [0.5, 0.5]
+        built = len(orthanc.calls)
+
+        icc = await user_client.get("/studies/st1/icc-profile?include_transform=true")
+        assert icc.json()["has_icc"] is True
+        assert icc.json()["profile_info"]["color_space"] == "RGB"
+        assert "color_transform" in icc.json()
+        leica = await user_client.get("/leica-pyramid/st1")
+        assert leica.json() == {"error": "Not a Leica multi-file pyramid"}
+        assert len(orthanc.calls) == built
+
+    async def test_raw_profile_matches_etag(self, user_client, orthanc):
+        response = await user_client.get("/studies/st1/icc-profile/raw")
+        assert response.status_code == 200
+        assert response.content == icc_header()
+        assert orthanc.calls[-1] == "/instances/i0/content/0048-0105/0/0028-2000"
+        assert not any(call.endswith("/file") for call in orthanc.calls)
+
+        again = await user_client.get("/studies/st1/icc-profile/raw", headers={"If-None-Match": response.headers["etag"]})
+        assert again.status_code == 304
+
+    async def test_no_profile(self, user_client, orthanc):
+        orthanc.icc = None
+        assert (await user_client.get("/studies/st1/icc-profile")).json()["has_icc"] is False
+        assert (await user_client.get("/studies/st1/icc-profile/raw")).status_code == 404
@@ -0,0 +1,168 @@
+"""
+Unit tests for the orthanc_client.py module.
+
+Tests cover:
+- Endpoint classification
+- Pooled requests with auth and base URL
+- Per-endpoint timeouts and metrics
+- Lifespan start/close
+"""
+
+import sys
+from pathlib import Path
+
+import httpx
+import pytest
+
+# Add converter module to path
+sys.path.insert(0, str(Path(__file__).parent.parent / "converter"))
+
+
+def make_client(handler, **kwargs):
+    from orthanc_client import OrthancClient
+    return OrthancClient(
+        "http://orthanc:8042/", "admin", "secret",
+        transport=httpx.MockTransport(handler), **kwargs
+    )
+
+
+class TestClassifyEndpoint:
+    """Tests for classify_endpoint."""
+
+    def test_tile_paths(self):
+        from orthanc_client import classify_endpoint
+        assert classify_endpoint("GET", "/wsi/tiles/abc/0/1/2") == "tile"
+        assert classify_endpoint("GET", "/instances/abc/frames/1/preview") == "tile"
+
+    def test_upload_paths(self):
+        from orthanc_client import classify_endpoint
+        assert classify_endpoint("POST", "/instances") == "upload"
+        assert classify_endpoint("POST", "/dicom-web/studies") == "upload"
+        assert classify_endpoint("GET", "/dicom-web/studies?limit=10") == "dicomweb"
+
+    def test_other_paths(self):
+        from orthanc_client import classify_endpoint
+        assert classify_endpoint("GET", "/system") == "system"
+        assert classify_endpoint("GET", "/instances/abc/file") == "file"
+        assert classify_endpoint("GET", "/studies/abc") == "metadata"
+
+
+class TestOrthancClient:
+    """Tests for the OrthancClient wrapper."""
+
+    async def test_request_uses_base_url_and_auth(self):
+        seen = {}
+
+        def handler(request):
+            seen["url"] = str(request.url)
+            seen["auth"] = request.headers.get("authorization")
+            return httpx.Response(200, json={"ID": "abc"})
+
+        client = make_client(handler)
+        response = await client.get("/studies/abc")
+        await client.close()
+
+        assert response.json() == {"ID": "abc"}
+        assert seen["url"] == "http://orthanc:8042/studies/abc"
+        assert seen["auth"].startswith("Basic ")
+
+    async def test_connection_is_reused(self):
+        client = make_client(lambda request: httpx.Response(200))
+        await client.start()
+        pooled = client._client
+
+        await client.get("/studies")
+        await client.get("/series/abc")
+
+        assert client._client is pooled
+        assert client.unpooled_requests == 0
+        await client.close()
+        assert client._client is None
+
+    async def test_per_endpoint_timeouts(self):
+        timeouts = {}
+
+        def handler(request):
+            timeouts[request.url.path] = request.extensions["timeout"]["read"]
+            return httpx.Response(200)
+
+        client = make_client(handler, timeouts={"tile": httpx.Timeout(7.0)})
+        await client.get("/wsi/tiles/s/0/0/0")
+        await client.get("/system")
+        await client.get("/studies/abc", timeout=3.0)
+        await client.close()
+
+        assert timeouts["/wsi/tiles/s/0/0/0"] == 7.0
+        assert timeouts["/system"] == 5.0
+        assert timeouts["/studies/abc"] == 3.0
+
+    async def test_metrics_count_requests_and_errors(self):
+        def handler(request):
+            if request.url.path == "/system":
+                return httpx.Response(503)
+            return httpx.Response(200, content=b"tile")
+
+        client = make_client(handler)
+        await client.get("/wsi/tiles/s/0/0/0")
+        await client.get("/wsi/tiles/s/0/0/1")
+        await client.get("/system")
+        metrics = client.get_metrics()
+        await client.close()
+
+        assert metrics["endpoints"]["tile"]["requests"] == 2
+        assert metrics["endpoints"]["tile"]["errors"] == 0
+        assert metrics["endpoints"]["tile"]["bytes_received"] == 8
+        assert metrics["endpoints"]["system"]["errors"] == 1
+
+    async def test_http2_without_h2_falls_back(self, monkeypatch):
+        import builtins
+        real_import = builtins.__import__
+
+        def fake_import(name, *args, **kwargs):
+            if name == "h2":
+                raise ImportError("no h2")
+            return real_import(name, *args, **kwargs)
+
+        monkeypatch.setattr(builtins, "__import__", fake_import)
+        client = make_client(lambda request: httpx.Response(200), http2=True)
+        response = await client.get("/system")
+        await client.close()
+
+        assert response.status_code == 200
+
+
+class TestOrthancStream:
+    """Tests for streamed responses."""
+
+    async def test_body_is_relayed_in_chunks(self):
+        def handler(request):
+            assert request.headers["range"] == "bytes=0-"
+            return httpx.Response(
+                206,
+                headers={"content-type": 'multipart/related; type="application/dicom"; boundary=b1'},
+                stream=httpx.ByteStream(b"x" * 1000),
+            )
+
+        client = make_client(handler)
+        upstream = await client.stream("GET", "/dicom-web/studies/1/series/2", headers={"range": "bytes=0-"})
+        chunks = [chunk async for chunk in upstream.aiter_raw(chunk_size=300)]
+        metrics = client.get_metrics()
+        await client.close()
+
+        assert upstream.status_code == 206
+        assert "boundary=b1" in upstream.headers["content-type"]
+        assert [len(c) for c in chunks] == [300, 300, 300, 100]
+        assert metrics["endpoints"]["dicomweb"]["bytes_received"] == 1000
+
+    async def test_close_before_end_releases_upstream(self):
+        client = make_client(lambda request: httpx.Response(200, stream=httpx.ByteStream(b"y" * 100)))
+        upstream = await client.stream("GET", "/instances/abc/file")
+        async for _ in upstream.aiter_raw(chunk_size=10):
+            break
+        await upstream.aclose()
+        await upstream.aclose()
+        metrics = client.get_metrics()
+        await client.close()
+
+        assert upstream.response.is_closed
+        assert metrics["endpoints"]["file"]["requests"] == 1
@@ -0,0 +1,243 @@
+"""
+Unit tests for the orthanc_index.py module.
+
+Tests cover:
+- Index rows round-trip into the WSI metadata builder
+- Applying /changes pages (deletes, parent study resolution)
+- Lease, initial sync and sequence persistence
+- Listings and WSI metadata reading the index, with Orthanc fallback
+- Studies written by this process bypass the index until re-indexed
+"""
+
+import sys
+import asyncio
+from pathlib import Path
+from contextlib import asynccontextmanager
+from unittest.mock import AsyncMock, patch
+
+import httpx
+from httpx import AsyncClient, ASGITransport
+
+# Add converter module to path
+sys.path.insert(0, str(Path(__file__).parent.parent / "converter"))
+
+
+def volume_tags(width, frames, series_uid="1.2.3", edof="YES"):
+    return {
+        "ImageType": "ORIGINAL\\PRIMARY\\VOLUME\\NONE",
+        "SeriesInstanceUID": series_uid,
+        "Modality": "SM",
+        "Manufacturer": "Leica Biosystems",
+        "InstanceNumber": str(frames),
+        "TotalPixelMatrixColumns": str(width),
+        "TotalPixelMatrixRows": str(width // 2),
+        "Columns": "256",
+        "Rows": "256",
+        "NumberOfFrames": str(frames),
+        "ExtendedDepthOfField": edof,
+    }
+
+
+def study_instances():
+    return [
+        {"id": "i0", "seriesId": "s0", "tags": volume_tags(4096, 128)},
+        {"id": "i1", "seriesId": "s0", "tags": volume_tags(2048, 32)},
+        {"id": "lbl", "seriesId": "s1", "tags": {"ImageType": "ORIGINAL\\PRIMARY\\LABEL", "SeriesInstanceUID": "1.2.4"}},
+    ]
+
+
+class FakeConn:
+    def __init__(self, row=None, value=None):
+        self.row = row
+        self.value = value
+        self.executed = []
+
+    async def execute(self, sql, *args):
+        self.executed.append((" ".join(sql.split()), args))
+
+    async def executemany(self, sql, rows):
+        self.executed.append((" ".join(sql.split()), list(rows)))
+
+    async def fetchrow(self, sql, *args):
+        return self.row
+
+    async def fetchval(self, sql, *args):
+        return self.value
+
+    @asynccontextmanager
+    async def transaction(self):
+        yield
+
+
+class FakePool:
+    def __init__(self, conn):
+        self.conn = conn
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield self.conn
+
+
+def fake_client(routes: dict):
+    """Orthanc client whose get() serves JSON from ``routes`` (404 otherwise)"""
+    async def get(path, **kwargs):
+        request = httpx.Request("GET", f"http://orthanc{path}")
+        if path not in routes:
+            return httpx.Response(404, request=request)
+        return httpx.Response(200, json=routes[path], request=request)
+    return AsyncMock(get=AsyncMock(side_effect=get))
+
+
+def make_index(client, conn):
+    from orthanc_index import OrthancIndex
+    pool = FakePool(conn)
+
+    async def pool_getter():
+        return pool
+
+    return OrthancIndex(client, pool_getter)
+
+
+class TestRows:
+    """Tests for study_rows and instance_from_row."""
+
+    def test_rows_rebuild_the_same_metadata(self):
+        from orthanc_index import study_rows, instance_from_row
+        from wsi_metadata import build_wsi_metadata
+        study = {"ID": "st", "ParentPatient": "p", "IsStable": True, "MainDicomTags": {"StudyInstanceUID": "1.2"}}
+        study_row, series_rows, instance_rows = study_rows(study, study_instances())
+        assert study_row[0] == "st" and study_row[-1] is True
+        assert [row[0] for row in series_rows] == ["s0", "s1"]
+        assert series_rows[0][3:] == ("SM", "Leica Biosystems")
+
+        uids = {row[0]: row[2] for row in series_rows}
+        columns = (
+            "instance_id", "series_id", "study_id", "instance_number", "image_type", "total_columns",
+            "total_rows", "frame_columns", "frame_rows", "number_of_frames", "focal_planes",
+            "extended_depth_of_field",
+        )
+        rows = [{**dict(zip(columns, row)), "series_instance_uid": uids[row[1]]} for row in instance_rows]
+        rebuilt = [instance_from_row(row) for row in rows]
+        assert build_wsi_metadata("st", rebuilt) == build_wsi_metadata("st", study_instances())
+
+
+class TestConsumer:
+    """Tests for applying change pages and the consumer step."""
+
+    async def test_apply_deletes_and_resolves_parents(self):
+        client = fake_client({"/instances/new/study": {"ID": "st2"}, "/series/ser/study": {"ID": "st3"}})
+        conn = FakeConn()
+        index = make_index(client, conn)
+        index._index_studies = AsyncMock()
+        await index._apply(FakePool(conn), [
+            {"ChangeType": "NewStudy", "ResourceType": "Study", "ID": "st1"},
+            {"ChangeType": "NewSeries", "ResourceType": "Series", "ID": "ser"},
+            {"ChangeType": "NewInstance", "ResourceType": "Instance", "ID": "new"},
+            {"ChangeType": "NewInstance", "ResourceType": "Instance", "ID": "gone"},
+            {"ChangeType": "Deleted", "ResourceType": "Study", "ID": "old"},
+        ])
+        assert index._index_studies.await_args.args[1] == ["st1", "st2", "st3"]
+        assert ("DELETE FROM orthanc_studies WHERE study_id = ANY($1::text[])", (["old"],)) in conn.executed
+
+    async def test_missing_study_is_removed(self):
+        conn = FakeConn()
+        index = make_index(fake_client({}), conn)
+        await index._index_study(FakePool(conn), "gone")
+        assert conn.executed == [("DELETE FROM orthanc_studies WHERE study_id = $1", ("gone",))]
+
+    async def test_follower_does_nothing(self):
+        client = fake_client({})
+        index = make_index(client, FakeConn(row=None))
+        assert await index._step() is True
+        client.get.assert_not_awaited()
+        assert index.get_stats()["consumer"] is False
+
+    async def test_first_run_resyncs(self):
+        client = fake_client({"/changes?last": {"Last": 42}, "/studies": ["a", "b"]})
+        conn = FakeConn(row={"last_seq": None})
+        index = make_index(client, conn)
+        index._index_studies = AsyncMock()
+        assert await index._step() is False
+        assert index._index_studies.await_args.args[1] == ["a", "b"]
+        assert index.last_seq == 42
+        assert index._ready
+
+    async def test_page_is_applied_and_sequence_saved(self):
+        page = {"Changes": [{"ChangeType": "StableStudy", "ResourceType": "Study", "ID": "a"}], "Done": True, "Last": 12}
+        client = fake_client({"/changes?last": {"Last": 12}, "/changes?since=10&limit=500": page})
+        conn = FakeConn(row={"last_seq": 10})
+        index = make_index(client, conn)
+        index._index_studies = AsyncMock()
+        assert await index._step() is True
+        assert index._index_studies.await_args.args[1] == ["a"]
+        assert index.last_seq == 12
+        assert index.get_stats()["changes_applied"] == 1
+
+    async def test_sequence_reset_triggers_resync(self):
+        client = fake_client({"/changes?last": {"Last": 3}, "/studies": []})
+        index = make_index(client, FakeConn(row={"last_seq": 10}))
+        index._index_studies = AsyncMock()
+        assert await index._step() is False
+        assert index.resyncs == 1
+        assert index.last_seq == 3
+
+
+class TestReaders:
+    """Tests for the index-backed listings and WSI metadata."""
+
+    async def test_unstable_study_falls_back_to_orthanc(self):
+        from wsi_metadata import load_wsi_metadata
+        index = make_index(fake_client({}), FakeConn(value=False))
+        index._ready = True
+        assert await index.study_instances("st") is None
+
+        fetch = AsyncMock(return_value=study_instances())
+        with patch("wsi_metadata.fetch_study_instance_tags", fetch):
+            metadata = await load_wsi_metadata(None, "st", use_cache=False, index=index)
+        assert fetch.await_count == 1
+        assert metadata["width"] == 4096
+
+    async def test_stable_study_read_from_index(self):
+        from wsi_metadata import load_wsi_metadata
+        index = AsyncMock()
+        index.study_instances = AsyncMock(return_value=study_instances())
+        fetch = AsyncMock()
+        with patch("wsi_metadata.fetch_study_instance_tags", fetch):
+            metadata = await load_wsi_metadata(None, "st", use_cache=False, index=index)
+        fetch.assert_not_awaited()
+        assert len(metadata["levels"]) == 2
+
+    async def test_changed_study_bypasses_index(self):
+        conn = FakeConn()
+        index = make_index(fake_client({}), conn)
+        index._wakeup = asyncio.Event()
+        await index.mark_changed("st")
+
+        assert conn.executed == [("UPDATE orthanc_studies SET is_stable = FALSE WHERE study_id = $1", ("st",))]
+        assert index._wakeup.is_set()
+
+    async def test_upload_marks_study_changed(self):
+        import main
+        from wsi_metadata import cache_wsi_metadata, get_cached_wsi_metadata
+        cache_wsi_metadata("st", {"old": True})
+        response = httpx.Response(200, json={"ID": "i9", "ParentStudy": "st"}, request=httpx.Request("POST", "http://orthanc/instances"))
+        client = AsyncClient(transport=ASGITransport(app=main.app), base_url="http://test")
+        with patch.object(main.orthanc_client, "post", AsyncMock(return_value=response)), \
+                patch.object(main.orthanc_index, "mark_changed", AsyncMock()) as mark_changed, \
+                patch("main.schedule_manifest_refresh"):
+            async with client:
+                await client.post("/instances", content=b"DICM", headers={"Content-Type": "application/dicom"})
+        mark_changed.assert_awaited_once_with("st")
+        assert get_cached_wsi_metadata("st") is None
+
+    async def test_listing_reads_index_when_ready(self):
+        import main
+        client = AsyncClient(transport=ASGITransport(app=main.app), base_url="http://test")
+        orthanc = AsyncMock()
+        with patch.object(main.orthanc_index, "is_ready", AsyncMock(return_value=True)), \
+                patch.object(main.orthanc_index, "study_ids", AsyncMock(return_value=["a", "b"])), \
+                patch.object(main.orthanc_client, "get", orthanc):
+            async with client:
+                response = await client.get("/studies")
+        assert response.json() == ["a", "b"]
+        orthanc.assert_not_awaited()
@@ -0,0 +1,156 @@
+"""
+Unit tests for the prefetch.py module.
+
+Tests cover:
+- Pyramid geometry and level selection
+- Tile prediction from pan/zoom velocity
+- The low-priority prefetch queue
+- Per-viewer prefetch keys on the endpoint
+"""
+
+import sys
+import asyncio
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from httpx import AsyncClient, ASGITransport
+
+# Add converter module to path
+sys.path.insert(0, str(Path(__file__).parent.parent / "converter"))
+
+
+# 4096 x 2048 slide, 256px tiles, three levels
+PYRAMID = {
+    "Sizes": [[4096, 2048], [2048, 1024], [1024, 512]],
+    "TilesSizes": [[256, 256], [256, 256], [256, 256]],
+    "TilesCount": [[16, 8], [8, 4], [4, 2]],
+}
+
+
+def levels():
+    from prefetch import levels_from_pyramid
+    return levels_from_pyramid(PYRAMID)
+
+
+class TestPyramidLevels:
+    """Tests for levels_from_pyramid, choose_level and tiles_in."""
+
+    def test_downsample_and_level_choice(self):
+        from prefetch import choose_level
+        lvls = levels()
+        assert [lvl.downsample for lvl in lvls] == [1.0, 2.0, 4.0]
+        assert choose_level(lvls, 0.5) == 0
+        assert choose_level(lvls, 3.0) == 1
+        assert choose_level(lvls, 100) == 2
+
+    def test_tiles_clipped_to_level(self):
+        from prefetch import tiles_in
+        assert tiles_in(levels()[1], -600, -600, 1000, 1000) == [(0, 0)]
+        assert tiles_in(levels()[0], 4000, 0, 500, 10) == [(15, 0)]
+
+
+class TestPredictTiles:
+    """Tests for predict_tiles."""
+
+    def test_pan_right_predicts_tiles_ahead(self):
+        from prefetch import predict_tiles
+        tiles = predict_tiles(levels(), 0, (0, 0, 512, 256), velocity=(1024, 0), zoom_velocity=0)
+        current = [t for t in tiles if t[0] == 0]
+
+        # Visible tiles (x 0-2) are skipped, the nearest ones come first
+        assert current[0] == (0, 3, 0)
+        assert all(x > 2 for _, x, _ in current)
+        assert max(x for _, x, _ in current) == 6
+
+    def test_idle_viewport_only_warms_coarser_level(self):
+        from prefetch import predict_tiles
+        assert predict_tiles(levels(), 0, (0, 0, 512, 256)) == [(1, 0, 0), (1, 1, 0)]
+
+    def test_zoom_in_targets_finer_level(self):
+        from prefetch import predict_tiles
+        tiles = predict_tiles(levels(), 1, (1024, 512, 1024, 512), zoom_velocity=1.0)
+        assert tiles and all(lvl == 0 for lvl, _, _ in tiles)
+
+    def test_max_tiles(self):
+        from prefetch import predict_tiles
+        tiles = predict_tiles(levels(), 0, (0, 0, 1024, 1024), velocity=(4000, 2000), max_tiles=5)
+        assert len(tiles) == 5
+
+
+class TestTilePrefetcher:
+    """Tests for TilePrefetcher."""
+
+    async def test_newer_prediction_supersedes_older(self):
+        from prefetch import TilePrefetcher
+        prefetcher = TilePrefetcher(warm=None)
+        prefetcher.submit("u:s", [("s", 0, 0, 0), ("s", 0, 1, 0)])
+        prefetcher.submit("u:s", [("s", 0, 5, 0)])
+
+        assert prefetcher.pending == 1
+        assert prefetcher.stats["superseded"] == 2
+
+    async def test_overflow_is_dropped(self):
+        from prefetch import TilePrefetcher
+        prefetcher = TilePrefetcher(warm=None, max_pending=3)
+        assert prefetcher.submit("a", [("s", 0, i, 0) for i in range(2)]) == 2
+        assert prefetcher.submit("b", [("s", 0, i, 1) for i in range(2)]) == 1
+        assert prefetcher.stats["dropped"] == 1
+
+    async def test_workers_warm_round_robin_and_wait_when_busy(self):
+        from prefetch import TilePrefetcher
+        warmed = []
+        busy = [True]
+
+        async def warm(tile):
+            warmed.append(tile)
+            return tile[2] != 9
+
+        def is_busy():
+            # Busy on the first check only
+            was, busy[0] = busy[0], False
+            return was
+
+        prefetcher = TilePrefetcher(warm=warm, busy=is_busy, concurrency=1)
+        prefetcher.submit("a", [("s", 0, 0, 0), ("s", 0, 1, 0)])
+        prefetcher.submit("b", [("s", 0, 9, 0)])
+        prefetcher.start()
+        for _ in range(50):
+            if len(warmed) == 3:
+                break
+            await asyncio.sleep(0.01)
+        await prefetcher.stop()
+
+        assert warmed == [("s", 0, 0, 0), ("s", 0, 9, 0), ("s", 0, 1, 0)]
+        assert prefetcher.stats["warmed"] == 2
+        assert prefetcher.stats["already_cached"] == 1
+        assert prefetcher.stats["busy_waits"] == 1
+
+
+class TestPrefetchEndpoint:
+    """Tests for POST /studies/{id}/prefetch."""
+
+    async def submit_keys(self, bodies):
+        import main
+        main.app.dependency_overrides[main.get_current_user] = lambda: None
+        submit = MagicMock(return_value=1)
+        body = {"series_id": "s", "viewport": {"x": 0, "y": 0, "width": 1024, "height": 512}}
+        try:
+            with patch.object(main.settings, "prefetch_enabled", True), \
+                    patch("main.can_access_study", AsyncMock(return_value=True)), \
+                    patch("main.lookup_series_study", AsyncMock(return_value="st")), \
+                    patch.object(main.pyramid_cache, "get", AsyncMock(return_value=levels())), \
+                    patch.object(main.tile_prefetcher, "submit", submit):
+                async with AsyncClient(transport=ASGITransport(app=main.app), base_url="http://test") as client:
+                    for extra in bodies:
+                        response = await client.post("/studies/st/prefetch", json={**body, **extra})
+                        assert response.status_code == 202
+        finally:
+            main.app.dependency_overrides.clear()
+        return [call.args[0] for call in submit.call_args_list]
+
+    async def test_anonymous_viewers_do_not_share_a_queue(self):
+        keys = await self.submit_keys([{"viewer_id": "tab-1"}, {"viewer_id": "tab-2"}, {}])
+        assert keys[0] != keys[1]
+        assert keys[0].endswith(":tab-1:s")
+        # Without an id the client address separates viewers
+        assert keys[2] == "None:127.0.0.1:s"
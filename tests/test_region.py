@@ -0,0 +1,202 @@
+"""
+Unit tests for the region.py module.
+
+Tests cover:
+- Mapping level-0 rectangles onto pyramid levels
+- Stitching tiles into a region, whole and in bands
+- Streamed PNG and tiled TIFF output
+- The /studies/{id}/region endpoint
+"""
+
+import io
+import sys
+from pathlib import Path
+from unittest.mock import AsyncMock, patch
+
+import numpy as np
+import pytest
+from httpx import AsyncClient, ASGITransport
+
+# Add converter module to path
+sys.path.insert(0, str(Path(__file__).parent.parent / "converter"))
+
+TILE = 256
+WIDTH, HEIGHT = 1000, 700
+
+
+def make_slide() -> np.ndarray:
+    rng = np.random.default_rng(0)
+    return (rng.random((HEIGHT, WIDTH, 3)) * 255).astype(np.uint8)
+
+
+def make_levels():
+    from prefetch import PyramidLevel
+    return [
+        PyramidLevel(WIDTH, HEIGHT, TILE, TILE, 4, 3, 1.0),
+        PyramidLevel(WIDTH // 2, HEIGHT // 2, TILE, TILE, 2, 2, 2.0),
+    ]
+
+
+def tile_fetcher(slide: np.ndarray):
+    """fetch(tile_x, tile_y) serving level-0 PNG tiles of ``slide``, padded like Orthanc's"""
+    from PIL import Image
+
+    async def fetch(tile_x, tile_y):
+        tile = np.zeros((TILE, TILE, 3), dtype=np.uint8)
+        part = slide[tile_y * TILE:(tile_y + 1) * TILE, tile_x * TILE:(tile_x + 1) * TILE]
+        tile[:part.shape[0], :part.shape[1]] = part
+        out = io.BytesIO()
+        Image.fromarray(tile).save(out, "PNG")
+        return out.getvalue(), "image/png"
+
+    return fetch
+
+
+async def collect(chunks) -> bytes:
+    return b"".join([chunk async for chunk in chunks])
+
+
+def decode(data: bytes) -> np.ndarray:
+    from PIL import Image
+    return np.asarray(Image.open(io.BytesIO(data)).convert("RGB"))
+
+
+class TestPlanRegion:
+    """Tests for plan_region and level_for_mpp."""
+
+    def test_region_is_clipped_to_the_image(self):
+        from region import plan_region
+        plan = plan_region(make_levels(), 0, 900, 600, 500, 500)
+        assert (plan.x, plan.y, plan.width, plan.height) == (900, 600, 100, 100)
+        assert list(plan.tile_columns()) == [3]
+        assert list(plan.tile_rows()) == [2]
+
+    def test_coarser_level_scales_the_rectangle(self):
+        from region import plan_region
+        plan = plan_region(make_levels(), 1, 100, 50, 301, 200)
+        assert (plan.x, plan.y, plan.width, plan.height) == (50, 25, 151, 100)
+
+    def test_outside_or_bad_level_rejected(self):
+        from region import plan_region
+        with pytest.raises(ValueError):
+            plan_region(make_levels(), 0, 5000, 0, 10, 10)
+        with pytest.raises(ValueError):
+            plan_region(make_levels(), 5, 0, 0, 10, 10)
+
+    def test_mpp_picks_coarsest_sufficient_level(self):
+        from region import level_for_mpp
+        assert level_for_mpp(make_levels(), 0.25, 0.25) == 0
+        assert level_for_mpp(make_levels(), 0.25, 0.4) == 0
+        assert level_for_mpp(make_levels(), 0.25, 0.5) == 1
+
+
+class TestStitching:
+    """Tests for stitch_region, iter_bands and the streamed encoders."""
+
+    async def test_stitch_matches_slide(self):
+        from region import plan_region, stitch_region
+        slide = make_slide()
+        plan = plan_region(make_levels(), 0, 100, 50, 800, 600)
+        region = await stitch_region(plan, tile_fetcher(slide))
+        assert np.array_equal(region, slide[50:650, 100:900])
+
+    async def test_missing_tiles_are_background(self):
+        from region import plan_region, stitch_region, BACKGROUND
+        plan = plan_region(make_levels(), 0, 0, 0, 300, 300)
+        region = await stitch_region(plan, AsyncMock(return_value=None))
+        assert (region == BACKGROUND).all()
+
+    async def test_bands_have_fixed_height(self):
+        from region import plan_region, iter_bands
+        slide = make_slide()
+        plan = plan_region(make_levels(), 0, 0, 10, WIDTH, 650)
+        heights = []
+        rows = []
+        async for band in iter_bands(plan, tile_fetcher(slide), 100):
+            heights.append(band.shape[0])
+            rows.append(band.copy())
+        assert heights == [100] * 6 + [50]
+        assert np.array_equal(np.concatenate(rows), slide[10:660])
+
+    async def test_png_stream_decodes_to_region(self):
+        from PIL import Image
+        from region import plan_region, iter_bands, png_stream
+        slide = make_slide()
+        plan = plan_region(make_levels(), 0, 100, 50, 800, 600)
+        data = await collect(png_stream(plan.width, plan.height, iter_bands(plan, tile_fetcher(slide), 64), 0.25))
+        assert np.array_equal(decode(data), slide[50:650, 100:900])
+        assert round(Image.open(io.BytesIO(data)).info["dpi"][0]) == 101600
+
+    async def test_tiff_stream_is_tiled_and_exact(self):
+        from PIL import Image
+        from region import plan_region, iter_bands, tiff_stream, tiff_size, TIFF_TILE_SIZE
+        slide = make_slide()
+        plan = plan_region(make_levels(), 0, 100, 50, 800, 600)
+        data = await collect(tiff_stream(
+            plan.width, plan.height, iter_bands(plan, tile_fetcher(slide), TIFF_TILE_SIZE), 0.25
+        ))
+        assert len(data) == tiff_size(plan.width, plan.height)
+        image = Image.open(io.BytesIO(data))
+        assert image.tile[0].extents == (0, 0, TIFF_TILE_SIZE, TIFF_TILE_SIZE)
+        assert np.array_equal(decode(data), slide[50:650, 100:900])
+
+
+class TestRegionEndpoint:
+    """Tests for GET /studies/{id}/region."""
+
+    @pytest.fixture
+    def client(self):
+        import main
+        main.app.dependency_overrides[main.require_user] = lambda: main.User(id=1, auth0_id="a", email="a@b.c")
+        yield AsyncClient(transport=ASGITransport(app=main.app), base_url="http://test")
+        main.app.dependency_overrides.clear()
+
+    def patches(self, slide):
+        import main
+        fetch = tile_fetcher(slide)
+
+        async def fetch_wsi_tile(series_id, level, x, y):
+            return await fetch(x, y)
+
+        return (
+            patch("main.can_access_study", AsyncMock(return_value=True)),
+            patch("main.resolve_region_source", AsyncMock(return_value=("abc", 0.25))),
+            patch.object(main.pyramid_cache, "get", AsyncMock(return_value=make_levels())),
+            patch.object(main, "fetch_wsi_tile", fetch_wsi_tile),
+        )
+
+    async def test_buffered_png_region(self, client):
+        slide = make_slide()
+        p1, p2, p3, p4 = self.patches(slide)
+        with p1, p2, p3, p4:
+            async with client:
+                response = await client.get("/studies/s/region?x=100&y=50&w=800&h=600")
+        assert response.status_code == 200
+        assert response.headers["x-region-level"] == "0"
+        assert response.headers["x-region-mpp"] == "0.25"
+        assert np.array_equal(decode(response.content), slide[50:650, 100:900])
+
+    async def test_large_region_is_streamed(self, client):
+        import main
+        slide = make_slide()
+        p1, p2, p3, p4 = self.patches(slide)
+        with p1, p2, p3, p4, patch.object(main.settings, "region_buffer_max_pixels", 1000):
+            async with client:
+                response = await client.get("/studies/s/region?x=0&y=0&w=1000&h=700&format=tiff")
+                jpeg = await client.get("/studies/s/region?x=0&y=0&w=1000&h=700&format=jpeg")
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "image/tiff"
+        assert np.array_equal(decode(response.content), slide)
+        assert jpeg.status_code == 400
+
+    async def test_invalid_requests_rejected(self, client):
+        slide = make_slide()
+        p1, p2, p3, p4 = self.patches(slide)
+        with p1, p2, p3, p4:
+            async with client:
+                both = await client.get("/studies/s/region?x=0&y=0&w=10&h=10&level=0&mpp=0.5")
+                outside = await client.get("/studies/s/region?x=5000&y=0&w=10&h=10")
+                bad_format = await client.get("/studies/s/region?x=0&y=0&w=10&h=10&format=gif")
+        assert both.status_code == 400
+        assert outside.status_code == 400
+        assert bad_format.status_code == 400
@@ -0,0 +1,154 @@
+"""
+Unit tests for the stow_upload.py module.
+
+Tests cover:
+- Batch planning
+- Streamed multipart/related bodies
+- STOW-RS upload, study lookup and progress reporting
+- Retries and per-file /instances fallback
+"""
+
+import sys
+from pathlib import Path
+
+import httpx
+import pytest
+
+# Add converter module to path
+sys.path.insert(0, str(Path(__file__).parent.parent / "converter"))
+
+
+STUDY_UID = "1.2.826.0.1.3680043.1"
+
+STOW_OK = {"00081190": {"vr": "UR", "Value": [f"http://orthanc/dicom-web/studies/{STUDY_UID}"]}}
+
+
+def write_files(tmp_path, sizes):
+    paths = []
+    for i, size in enumerate(sizes):
+        path = tmp_path / f"level_{i}.dcm"
+        path.write_bytes(bytes([i]) * size)
+        paths.append(path)
+    return paths
+
+
+def make_client(handler):
+    from orthanc_client import OrthancClient
+    return OrthancClient("http://orthanc", "u", "p", transport=httpx.MockTransport(handler))
+
+
+def split_parts(request: httpx.Request) -> list[bytes]:
+    boundary = request.headers["content-type"].split("boundary=")[1]
+    body = request.content
+    parts = body.split(f"--{boundary}".encode())[1:-1]
+    return [p.split(b"\r\n\r\n", 1)[1][:-2] for p in parts]
+
+
+class TestPlanBatches:
+    """Tests for plan_batches."""
+
+    def test_groups_by_size(self):
+        from stow_upload import plan_batches
+        files = [(Path("a"), 40), (Path("b"), 40), (Path("c"), 40), (Path("d"), 500)]
+        batches = plan_batches(files, 100)
+        assert [[p.name for p, _ in b] for b in batches] == [["a", "b"], ["c"], ["d"]]
+
+    def test_zero_disables_batching(self):
+        from stow_upload import plan_batches
+        files = [(Path("a"), 1), (Path("b"), 1)]
+        assert len(plan_batches(files, 0)) == 2
+
+
+class TestMultipartRelated:
+    """Tests for the streamed multipart body."""
+
+    async def test_content_length_matches_body(self, tmp_path):
+        from stow_upload import multipart_related
+        paths = write_files(tmp_path, [10, 20_000])
+        counter = [0]
+        body, length, content_type = multipart_related(
+            [(p, p.stat().st_size) for p in paths], counter
+        )
+        data = b"".join([chunk async for chunk in body])
+
+        assert len(data) == length
+        assert counter[0] == 20_010
+        assert content_type.startswith('multipart/related; type="application/dicom"')
+
+
+class TestStowUploader:
+    """Tests for StowUploader."""
+
+    async def test_batched_stow_and_lookup(self, tmp_path):
+        from stow_upload import StowUploader
+        seen = []
+
+        def handler(request):
+            if request.url.path == "/dicom-web/studies":
+                seen.append(split_parts(request))
+                return httpx.Response(200, json=STOW_OK)
+            if request.url.path == "/tools/lookup":
+                assert request.content.decode() == STUDY_UID
+                return httpx.Response(200, json=[{"ID": "orthanc-study", "Type": "Study"}])
+            return httpx.Response(404)
+
+        paths = write_files(tmp_path, [100, 100, 300])
+        reports = []
+        uploader = StowUploader(make_client(handler), concurrency=2, batch_bytes=250)
+        result = await uploader.upload(paths, on_progress=lambda p: reports.append(p.files_done))
+
+        assert result["study_id"] == "orthanc-study"
+        assert result["files"] == 3
+        assert result["bytes"] == 500
+        assert sorted(len(parts) for parts in seen) == [1, 2]
+        assert bytes([2]) * 300 in [part for parts in seen for part in parts]
+        assert reports[-1] == 3
+
+    async def test_retries_server_errors(self, tmp_path):
+        from stow_upload import StowUploader
+        calls = []
+
+        def handler(request):
+            if request.url.path == "/dicom-web/studies":
+                calls.append(1)
+                if len(calls) == 1:
+                    return httpx.Response(503)
+                return httpx.Response(200, json=STOW_OK)
+            return httpx.Response(200, json=[{"ID": "s", "Type": "Study"}])
+
+        uploader = StowUploader(make_client(handler), retry_delay=0)
+        result = await uploader.upload(write_files(tmp_path, [50]))
+
+        assert len(calls) == 2
+        assert result["retries"] == 1
+        assert result["bytes"] == 50
+
+    async def test_falls_back_to_instances(self, tmp_path):
+        from stow_upload import StowUploader
+        stored = []
+
+        def handler(request):
+            if request.url.path == "/dicom-web/studies":
+                return httpx.Response(415, text="Unsupported Media Type")
+            if request.url.path == "/instances":
+                stored.append(request.content)
+                return httpx.Response(200, json={"ID": "i", "ParentStudy": "rest-study"})
+            return httpx.Response(404)
+
+        uploader = StowUploader(make_client(handler), retry_delay=0)
+        result = await uploader.upload(write_files(tmp_path, [10, 20]))
+
+        assert result["study_id"] == "rest-study"
+        assert result["fallbacks"] == 1
+        assert sorted(len(body) for body in stored) == [10, 20]
+
+    async def test_gives_up_after_max_attempts(self, tmp_path):
+        from stow_upload import StowUploader
+
+        def handler(request):
+            return httpx.Response(500, text="disk full")
+
+        uploader = StowUploader(make_client(handler), batch_bytes=0, max_attempts=2, retry_delay=0)
+
+        with pytest.raises(Exception, match="level_0.dcm failed: Orthanc returned 500: disk full"):
+            await uploader.upload(write_files(tmp_path, [10]))
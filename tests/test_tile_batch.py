@@ -0,0 +1,122 @@
+"""
+Unit tests for the tile_batch.py module.
+
+Tests cover:
+- Tile pack encoding/decoding
+- Concurrent fetches with per-tile failures
+- The POST /studies/{id}/tiles:batch endpoint
+"""
+
+import sys
+import asyncio
+from pathlib import Path
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from httpx import AsyncClient, ASGITransport
+
+# Add converter module to path
+sys.path.insert(0, str(Path(__file__).parent.parent / "converter"))
+
+
+class TestTilePack:
+    """Tests for pack_tiles and unpack_tiles."""
+
+    def test_round_trip_keeps_order_and_status(self):
+        from tile_batch import pack_tiles, unpack_tiles
+        packed = pack_tiles([(b"jpeg", "image/jpeg"), None, RuntimeError("boom"), (b"", "image/png")])
+
+        assert unpack_tiles(packed) == [
+            (200, "image/jpeg", b"jpeg"),
+            (404, None, b""),
+            (502, None, b""),
+            (200, "image/png", b""),
+        ]
+
+    def test_truncated_pack_rejected(self):
+        from tile_batch import pack_tiles, unpack_tiles
+        with pytest.raises(ValueError, match="trailing"):
+            unpack_tiles(pack_tiles([(b"abc", "image/jpeg")]) + b"x")
+
+
+class TestFetchTiles:
+    """Tests for fetch_tiles."""
+
+    async def test_concurrency_is_bounded_and_order_kept(self):
+        from tile_batch import fetch_tiles
+        in_flight = 0
+        peak = 0
+
+        async def fetch(key):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01 * (5 - key))
+            in_flight -= 1
+            return bytes([key]), "image/jpeg"
+
+        results = await fetch_tiles(range(5), fetch, concurrency=2)
+
+        assert [r[0] for r in results] == [bytes([i]) for i in range(5)]
+        assert peak == 2
+
+    async def test_failure_is_isolated(self):
+        from tile_batch import fetch_tiles
+
+        async def fetch(key):
+            if key == 1:
+                raise RuntimeError("orthanc down")
+            return None if key == 2 else (b"t", "image/jpeg")
+
+        results = await fetch_tiles([0, 1, 2], fetch)
+
+        assert results[0] == (b"t", "image/jpeg")
+        assert isinstance(results[1], RuntimeError)
+        assert results[2] is None
+
+
+class TestTileBatchEndpoint:
+    """Tests for POST /studies/{id}/tiles:batch."""
+
+    @pytest.fixture
+    def client(self):
+        from main import app
+        yield AsyncClient(transport=ASGITransport(app=app), base_url="http://test")
+
+    async def test_batch_returns_pack_in_request_order(self, client):
+        import main
+        from tile_batch import TILE_PACK_MEDIA_TYPE, unpack_tiles
+
+        async def fetch_wsi_tile(series_id, level, x, y):
+            return None if x == 9 else (f"{level}/{x}/{y}".encode(), "image/jpeg")
+
+        with patch("main.can_access_study", AsyncMock(return_value=True)), \
+                patch("main.lookup_series_study", AsyncMock(return_value="study")), \
+                patch.object(main, "fetch_wsi_tile", fetch_wsi_tile):
+            async with client:
+                response = await client.post("/studies/study/tiles:batch", json={
+                    "series_id": "ser",
+                    "tiles": [{"level": 2, "x": 0, "y": 1}, {"level": 2, "x": 9, "y": 0}],
+                })
+
+        assert response.status_code == 200
+        assert response.headers["content-type"] == TILE_PACK_MEDIA_TYPE
+        assert unpack_tiles(response.content) == [(200, "image/jpeg", b"2/0/1"), (404, None, b"")]
+
+    async def test_series_from_other_study_rejected(self, client):
+        with patch("main.can_access_study", AsyncMock(return_value=True)), \
+                patch("main.lookup_series_study", AsyncMock(return_value="other")):
+            async with client:
+                response = await client.post("/studies/study/tiles:batch", json={
+                    "series_id": "ser", "tiles": [{"level": 0, "x": 0, "y": 0}],
+                })
+
+        assert response.status_code == 404
+
+    async def test_batch_size_is_limited(self, client):
+        import main
+        tiles = [{"level": 0, "x": i, "y": 0} for i in range(main.settings.tile_batch_max_tiles + 1)]
+        async with client:
+            response = await client.post("/studies/study/tiles:batch", json={"series_id": "ser", "tiles": tiles})
+
+        assert response.status_code == 400
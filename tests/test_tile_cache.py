@@ -0,0 +1,262 @@
+"""
+Unit tests for the tile_cache.py module.
+
+Tests cover:
+- Byte-bounded LRU eviction and TTL expiry
+- Two-tier lookups (memory, Redis)
+- Single-flight fetches (including cancelled callers)
+- Series invalidation
+- Prefetch warming and hit accounting
+"""
+
+import sys
+import asyncio
+from pathlib import Path
+
+import pytest
+
+# Add converter module to path
+sys.path.insert(0, str(Path(__file__).parent.parent / "converter"))
+
+
+class FakeRedis:
+    """Minimal async Redis stand-in."""
+
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, ex=None):
+        self.data[key] = value
+
+    async def delete(self, *keys):
+        return sum(1 for k in keys if self.data.pop(k, None) is not None)
+
+    async def scan_iter(self, match=None, count=None):
+        prefix = match.rstrip("*")
+        for key in list(self.data):
+            if key.startswith(prefix):
+                yield key
+
+    async def aclose(self):
+        pass
+
+
+def make_cache(max_bytes=1024, redis=None):
+    from tile_cache import TileCache
+    cache = TileCache(max_memory_bytes=max_bytes, memory_ttl=60, redis_url="redis://fake" if redis else None)
+    cache._redis = redis
+    return cache
+
+
+class TestByteLRUCache:
+    """Tests for ByteLRUCache."""
+
+    def test_evicts_least_recently_used_by_size(self):
+        from tile_cache import ByteLRUCache
+        cache = ByteLRUCache(max_bytes=10, ttl=60)
+        cache.set("a", b"1234", "image/jpeg")
+        cache.set("b", b"1234", "image/jpeg")
+        cache.get("a")  # a is now most recent
+        cache.set("c", b"1234", "image/jpeg")
+
+        assert cache.get("b") is None
+        assert cache.get("a") == (b"1234", "image/jpeg")
+        assert cache.current_bytes == 8
+        assert cache.evictions == 1
+
+    def test_expired_entries_are_dropped(self, monkeypatch):
+        import tile_cache
+        cache = tile_cache.ByteLRUCache(max_bytes=100, ttl=10)
+        monkeypatch.setattr(tile_cache.time, "monotonic", lambda: 1000.0)
+        cache.set("a", b"x", "image/jpeg")
+        monkeypatch.setattr(tile_cache.time, "monotonic", lambda: 1011.0)
+
+        assert cache.get("a") is None
+        assert cache.current_bytes == 0
+
+    def test_oversized_entry_is_not_stored(self):
+        from tile_cache import ByteLRUCache
+        cache = ByteLRUCache(max_bytes=4, ttl=60)
+        cache.set("a", b"too large", "image/jpeg")
+        assert len(cache) == 0
+
+
+class TestTileCache:
+    """Tests for TileCache."""
+
+    def test_tile_key(self):
+        from tile_cache import tile_key
+        assert tile_key("s1", 2, 3, 4) == "tile:s1:2:3:4:native"
+        assert tile_key("s1", 2, 3, 4, "webp") == "tile:s1:2:3:4:webp"
+
+    async def test_fetch_then_memory_hit(self):
+        cache = make_cache()
+        calls = 0
+
+        async def fetch():
+            nonlocal calls
+            calls += 1
+            return b"jpeg", "image/jpeg"
+
+        assert await cache.get_or_fetch("k", fetch) == (b"jpeg", "image/jpeg")
+        assert await cache.get_or_fetch("k", fetch) == (b"jpeg", "image/jpeg")
+        assert calls == 1
+        assert cache.stats["memory_hits"] == 1
+        assert cache.stats["misses"] == 1
+
+    async def test_redis_hit_populates_memory(self):
+        redis = FakeRedis()
+        redis.data["k"] = b"image/png\0png-bytes"
+        cache = make_cache(redis=redis)
+
+        assert await cache.get("k") == (b"png-bytes", "image/png")
+        assert cache.stats["redis_hits"] == 1
+        assert cache.memory.get("k") == (b"png-bytes", "image/png")
+
+    async def test_set_writes_both_tiers(self):
+        redis = FakeRedis()
+        cache = make_cache(redis=redis)
+        await cache.set("k", b"data", "image/jpeg")
+        assert redis.data["k"] == b"image/jpeg\0data"
+
+    async def test_single_flight(self):
+        cache = make_cache()
+        calls = 0
+
+        async def fetch():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return b"tile", "image/jpeg"
+
+        results = await asyncio.gather(*[cache.get_or_fetch("k", fetch) for _ in range(5)])
+        assert calls == 1
+        assert all(r == (b"tile", "image/jpeg") for r in results)
+        assert cache.stats["coalesced"] == 4
+
+    async def test_missing_tiles_not_cached(self):
+        cache = make_cache()
+
+        async def fetch():
+            return None
+
+        assert await cache.get_or_fetch("k", fetch) is None
+        assert len(cache.memory) == 0
+
+    async def test_fetch_error_propagates_to_waiters(self):
+        cache = make_cache()
+
+        async def fetch():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("orthanc down")
+
+        results = await asyncio.gather(
+            cache.get_or_fetch("k", fetch), cache.get_or_fetch("k", fetch), return_exceptions=True
+        )
+        assert all(isinstance(r, RuntimeError) for r in results)
+        assert "k" not in cache._inflight
+
+    async def test_cancelled_leader_does_not_fail_waiters(self):
+        cache = make_cache()
+        release = asyncio.Event()
+
+        async def fetch():
+            await release.wait()
+            return b"tile", "image/jpeg"
+
+        leader = asyncio.create_task(cache.get_or_fetch("k", fetch))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(cache.get_or_fetch("k", fetch))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        release.set()
+
+        assert await waiter == (b"tile", "image/jpeg")
+        assert leader.cancelled()
+        assert await cache.get("k") == (b"tile", "image/jpeg")
+        assert "k" not in cache._inflight
+
+    async def test_fetch_cancelled_when_nobody_waits(self):
+        cache = make_cache()
+        started, stopped = asyncio.Event(), asyncio.Event()
+
+        async def fetch():
+            started.set()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                stopped.set()
+                raise
+
+        leader = asyncio.create_task(cache.get_or_fetch("k", fetch))
+        await started.wait()
+        leader.cancel()
+        await asyncio.wait_for(stopped.wait(), 1)
+        await asyncio.sleep(0)
+        assert "k" not in cache._inflight
+
+    async def test_invalidate_series(self):
+        from tile_cache import tile_key
+        redis = FakeRedis()
+        cache = make_cache(redis=redis)
+        await cache.set(tile_key("s1", 0, 0, 0), b"a", "image/jpeg")
+        await cache.set(tile_key("s1", 1, 0, 0), b"b", "image/jpeg")
+        await cache.set(tile_key("s2", 0, 0, 0), b"c", "image/jpeg")
+
+        removed = await cache.invalidate_series("s1")
+
+        assert removed == 4  # two memory + two Redis entries
+        assert await cache.get(tile_key("s1", 0, 0, 0)) is None
+        assert await cache.get(tile_key("s2", 0, 0, 0)) == (b"c", "image/jpeg")
+
+    async def test_redis_failure_falls_back_to_memory(self):
+        class BrokenRedis(FakeRedis):
+            async def get(self, key):
+                raise ConnectionError("refused")
+
+        cache = make_cache(redis=BrokenRedis())
+        assert await cache.get("k") is None
+        assert cache.stats["redis_errors"] == 1
+        # Redis is skipped until the retry window passes
+        assert cache._get_redis() is None
+
+    async def test_warm_counts_prefetch_hits_not_lookups(self):
+        cache = make_cache()
+
+        async def fetch():
+            return b"jpeg", "image/jpeg"
+
+        assert await cache.warm("k", fetch) is True
+        assert await cache.warm("k", fetch) is False
+        assert cache.stats["misses"] == 0
+
+        assert await cache.get_or_fetch("k", fetch) == (b"jpeg", "image/jpeg")
+        assert await cache.get("k") == (b"jpeg", "image/jpeg")
+        stats = cache.get_stats()
+        assert stats["prefetched"] == 1
+        assert stats["prefetch_hits"] == 1
+        assert stats["prefetch_hit_rate"] == 1.0
+
+    async def test_request_during_warm_is_coalesced(self):
+        cache = make_cache()
+        release = asyncio.Event()
+
+        async def slow_fetch():
+            await release.wait()
+            return b"jpeg", "image/jpeg"
+
+        warm = asyncio.create_task(cache.warm("k", slow_fetch))
+        await asyncio.sleep(0)
+        assert cache.interactive_inflight() == 0
+        get = asyncio.create_task(cache.get_or_fetch("k", slow_fetch))
+        await asyncio.sleep(0)
+        release.set()
+
+        assert await get == (b"jpeg", "image/jpeg")
+        assert await warm is True
+        assert cache.stats["coalesced"] == 1
+        assert cache.stats["prefetch_hits"] == 1
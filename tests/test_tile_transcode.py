@@ -0,0 +1,116 @@
+"""
+Unit tests for the tile_transcode.py module.
+
+Tests cover:
+- Quality hints and Accept negotiation per policy
+- Pillow transcoding on the thread pool
+- Transcoded tiles served and cached through the WSI proxy
+"""
+
+import io
+import sys
+from pathlib import Path
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from httpx import AsyncClient, ASGITransport
+
+# Add converter module to path
+sys.path.insert(0, str(Path(__file__).parent.parent / "converter"))
+
+BROWSER_ACCEPT = "image/avif,image/webp,image/apng,image/*,*/*;q=0.8"
+ALL_FORMATS = {"jpeg", "webp", "avif"}
+
+
+def make_jpeg(quality=95) -> bytes:
+    from PIL import Image
+    import numpy as np
+    rng = np.random.default_rng(0)
+    pixels = (rng.random((256, 256, 3)) * 64 + 96).astype("uint8")
+    out = io.BytesIO()
+    Image.fromarray(pixels).save(out, "JPEG", quality=quality)
+    return out.getvalue()
+
+
+class TestNegotiate:
+    """Tests for parse_quality and negotiate."""
+
+    @pytest.mark.parametrize("hint,expected", [
+        ("low", 50), ("HIGH", 85), ("60", 60), ("0", None), ("101", None), ("best", None), (None, None),
+    ])
+    def test_parse_quality(self, hint, expected):
+        from tile_transcode import parse_quality
+        assert parse_quality(hint) == expected
+
+    def test_off_policy_never_transcodes(self):
+        from tile_transcode import negotiate
+        assert negotiate(BROWSER_ACCEPT, "low", "off", formats=ALL_FORMATS) is None
+
+    def test_balanced_needs_a_hint(self):
+        from tile_transcode import negotiate, TileFormat
+        assert negotiate(BROWSER_ACCEPT, None, "balanced", formats=ALL_FORMATS) is None
+        assert negotiate(BROWSER_ACCEPT, "medium", "balanced", formats=ALL_FORMATS) == TileFormat("webp", 70)
+        assert negotiate(BROWSER_ACCEPT, None, "balanced", save_data=True, formats=ALL_FORMATS) == TileFormat("webp", 50)
+
+    def test_bandwidth_prefers_avif(self):
+        from tile_transcode import negotiate, TileFormat
+        assert negotiate(BROWSER_ACCEPT, None, "bandwidth", default_quality=60, formats=ALL_FORMATS) == TileFormat("avif", 60)
+        assert negotiate("image/webp", None, "bandwidth", formats={"jpeg", "webp"}).name == "webp"
+
+    def test_jpeg_only_with_explicit_request(self):
+        from tile_transcode import negotiate, TileFormat
+        assert negotiate("image/jpeg", None, "bandwidth", formats=ALL_FORMATS) is None
+        assert negotiate("image/jpeg", "low", "bandwidth", formats=ALL_FORMATS) == TileFormat("jpeg", 50)
+
+
+class TestTileTranscoder:
+    """Tests for TileTranscoder."""
+
+    async def test_webp_is_smaller_and_decodable(self):
+        from PIL import Image
+        from tile_transcode import TileTranscoder, TileFormat
+        transcoder = TileTranscoder(workers=1)
+        if "webp" not in transcoder.formats:
+            pytest.skip("Pillow built without WebP")
+        source = make_jpeg()
+
+        webp = await transcoder.transcode(source, TileFormat("webp", 50))
+        transcoder.close()
+
+        assert Image.open(io.BytesIO(webp)).format == "WEBP"
+        assert len(webp) < len(source)
+        stats = transcoder.get_stats()
+        assert stats["transcoded"] == 1
+        assert 0 < stats["size_ratio"] < 1
+
+    def test_unknown_policy_rejected(self):
+        from tile_transcode import TileTranscoder
+        with pytest.raises(ValueError):
+            TileTranscoder(policy="fast")
+
+
+class TestTranscodedTileEndpoint:
+    """Tests for negotiated tiles through the WSI proxy."""
+
+    async def test_quality_hint_serves_cached_transcode(self):
+        import main
+        from tile_transcode import TileFormat
+        main.tile_cache.memory.clear()
+        native = AsyncMock(return_value=(make_jpeg(), "image/jpeg"))
+        fmt = TileFormat("jpeg", 50)
+        client = AsyncClient(transport=ASGITransport(app=main.app), base_url="http://test")
+
+        with patch("main.can_access_study", AsyncMock(return_value=True)), \
+                patch("main.extract_study_id_from_wsi_path", AsyncMock(return_value="study")), \
+                patch.object(main, "fetch_tile_from_orthanc", native), \
+                patch.object(main.tile_transcoder, "negotiate", return_value=fmt):
+            async with client:
+                first = await client.get("/wsi/tiles/abc/0/1/2?_=1&quality=low")
+                second = await client.get("/wsi/tiles/abc/0/1/2?_=2&quality=low")
+
+        assert first.status_code == 200
+        assert first.headers["content-type"] == "image/jpeg"
+        assert first.content == second.content
+        assert len(first.content) < len(native.return_value[0])
+        assert "Accept" in first.headers["vary"]
+        assert native.await_count == 1
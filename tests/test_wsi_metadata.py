@@ -0,0 +1,160 @@
+"""
+Unit tests for the wsi_metadata.py module.
+
+Tests cover:
+- Pyramid / focal plane / label / macro classification
+- Bulk tag fetch and per-instance fallback
+- Per-study metadata cache
+"""
+
+import sys
+import asyncio
+from pathlib import Path
+
+import httpx
+import pytest
+
+# Add converter module to path
+sys.path.insert(0, str(Path(__file__).parent.parent / "converter"))
+
+
+def volume_tags(series_uid, width, frames=16, edof="NO", number=1):
+    return {
+        "SeriesInstanceUID": series_uid,
+        "ImageType": "DERIVED\\PRIMARY\\VOLUME\\NONE",
+        "TotalPixelMatrixColumns": str(width),
+        "TotalPixelMatrixRows": str(width // 2),
+        "Columns": "256",
+        "Rows": "256",
+        "NumberOfFrames": str(frames),
+        "ExtendedDepthOfField": edof,
+        "InstanceNumber": str(number),
+    }
+
+
+STUDY_INSTANCES = {
+    "i-main-0": ("s-main", volume_tags("1.2.main", 4096, edof="YES")),
+    "i-main-1": ("s-main", volume_tags("1.2.main", 1024, edof="YES")),
+    "i-z2": ("s-z2", volume_tags("1.2.z2", 4096, number=2)),
+    "i-z1": ("s-z1", volume_tags("1.2.z1", 4096, number=1)),
+    "i-label": ("s-main", {"ImageType": "ORIGINAL\\PRIMARY\\LABEL\\NONE",
+                           "TotalPixelMatrixColumns": "500", "TotalPixelMatrixRows": "300"}),
+    "i-macro": ("s-main", {"ImageType": "ORIGINAL\\PRIMARY\\OVERVIEW\\NONE",
+                           "TotalPixelMatrixColumns": "800", "TotalPixelMatrixRows": "400"}),
+}
+
+
+class FakeOrthanc:
+    """Async stand-in for OrthancClient serving STUDY_INSTANCES."""
+
+    def __init__(self, bulk=True):
+        self.bulk = bulk
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def get(self, path):
+        self.calls.append(path)
+        request = httpx.Request("GET", f"http://orthanc{path}")
+        if path == "/studies/st1/instances":
+            body = [{"ID": iid, "ParentSeries": sid} for iid, (sid, _) in STUDY_INSTANCES.items()]
+            return httpx.Response(200, json=body, request=request)
+        if path.startswith("/studies/st1/instances-tags"):
+            if not self.bulk:
+                return httpx.Response(404, request=request)
+            body = {iid: tags for iid, (_, tags) in STUDY_INSTANCES.items()}
+            return httpx.Response(200, json=body, request=request)
+        if path.endswith("/simplified-tags"):
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            await asyncio.sleep(0.001)
+            self.in_flight -= 1
+            iid = path.split("/")[2]
+            return httpx.Response(200, json=STUDY_INSTANCES[iid][1], request=request)
+        return httpx.Response(404, request=request)
+
+
+@pytest.fixture(autouse=True)
+def clear_metadata_cache():
+    import wsi_metadata
+    wsi_metadata.invalidate_wsi_metadata()
+    yield
+    wsi_metadata.invalidate_wsi_metadata()
+
+
+class TestBuildWsiMetadata:
+    """Tests for build_wsi_metadata classification."""
+
+    def test_classifies_pyramid_focal_planes_label_macro(self):
+        from wsi_metadata import build_wsi_metadata
+        instances = [{"id": iid, "seriesId": sid, "tags": tags} for iid, (sid, tags) in STUDY_INSTANCES.items()]
+
+        metadata = build_wsi_metadata("st1", instances)
+
+        assert metadata["instanceId"] == "i-main-0"
+        assert [lvl["instanceId"] for lvl in metadata["levels"]] == ["i-main-0", "i-main-1"]
+        assert metadata["tilesX"] == 16 and metadata["tilesY"] == 8
+        assert metadata["extendedDepthOfField"] is True
+        assert [fp["instanceId"] for fp in metadata["focalPlanes"]] == ["i-z1", "i-z2"]
+        assert metadata["labelInstance"]["instanceId"] == "i-label"
+        assert metadata["macroInstance"]["instanceId"] == "i-macro"
+
+    def test_without_edof_uses_largest_series(self):
+        from wsi_metadata import build_wsi_metadata
+        instances = [
+            {"id": "a0", "tags": volume_tags("1.a", 2048)},
+            {"id": "a1", "tags": volume_tags("1.a", 512)},
+            {"id": "b0", "tags": volume_tags("1.b", 2048, number=2)},
+        ]
+
+        metadata = build_wsi_metadata("st", instances)
+
+        assert metadata["instanceId"] == "a0"
+        assert [fp["seriesUID"] for fp in metadata["focalPlanes"]] == ["1.b"]
+
+    def test_no_volume_instances(self):
+        from wsi_metadata import build_wsi_metadata
+        tags = {"ImageType": "ORIGINAL\\PRIMARY\\LABEL", "NumberOfFrames": "1"}
+        assert build_wsi_metadata("st", [{"id": "x", "tags": tags}]) is None
+
+
+class TestLoadWsiMetadata:
+    """Tests for fetching and caching."""
+
+    async def test_bulk_endpoint_is_two_requests(self):
+        from wsi_metadata import load_wsi_metadata
+        client = FakeOrthanc(bulk=True)
+
+        metadata = await load_wsi_metadata(client, "st1")
+
+        assert metadata["instanceId"] == "i-main-0"
+        assert len(client.calls) == 2
+
+    async def test_fallback_is_bounded_concurrent(self):
+        from wsi_metadata import fetch_study_instance_tags
+        client = FakeOrthanc(bulk=False)
+
+        instances = await fetch_study_instance_tags(client, "st1", concurrency=2)
+
+        assert len(instances) == len(STUDY_INSTANCES)
+        assert 1 <= client.max_in_flight <= 2
+        assert instances[0]["seriesId"] == "s-main"
+
+    async def test_cached_until_invalidated(self):
+        from wsi_metadata import load_wsi_metadata, invalidate_wsi_metadata
+        client = FakeOrthanc()
+
+        await load_wsi_metadata(client, "st1")
+        await load_wsi_metadata(client, "st1")
+        assert len(client.calls) == 2
+
+        invalidate_wsi_metadata("st1")
+        await load_wsi_metadata(client, "st1")
+        assert len(client.calls) == 4
+
+    async def test_missing_study_raises(self):
+        from wsi_metadata import load_wsi_metadata
+        client = FakeOrthanc()
+
+        with pytest.raises(httpx.HTTPStatusError):
+            await load_wsi_metadata(client, "unknown")
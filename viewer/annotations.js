@@ -14,6 +14,16 @@ class AnnotationManager {
         this.studyId = null;
         this.initialized = false;
         
+        // Slides with more annotations than this load only what intersects the
+        // viewport (plus a margin), re-queried as the view moves
+        this.viewportQueryThreshold = 2000;
+        this.viewportMaxAnnotations = 20000;
+        this.viewportMargin = 0.5;
+        this.viewportMode = false;
+        this._loadedBox = null;
+        this._loadedLod = 1;
+        this._viewportRequest = 0;
+        
         // Auth function for API calls (optional, set via setAuthFunction)
         this.authFetch = options.authFetch || null;
         
@@ -32,6 +42,7 @@ class AnnotationManager {
         this._onMouseUp = this.onMouseUp.bind(this);
         this._onDblClick = this.onDblClick.bind(this);
         this._onAnimation = () => this.render();
+        this._onViewportChanged = () => this.loadViewportAnnotations();
         this._onResize = () => this.resizeCanvas();
         
         // Styles
@@ -76,6 +87,7 @@ class AnnotationManager {
         // Bind viewport events for redrawing
         this.viewer.addHandler('animation', this._onAnimation);
         this.viewer.addHandler('animation-finish', this._onAnimation);
+        this.viewer.addHandler('animation-finish', this._onViewportChanged);
         this.viewer.addHandler('resize', this._onResize);
         
         // Initial resize
@@ -99,6 +111,9 @@ class AnnotationManager {
         this.isDrawing = false;
         this.currentTool = null;
         this.studyId = null;
+        this.viewportMode = false;
+        this._loadedBox = null;
+        this._viewportRequest++;
         
         // Remove event handlers from canvas
         if (this.canvas) {
@@ -117,6 +132,7 @@ class AnnotationManager {
         if (this.viewer) {
             this.viewer.removeHandler('animation', this._onAnimation);
             this.viewer.removeHandler('animation-finish', this._onAnimation);
+            this.viewer.removeHandler('animation-finish', this._onViewportChanged);
             this.viewer.removeHandler('resize', this._onResize);
         }
         
@@ -368,11 +384,22 @@ class AnnotationManager {
     async loadAnnotations(studyId) {
         this.studyId = studyId;
         this.annotations = [];
+        this.viewportMode = false;
+        this._loadedBox = null;
         
         try {
-            const response = await this._fetch(`/api/studies/${studyId}/annotations`);
+            const response = await this._fetch(
+                `/api/studies/${studyId}/annotations?limit=${this.viewportQueryThreshold}`
+            );
             if (response.ok) {
                 const data = await response.json();
+                if (data.truncated) {
+                    // Too many to load up front: switch to viewport queries
+                    console.log(`More than ${this.viewportQueryThreshold} annotations, loading by viewport`);
+                    this.viewportMode = true;
+                    await this.loadViewportAnnotations();
+                    return;
+                }
                 this.annotations = data.annotations || [];
                 console.log(`Loaded ${this.annotations.length} annotations`);
                 this.render();
@@ -387,6 +414,71 @@ class AnnotationManager {
         }
     }
     
+    // Image-pixel rectangle of the current view, grown by viewportMargin on each side
+    _viewportImageBox() {
+        const bounds = this.viewer.viewport.viewportToImageRectangle(this.viewer.viewport.getBounds(true));
+        const mx = bounds.width * this.viewportMargin;
+        const my = bounds.height * this.viewportMargin;
+        return {
+            x0: Math.floor(bounds.x - mx),
+            y0: Math.floor(bounds.y - my),
+            x1: Math.ceil(bounds.x + bounds.width + mx),
+            y1: Math.ceil(bounds.y + bounds.height + my)
+        };
+    }
+    
+    // Image pixels per screen pixel, floored to the server's 2x simplification
+    // steps (1 = full detail)
+    _viewportLod() {
+        const zoom = this.viewer.viewport.viewportToImageZoom(this.viewer.viewport.getZoom(true));
+        if (!(zoom > 0) || zoom >= 0.5) return 1;
+        return Math.pow(2, Math.floor(Math.log2(1 / zoom)));
+    }
+    
+    // Viewport mode: fetch the annotations intersecting the (padded) view,
+    // simplified for the current magnification; skipped while the view stays
+    // inside the last loaded box at the same level of detail
+    async loadViewportAnnotations() {
+        if (!this.viewportMode || !this.studyId || !this.viewer.world.getItemCount()) return;
+        
+        const view = this.viewer.viewport.viewportToImageRectangle(this.viewer.viewport.getBounds(true));
+        const lod = this._viewportLod();
+        const loaded = this._loadedBox;
+        if (loaded && lod === this._loadedLod && view.x >= loaded.x0 && view.y >= loaded.y0 &&
+            view.x + view.width <= loaded.x1 && view.y + view.height <= loaded.y1) {
+            return;
+        }
+        
+        const box = this._viewportImageBox();
+        const studyId = this.studyId;
+        const request = ++this._viewportRequest;
+        try {
+            const bbox = `${box.x0},${box.y0},${box.x1},${box.y1}`;
+            const simplify = lod > 1 ? `&simplify=${lod}` : '';
+            const response = await this._fetch(
+                `/api/studies/${studyId}/annotations?bbox=${bbox}&limit=${this.viewportMaxAnnotations}${simplify}`
+            );
+            if (!response.ok) {
+                console.warn('Failed to load viewport annotations:', response.status, response.statusText);
+                return;
+            }
+            const data = await response.json();
+            // A newer viewport (or another slide) superseded this request
+            if (request !== this._viewportRequest || studyId !== this.studyId) return;
+            
+            this.annotations = data.annotations || [];
+            // A truncated box is incomplete: re-query on the next move
+            this._loadedBox = data.truncated ? null : box;
+            this._loadedLod = lod;
+            this.render();
+            if (typeof updateAnnotationsList === 'function') {
+                updateAnnotationsList();
+            }
+        } catch (e) {
+            console.warn('Failed to load viewport annotations:', e);
+        }
+    }
+    
     // Save annotation
     async saveAnnotation(annotation) {
         if (!this.studyId) return null;
@@ -9,7 +9,7 @@ class ColorCorrectionFilter {
         this.viewer = viewer;
         this.enabled = false;
         this.iccEnabled = false;
-        this.iccMode = null; // 'webgl' | 'css' | null
+        this.iccMode = null; // 'server' | 'webgl' | 'css' | null
         
         // Manual color correction parameters (user-controlled, independent of ICC)
         this.params = {
@@ -366,7 +366,8 @@ class ColorCorrectionFilter {
     
     // Load and apply ICC profile
     async loadICCProfile(studyId) {
-        if (!this.webglReady) {
+        // Server-side correction needs no WebGL
+        if (!this.webglReady && !this._tileSourceSupportsServerICC()) {
             console.warn('WebGL not available for ICC transform');
             return false;
         }
@@ -407,6 +408,15 @@ class ColorCorrectionFilter {
         this.iccEnabled = true;
         this.enabled = true;
 
+        // Prefer exact server-side correction (per-series 3D LUT applied to the tiles)
+        if (this._setServerICC(true)) {
+            this.iccMode = 'server';
+            this.iccGamma = 1.0;
+            this.updateFilterStyles();
+            console.log('ICC color correction enabled (server LUT mode)');
+            return true;
+        }
+
         // Use CSS filter mode - WebGL overlay has compatibility issues with OpenSeadragon canvas
         this.iccMode = 'css';
 
@@ -430,7 +440,27 @@ class ColorCorrectionFilter {
         return true;
     }
     
+    _tileSourceSupportsServerICC() {
+        const source = this.viewer?.world?.getItemAt(0)?.source;
+        return !!source && 'iccCorrected' in source;
+    }
+
+    // Switch the tile source to server-corrected tiles and reload the visible tiles
+    _setServerICC(enabled) {
+        const item = this.viewer?.world?.getItemAt(0);
+        if (!item || !this._tileSourceSupportsServerICC()) return false;
+        if (item.source.iccCorrected !== enabled) {
+            item.source.iccCorrected = enabled;
+            item.reset();
+            this.viewer.forceRedraw();
+        }
+        return true;
+    }
+
     disableICC() {
+        if (this.iccMode === 'server') {
+            this._setServerICC(false);
+        }
         this.iccEnabled = false;
         this.iccMode = null;
 
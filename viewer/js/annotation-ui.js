@@ -79,8 +79,11 @@ function toggleExportMenu() {
 }
 
 /**
- * Export annotations in JSON or GeoJSON format
+ * Export annotations (json, geojson, ndjson, qupath or asap).
+ * The server streams the file; it is saved as received without parsing.
  */
+const EXPORT_EXTENSIONS = { json: 'json', geojson: 'geojson', ndjson: 'ndjson', qupath: 'geojson', asap: 'xml' };
+
 async function exportAnnotations(format = 'json') {
     if (!currentStudy) {
         alert('No study loaded');
@@ -96,21 +99,19 @@ async function exportAnnotations(format = 'json') {
             throw new Error(`Export failed: ${response.status} - ${errorText}`);
         }
         
-        const data = await response.json();
-        
         // Create downloadable file
-        const blob = new Blob([JSON.stringify(data, null, 2)], { type: 'application/json' });
+        const blob = await response.blob();
         const url = URL.createObjectURL(blob);
         
         const a = document.createElement('a');
         a.href = url;
-        a.download = `annotations_${currentStudy.slice(0, 8)}_${new Date().toISOString().slice(0, 10)}.${format === 'geojson' ? 'geojson' : 'json'}`;
+        a.download = `annotations_${currentStudy.slice(0, 8)}_${new Date().toISOString().slice(0, 10)}${format === 'qupath' ? '_qupath' : ''}.${EXPORT_EXTENSIONS[format] || 'json'}`;
         document.body.appendChild(a);
         a.click();
         document.body.removeChild(a);
         URL.revokeObjectURL(url);
         
-        console.log(`Exported ${data.count || data.features?.length || 0} annotations as ${format}`);
+        console.log(`Exported annotations as ${format} (${blob.size} bytes)`);
     } catch (e) {
         console.error('Export error:', e);
         alert('Failed to export annotations: ' + e.message);
@@ -148,45 +149,38 @@ async function importAnnotationsFile(event) {
     }
     
     try {
-        const text = await file.text();
-        const data = JSON.parse(text);
-        
-        let annotations = [];
-        if (data.type === 'FeatureCollection' && data.features) {
-            annotations = data.features.map(feature => ({
-                type: feature.properties?.annotation_type || feature.geometry?.type || 'unknown',
-                tool: feature.properties?.tool || feature.geometry?.type?.toLowerCase() || 'unknown',
-                geometry: feature.geometry,
-                properties: feature.properties || {}
-            }));
-        } else if (data.annotations) {
-            annotations = data.annotations;
-        } else if (Array.isArray(data)) {
-            annotations = data;
+        // GeoJSON goes up as-is; PathView JSON exports and plain arrays as NDJSON.
+        // Either way one bulk request, streamed and COPYed server-side.
+        let body = file;
+        let contentType = 'application/geo+json';
+        if (!/\.(ndjson|jsonl)$/i.test(file.name)) {
+            const data = JSON.parse(await file.text());
+            if (!(data.type === 'FeatureCollection' && data.features)) {
+                const annotations = data.annotations || (Array.isArray(data) ? data : []);
+                if (annotations.length === 0) {
+                    alert('No annotations found in file');
+                    return;
+                }
+                body = annotations.map(ann => JSON.stringify(ann)).join('\n');
+                contentType = 'application/x-ndjson';
+            }
+        } else {
+            contentType = 'application/x-ndjson';
         }
         
-        if (annotations.length === 0) {
-            alert('No annotations found in file');
-            return;
+        const response = await authFetch(`/api/studies/${currentStudy}/annotations:bulk?skip_invalid=true`, {
+            method: 'POST',
+            headers: { 'Content-Type': contentType },
+            body
+        });
+        if (!response.ok) {
+            const error = await response.json().catch(() => ({}));
+            throw new Error(typeof error.detail === 'string' ? error.detail : response.statusText);
         }
-        
-        let imported = 0;
-        for (const ann of annotations) {
-            try {
-                const response = await authFetch(`/api/studies/${currentStudy}/annotations`, {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({
-                        type: ann.type || 'region',
-                        tool: ann.tool || 'rectangle',
-                        geometry: ann.geometry,
-                        properties: ann.properties || {}
-                    })
-                });
-                if (response.ok) imported++;
-            } catch (e) {
-                console.warn('Failed to import annotation:', e);
-            }
+        const result = await response.json();
+        const imported = result.imported;
+        if (result.errors.length) {
+            console.warn('Skipped invalid annotations:', result.errors);
         }
         
         if (annotationManager) {
@@ -194,7 +188,7 @@ async function importAnnotationsFile(event) {
         }
         updateAnnotationsList();
         
-        alert(`Imported ${imported} of ${annotations.length} annotations`);
+        alert(`Imported ${imported} of ${imported + result.skipped} annotations`);
         console.log(`Imported ${imported} annotations from ${file.name}`);
         
     } catch (e) {
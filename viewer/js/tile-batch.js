@@ -0,0 +1,196 @@
+/**
+ * Batched tile loading for OpenSeadragon
+ *
+ * Instead of one HTTP request per tile, tile requests issued within a few
+ * milliseconds of each other (i.e. the whole visible viewport) are sent as
+ * one POST /api/studies/{id}/tiles:batch. Auth, the access check and the
+ * proxy overhead are then paid once per viewport instead of once per tile.
+ *
+ * The response is a tile pack (see converter/tile_batch.py):
+ *   uint32 header length | JSON header [{status, type, length}, ...] | payloads
+ *
+ * Usage:
+ *   enableTileBatching(tileSource, { studyId, seriesId, headers });
+ *
+ * The tile source must implement getTileBatchKey(level, x, y), returning
+ * { level, x, y[, instance, frame, icc] } or null to load that tile the usual way.
+ * Requires OpenSeadragon >= 4.1 (TileSource.downloadTileStart).
+ * Disable with localStorage.setItem('PATHVIEW_TILE_BATCH', 'off').
+ */
+
+(function() {
+    'use strict';
+
+    const TILE_PACK_MEDIA_TYPE = 'application/vnd.pathview.tile-pack';
+    // Must not exceed the converter's TILE_BATCH_MAX_TILES
+    const DEFAULT_MAX_TILES = 64;
+    const DEFAULT_FLUSH_DELAY_MS = 4;
+
+    /**
+     * Decode a tile pack into [{ status, type, data }] in request order
+     */
+    function unpackTiles(buffer) {
+        const view = new DataView(buffer);
+        const headerLength = view.getUint32(0);
+        const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 4, headerLength)));
+        let offset = 4 + headerLength;
+        return header.map(entry => {
+            const data = new Uint8Array(buffer, offset, entry.length);
+            offset += entry.length;
+            return { status: entry.status, type: entry.type, data };
+        });
+    }
+
+    /**
+     * Hand a decoded tile to OpenSeadragon (same result as the default image job)
+     */
+    function deliverTile(context, tile) {
+        if (context.userData.tileBatchAborted) return;
+        if (tile.status !== 200) {
+            context.finish(null, null, `Tile unavailable (${tile.status})`);
+            return;
+        }
+        const url = URL.createObjectURL(new Blob([tile.data], { type: tile.type }));
+        const image = new Image();
+        image.onload = () => {
+            URL.revokeObjectURL(url);
+            context.finish(image, null);
+        };
+        image.onerror = () => {
+            URL.revokeObjectURL(url);
+            context.finish(null, null, 'Tile decode failed');
+        };
+        image.src = url;
+    }
+
+    class TileBatchLoader {
+        constructor(options) {
+            this.studyId = options.studyId;
+            this.seriesId = options.seriesId;
+            this.headers = options.headers || {};
+            this.maxTiles = options.maxTiles || DEFAULT_MAX_TILES;
+            this.flushDelayMs = options.flushDelayMs ?? DEFAULT_FLUSH_DELAY_MS;
+            this.pending = [];
+            this.timer = null;
+            this.stats = { batches: 0, tiles: 0, failures: 0 };
+        }
+
+        setHeaders(headers) {
+            this.headers = headers || {};
+        }
+
+        /**
+         * Queue a tile; the queue is flushed after a short delay or once full
+         */
+        request(key, context) {
+            this.pending.push({ key, context });
+            if (this.pending.length >= this.maxTiles) {
+                this.flush();
+            } else if (!this.timer) {
+                this.timer = setTimeout(() => this.flush(), this.flushDelayMs);
+            }
+        }
+
+        /**
+         * Drop a queued tile, or mark an in-flight one so its result is ignored
+         */
+        abort(context) {
+            context.userData.tileBatchAborted = true;
+            this.pending = this.pending.filter(job => job.context !== context);
+        }
+
+        async flush() {
+            clearTimeout(this.timer);
+            this.timer = null;
+            const jobs = this.pending.splice(0, this.maxTiles);
+            if (this.pending.length) {
+                this.timer = setTimeout(() => this.flush(), 0);
+            }
+            if (!jobs.length) return;
+
+            this.stats.batches++;
+            this.stats.tiles += jobs.length;
+            try {
+                const response = await fetch(`/api/studies/${this.studyId}/tiles:batch`, {
+                    method: 'POST',
+                    headers: {
+                        ...this.headers,
+                        'Content-Type': 'application/json',
+                        'Accept': `${TILE_PACK_MEDIA_TYPE}, image/jpeg, image/png, image/webp`
+                    },
+                    body: JSON.stringify({
+                        series_id: this.seriesId,
+                        tiles: jobs.map(job => job.key)
+                    })
+                });
+                if (!response.ok) {
+                    throw new Error(`Tile batch failed: ${response.status}`);
+                }
+                const tiles = unpackTiles(await response.arrayBuffer());
+                tiles.forEach((tile, i) => deliverTile(jobs[i].context, tile));
+            } catch (e) {
+                this.stats.failures++;
+                console.warn('🧩 [tile-batch]', e.message || e);
+                for (const job of jobs) {
+                    if (!job.context.userData.tileBatchAborted) {
+                        job.context.finish(null, null, e.message || String(e));
+                    }
+                }
+            }
+        }
+    }
+
+    function tileBatchingEnabled() {
+        if (typeof OpenSeadragon === 'undefined' ||
+            typeof OpenSeadragon.TileSource.prototype.downloadTileStart !== 'function') {
+            return false;
+        }
+        try {
+            return localStorage.getItem('PATHVIEW_TILE_BATCH') !== 'off';
+        } catch (e) {
+            return true;
+        }
+    }
+
+    /**
+     * Route a tile source's tile downloads through a TileBatchLoader
+     */
+    function enableTileBatching(tileSource, options) {
+        if (!tileBatchingEnabled() || typeof tileSource.getTileBatchKey !== 'function') {
+            return null;
+        }
+        const loader = new TileBatchLoader(options);
+        const base = OpenSeadragon.TileSource.prototype;
+        tileSource.tileBatchLoader = loader;
+        tileSource.downloadTileStart = function(context) {
+            const tile = context.tile;
+            const key = tile ? this.getTileBatchKey(tile.level, tile.x, tile.y) : null;
+            if (!key) {
+                return base.downloadTileStart.call(this, context);
+            }
+            context.userData.tileBatched = true;
+            loader.request(key, context);
+        };
+        tileSource.downloadTileAbort = function(context) {
+            if (context.userData.tileBatched) {
+                loader.abort(context);
+            } else {
+                base.downloadTileAbort.call(this, context);
+            }
+        };
+        return loader;
+    }
+
+    // Export to global scope
+    if (typeof window !== 'undefined') {
+        window.TileBatchLoader = TileBatchLoader;
+        window.enableTileBatching = enableTileBatching;
+        window.tileBatchingEnabled = tileBatchingEnabled;
+        window.unpackTiles = unpackTiles;
+    }
+
+    // Export for module systems
+    if (typeof module !== 'undefined' && module.exports) {
+        module.exports = { TileBatchLoader, enableTileBatching, tileBatchingEnabled, unpackTiles };
+    }
+})();
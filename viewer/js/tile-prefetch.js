@@ -0,0 +1,167 @@
+/**
+ * Predictive viewport prefetch
+ *
+ * While the slide is moving (mouse drag, SpaceMouse, keyboard, zoom), the
+ * viewport position, scale and pan/zoom velocity are reported to
+ * POST /api/studies/{id}/prefetch. The converter warms its tile cache for
+ * where the viewport is heading, so tiles that scroll into view during a
+ * fast pan are already cached instead of showing blank.
+ *
+ * Usage:
+ *   attachViewportPrefetch(viewer, { studyId, seriesId, headers });
+ *
+ * Disable with localStorage.setItem('PATHVIEW_PREFETCH', 'off').
+ */
+
+(function() {
+    'use strict';
+
+    // At most one prefetch report per interval while moving
+    const REPORT_INTERVAL_MS = 200;
+    // Velocity smoothing (exponential moving average weight of a new sample)
+    const SMOOTHING = 0.5;
+    // Ignore motion slower than this share of the viewport per second
+    const MIN_PAN_FRACTION = 0.05;
+    // ... or zoom slower than this many pyramid levels per second
+    const MIN_ZOOM_VELOCITY = 0.1;
+
+    // Identifies this viewer to the converter, so each tab's newer prediction
+    // replaces only its own older one (anonymous viewers share a user id)
+    function newViewerId() {
+        if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+        return Math.random().toString(36).slice(2) + Date.now().toString(36);
+    }
+
+    function prefetchEnabled() {
+        try {
+            return localStorage.getItem('PATHVIEW_PREFETCH') !== 'off';
+        } catch (e) {
+            return true;
+        }
+    }
+
+    class ViewportPrefetcher {
+        constructor(viewer, options) {
+            this.viewer = viewer;
+            this.studyId = options.studyId;
+            this.seriesId = options.seriesId;
+            this.headers = options.headers || {};
+            this.viewerId = newViewerId();
+            this.last = null;
+            this.velocity = { x: 0, y: 0, zoom: 0 };
+            this.lastReport = 0;
+            this.inFlight = false;
+            this.stats = { reports: 0, queued: 0, failures: 0 };
+            this._onAnimation = () => this.sample();
+            this._onAnimationFinish = () => this.reset();
+            viewer.addHandler('animation', this._onAnimation);
+            viewer.addHandler('animation-finish', this._onAnimationFinish);
+        }
+
+        setHeaders(headers) {
+            this.headers = headers || {};
+        }
+
+        detach() {
+            this.viewer.removeHandler('animation', this._onAnimation);
+            this.viewer.removeHandler('animation-finish', this._onAnimationFinish);
+        }
+
+        reset() {
+            this.last = null;
+            this.velocity = { x: 0, y: 0, zoom: 0 };
+        }
+
+        /**
+         * Current viewport in full-resolution image pixels
+         */
+        currentViewport() {
+            const item = this.viewer.world.getItemAt(0);
+            if (!item) return null;
+            const rect = item.viewportToImageRectangle(this.viewer.viewport.getBounds(true));
+            const containerWidth = this.viewer.viewport.getContainerSize().x || 1;
+            return {
+                x: rect.x, y: rect.y, width: rect.width, height: rect.height,
+                scale: rect.width / containerWidth
+            };
+        }
+
+        sample() {
+            const now = performance.now();
+            const viewport = this.currentViewport();
+            if (!viewport) return;
+
+            if (this.last) {
+                const dt = (now - this.last.time) / 1000;
+                if (dt > 0) {
+                    const vx = (viewport.x + viewport.width / 2 - this.last.cx) / dt;
+                    const vy = (viewport.y + viewport.height / 2 - this.last.cy) / dt;
+                    // Scale halves per level zoomed in
+                    const vz = -Math.log2(viewport.scale / this.last.scale) / dt;
+                    this.velocity.x += SMOOTHING * (vx - this.velocity.x);
+                    this.velocity.y += SMOOTHING * (vy - this.velocity.y);
+                    this.velocity.zoom += SMOOTHING * (vz - this.velocity.zoom);
+                }
+            }
+            this.last = {
+                time: now,
+                cx: viewport.x + viewport.width / 2,
+                cy: viewport.y + viewport.height / 2,
+                scale: viewport.scale
+            };
+
+            const panSpeed = Math.hypot(this.velocity.x, this.velocity.y) / Math.max(viewport.width, 1);
+            const moving = panSpeed >= MIN_PAN_FRACTION || Math.abs(this.velocity.zoom) >= MIN_ZOOM_VELOCITY;
+            if (moving && !this.inFlight && now - this.lastReport >= REPORT_INTERVAL_MS) {
+                this.lastReport = now;
+                this.report(viewport);
+            }
+        }
+
+        async report(viewport) {
+            this.inFlight = true;
+            this.stats.reports++;
+            try {
+                const response = await fetch(`/api/studies/${this.studyId}/prefetch`, {
+                    method: 'POST',
+                    headers: { ...this.headers, 'Content-Type': 'application/json' },
+                    body: JSON.stringify({
+                        series_id: this.seriesId,
+                        viewer_id: this.viewerId,
+                        viewport: { x: viewport.x, y: viewport.y, width: viewport.width, height: viewport.height },
+                        velocity: { x: this.velocity.x, y: this.velocity.y },
+                        scale: viewport.scale,
+                        zoom_velocity: this.velocity.zoom
+                    })
+                });
+                if (response.ok) {
+                    const result = await response.json();
+                    this.stats.queued += result.queued || 0;
+                } else {
+                    this.stats.failures++;
+                }
+            } catch (e) {
+                // Prefetch is best-effort
+                this.stats.failures++;
+            } finally {
+                this.inFlight = false;
+            }
+        }
+    }
+
+    function attachViewportPrefetch(viewer, options) {
+        if (!viewer || !prefetchEnabled()) return null;
+        return new ViewportPrefetcher(viewer, options);
+    }
+
+    // Export to global scope
+    if (typeof window !== 'undefined') {
+        window.ViewportPrefetcher = ViewportPrefetcher;
+        window.attachViewportPrefetch = attachViewportPrefetch;
+    }
+
+    // Export for module systems
+    if (typeof module !== 'undefined' && module.exports) {
+        module.exports = { ViewportPrefetcher, attachViewportPrefetch };
+    }
+})();
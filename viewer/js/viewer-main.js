@@ -317,6 +317,8 @@ async function loadStudy(studyId) {
                 // Focal plane support - stores instance IDs per pyramid level
                 this.focalPlaneLevels = options.focalPlaneLevels || null;
                 this.currentFocalPlaneLevels = null;  // Active focal plane levels (null = main pyramid)
+                // Server-side ICC correction of tiles (toggled by color-correction.js)
+                this.iccCorrected = false;
             };
             OpenSeadragon.WsiTileSource.prototype = Object.create(OpenSeadragon.TileSource.prototype);
             OpenSeadragon.WsiTileSource.prototype.constructor = OpenSeadragon.WsiTileSource;
@@ -355,7 +357,19 @@ async function loadStudy(studyId) {
                     const top = y * wsi.tileHeight;
                     return `/wsi/instances/${instanceId}/frames/1/rendered?left=${left}&top=${top}&width=${wsi.tileWidth}&height=${wsi.tileHeight}&_=${this.sessionId}`;
                 }
-                return `/wsi/tiles/${this.wsiSeriesId}/${wsi.wsiIndex}/${x}/${y}?_=${this.sessionId}`;
+                return `/wsi/tiles/${this.wsiSeriesId}/${wsi.wsiIndex}/${x}/${y}?_=${this.sessionId}${this.iccCorrected ? '&icc=1' : ''}`;
+            };
+            // Key for /tiles:batch (see tile-batch.js); null = load this tile via getTileUrl
+            OpenSeadragon.WsiTileSource.prototype.getTileBatchKey = function(level, x, y) {
+                const wsi = this.wsiLevels[level];
+                if (!wsi || x < 0 || y < 0 || x >= wsi.tilesX || y >= wsi.tilesY) return null;
+                if (this.currentFocalPlaneLevels && this.currentFocalPlaneLevels[level]) {
+                    const fpLevel = this.currentFocalPlaneLevels[level];
+                    const frame = y * Math.ceil(fpLevel.width / wsi.tileWidth) + x;
+                    return { level: wsi.wsiIndex, x, y, instance: fpLevel.instanceId, frame };
+                }
+                if (this.pyramid?.IsVirtualPyramid) return null;
+                return { level: wsi.wsiIndex, x, y, icc: !!this.iccCorrected };
             };
         }
         
@@ -399,6 +413,11 @@ async function loadStudy(studyId) {
             // ignore
         }
 
+        // One /tiles:batch request per viewport instead of one request per tile
+        const tileBatchLoader = typeof enableTileBatching === 'function'
+            ? enableTileBatching(wsiTileSource, { studyId, seriesId, headers: tileAuthHeaders })
+            : null;
+
         viewer = OpenSeadragon({
             id: 'osd-viewer',
             prefixUrl: 'https://cdn.jsdelivr.net/npm/openseadragon@4.1/build/openseadragon/images/',
@@ -418,7 +437,8 @@ async function loadStudy(studyId) {
             maxZoomPixelRatio: 4,
             minZoomImageRatio: 0.5,
             immediateRender: true,
-            imageLoaderLimit: 12,
+            // Batched tiles share a request, so let a whole viewport be in flight
+            imageLoaderLimit: tileBatchLoader ? 64 : 12,
             tileSources: wsiTileSource,
             crossOriginPolicy: false,  // Don't set crossOrigin, we're using ajax with auth
             loadTilesWithAjax: true,
@@ -427,6 +447,11 @@ async function loadStudy(studyId) {
             preload: true,
         });
 
+        // Warm the converter's tile cache ahead of pans/zooms
+        if (typeof attachViewportPrefetch === 'function') {
+            attachViewportPrefetch(viewer, { studyId, seriesId, headers: tileAuthHeaders });
+        }
+
         viewer.addHandler('zoom', (e) => {
             const zoomEl = document.getElementById('zoom-level');
             if (zoomEl) zoomEl.textContent = e.zoom.toFixed(1) + 'x';
@@ -696,7 +721,13 @@ async function loadStudyInViewer2(studyId, slideName) {
                     const top = y * wsi.tileHeight;
                     return `/dicom-web/instances/${instanceId}/rendered?window=center:128,width:256&viewport=${wsi.tileWidth},${wsi.tileHeight}&region=${left},${top},${wsi.tileWidth},${wsi.tileHeight}`;
                 }
-                return `/wsi/tiles/${this.wsiSeriesId}/${wsi.wsiIndex}/${x}/${y}?_=${this.sessionId}`;
+                return `/wsi/tiles/${this.wsiSeriesId}/${wsi.wsiIndex}/${x}/${y}?_=${this.sessionId}${this.iccCorrected ? '&icc=1' : ''}`;
+            };
+            OpenSeadragon.WsiTileSource.prototype.getTileBatchKey = function(level, x, y) {
+                const wsi = this.wsiLevels[level];
+                if (!wsi || x < 0 || y < 0 || x >= wsi.tilesX || y >= wsi.tilesY) return null;
+                if (this.pyramid?.IsVirtualPyramid) return null;
+                return { level: wsi.wsiIndex, x, y, icc: !!this.iccCorrected };
             };
         }
         
@@ -711,6 +742,9 @@ async function loadStudyInViewer2(studyId, slideName) {
         } catch (e) {
             // ignore
         }
+        const tileBatchLoader2 = typeof enableTileBatching === 'function'
+            ? enableTileBatching(tileSource2, { studyId, seriesId, headers: authHeaders })
+            : null;
         
         viewer2 = OpenSeadragon({
             id: 'osd-viewer-2',
@@ -731,7 +765,7 @@ async function loadStudyInViewer2(studyId, slideName) {
             maxZoomPixelRatio: 4,
             minZoomImageRatio: 0.5,
             immediateRender: true,
-            imageLoaderLimit: 12,
+            imageLoaderLimit: tileBatchLoader2 ? 64 : 12,
             crossOriginPolicy: false,  // Don't set crossOrigin, we're using ajax with auth
             loadTilesWithAjax: true,
             ajaxHeaders: authHeaders,
@@ -739,6 +773,9 @@ async function loadStudyInViewer2(studyId, slideName) {
             tileSources: tileSource2,
             preload: true
         });
+        if (typeof attachViewportPrefetch === 'function') {
+            attachViewportPrefetch(viewer2, { studyId, seriesId, headers: authHeaders });
+        }
         
         viewer2.addHandler('open', () => {
             addViewerLabel('osd-viewer-2', compareSlideName2);